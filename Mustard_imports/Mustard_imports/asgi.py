@@ -3,6 +3,13 @@ ASGI config for Mustard_imports project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with uvicorn so the async views (payments, Google sign-in, scraping,
+bulk import) can wait on upstreams without holding a worker each:
+
+    uvicorn Mustard_imports.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+
+Synchronous views still work; Django runs them in a thread pool.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
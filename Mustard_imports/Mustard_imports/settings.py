@@ -66,6 +66,9 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        'payment_status': '60/min',
+    },
 }
 # Djoser settings for token-based authentication
 DJOSER = {
@@ -78,11 +81,64 @@ DJOSER = {
 }
 
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# Shared cache: every worker behind the load balancer (see loadBalancing.md)
+# must read and invalidate the same entries, so a per-process LocMemCache is
+# not an option. CACHE_BACKEND picks the implementation:
+#   redis     - Redis via django-redis (default when REDIS_URL is set)
+#   sqlite    - single SQLite file shared by all workers on the host (no server)
+#   fakeredis - in-process Redis emulation, used by the test suite
+#   locmem    - per-process memory, only for one-off scripts
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis' if os.getenv('REDIS_URL') else 'sqlite')
+CACHE_KEY_PREFIX = 'mustard'
+
+if CACHE_BACKEND in ('redis', 'fakeredis'):
+    _redis_options = {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        'SOCKET_CONNECT_TIMEOUT': 2,  # seconds
+        'SOCKET_TIMEOUT': 2,  # seconds
+        'IGNORE_EXCEPTIONS': True,  # A cache outage degrades to cache misses
     }
-}
+    if CACHE_BACKEND == 'fakeredis':
+        from fakeredis import FakeRedisConnection
+        _redis_options['CONNECTION_POOL_KWARGS'] = {'connection_class': FakeRedisConnection}
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+            'OPTIONS': _redis_options,
+        }
+    }
+elif CACHE_BACKEND == 'sqlite':
+    CACHES = {
+        'default': {
+            'BACKEND': 'ecommerce.api.cache_backends.SQLiteCache',
+            'LOCATION': os.getenv('CACHE_SQLITE_PATH', str(BASE_DIR / 'cache.sqlite3')),
+            'KEY_PREFIX': CACHE_KEY_PREFIX,
+            'OPTIONS': {'MAX_ENTRIES': 50000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Hot endpoints use single-flight locking and stale-while-revalidate
+# (see ecommerce/api/caching.py). Refreshes run on a small thread pool.
+RESPONSE_CACHE_STAMPEDE_PROTECTION = True
+RESPONSE_CACHE_BACKGROUND_REFRESH = True
+
+# Product search engine: 'auto' uses PostgreSQL full-text search on Postgres
+# and the FTS5 index on SQLite (once `manage.py setup_search` has created it),
+# falling back to substring matching. Also: 'postgres', 'sqlite', 'icontains'.
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+
+# Background jobs (see ecommerce/api/jobs.py) start on a thread pool in the
+# web process right after they are enqueued. Run `manage.py run_jobs` as well
+# to pick up retries and jobs left behind by a restart.
+JOBS_RUN_IN_PROCESS = os.getenv('JOBS_RUN_IN_PROCESS', 'True') == 'True'
 
 
 
@@ -345,6 +401,9 @@ mimetypes.add_type("image/svg+xml", ".svg")
 
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 
+# Product scraping (api/scraping.py)
+FIRECRAWL_API_KEY = os.getenv('FIRECRAWL_API_KEY', '')
+
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -5,6 +5,30 @@ from .models import *
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('order', 'payment_status', 'mpesa_receipt_number', 'phone_number', 'amount')
 
+
+@admin.register(PaymentCallbackInbox)
+class PaymentCallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ('checkout_request_id', 'result_code', 'deliveries', 'received_at', 'processed_at', 'outcome')
+    list_filter = ('outcome',)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'to', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'key', 'status', 'attempts', 'run_after', 'finished_at')
+    list_filter = ('status', 'name')
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'product', 'cart_item', 'quantity', 'expires_at', 'created_at')
+    raw_id_fields = ('product', 'cart_item')
+
 admin.site.register(User)   
 admin.site.register(Category)
 admin.site.register(Product)
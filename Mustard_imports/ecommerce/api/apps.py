@@ -6,4 +6,5 @@ class CoreConfig(AppConfig):
     label = 'api'
 
     def ready(self):
-        from . import signals
\ No newline at end of file
+        from . import signals
+        from . import mailer, payments, product_import, scraping  # register their jobs
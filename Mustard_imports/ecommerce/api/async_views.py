@@ -0,0 +1,67 @@
+"""
+DRF-style function views for the async execution path.
+
+DRF's views are synchronous, so an endpoint that spends its time waiting on
+an upstream (M-Pesa, Google, Firecrawl, image hosts) or on a long poll holds
+a worker thread for the whole wait. ``async_api_view`` turns an ``async def``
+into a Django async view that keeps DRF's behaviour:
+
+    @async_api_view(['GET'], permission_classes=[IsAuthenticated])
+    async def endpoint(request):
+        data = await http_client.aget('google', url)
+        payment = await sync_to_async(Payment.objects.get)(pk=...)
+        return Response({...})
+
+Authentication, permissions, throttling and content negotiation run first.
+They may touch the database, so they run through ``sync_to_async``, and so
+must every ORM call in the view. Exceptions go through DRF's exception
+handler and the returned ``Response`` is rendered as usual. Under an ASGI
+server (``Mustard_imports.asgi``) a worker can serve many such requests at
+once on its event loop; under WSGI they still work, one per thread.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+
+def async_api_view(http_method_names, permission_classes=None, throttle_classes=None):
+    """``@api_view`` plus ``@permission_classes``/``@throttle_classes`` for an ``async def`` view."""
+    allowed = [method.lower() for method in http_method_names] + ['options']
+
+    def decorator(func):
+        # A throwaway APIView carries the policies, as @api_view's WrappedAPIView does
+        view_class = type(func.__name__, (APIView,), {
+            'http_method_names': allowed,
+            'permission_classes': permission_classes or api_settings.DEFAULT_PERMISSION_CLASSES,
+            'throttle_classes': throttle_classes or api_settings.DEFAULT_THROTTLE_CLASSES,
+        })
+
+        @csrf_exempt  # as APIView.as_view(); SessionAuthentication enforces CSRF itself
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            api_view = view_class()
+            api_view.args, api_view.kwargs = args, kwargs
+            api_view.headers = {}
+            drf_request = api_view.initialize_request(request, *args, **kwargs)
+            api_view.request = drf_request
+            try:
+                method = request.method.lower()
+                if method not in allowed:
+                    raise MethodNotAllowed(request.method)
+                await sync_to_async(api_view.initial)(drf_request, *args, **kwargs)
+                if method == 'options':
+                    response = await sync_to_async(api_view.options)(drf_request, *args, **kwargs)
+                else:
+                    response = await func(drf_request, *args, **kwargs)
+            except Exception as exc:
+                response = await sync_to_async(api_view.handle_exception)(exc)
+            return api_view.finalize_response(drf_request, response, *args, **kwargs)
+
+        view.cls = view_class
+        return view
+    return decorator
@@ -0,0 +1,116 @@
+"""
+A cached index of the attribute values each product offers:
+
+    {attribute name: ((value id, value), ...)}   values sorted
+
+Cart validation checks the attributes a shopper picked against it as
+frozensets (``allowed_attributes``). ``ProductSerializer.get_attributes``
+renders it when the product wasn't read with its attribute values. The bulk
+importer stores the index of the products it creates, which it already
+knows, so their first reads don't touch the database.
+
+Entries are versioned by the ``attributes:{product id}`` cache tag. A change
+to ``Product.attribute_values``, or the renaming or deletion of an attribute
+or value, bumps the tags of the products concerned once committed, and
+readers move to new keys. Entries missing for a batch of products are
+rebuilt with one query. If the cache is down, the index is read from the
+database.
+"""
+
+import logging
+
+from django.core.cache import cache
+
+from ..models import Product
+from .caching import bump_tags_on_commit, get_generations, start_generations
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTE_INDEX_TTL = 60 * 60 * 24  # seconds; changed entries are never read again, this bounds memory
+
+INDEX_KEY = 'attributes:index:{}:{}'
+
+
+def _tag(product_id):
+    return f'attributes:{product_id}'
+
+
+def build_index(values):
+    """The index of ``(value id, attribute name, value)`` triples."""
+    index = {}
+    for value_id, name, value in values:
+        index.setdefault(name, []).append((value_id, value))
+    return {name: tuple(sorted(pairs, key=lambda pair: (pair[1], pair[0]))) for name, pairs in index.items()}
+
+
+def index_from_values(attribute_values):
+    """The index of AttributeValue objects read with their attribute, as a prefetch has them."""
+    return build_index((value.id, value.attribute.name, value.value) for value in attribute_values)
+
+
+def _stored_index(product_ids):
+    values = {product_id: [] for product_id in product_ids}
+    for product_id, value_id, name, value in (
+        Product.attribute_values.through.objects.filter(product_id__in=product_ids)
+        .values_list('product_id', 'attributevalue_id', 'attributevalue__attribute__name', 'attributevalue__value')
+    ):
+        values[product_id].append((value_id, name, value))
+    return {product_id: build_index(triples) for product_id, triples in values.items()}
+
+
+def attribute_index(product_ids):
+    """{product id: index} for ``product_ids``, from the cache, rebuilding the missing entries."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    generations = get_generations([_tag(product_id) for product_id in product_ids])
+    if generations is None:
+        return _stored_index(product_ids)
+    keys = {product_id: INDEX_KEY.format(product_id, generations[_tag(product_id)]) for product_id in product_ids}
+    try:
+        found = cache.get_many(list(keys.values()))
+    except Exception as e:
+        logger.warning(f"Failed to read attribute indexes: {e}")
+        found = {}
+    index = {product_id: found[key] for product_id, key in keys.items() if key in found}
+    missing = [product_id for product_id in product_ids if product_id not in index]
+    if missing:
+        stored = _stored_index(missing)
+        index.update(stored)
+        try:
+            cache.set_many({keys[product_id]: stored[product_id] for product_id in missing}, timeout=ATTRIBUTE_INDEX_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to cache attribute indexes: {e}")
+    return index
+
+
+def allowed_attributes(product_ids):
+    """{product id: {attribute name: frozenset of allowed values}}."""
+    return {
+        product_id: {name: frozenset(value for _, value in values) for name, values in index.items()}
+        for product_id, index in attribute_index(product_ids).items()
+    }
+
+
+def remember_attributes(indexes):
+    """
+    Store ``indexes`` (product id -> index) of just-created products under
+    fresh versions. Call it once their transaction has committed.
+    """
+    generations = start_generations([_tag(product_id) for product_id in indexes])
+    if generations is None:
+        return
+    try:
+        cache.set_many(
+            {INDEX_KEY.format(product_id, generations[_tag(product_id)]): index for product_id, index in indexes.items()},
+            timeout=ATTRIBUTE_INDEX_TTL,
+        )
+    except Exception as e:
+        logger.warning(f"Failed to cache attribute indexes: {e}")
+
+
+def forget_attributes(product_ids):
+    """Retire the cached indexes of ``product_ids`` once committed."""
+    tags = [_tag(product_id) for product_id in set(product_ids)]
+    if tags:
+        bump_tags_on_commit(*tags)
@@ -0,0 +1,242 @@
+"""
+Creating many products at once, for scraping and bulk imports.
+
+``create_products`` writes a batch of plain product dicts with a fixed number
+of queries whatever the batch size. Suppliers and attribute values named by
+the batch are resolved in bulk and created when missing. Slugs are allocated
+with one lookup. Products, their attribute links and their inventory go in
+with ``bulk_create``.
+
+``bulk_create`` skips the Product signals, so the batch then does once what
+they would have done per product: index the products for search, invalidate
+the cached pages showing them and publish the suggestion changes. The
+attribute index of the new products is known already and stored for their
+first reads.
+``create_images`` does the same for a batch of downloaded product images.
+"""
+
+import logging
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from ..models import Attribute, AttributeValue, Category, Inventory, Product, ProductImage, Supplier
+from .attributes import build_index, remember_attributes
+from .caching import bump_tags_on_commit
+from .search import get_search_backend
+from .suggest import publish_change
+
+logger = logging.getLogger(__name__)
+
+# Batches larger than this have workers rebuild their suggestion index
+# instead of applying one change per product
+SUGGEST_REBUILD_THRESHOLD = 100
+
+PRODUCT_FIELDS = (
+    'name', 'description', 'price', 'below_moq_price', 'moq', 'moq_per_person', 'moq_status',
+    'is_pick_and_pay', 'meta_title', 'meta_description',
+)
+
+
+class AttributeLookup:
+    """
+    ``(attribute name, value)`` -> AttributeValue id, filled in bulk.
+
+    Keep one per batch, or per file for an import, so each pair is looked up
+    or created once.
+    """
+
+    def __init__(self):
+        self._attributes = {}
+        self._values = {}
+
+    def resolve(self, pairs):
+        """Load or create every pair not seen yet."""
+        missing = {pair for pair in pairs if pair not in self._values}
+        if not missing:
+            return
+        names = {name for name, _ in missing} - set(self._attributes)
+        if names:
+            Attribute.objects.bulk_create([Attribute(name=name) for name in names], ignore_conflicts=True)
+            self._attributes.update(Attribute.objects.filter(name__in=names).values_list('name', 'id'))
+
+        wanted = [(self._attributes[name], value) for name, value in missing]
+        AttributeValue.objects.bulk_create(
+            [AttributeValue(attribute_id=attribute_id, value=value) for attribute_id, value in wanted],
+            ignore_conflicts=True,
+        )
+        by_id = {attribute_id: name for name, attribute_id in self._attributes.items()}
+        query = Q()
+        for attribute_id in {attribute_id for attribute_id, _ in wanted}:
+            query |= Q(attribute_id=attribute_id, value__in=[value for a, value in wanted if a == attribute_id])
+        for value_id, attribute_id, value in AttributeValue.objects.filter(query).values_list('id', 'attribute_id', 'value'):
+            self._values[(by_id[attribute_id], value)] = value_id
+
+    def ids(self, pairs):
+        return [self._values[pair] for pair in pairs]
+
+    def index(self, pairs):
+        """The attribute index (see attributes.py) of a product offering ``pairs``."""
+        return build_index({(self._values[pair], *pair) for pair in pairs})
+
+
+def category_id(name, slug, description):
+    """The id of the category called ``name``, created active if missing."""
+    category, _ = Category.objects.get_or_create(
+        name=name, defaults={'slug': slug, 'description': description, 'is_active': True}
+    )
+    return category.id
+
+
+def supplier_ids(names):
+    """Supplier name -> id for ``names``, creating those that don't exist."""
+    names = set(names)
+    found = {}
+    if not names:
+        return found
+    # Supplier names aren't unique; like get_or_create(name=...), use the oldest
+    for supplier_id, name in Supplier.objects.filter(name__in=names).order_by('-id').values_list('id', 'name'):
+        found[name] = supplier_id
+    created = Supplier.objects.bulk_create([
+        Supplier(name=name, contact_email='', phone='', address='') for name in names - set(found)
+    ])
+    found.update((supplier.name, supplier.id) for supplier in created)
+    return found
+
+
+def unique_slugs(names):
+    """A free slug per name, numbered like Product.save() numbers them."""
+    bases = [slugify(name) or 'product' for name in names]
+    taken = set(Product.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+    if taken:
+        # Only a base that is taken can have numbered siblings
+        query = Q()
+        for base in taken:
+            query |= Q(slug__startswith=f'{base}-')
+        taken.update(Product.objects.filter(query).values_list('slug', flat=True))
+    slugs = []
+    for base in bases:
+        slug, counter = base, 1
+        while slug in taken:
+            slug = f'{base}-{counter}'
+            counter += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def build_product(data):
+    """An unsaved Product for ``data``, with the defaults ProductSerializer.create() applies."""
+    product = Product(**{field: data[field] for field in PRODUCT_FIELDS if field in data})
+    product.category_id = data['category_id']
+    product.supplier_id = data.get('supplier_id')
+    product.meta_title = product.meta_title or product.name or 'Product'
+    product.meta_description = product.meta_description or product.description or 'Discover this product at MustardImports.'
+    # As Product.save() does for Pick and Pay products
+    if product.is_pick_and_pay:
+        product.moq = 1
+        product.moq_status = 'not_applicable'
+        product.moq_per_person = 1
+        product.below_moq_price = None
+    product.full_clean(exclude=['slug', 'category', 'supplier'], validate_unique=False, validate_constraints=False)
+    return product
+
+
+def create_products(rows, attributes=None):
+    """
+    Create a product per dict in ``rows``. Each row has the Product fields,
+    ``category_id``, and optionally ``supplier_id`` or ``supplier_name``,
+    ``attributes`` as ``(name, value)`` pairs and ``inventory_quantity``.
+
+    Returns ``(created, errors)``: the saved products and ``(row index,
+    message)`` for each row that failed validation.
+    """
+    attributes = attributes or AttributeLookup()
+    rows = list(rows)
+    categories = dict(Category.objects.filter(
+        pk__in={data.get('category_id') for data in rows}
+    ).values_list('id', 'slug'))
+    known_suppliers = set(Supplier.objects.filter(
+        pk__in={data['supplier_id'] for data in rows if data.get('supplier_id')}
+    ).values_list('id', flat=True))
+
+    built, errors = [], []
+    for index, data in enumerate(rows):
+        if data.get('category_id') not in categories:
+            errors.append((index, {'category_id': [f"Invalid pk \"{data.get('category_id')}\" - object does not exist."]}))
+            continue
+        if data.get('supplier_id') and data['supplier_id'] not in known_suppliers:
+            errors.append((index, {'supplier_id': [f"Invalid pk \"{data['supplier_id']}\" - object does not exist."]}))
+            continue
+        try:
+            built.append((data, build_product(data)))
+        except ValidationError as e:
+            errors.append((index, e.message_dict if hasattr(e, 'error_dict') else e.messages))
+        except (TypeError, ValueError) as e:
+            errors.append((index, str(e)))
+    if not built:
+        return [], errors
+
+    with transaction.atomic():
+        suppliers = supplier_ids(data['supplier_name'] for data, _ in built if data.get('supplier_name'))
+        attributes.resolve(pair for data, _ in built for pair in data.get('attributes', ()))
+        products = [product for _, product in built]
+        for product, slug in zip(products, unique_slugs(product.name for product in products)):
+            product.slug = slug
+        for data, product in built:
+            if data.get('supplier_name'):
+                product.supplier_id = suppliers[data['supplier_name']]
+
+        Product.objects.bulk_create(products)
+        Product.attribute_values.through.objects.bulk_create([
+            Product.attribute_values.through(product_id=product.id, attributevalue_id=value_id)
+            for data, product in built
+            for value_id in set(attributes.ids(data.get('attributes', ())))
+        ], ignore_conflicts=True)
+        Inventory.objects.bulk_create([
+            Inventory(product=product, quantity=data.get('inventory_quantity') or 0, low_stock_threshold=10)
+            for data, product in built if product.is_pick_and_pay
+        ])
+
+        # What the Product signals would have done, once for the batch
+        get_search_backend().index_products(products)
+        # New slugs have no cached pages of their own
+        category_slugs = {categories[product.category_id] for product in products}
+        bump_tags_on_commit('catalog', *(f'category:{slug}' for slug in category_slugs if slug))
+        _publish_changes([product.id for product in products])
+        indexes = {product.id: attributes.index(data.get('attributes', ())) for data, product in built}
+        transaction.on_commit(lambda: remember_attributes(indexes))
+
+    logger.info(f"Created {len(products)} products in one batch, {len(errors)} rows rejected")
+    return products, errors
+
+
+def _publish_changes(product_ids):
+    if len(product_ids) > SUGGEST_REBUILD_THRESHOLD:
+        publish_change()
+    else:
+        for product_id in product_ids:
+            publish_change(product_id)
+
+
+def create_images(images):
+    """Save ``(product id, image file)`` pairs as ProductImages, with the signals' work done once."""
+    images = list(images)
+    if not images:
+        return []
+    with transaction.atomic():
+        # bulk_create still runs FileField.pre_save, which stores the files
+        created = ProductImage.objects.bulk_create(
+            [ProductImage(product_id=product_id, image=image) for product_id, image in images]
+        )
+        product_ids = {product_id for product_id, _ in images}
+        tags = {'catalog'}
+        for slug, category_slug in Product.objects.filter(pk__in=product_ids).values_list('slug', 'category__slug'):
+            tags.add(f'product:{slug}')
+            if category_slug:
+                tags.add(f'category:{category_slug}')
+        bump_tags_on_commit(*tags)
+        _publish_changes(sorted(product_ids))
+    return created
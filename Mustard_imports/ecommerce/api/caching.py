@@ -0,0 +1,378 @@
+"""
+Response caching for read endpoints.
+
+Usage (innermost decorator, below @api_view/@permission_classes so that DRF
+authentication and permission checks always run before the cache is read)::
+
+    @api_view(['GET'])
+    @permission_classes([AllowAny])
+    @cached_response(key_params={'page': '1', 'per_page': '10'}, ttl=60 * 15)
+    def some_view(request):
+        ...
+
+    class SomeView(APIView):
+        @cached_response(ttl=60 * 5, vary_on_user=True)
+        def get(self, request, slug):
+            ...
+
+The cache key is built from the endpoint name, the declared query parameters
+(missing and empty values normalise to the declared default), the URL kwargs,
+any declared request headers and, with ``vary_on_user``, the requesting user.
+The parts are hashed so arbitrary client input never ends up in a cache key.
+
+Views that authorise inside their body (rather than through a permission
+class) must use ``vary_on_user=True``: an entry is then only ever served to
+the user whose own request produced it.
+
+Only 200 responses to GET/HEAD are cached. Cached responses carry an ETag and
+a matching ``If-None-Match`` gets a 304 without a body.
+
+Hot endpoints can opt into stampede protection. ``single_flight=True`` lets
+one request compute a missing entry while concurrent requests for the same
+key wait for it. ``stale_ttl`` keeps entries ``stale_ttl`` seconds past their
+``ttl``; an expired entry is still served while a single request refreshes it
+in a background thread (stale-while-revalidate). Both can be switched off with
+``RESPONSE_CACHE_STAMPEDE_PROTECTION = False`` and the refresh made inline
+with ``RESPONSE_CACHE_BACKGROUND_REFRESH = False`` (used by the tests).
+
+Invalidation is tag based. Each endpoint declares tags such as
+``'category:{category_slug}'`` (formatted with the URL kwargs, plus ``{user}``
+for the requesting user's id). Every tag has a generation counter in the cache
+and the current generations are part of the key, so ``bump_tags('catalog')``
+makes every page and variant of every endpoint tagged ``catalog`` unreachable
+at once, without enumerating or scanning keys. Orphaned entries simply expire.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.http import HttpRequest
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .metrics import CACHED_ENDPOINTS, record_cache_event
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'resp'
+GENERATION_PREFIX = 'gen'
+
+# Single-flight lock: held while one request recomputes an entry
+LOCK_TIMEOUT = 30  # seconds, upper bound if the holder dies
+LOCK_WAIT_TIMEOUT = 5  # seconds a waiter polls before computing itself
+LOCK_POLL_INTERVAL = 0.025  # seconds
+
+# Threads used for stale-while-revalidate refreshes (per worker process)
+REFRESH_WORKERS = 2
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _generation_key(tag):
+    return f'{GENERATION_PREFIX}:{tag}'
+
+
+def _new_generation():
+    # Generations start from the clock rather than 0 so that a counter which
+    # was evicted and recreated can never return to a value used before.
+    return time.time_ns() // 1000
+
+
+def get_generations(tags):
+    """Return {tag: generation}, creating missing counters."""
+    if not tags:
+        return {}
+    keys = {_generation_key(tag): tag for tag in tags}
+    try:
+        found = cache.get_many(list(keys))
+        for key, tag in keys.items():
+            if key not in found:
+                cache.add(key, _new_generation(), timeout=None)
+                found[key] = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Failed to read cache generations for {tags}: {e}")
+        return None
+    return {tag: found[key] for key, tag in keys.items()}
+
+
+def bump_tags(*tags):
+    """Invalidate every cached response carrying any of ``tags``."""
+    for tag in tags:
+        key = _generation_key(tag)
+        try:
+            try:
+                cache.incr(key)
+            except ValueError:
+                if not cache.add(key, _new_generation(), timeout=None):
+                    cache.incr(key)
+        except Exception as e:
+            logger.error(f"Failed to invalidate cache tag {tag}: {e}")
+    logger.debug(f"Bumped cache tags: {tags}")
+
+
+def start_generations(tags):
+    """
+    Give ``tags`` fresh generations with one write, as bumping each would,
+    and return {tag: generation}, or None if the cache is unavailable. For
+    tags new to the cache, such as those of just-created objects.
+    """
+    generation = _new_generation()
+    generations = {tag: generation for tag in tags}
+    try:
+        cache.set_many({_generation_key(tag): generation for tag in tags}, timeout=None)
+    except Exception as e:
+        logger.warning(f"Failed to start cache generations for {tags}: {e}")
+        return None
+    return generations
+
+
+def bump_tags_on_commit(*tags):
+    """
+    bump_tags once the current transaction commits. Bumped earlier, a reader
+    between the bump and the commit would cache the old rows under the new
+    generation, and they would be served until the entry expired.
+    """
+    transaction.on_commit(lambda: bump_tags(*tags))
+
+
+def _hash(parts):
+    payload = json.dumps(parts, sort_keys=True, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _normalize_params(key_params, values):
+    params = {}
+    for name, default in key_params.items():
+        value = values.get(name)
+        params[name] = default if value in (None, '') else str(value)
+    return params
+
+
+def make_cache_key(endpoint, params=None, path_kwargs=None, user_id=None, headers=None, generations=None):
+    parts = {
+        'p': params or {},
+        'k': {name: str(value) for name, value in (path_kwargs or {}).items()},
+        'u': user_id,
+        'h': headers or {},
+        'g': generations or {},
+    }
+    return f'{CACHE_KEY_PREFIX}:{endpoint}:{_hash(parts)}'
+
+
+def compute_etag(data):
+    return f'"{_hash(data)}"'
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or '*' in candidates
+
+
+def _find_request(args):
+    # Function views get (request, ...); view methods get (self, request, ...).
+    for arg in args[:2]:
+        if isinstance(arg, (Request, HttpRequest)):
+            return arg
+    raise TypeError('cached_response could not find the request argument')
+
+
+def _cached_reply(request, data, etag):
+    if _etag_matches(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return Response(data, headers={'ETag': etag})
+
+
+def _read_entry(cache_key, endpoint):
+    try:
+        return cache.get(cache_key)
+    except Exception as e:
+        logger.warning(f"Cache read failed for {endpoint}: {e}")
+        return None
+
+
+def _acquire_lock(lock_key):
+    try:
+        return cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+    except Exception:
+        # No shared cache means no coordination: let every request compute.
+        return True
+
+
+def _release_lock(lock_key):
+    try:
+        cache.delete(lock_key)
+    except Exception as e:
+        logger.warning(f"Failed to release cache lock {lock_key}: {e}")
+
+
+def _wait_for_entry(cache_key, endpoint, timeout):
+    """Poll for the entry another request is computing; None if it never shows up."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = _read_entry(cache_key, endpoint)
+        if entry is not None:
+            return entry
+    return None
+
+
+def _compute_and_store(view_func, args, kwargs, cache_key, endpoint, ttl, stale_ttl):
+    """Run the view and cache a 200 response; returns the response and its ETag."""
+    response = view_func(*args, **kwargs)
+    if not isinstance(response, Response) or response.status_code != status.HTTP_200_OK:
+        return response, None
+
+    etag = compute_etag(response.data)
+    entry = {'data': response.data, 'etag': etag, 'fresh_until': time.time() + ttl}
+    try:
+        cache.set(cache_key, entry, timeout=ttl + stale_ttl)
+    except Exception as e:
+        logger.warning(f"Cache write failed for {endpoint}: {e}")
+    return response, etag
+
+
+def _refresh_in_background(view_func, args, kwargs, cache_key, lock_key, endpoint, ttl, stale_ttl):
+    try:
+        _compute_and_store(view_func, args, kwargs, cache_key, endpoint, ttl, stale_ttl)
+    except Exception as e:
+        logger.error(f"Background refresh of {endpoint} failed: {e}", exc_info=True)
+    finally:
+        _release_lock(lock_key)
+        # Executor threads are not request threads, so Django will not close
+        # their database connections for us.
+        connections.close_all()
+
+
+def _refresh_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+    return _executor
+
+
+def cached_response(key_params=None, ttl=60 * 15, vary_on_user=False, key_headers=None, tags=None, name=None,
+                    stale_ttl=0, single_flight=False):
+    """
+    Cache the JSON payload of a read endpoint in the shared cache.
+
+    Args:
+        key_params: query parameter names that change the response, either a
+            list or a {name: default} dict so that ``?page=1`` and no page
+            share an entry
+        ttl: cache lifetime in seconds
+        vary_on_user: keep a separate entry per authenticated user
+        key_headers: request headers that change the response
+        tags: invalidation tags, formatted with the URL kwargs and ``user``
+        name: endpoint name for metrics/invalidation, defaults to the view's
+            qualified name (e.g. ``ProductDetail.get``)
+        stale_ttl: seconds an expired entry may still be served while one
+            request refreshes it (stale-while-revalidate)
+        single_flight: on a miss, let one request compute while concurrent
+            requests for the same key wait for its result
+    """
+    if isinstance(key_params, dict):
+        key_params = dict(key_params)
+    else:
+        key_params = {param: None for param in key_params or ()}
+    key_headers = list(key_headers or ())
+    tags = list(tags or ())
+
+    def decorator(view_func):
+        endpoint = name or view_func.__qualname__
+        CACHED_ENDPOINTS.add(endpoint)
+
+        def respond(request, response, etag):
+            if etag is None:
+                return response
+            if _etag_matches(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            response['ETag'] = etag
+            return response
+
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            request = _find_request(args)
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(*args, **kwargs)
+
+            generations = get_generations([tag.format(user=request.user.pk, **kwargs) for tag in tags])
+            if generations is None:
+                # Without generations a stale entry could be served; skip the cache.
+                return view_func(*args, **kwargs)
+
+            query_params = getattr(request, 'query_params', request.GET)
+            user_id = None
+            if vary_on_user:
+                user_id = request.user.pk if request.user.is_authenticated else 'anonymous'
+            cache_key = make_cache_key(
+                endpoint,
+                params=_normalize_params(key_params, query_params),
+                path_kwargs=kwargs,
+                user_id=user_id,
+                headers={header: request.headers.get(header, '') for header in key_headers},
+                generations=generations,
+            )
+            lock_key = f'lock:{cache_key}'
+            protected = getattr(settings, 'RESPONSE_CACHE_STAMPEDE_PROTECTION', True)
+
+            entry = _read_entry(cache_key, endpoint)
+            if entry is not None and entry.get('fresh_until', float('inf')) > time.time():
+                record_cache_event(endpoint, 'hit')
+                return _cached_reply(request, entry['data'], entry['etag'])
+
+            if entry is not None and protected:
+                # Expired but within stale_ttl: one request refreshes, everyone
+                # (including that request, in background mode) gets the old payload.
+                record_cache_event(endpoint, 'stale')
+                if _acquire_lock(lock_key):
+                    if getattr(settings, 'RESPONSE_CACHE_BACKGROUND_REFRESH', True):
+                        _refresh_executor().submit(
+                            _refresh_in_background, view_func, args, kwargs,
+                            cache_key, lock_key, endpoint, ttl, stale_ttl,
+                        )
+                    else:
+                        try:
+                            return respond(request, *_compute_and_store(
+                                view_func, args, kwargs, cache_key, endpoint, ttl, stale_ttl
+                            ))
+                        finally:
+                            _release_lock(lock_key)
+                return _cached_reply(request, entry['data'], entry['etag'])
+
+            if single_flight and protected:
+                if _acquire_lock(lock_key):
+                    record_cache_event(endpoint, 'miss')
+                    try:
+                        return respond(request, *_compute_and_store(
+                            view_func, args, kwargs, cache_key, endpoint, ttl, stale_ttl
+                        ))
+                    finally:
+                        _release_lock(lock_key)
+
+                entry = _wait_for_entry(cache_key, endpoint, LOCK_WAIT_TIMEOUT)
+                if entry is not None:
+                    record_cache_event(endpoint, 'coalesced')
+                    return _cached_reply(request, entry['data'], entry['etag'])
+                # The lock holder failed or returned an uncacheable response.
+
+            record_cache_event(endpoint, 'miss')
+            return respond(request, *_compute_and_store(
+                view_func, args, kwargs, cache_key, endpoint, ttl, stale_ttl
+            ))
+
+        wrapper.cache_endpoint = endpoint
+        return wrapper
+
+    return decorator
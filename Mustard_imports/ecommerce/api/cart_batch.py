@@ -0,0 +1,157 @@
+"""
+Changing many cart items in one request.
+
+``apply_operations`` takes a list of operations, such as a guest cart being
+merged or a past order bought again::
+
+    {"op": "add", "productId": 7, "quantity": 2, "attributes": {"Color": "Red"}}
+    {"op": "update", "itemId": 31, "quantity": 5}
+    {"op": "remove", "itemId": 32}
+
+They are applied in order, in one transaction, with the same rules as the
+single-item endpoints. An add merges into the item with the same product and
+attributes, and an update sets the quantity. Either every operation is
+applied or none is. The queries don't depend on the number of operations:
+
+1. The cart row is locked, so batches on one cart run one after the other.
+2. The cart's items and the products being added are read once each, and
+   the attributes those products offer come from the cached index.
+3. The operations are applied to those objects in memory.
+4. Removed items are deleted, changed items written with ``bulk_update``
+   and new ones inserted with ``bulk_create``.
+5. The Pick and Pay stock of the changed and new items is held with
+   ``reserve_items``, last, as stock.py asks.
+
+``bulk_update`` and ``bulk_create`` skip ``CartItem.save``, whose stock
+check is made against the holds instead.
+"""
+
+import json
+
+from django.db import transaction
+
+from ..models import Cart, CartItem, Product
+from .attributes import allowed_attributes
+from .stock import OutOfStock, release, reserve_items
+
+MAX_OPERATIONS = 100  # operations accepted in one request
+OPERATIONS = ('add', 'update', 'remove')
+
+
+class CartBatchError(ValueError):
+    """The batch can't be applied; ``operation`` is the index of the one at fault, if known."""
+
+    def __init__(self, message, operation=None):
+        self.operation = operation
+        super().__init__(message)
+
+
+def attribute_error(attributes, allowed):
+    """
+    The error for the first of ``attributes`` that ``allowed`` ({name:
+    frozenset of values}, see attributes.py) doesn't permit, or None.
+    """
+    for attr_name, attr_value in attributes.items():
+        if attr_name not in allowed:
+            return f"Invalid attribute: {attr_name}"
+        if not isinstance(attr_value, str) or attr_value not in allowed[attr_name]:
+            return f"Invalid value for {attr_name}: {attr_value}"
+    return None
+
+
+def _quantity(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def _check(operations):
+    """Check the shape of every operation before anything is read."""
+    if not isinstance(operations, list) or not operations:
+        raise CartBatchError("operations must be a non-empty list")
+    if len(operations) > MAX_OPERATIONS:
+        raise CartBatchError(f"At most {MAX_OPERATIONS} operations per request")
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise CartBatchError(f"op must be one of: {', '.join(OPERATIONS)}", index)
+        if operation['op'] == 'add':
+            if not isinstance(operation.get('productId'), int):
+                raise CartBatchError("productId required", index)
+            if not isinstance(operation.get('attributes', {}), dict):
+                raise CartBatchError("attributes must be an object", index)
+            if not _quantity(operation.get('quantity', 1)):
+                raise CartBatchError("Invalid quantity", index)
+        else:
+            if not isinstance(operation.get('itemId'), int):
+                raise CartBatchError("itemId required", index)
+            if operation['op'] == 'update' and not _quantity(operation.get('quantity')):
+                raise CartBatchError("Invalid quantity", index)
+
+
+def _key(product_id, attributes):
+    return product_id, json.dumps(attributes, sort_keys=True)
+
+
+def apply_operations(cart, operations):
+    """
+    Apply ``operations`` to ``cart``, all or nothing. Raises CartBatchError
+    with the customer-facing message if one of them can't be applied.
+    """
+    _check(operations)
+    adds = [operation for operation in operations if operation['op'] == 'add']
+
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().get(pk=cart.pk)
+        items = {item.id: item for item in CartItem.objects.filter(cart=cart).select_related('product')}
+        by_key = {_key(item.product_id, item.attributes): item for item in items.values()}
+        products = Product.objects.in_bulk({operation['productId'] for operation in adds})
+        allowed = allowed_attributes([operation['productId'] for operation in adds if operation.get('attributes')])
+
+        changed, added, removed = set(), [], []
+        for index, operation in enumerate(operations):
+            if operation['op'] == 'add':
+                product = products.get(operation['productId'])
+                if product is None:
+                    raise CartBatchError("Product not found", index)
+                attributes = operation.get('attributes', {})
+                error = attribute_error(attributes, allowed.get(product.id, {}))
+                if error:
+                    raise CartBatchError(error, index)
+                item = by_key.get(_key(product.id, attributes))
+                if item is None:
+                    item = CartItem(cart=cart, product=product, attributes=attributes, quantity=0)
+                    by_key[_key(product.id, attributes)] = item
+                    added.append(item)
+                elif item.id:
+                    changed.add(item.id)
+                item.quantity += operation.get('quantity', 1)
+                continue
+
+            item = items.get(operation['itemId'])
+            if item is None:
+                raise CartBatchError("Cart item not found", index)
+            if operation['op'] == 'update':
+                item.quantity = operation['quantity']
+                changed.add(item.id)
+            else:
+                del items[item.id]
+                if by_key.get(_key(item.product_id, item.attributes)) is item:
+                    del by_key[_key(item.product_id, item.attributes)]
+                removed.append(item.id)
+
+        changed = [items[item_id] for item_id in sorted(changed) if item_id in items]
+        if removed:
+            release(removed)
+            CartItem.objects.filter(id__in=removed).delete()
+        CartItem.objects.bulk_update(changed, ['quantity'])
+        CartItem.objects.bulk_create(added)
+
+        # A cart left with Pick and Pay products only is collected, not shipped
+        kept = list(items.values()) + added
+        if cart.shipping_method_id and kept and all(item.product.is_pick_and_pay for item in kept):
+            cart.shipping_method = None
+            cart.save(update_fields=['shipping_method'])
+
+        try:
+            reserve_items({item: item.quantity for item in changed + added if item.product.is_pick_and_pay})
+        except OutOfStock as e:
+            raise CartBatchError(f"{e.product.name}: {e}")
+    return cart
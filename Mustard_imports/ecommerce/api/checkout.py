@@ -0,0 +1,147 @@
+"""
+Turning a cart into an order.
+
+``place_order`` runs the checkout in one transaction with a fixed number of
+queries, however many items the cart holds:
+
+1. The cart row is locked, so two checkouts of one cart run one after the
+   other and the second finds it empty.
+2. The items are read once, with their products.
+3. The inventory rows of every Pick and Pay product are locked with one
+   ``SELECT ... FOR UPDATE`` in product id order. Concurrent checkouts
+   take their locks in the same order, so they queue instead of
+   deadlocking.
+4. Stock is taken with one ``UPDATE`` that only matches rows still holding
+   enough units, and the checkout fails unless every row matched. With the
+   locks held that always holds; it also keeps stock from going negative on
+   databases that ignore ``FOR UPDATE``.
+5. The cart's stock reservations are locked.
+6. The order and its items are inserted with ``bulk_create``, the total
+   worked out in Python from the prices just read. Deleting the cart items
+   deletes their holds.
+7. Last, the units the cart doesn't hold are taken from the available-stock
+   counters (see stock.py), so units held by other carts can't be sold to
+   this one.
+
+``bulk_create`` and ``update`` skip the model signals. A new, pending order
+triggers none of the MOQ or status receivers, and the cached pages showing
+the products whose stock changed are invalidated after the commit.
+"""
+
+import logging
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, When
+from django.utils import timezone
+
+from ..models import Cart, Inventory, Order, OrderItem
+from .caching import bump_tags
+from .stock import OutOfStock, available_stock, claim_holds, take_unheld
+
+logger = logging.getLogger(__name__)
+
+# Orders left without items by an interrupted checkout are removed this long after
+INCOMPLETE_ORDER_WINDOW = timedelta(minutes=5)
+
+
+class CheckoutError(ValueError):
+    """The cart can't be ordered as it stands; the message is shown to the customer."""
+
+
+def _take_stock(wanted, products):
+    """Take ``wanted`` (product id -> quantity) from the locked inventory rows."""
+    inventory = dict(
+        Inventory.objects.select_for_update().filter(product_id__in=wanted)
+        .order_by('product_id').values_list('product_id', 'quantity')
+    )
+    for product_id, quantity in wanted.items():
+        name = products[product_id].name
+        if product_id not in inventory:
+            raise CheckoutError(f"No inventory record found for Pick and Pay product {name}")
+        if quantity > inventory[product_id]:
+            raise CheckoutError(f"Insufficient stock for {name}: {inventory[product_id]} available, {quantity} requested")
+
+    enough = Q()
+    for product_id, quantity in wanted.items():
+        enough |= Q(product_id=product_id, quantity__gte=quantity)
+    updated = Inventory.objects.filter(enough).update(
+        quantity=Case(*(When(product_id=product_id, then=F('quantity') - quantity) for product_id, quantity in wanted.items())),
+        last_updated=timezone.now(),
+    )
+    if updated != len(wanted):
+        raise CheckoutError("Stock changed while placing the order, please try again")
+
+
+def _take_unheld(wanted, held, products):
+    """Take from the stock counters what the cart wants but doesn't hold."""
+    try:
+        take_unheld(wanted, held, products)
+    except OutOfStock as e:
+        product_id = e.product.id
+        available = e.available + held.get(product_id, 0)
+        raise CheckoutError(f"Insufficient stock for {e.product.name}: {available} available, {wanted[product_id]} requested")
+
+
+def place_order(user, cart_id):
+    """Create an order from the user's cart and empty the cart. Raises Cart.DoesNotExist or CheckoutError."""
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().select_related('shipping_method').get(id=cart_id, user=user)
+        items = list(cart.items.select_related('product__category').order_by('id'))
+        if not items:
+            raise CheckoutError("Cart is empty")
+
+        all_pick_and_pay = all(item.product.is_pick_and_pay for item in items)
+        if all_pick_and_pay and cart.shipping_method:
+            raise CheckoutError("Shipping method must be null for carts with only Pick and Pay products")
+        if not all_pick_and_pay and not cart.shipping_method:
+            raise CheckoutError("No shipping method selected for non-Pick and Pay products")
+
+        # Clean up incomplete orders
+        Order.objects.filter(user=user, created_at__gte=timezone.now() - INCOMPLETE_ORDER_WINDOW).exclude(
+            Exists(OrderItem.objects.filter(order=OuterRef('pk')))
+        ).delete()
+
+        products = {item.product_id: item.product for item in items}
+        wanted = Counter()
+        for item in items:
+            if item.product.is_pick_and_pay:
+                wanted[item.product_id] += item.quantity
+        if wanted:
+            wanted = dict(sorted(wanted.items()))
+            available_stock(wanted)  # rebuilds missing counters before the stock changes
+            _take_stock(wanted, products)
+            held = claim_holds([item.id for item in items if item.product_id in wanted])
+
+        shipping_method = None if all_pick_and_pay else cart.shipping_method
+        shipping_cost = Decimal(str(shipping_method.price)) if shipping_method else Decimal('0.00')
+        lines = [(item, item.price_per_piece) for item in items]
+        # Inserted directly: Order.save() would re-read the items to total them
+        order, = Order.objects.bulk_create([Order(
+            user=user,
+            shipping_method=shipping_method,
+            shipping_cost=shipping_cost,
+            payment_status='pending',
+            delivery_status='ready_for_pickup' if all_pick_and_pay else 'processing',
+            total_price=sum((price * item.quantity for item, price in lines), Decimal('0.00')) + shipping_cost,
+        )])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=item.product_id, attributes=item.attributes, quantity=item.quantity, price=price)
+            for item, price in lines
+        ])
+        cart.items.all().delete()  # and their holds
+        if wanted:
+            # Last, as the counters aren't rolled back with the transaction
+            _take_unheld(wanted, held, products)
+
+    if wanted:
+        # What the Inventory signals would have done, once the new stock is visible
+        tags = {'catalog'}
+        for product_id in wanted:
+            tags.update([f'product:{products[product_id].slug}', f'category:{products[product_id].category.slug}'])
+        bump_tags(*tags)
+
+    logger.info(f"Order MI{order.id} placed from cart {cart.id}: {len(items)} items, total {order.total_price}")
+    return order
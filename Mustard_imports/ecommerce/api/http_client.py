@@ -0,0 +1,422 @@
+"""
+Shared client for outbound HTTP calls: M-Pesa, Firecrawl, product image
+downloads and Google token verification.
+
+Every upstream gets one ``requests.Session`` per process, so connections are
+pooled and kept alive instead of paying a TCP + TLS handshake per call, and
+every call is bounded by the upstream's connect/read timeouts. Failed calls
+are retried with jittered exponential backoff when that is safe: any method
+whose request never reached the server, and idempotent methods on timeouts,
+dropped connections and 429/502/503/504 answers. POSTs such as an STK push
+are not resent once they may have been received.
+
+Each upstream also has a circuit breaker. After ``failure_threshold``
+consecutive failures (transport errors or 5xx answers) calls fail fast with
+``CircuitOpenError`` for ``reset_timeout`` seconds, then one probe call is let
+through and its result closes or reopens the breaker. Breakers are per
+process. Call counts and latency histograms go to the shared metrics
+counters and are reported by ``upstream_stats()``.
+
+Async views use ``arequest``/``aget``/``apost`` instead. The same policies
+apply to an aiohttp client, which runs on a per-process I/O loop.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+import yarl
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from .metrics import get_counters, histogram_stats, incr_counter, record_histogram, record_timing, timing_stats
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 502, 503, 504}
+BREAKER_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# ok: 2xx-4xx answer, server_error: 5xx answer, error: timeout or connection
+# error, retry: attempt repeated, short_circuit: refused by an open breaker
+UPSTREAM_EVENTS = ('ok', 'server_error', 'error', 'retry', 'short_circuit')
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class ConnectFailed(requests.ConnectionError):
+    """Raised by the async client when no connection could be made, so nothing was sent."""
+
+
+class Upstream:
+    def __init__(self, name, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.25, backoff_cap=2,
+                 failure_threshold=5, reset_timeout=30, pool_size=10, breaker_per_host=False,
+                 breaker_statuses=BREAKER_STATUSES):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries  # extra attempts after the first
+        self.backoff = backoff  # seconds, doubled per attempt before jitter
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_size = pool_size  # connections kept per host
+        self.breaker_per_host = breaker_per_host
+        self.breaker_statuses = breaker_statuses  # answers that count as failures
+
+
+UPSTREAMS = {
+    # STK push answers once Safaricom has queued the prompt, usually in a few
+    # seconds. Daraja answers 500 to status queries while a payment is still
+    # being processed, so only gateway errors count against the breaker.
+    'mpesa': Upstream('mpesa', read_timeout=15, breaker_statuses={502, 503, 504}),
+    # Firecrawl renders the scraped page before answering
+    'firecrawl': Upstream('firecrawl', read_timeout=60, retries=1),
+    # Bulk import images come from arbitrary hosts; one bad host shouldn't block the rest
+    'images': Upstream('images', read_timeout=10, retries=1, breaker_per_host=True),
+    'google': Upstream('google', read_timeout=5),
+}
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0  # consecutive
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            # Once the breaker has cooled down, let a single probe through
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning(f"Opening circuit breaker after {self.failures} consecutive failures")
+                self.opened_at = self.clock()
+            self._probing = False
+
+
+_breakers = {}
+_sessions = {}
+_async_sessions = {}  # only touched on the I/O loop
+_loop = None
+_registry_lock = threading.Lock()
+
+
+def get_breaker(upstream, url=None):
+    key = upstream.name
+    if upstream.breaker_per_host and url:
+        key = f'{upstream.name}:{urlsplit(url).netloc}'
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(upstream.failure_threshold, upstream.reset_timeout))
+    return breaker
+
+
+def request_not_sent(exc):
+    """True when the request can't have reached the server, so resending it is always safe."""
+    if isinstance(exc, (CircuitOpenError, ConnectFailed, requests.ConnectTimeout)):
+        return True
+    reason = exc.args[0] if exc.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+
+
+class _UpstreamPolicy:
+    """Timeouts, backoff and metrics shared by the sync and async clients."""
+
+    def _timeout(self, requested):
+        """The upstream's (connect, read) timeouts; callers may only shorten them."""
+        connect, read = self.upstream.connect_timeout, self.upstream.read_timeout
+        if requested is None:
+            return connect, read
+        if isinstance(requested, (tuple, list)):
+            return min(requested[0] or connect, connect), min(requested[1] or read, read)
+        return min(requested, connect), min(requested, read)
+
+    def _backoff(self, attempt):
+        # "Full jitter": spread retries from many workers instead of synchronising them
+        return random.uniform(0, min(self.upstream.backoff_cap, self.upstream.backoff * 2 ** attempt))
+
+    def _observe(self, started, event):
+        elapsed = time.perf_counter() - started
+        name = f'http:{self.upstream.name}'
+        record_timing(f'{name}:latency', elapsed)
+        record_histogram(f'{name}:latency', elapsed * 1000, LATENCY_BUCKETS_MS)
+        self._record(event)
+
+    def _record(self, event):
+        incr_counter(f'http:{self.upstream.name}:{event}')
+
+
+class UpstreamSession(_UpstreamPolicy, requests.Session):
+    """A pooled session that applies an upstream's timeouts, retries, breaker and metrics to every call."""
+
+    def __init__(self, upstream):
+        super().__init__()
+        self.upstream = upstream
+        adapter = HTTPAdapter(pool_connections=upstream.pool_size, pool_maxsize=upstream.pool_size, max_retries=0)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        upstream = self.upstream
+        breaker = get_breaker(upstream, url)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        timeout = self._timeout(timeout)
+
+        for attempt in range(upstream.retries + 1):
+            last_attempt = attempt == upstream.retries
+            if not breaker.allow():
+                self._record('short_circuit')
+                raise CircuitOpenError(f"Circuit breaker for {upstream.name} is open, not calling {url}")
+
+            started = time.perf_counter()
+            try:
+                response = super().request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._observe(started, 'error')
+                breaker.record_failure()
+                if last_attempt or not (idempotent or request_not_sent(e)):
+                    raise
+                logger.warning(f"{upstream.name} call to {url} failed ({e.__class__.__name__}), retrying")
+            else:
+                server_error = response.status_code >= 500
+                self._observe(started, 'server_error' if server_error else 'ok')
+                if response.status_code in upstream.breaker_statuses:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if last_attempt or not idempotent or response.status_code not in RETRY_STATUSES:
+                    return response
+                logger.warning(f"{upstream.name} call to {url} answered {response.status_code}, retrying")
+                response.close()
+
+            self._record('retry')
+            time.sleep(self._backoff(attempt))
+
+
+class AsyncUpstreamClient(_UpstreamPolicy):
+    """
+    The aiohttp counterpart of UpstreamSession, for async views. Calls follow
+    the same timeouts, retry rules, breaker and metrics, return a
+    ``requests.Response`` and raise ``requests`` exceptions, so response
+    handling is shared with the sync path. Runs on the I/O loop (see
+    ``arequest``).
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.session = aiohttp.ClientSession(
+            # Hosts of a per-host upstream (images) don't share one connection budget
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=upstream.pool_size),
+            # Cookies are per call, as with requests.get
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+
+    async def request(self, method, url, timeout=None, params=None, **kwargs):
+        upstream = self.upstream
+        # Let requests encode the query string, so both clients send the same URL
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, params)
+        target = yarl.URL(prepared.url, encoded=True)
+        breaker = get_breaker(upstream, url)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        connect, read = self._timeout(timeout)
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+        for attempt in range(upstream.retries + 1):
+            last_attempt = attempt == upstream.retries
+            if not breaker.allow():
+                self._record('short_circuit')
+                raise CircuitOpenError(f"Circuit breaker for {upstream.name} is open, not calling {url}")
+
+            started = time.perf_counter()
+            try:
+                response = await self._send(method, target, client_timeout, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._observe(started, 'error')
+                breaker.record_failure()
+                if last_attempt or not (idempotent or request_not_sent(e)):
+                    raise
+                logger.warning(f"{upstream.name} call to {url} failed ({e.__class__.__name__}), retrying")
+            else:
+                server_error = response.status_code >= 500
+                self._observe(started, 'server_error' if server_error else 'ok')
+                if response.status_code in upstream.breaker_statuses:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if last_attempt or not idempotent or response.status_code not in RETRY_STATUSES:
+                    return response
+                logger.warning(f"{upstream.name} call to {url} answered {response.status_code}, retrying")
+
+            self._record('retry')
+            await asyncio.sleep(self._backoff(attempt))
+
+    async def _send(self, method, target, client_timeout, kwargs):
+        try:
+            async with self.session.request(method, target, timeout=client_timeout, **kwargs) as answer:
+                response = requests.Response()
+                response.status_code = answer.status
+                response.reason = answer.reason
+                response.url = str(answer.url)
+                response.headers = CaseInsensitiveDict(answer.headers)
+                response.encoding = get_encoding_from_headers(response.headers)
+                response._content = await answer.read()
+                return response
+        except aiohttp.ConnectionTimeoutError as e:
+            raise requests.ConnectTimeout(str(e)) from e
+        except (aiohttp.SocketTimeoutError, asyncio.TimeoutError) as e:
+            raise requests.ReadTimeout(str(e)) from e
+        except aiohttp.ClientConnectorError as e:
+            raise ConnectFailed(str(e)) from e
+        except aiohttp.ClientError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+
+def session(name):
+    """The process-wide session for a configured upstream."""
+    client = _sessions.get(name)
+    if client is None:
+        with _registry_lock:
+            client = _sessions.get(name)
+            if client is None:
+                client = _sessions[name] = UpstreamSession(UPSTREAMS[name])
+    return client
+
+
+def request(name, method, url, **kwargs):
+    return session(name).request(method, url, **kwargs)
+
+
+def get(name, url, **kwargs):
+    return request(name, 'GET', url, **kwargs)
+
+
+def post(name, url, **kwargs):
+    return request(name, 'POST', url, **kwargs)
+
+
+def _io_loop():
+    """
+    The event loop that runs every async outbound call in this process.
+
+    aiohttp sessions belong to the loop they were created on. Under WSGI, and
+    in tests, each async view runs on a short-lived loop of its own, so the
+    sessions live here instead and keep their pooled connections across
+    requests whatever loop the caller is on.
+    """
+    global _loop
+    with _registry_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='http-io', daemon=True).start()
+    return _loop
+
+
+def async_session(name):
+    """The I/O loop's client for a configured upstream; only call it on that loop."""
+    client = _async_sessions.get(name)
+    if client is None:
+        client = _async_sessions[name] = AsyncUpstreamClient(UPSTREAMS[name])
+    return client
+
+
+def submit(coro):
+    """Run ``coro`` on the I/O loop from synchronous code; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, _io_loop())
+
+
+async def arequest(name, method, url, **kwargs):
+    """``request`` for async code: awaits the call without blocking the caller's loop."""
+    return await asyncio.wrap_future(submit(_arequest(name, method, url, **kwargs)))
+
+
+async def _arequest(name, method, url, **kwargs):
+    return await async_session(name).request(method, url, **kwargs)
+
+
+async def aget(name, url, **kwargs):
+    return await arequest(name, 'GET', url, **kwargs)
+
+
+async def apost(name, url, **kwargs):
+    return await arequest(name, 'POST', url, **kwargs)
+
+
+async def _close_async_sessions():
+    for client in _async_sessions.values():
+        await client.session.close()
+    _async_sessions.clear()
+
+
+def reset():
+    """Close pooled connections and forget breaker state, e.g. between tests."""
+    with _registry_lock:
+        for client in _sessions.values():
+            client.close()
+        _sessions.clear()
+        _breakers.clear()
+        loop = _loop
+    if loop is not None:
+        asyncio.run_coroutine_threadsafe(_close_async_sessions(), loop).result()
+
+
+def upstream_stats():
+    """Per-upstream call outcomes and latency across workers, plus this process's breaker states."""
+    names = sorted(UPSTREAMS)
+    counters = get_counters([f'http:{name}:{event}' for name in names for event in UPSTREAM_EVENTS])
+    stats = {}
+    for name in names:
+        latency = timing_stats(f'http:{name}:latency')
+        latency.update(histogram_stats(f'http:{name}:latency', LATENCY_BUCKETS_MS))
+        stats[name] = {
+            **{event: counters[f'http:{name}:{event}'] for event in UPSTREAM_EVENTS},
+            'latency_ms': latency,
+            'circuits': {
+                key: breaker.state for key, breaker in list(_breakers.items())
+                if key == name or key.startswith(f'{name}:')
+            },
+        }
+    return stats
@@ -0,0 +1,299 @@
+"""
+Background jobs backed by the ``Job`` table.
+
+A job is a registered function that receives the ``Job`` row::
+
+    @job('payments.initiate', max_attempts=3)
+    def initiate_payment(job):
+        order_id = job.payload['order_id']
+        ...
+
+    enqueue('payments.initiate', {'order_id': order.id}, key=f'payment:{order.id}')
+
+Enqueued jobs start on a small in-process thread pool as soon as the
+enqueueing transaction commits (``JOBS_RUN_IN_PROCESS``), so the request that
+enqueued them returns without waiting. ``manage.py run_jobs`` runs whatever
+that misses: retries whose backoff has elapsed, jobs enqueued while in-process
+running is off, and jobs orphaned by a process that died mid-run.
+
+A job that raises is retried with exponential backoff until it has run
+``max_attempts`` times; raise ``RetryJob`` to choose the delay. After the last
+attempt it is marked failed and its ``on_failure`` hook runs.
+
+Long jobs keep their progress in ``Job.result`` through ``JobProgress``, so a
+status endpoint can report it and a retry can resume from it. Each progress
+write also renews the job's lease (``locked_at``). A job whose lease expired
+was requeued and may be running elsewhere. Its next write raises
+``LeaseLost``, and its outcome is discarded, so two workers never carry on
+the same job.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from ..models import Job
+from .metrics import get_counters, incr_counter
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+RETRY_BASE_DELAY = 5  # seconds, doubled per attempt
+RETRY_MAX_DELAY = 60 * 30
+LEASE_TIMEOUT = 60 * 10  # seconds after which a running job is assumed orphaned
+PROGRESS_INTERVAL = 1  # seconds between unforced JobProgress writes
+
+# Threads that run jobs right after they are enqueued (per worker process)
+IN_PROCESS_WORKERS = 4
+_executor = None
+_executor_lock = threading.Lock()
+
+# done: finished, retry: raised and was rescheduled, failed: out of attempts
+JOB_EVENTS = ('done', 'retry', 'failed')
+
+_registry = {}
+
+
+class RetryJob(Exception):
+    """Raise from a job to have it run again after ``delay`` seconds (default: the usual backoff)."""
+
+    def __init__(self, message='', delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class LeaseLost(Exception):
+    """The job's lease expired and another worker may have taken it over."""
+
+
+class JobSpec:
+    def __init__(self, name, func, max_attempts, on_failure):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.on_failure = on_failure
+
+
+def job(name, max_attempts=5, on_failure=None):
+    """Register the decorated function as the handler for jobs called ``name``."""
+    def decorator(func):
+        _registry[name] = JobSpec(name, func, max_attempts, on_failure)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """
+    Queue a ``name`` job and return it. With a ``key``, a queued or running
+    job with the same key is returned instead of queueing a second one.
+    """
+    spec = _registry[name]
+    fields = {
+        'name': name,
+        'key': key,
+        'payload': payload or {},
+        'max_attempts': max_attempts or spec.max_attempts,
+        'run_after': timezone.now() + timedelta(seconds=delay),
+    }
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                queued = Job.objects.create(**fields)
+            break
+        except IntegrityError:
+            existing = Job.objects.filter(key=key, status__in=ACTIVE_STATUSES).first()
+            if existing is not None:
+                return existing
+            # The active job finished between our insert and the lookup: try again
+    else:
+        raise IntegrityError(f"Could not enqueue {name} job with key {key}")
+
+    if not delay:
+        transaction.on_commit(lambda: start(queued.id))
+    return queued
+
+
+def start(job_id):
+    """Run a job on the in-process pool, if in-process running is enabled."""
+    if getattr(settings, 'JOBS_RUN_IN_PROCESS', True):
+        _job_executor().submit(_run_in_thread, job_id)
+
+
+def _job_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IN_PROCESS_WORKERS, thread_name_prefix='jobs')
+    return _executor
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    except Exception as e:
+        logger.error(f"Running job {job_id} failed: {e}", exc_info=True)
+    finally:
+        # Executor threads are not request threads, so Django will not close
+        # their database connections for us.
+        connections.close_all()
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim(job_id, worker):
+    """Mark a due, queued job as running; False if it isn't due or another worker took it first."""
+    now = timezone.now()
+    return Job.objects.filter(pk=job_id, status='queued', run_after__lte=now).update(
+        status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+    ) == 1
+
+
+def _owned(held_job):
+    """The job's row, if it is still running under the lease ``held_job`` holds."""
+    return Job.objects.filter(pk=held_job.pk, status='running', locked_by=held_job.locked_by)
+
+
+def run_job(job_id, worker=None):
+    """Claim and run one job. Returns False when it was not ours to run."""
+    if not claim(job_id, worker or worker_id()):
+        return False
+
+    claimed = Job.objects.get(pk=job_id)
+    spec = _registry.get(claimed.name)
+    try:
+        if spec is None:
+            raise LookupError(f"No handler registered for job {claimed.name}")
+        spec.func(claimed)
+    except LeaseLost:
+        logger.warning(f"Job {claimed.id} {claimed.name} lost its lease, leaving it to the worker that took it over")
+    except Exception as e:
+        _record_failure(claimed, spec, e)
+    else:
+        claimed.status = 'done'
+        claimed.finished_at = timezone.now()
+        if _owned(claimed).update(status='done', result=claimed.result, finished_at=claimed.finished_at):
+            incr_counter(f'jobs:{claimed.name}:done')
+        else:
+            logger.warning(f"Job {claimed.id} {claimed.name} finished after losing its lease; result discarded")
+    return True
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def _record_failure(failed, spec, exc):
+    owned = _owned(failed)  # before the lock fields are cleared
+    failed.last_error = ''.join(traceback.format_exception(exc))[-4000:]
+    if spec is not None and failed.attempts < failed.max_attempts:
+        delay = exc.delay if isinstance(exc, RetryJob) and exc.delay is not None else retry_delay(failed.attempts)
+        failed.status = 'queued'
+        failed.run_after = timezone.now() + timedelta(seconds=delay)
+        failed.locked_by = ''
+        failed.locked_at = None
+        logger.warning(f"Job {failed.id} {failed.name} attempt {failed.attempts} failed ({exc}), retrying in {delay}s")
+        incr_counter(f'jobs:{failed.name}:retry')
+    else:
+        failed.status = 'failed'
+        failed.finished_at = timezone.now()
+        logger.error(f"Job {failed.id} {failed.name} failed after {failed.attempts} attempts: {exc}")
+        incr_counter(f'jobs:{failed.name}:failed')
+    updated = owned.update(**{
+        field: getattr(failed, field)
+        for field in ('status', 'result', 'run_after', 'locked_by', 'locked_at', 'last_error', 'finished_at')
+    })
+    if not updated:
+        logger.warning(f"Job {failed.id} {failed.name} failed after losing its lease; failure discarded")
+        return
+
+    if failed.status == 'failed' and spec is not None and spec.on_failure is not None:
+        try:
+            spec.on_failure(failed, exc)
+        except Exception as e:
+            logger.error(f"on_failure hook of job {failed.id} {failed.name} raised: {e}", exc_info=True)
+
+
+class JobProgress:
+    """
+    A job's progress, kept in ``Job.result`` so a retry resumes from it.
+    ``defaults`` fill in what an earlier attempt didn't record.
+    """
+
+    def __init__(self, running_job, **defaults):
+        self.job = running_job
+        self.state = {**defaults, **(running_job.result or {})}
+        self._written = 0
+
+    def __getitem__(self, name):
+        return self.state[name]
+
+    def update(self, force=False, **changes):
+        """
+        Apply ``changes``; written to the row, renewing the job's lease, at
+        most every PROGRESS_INTERVAL unless forced. Raises LeaseLost if the
+        job is no longer ours.
+        """
+        self.state.update(changes)
+        if force or time.monotonic() - self._written >= PROGRESS_INTERVAL:
+            self.job.result = self.state
+            if not _owned(self.job).update(result=self.state, locked_at=timezone.now()):
+                raise LeaseLost(f"Job {self.job.id} {self.job.name} lost its lease")
+            self._written = time.monotonic()
+
+
+def error_summary(failed_job):
+    """The last line of a failed job's traceback, for status endpoints."""
+    if failed_job.status != 'failed' or not failed_job.last_error:
+        return None
+    return failed_job.last_error.strip().splitlines()[-1]
+
+
+def requeue_orphans():
+    """Put running jobs whose lease expired (their process died) back in the queue."""
+    cutoff = timezone.now() - timedelta(seconds=LEASE_TIMEOUT)
+    count = Job.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='queued', locked_by='', locked_at=None,
+    )
+    if count:
+        logger.warning(f"Requeued {count} orphaned jobs")
+    return count
+
+
+def run_pending(limit=100, worker=None):
+    """Run up to ``limit`` due jobs, oldest first; returns how many ran."""
+    requeue_orphans()
+    due = Job.objects.filter(status='queued', run_after__lte=timezone.now()).order_by('run_after', 'id')
+    ran = 0
+    for job_id in due.values_list('id', flat=True)[:limit]:
+        if run_job(job_id, worker):
+            ran += 1
+    return ran
+
+
+def job_stats():
+    """Jobs per name by current status, plus done/retry/failed event counts across workers."""
+    names = sorted(_registry)
+    counters = get_counters([f'jobs:{name}:{event}' for name in names for event in JOB_EVENTS])
+    rows = Job.objects.filter(status__in=ACTIVE_STATUSES).values('name', 'status').annotate(count=Count('id'))
+    active = {(row['name'], row['status']): row['count'] for row in rows}
+    return {
+        name: {
+            'queued': active.get((name, 'queued'), 0),
+            'running': active.get((name, 'running'), 0),
+            **{event: counters[f'jobs:{name}:{event}'] for event in JOB_EVENTS},
+        }
+        for name in names
+    }
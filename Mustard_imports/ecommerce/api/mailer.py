@@ -0,0 +1,269 @@
+"""
+Outbound email through the ``OutboundEmail`` table.
+
+Request handlers and signals call ``queue_email`` instead of ``send_mail``; it
+only inserts a row, so a slow or unreachable mail server never holds up a
+response. Once the transaction commits an ``email.send`` job drains the
+outbox: it claims due messages in batches and sends each batch over a single
+SMTP connection (``EMAIL_BACKEND``, so the locmem and file backends work
+too), rather than a TCP + TLS handshake per message.
+
+A message that fails is retried with exponential backoff; after
+``max_attempts`` it is marked ``dead`` and kept for inspection. Retries are
+sent by delayed ``email.send`` jobs, and ``manage.py send_emails`` drains the
+outbox directly (``--loop`` to keep running as a dedicated worker).
+
+HTML bodies come from the templates in ``api/templates``, compiled once per
+process and reused (see ``render_email``). Bulk notifications use
+``render_many`` and ``queue_emails`` to render once per distinct message
+shape and insert the whole batch in a few queries.
+"""
+
+import json
+import logging
+import secrets
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Count, F
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import conditional_escape
+
+from ..models import OutboundEmail
+from .jobs import enqueue, job, worker_id
+from .metrics import get_counters, incr_counter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50  # messages sent per SMTP connection
+QUEUE_BATCH_SIZE = 500  # rows per INSERT when queueing in bulk
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30  # seconds, doubled per attempt
+RETRY_MAX_DELAY = 60 * 60
+LEASE_TIMEOUT = 60 * 10  # seconds after which a message left 'sending' is assumed orphaned
+
+EMAIL_TEMPLATES = ('order_confirmation_email.html', 'shipped_email.html')
+
+# sent: delivered to the mail server, retry: failed and rescheduled, dead: out of attempts
+EMAIL_EVENTS = ('sent', 'retry', 'dead')
+
+
+@lru_cache(maxsize=None)
+def _template(name):
+    return get_template(name)
+
+
+def render_email(template_name, context):
+    """Render an email template, compiling it only on first use in this process."""
+    return _template(template_name).render(context)
+
+
+def warm_templates():
+    """Compile the email templates up front, e.g. when a worker starts."""
+    for name in EMAIL_TEMPLATES:
+        _template(name)
+
+
+def display_name(user):
+    return f'{user.first_name} {user.last_name}'.strip() or user.username
+
+
+def render_many(template_name, contexts, fields):
+    """
+    Render ``template_name`` for many contexts that differ only in ``fields``.
+
+    The template is rendered once per distinct combination of the other
+    values, with a placeholder for each field, and each context's escaped
+    values are then substituted. ``fields`` must appear in the template as
+    plain ``{{ field }}`` output, not in tags or through filters.
+    """
+    template = _template(template_name)
+    token = secrets.token_hex(8)
+    placeholders = {field: f'[[{field}:{token}]]' for field in fields}
+    shapes = {}
+    bodies = []
+    for context in contexts:
+        shared = {name: value for name, value in context.items() if name not in placeholders}
+        shape = json.dumps(shared, sort_keys=True, default=str)
+        if shape not in shapes:
+            shapes[shape] = template.render({**shared, **placeholders})
+        body = shapes[shape]
+        for field, placeholder in placeholders.items():
+            body = body.replace(placeholder, conditional_escape(context.get(field, '')))
+        bodies.append(body)
+    return bodies
+
+
+def _outbound_email(subject, message, recipient_list, from_email=None, html_message=None,
+                    template=None, context=None, max_attempts=MAX_ATTEMPTS):
+    return OutboundEmail(
+        to=list(recipient_list),
+        from_email=from_email or '',
+        subject=subject,
+        body=message,
+        html_body=html_message or '',
+        template=template or '',
+        context=context or {},
+        max_attempts=max_attempts,
+    )
+
+
+def queue_email(subject, message, recipient_list, from_email=None, html_message=None,
+                template=None, context=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Queue an email; takes ``send_mail``'s arguments. Pass ``template`` and a
+    JSON-serialisable ``context`` to have the HTML body rendered when the
+    message is sent instead of on the request path.
+    """
+    email = _outbound_email(
+        subject, message, recipient_list, from_email=from_email, html_message=html_message,
+        template=template, context=context, max_attempts=max_attempts,
+    )
+    email.save()
+    # One drain job covers every message queued while it is waiting to run
+    enqueue('email.send', key='email-outbox')
+    return email
+
+
+def queue_emails(messages):
+    """Queue many emails in a few inserts; each message is a dict of ``queue_email`` arguments."""
+    emails = OutboundEmail.objects.bulk_create(
+        [_outbound_email(**message) for message in messages], batch_size=QUEUE_BATCH_SIZE,
+    )
+    if emails:
+        enqueue('email.send', key='email-outbox')
+    return emails
+
+
+def requeue_orphans():
+    """Put messages whose worker died mid-batch back in the queue."""
+    cutoff = timezone.now() - timedelta(seconds=LEASE_TIMEOUT)
+    count = OutboundEmail.objects.filter(status='sending', locked_at__lt=cutoff).update(
+        status='queued', locked_by='', locked_at=None,
+    )
+    if count:
+        logger.warning(f"Requeued {count} orphaned emails")
+    return count
+
+
+def claim_batch(limit=BATCH_SIZE, worker=None):
+    """Mark up to ``limit`` due messages as sending by this worker and return them."""
+    worker = worker or worker_id()
+    now = timezone.now()
+    due = OutboundEmail.objects.filter(status='queued', send_after__lte=now).order_by('send_after', 'id')
+    ids = list(due.values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    # Another worker may have claimed some of them since the read; only ours come back
+    OutboundEmail.objects.filter(pk__in=ids, status='queued').update(
+        status='sending', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+    )
+    return list(OutboundEmail.objects.filter(pk__in=ids, status='sending', locked_by=worker).order_by('id'))
+
+
+def _build_message(email, connection):
+    html_body = email.html_body
+    if email.template:
+        html_body = render_email(email.template, email.context)
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=email.to,
+        connection=connection,
+    )
+    if html_body:
+        message.attach_alternative(html_body, 'text/html')
+    return message
+
+
+def retry_delay(attempts):
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+
+def _record_failure(email, exc):
+    email.last_error = str(exc)[:4000]
+    email.locked_by = ''
+    email.locked_at = None
+    if email.attempts < email.max_attempts:
+        email.status = 'queued'
+        email.send_after = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+        logger.warning(f"Email {email.id} attempt {email.attempts} failed ({exc}), retrying at {email.send_after}")
+        outcome = 'retry'
+    else:
+        email.status = 'dead'
+        logger.error(f"Email {email.id} to {email.to} failed after {email.attempts} attempts: {exc}")
+        outcome = 'dead'
+    email.save(update_fields=['status', 'send_after', 'locked_by', 'locked_at', 'last_error'])
+    return outcome
+
+
+def send_batch(limit=BATCH_SIZE, worker=None):
+    """Claim and send one batch over a single connection; returns a Counter of EMAIL_EVENTS."""
+    batch = claim_batch(limit, worker)
+    outcomes = Counter()
+    if not batch:
+        return outcomes
+
+    connection = get_connection(fail_silently=False)
+    try:
+        for email in batch:
+            try:
+                # Opens the connection on first use, and again after a failure closed it
+                connection.open()
+                connection.send_messages([_build_message(email, connection)])
+            except Exception as e:
+                # The server may have dropped us; start the next message on a fresh connection
+                connection.close()
+                outcomes[_record_failure(email, e)] += 1
+            else:
+                OutboundEmail.objects.filter(pk=email.pk).update(
+                    status='sent', sent_at=timezone.now(), locked_by='', locked_at=None, last_error='',
+                )
+                outcomes['sent'] += 1
+    finally:
+        connection.close()
+
+    for outcome, count in outcomes.items():
+        incr_counter(f'email:{outcome}', count)
+    return outcomes
+
+
+def drain_outbox(limit=BATCH_SIZE, worker=None):
+    """Send batches until no message is due; returns the combined outcomes."""
+    requeue_orphans()
+    total = Counter()
+    while True:
+        outcomes = send_batch(limit, worker)
+        total += outcomes
+        if sum(outcomes.values()) < limit:
+            return total
+
+
+@job('email.send', max_attempts=3)
+def send_queued_emails(email_job):
+    """Drain the outbox, then schedule a pass for the earliest retry still waiting."""
+    outcomes = drain_outbox()
+    email_job.result = dict(outcomes)
+    next_retry = (
+        OutboundEmail.objects.filter(status='queued').order_by('send_after').values_list('send_after', flat=True).first()
+    )
+    if next_retry is not None:
+        # Keyed by due time: this job's own key is still active, so reusing it would be a no-op
+        delay = max(1, int((next_retry - timezone.now()).total_seconds()) + 1)
+        enqueue('email.send', key=f'email-outbox:{int(next_retry.timestamp())}', delay=delay)
+
+
+def email_stats():
+    """Outbox size by status, plus sent/retry/dead totals across workers."""
+    counters = get_counters([f'email:{event}' for event in EMAIL_EVENTS])
+    rows = OutboundEmail.objects.values('status').annotate(count=Count('id'))
+    by_status = {row['status']: row['count'] for row in rows}
+    return {
+        **{event: counters[f'email:{event}'] for event in EMAIL_EVENTS},
+        'outbox': {status: by_status.get(status, 0) for status, _ in OutboundEmail.STATUS_CHOICES},
+    }
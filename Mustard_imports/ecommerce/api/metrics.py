@@ -0,0 +1,126 @@
+"""
+Lightweight counters kept in the shared cache.
+
+Counters live in the default cache rather than in process memory so that the
+numbers reported by the admin endpoints cover every worker, not just the one
+that happened to serve the stats request.
+"""
+
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'metrics'
+
+# Endpoint names registered by @cached_response at import time. Every worker
+# imports the same views, so this set is identical across processes.
+CACHED_ENDPOINTS = set()
+
+
+def _counter_key(name):
+    return f'{METRICS_PREFIX}:{name}'
+
+
+def incr_counter(name, delta=1):
+    """Atomically increment a shared counter, creating it on first use."""
+    key = _counter_key(name)
+    try:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # add() loses the race if another worker created the key first.
+            if not cache.add(key, delta, timeout=None):
+                cache.incr(key, delta)
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+def get_counters(names):
+    """Return {name: value} for the given counters, missing counters read as 0."""
+    try:
+        values = cache.get_many([_counter_key(name) for name in names])
+    except Exception as e:
+        logger.warning(f"Failed to read metrics: {e}")
+        values = {}
+    return {name: values.get(_counter_key(name), 0) for name in names}
+
+
+def record_timing(name, seconds):
+    """Add one duration to the ``name`` timing (a call count and a total in microseconds)."""
+    incr_counter(f'{name}:count')
+    incr_counter(f'{name}:total_us', int(seconds * 1000000))
+
+
+def timing_stats(name):
+    """{'count': n, 'avg_ms': mean duration} for a timing recorded with record_timing()."""
+    counters = get_counters([f'{name}:count', f'{name}:total_us'])
+    count = counters[f'{name}:count']
+    return {
+        'count': count,
+        'avg_ms': round(counters[f'{name}:total_us'] / count / 1000, 2) if count else None,
+    }
+
+
+def _bucket_label(bound):
+    return 'inf' if bound is None else str(bound)
+
+
+def record_histogram(name, value, buckets):
+    """Count ``value`` in the first of the ascending ``buckets`` it fits under, or in 'inf'."""
+    bound = next((bound for bound in buckets if value <= bound), None)
+    incr_counter(f'{name}:le_{_bucket_label(bound)}')
+
+
+def histogram_stats(name, buckets):
+    """Per-bucket counts and p50/p95/p99 estimates (the bucket bound the percentile falls in)."""
+    bounds = list(buckets) + [None]
+    counters = get_counters([f'{name}:le_{_bucket_label(bound)}' for bound in bounds])
+    counts = [counters[f'{name}:le_{_bucket_label(bound)}'] for bound in bounds]
+    total = sum(counts)
+
+    def percentile(fraction):
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(bounds, counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound if bound is not None else 'inf'
+
+    return {
+        'buckets': {_bucket_label(bound): count for bound, count in zip(bounds, counts)},
+        'p50': percentile(0.5),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+    }
+
+
+# hit: fresh entry, stale: expired entry served during a refresh,
+# coalesced: waited for another request's computation, miss: computed here
+CACHE_EVENTS = ('hit', 'stale', 'coalesced', 'miss')
+
+
+def record_cache_event(endpoint, event):
+    incr_counter(f'cache:{endpoint}:{event}')
+
+
+def cache_stats():
+    """Per-endpoint event counts and hit rate for every cached endpoint."""
+    endpoints = sorted(CACHED_ENDPOINTS)
+    names = [f'cache:{endpoint}:{event}' for endpoint in endpoints for event in CACHE_EVENTS]
+    counters = get_counters(names)
+
+    stats = {}
+    for endpoint in endpoints:
+        counts = {event: counters[f'cache:{endpoint}:{event}'] for event in CACHE_EVENTS}
+        total = sum(counts.values())
+        stats[endpoint] = {
+            'hits': counts['hit'],
+            'stale': counts['stale'],
+            'coalesced': counts['coalesced'],
+            'misses': counts['miss'],
+            'hit_rate': round((total - counts['miss']) / total, 4) if total else None,
+        }
+    return stats
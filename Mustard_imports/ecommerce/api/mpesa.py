@@ -0,0 +1,280 @@
+"""
+M-Pesa (Safaricom Daraja) client: OAuth tokens, STK push and STK push query.
+
+Daraja access tokens live for about an hour (``expires_in``). Rather than
+fetching one before every call, ``MpesaTokenManager`` keeps the token in the
+shared cache, so every worker process reuses it, plus a copy in process
+memory so most calls don't touch the cache at all.
+
+The token is refreshed ``TOKEN_REFRESH_MARGIN`` seconds before it expires.
+One caller does the refresh: threads in a process take a lock, processes
+take a short-lived lock key in the cache (``cache.add``). During the margin
+everyone else keeps using the still-valid token. When there is no valid
+token at all, they wait for the refresher's result instead of each doing
+their own OAuth round trip.
+"""
+
+import base64
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+from django.core.cache import cache
+from dotenv import load_dotenv
+
+from . import http_client
+from .metrics import get_counters, incr_counter, record_timing, timing_stats
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+# M-Pesa Configuration
+CONSUMER_KEY = os.getenv('CONSUMER_KEY')
+CONSUMER_SECRET = os.getenv('CONSUMER_SECRET')
+MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
+MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE')
+CALLBACK_URL = os.getenv('CALLBACK_URL')
+MPESA_BASE_URL = os.getenv('MPESA_BASE_URL')
+
+TOKEN_CACHE_KEY = 'mpesa:token'
+TOKEN_REFRESH_MARGIN = 120  # seconds before expiry at which the token is refreshed
+TOKEN_LOCK_TIMEOUT = 15  # seconds, upper bound if the refreshing process dies
+TOKEN_WAIT_TIMEOUT = 5  # seconds a caller waits for another process's refresh
+TOKEN_POLL_INTERVAL = 0.05  # seconds
+
+# hit: valid token from memory or the shared cache, stale: token inside the
+# refresh margin used while another caller refreshes, fetch: OAuth round trip
+TOKEN_EVENTS = ('hit', 'stale', 'fetch', 'fetch_error')
+
+
+class MpesaTokenManager:
+    """Caches Daraja OAuth tokens across threads and processes; see the module docstring."""
+
+    def __init__(self, cache_key=TOKEN_CACHE_KEY, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self.cache_key = cache_key
+        self.lock_key = f'{cache_key}:lock'
+        self.refresh_margin = refresh_margin
+        self._entry = None  # last entry seen by this process
+        self._lock = threading.Lock()
+
+    def get_token(self):
+        now = time.time()
+        entry = self._entry
+        if entry is None or now >= entry['refresh_at']:
+            entry = self._read()
+        if entry is not None and now < entry['refresh_at']:
+            self._entry = entry
+            self._record('hit')
+            return entry['token']
+
+        usable = entry if entry is not None and now < entry['expires_at'] else None
+        # With a usable token, don't queue behind a refresh already running in this process
+        if not self._lock.acquire(blocking=usable is None):
+            self._record('stale')
+            return usable['token']
+        try:
+            return self._refresh(usable)
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Forget the current token, e.g. after Daraja rejected it."""
+        self._entry = None
+        try:
+            cache.delete(self.cache_key)
+        except Exception as e:
+            logger.warning(f"Failed to delete cached M-Pesa token: {e}")
+
+    def _refresh(self, usable):
+        # Another thread or process may have refreshed while we waited
+        entry = self._read() or self._entry
+        if entry is not None and time.time() < entry['refresh_at']:
+            self._entry = entry
+            self._record('hit')
+            return entry['token']
+
+        if self._acquire():
+            try:
+                return self._fetch()['token']
+            except Exception:
+                if usable is None:
+                    raise
+                logger.warning("M-Pesa token refresh failed, using the current token until it expires")
+                return usable['token']
+            finally:
+                self._release()
+
+        if usable is not None:
+            self._record('stale')
+            return usable['token']
+
+        deadline = time.monotonic() + TOKEN_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(TOKEN_POLL_INTERVAL)
+            entry = self._read()
+            if entry is not None and time.time() < entry['expires_at']:
+                self._entry = entry
+                self._record('hit')
+                return entry['token']
+        # The refreshing process is stuck or gone
+        return self._fetch()['token']
+
+    def _fetch(self):
+        started = time.perf_counter()
+        try:
+            token, expires_in = request_access_token()
+        except Exception:
+            self._record('fetch_error')
+            raise
+        finally:
+            record_timing('mpesa_token:fetch', time.perf_counter() - started)
+        self._record('fetch')
+
+        now = time.time()
+        entry = {
+            'token': token,
+            'expires_at': now + expires_in,
+            # Short-lived tokens refresh halfway rather than immediately
+            'refresh_at': now + max(expires_in - self.refresh_margin, expires_in / 2),
+        }
+        try:
+            cache.set(self.cache_key, entry, timeout=expires_in)
+        except Exception as e:
+            logger.warning(f"Failed to cache M-Pesa token: {e}")
+        self._entry = entry
+        return entry
+
+    def _read(self):
+        try:
+            return cache.get(self.cache_key)
+        except Exception as e:
+            logger.warning(f"Failed to read cached M-Pesa token: {e}")
+            return None
+
+    def _acquire(self):
+        try:
+            return cache.add(self.lock_key, 1, timeout=TOKEN_LOCK_TIMEOUT)
+        except Exception:
+            # No shared cache means no coordination: refresh here
+            return True
+
+    def _release(self):
+        try:
+            cache.delete(self.lock_key)
+        except Exception as e:
+            logger.warning(f"Failed to release M-Pesa token lock: {e}")
+
+    def _record(self, event):
+        incr_counter(f'mpesa_token:{event}')
+
+
+token_manager = MpesaTokenManager()
+
+
+def token_stats():
+    """Token cache event counts, hit rate and OAuth fetch latency, across workers."""
+    counts = get_counters([f'mpesa_token:{event}' for event in TOKEN_EVENTS])
+    counts = {event: counts[f'mpesa_token:{event}'] for event in TOKEN_EVENTS}
+    served = counts['hit'] + counts['stale'] + counts['fetch']
+    return {
+        **counts,
+        'hit_rate': round((counts['hit'] + counts['stale']) / served, 4) if served else None,
+        'fetch_latency': timing_stats('mpesa_token:fetch'),
+    }
+
+
+# M-Pesa Payment Integration Functions
+
+def request_access_token():
+    """One OAuth round trip: (access token, lifetime in seconds)."""
+    try:
+        encoded_credentials = base64.b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode()
+        headers = {
+            "Authorization": f"Basic {encoded_credentials}",
+            "Content-Type": "application/json"
+        }
+        response = http_client.get(
+            'mpesa',
+            f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials",
+            headers=headers
+        ).json()
+
+        if "access_token" in response:
+            return response["access_token"], int(response.get("expires_in", 3599))
+        else:
+            raise Exception(f"Failed to get access token: {response.get('errorMessage', 'Unknown error')}")
+    except Exception as e:
+        logger.error(f"Failed to generate access token: {str(e)}")
+        raise Exception(f"Failed to get access token: {str(e)}")
+
+
+def generate_access_token():
+    return token_manager.get_token()
+
+
+def _post(path, request_body):
+    """POST to Daraja with the cached token, fetching a new one once if it was rejected."""
+    for attempt in range(2):
+        headers = {
+            "Authorization": f"Bearer {generate_access_token()}",
+            "Content-Type": "application/json"
+        }
+        response = http_client.post('mpesa', f"{MPESA_BASE_URL}{path}", json=request_body, headers=headers)
+        if response.status_code != 401 or attempt:
+            return response.json()
+        logger.warning("M-Pesa rejected the cached access token, fetching a new one")
+        token_manager.invalidate()
+
+
+def send_stk_push(phone_number, amount, order_id):
+    try:
+        try:
+            amount = float(amount)  # Ensure amount is numeric
+            if amount <= 0:
+                raise ValueError("Amount must be greater than 0")
+            amount = int(amount)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid amount value: {amount} - {str(e)}")
+            raise ValueError("Invalid amount format")
+
+        logger.info(f"Formatted amount for STK push: {amount}")
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        stk_password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
+
+        request_body = {
+            "BusinessShortCode": MPESA_SHORTCODE,
+            "Password": stk_password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": str(amount),
+            "PartyA": phone_number,
+            "PartyB": MPESA_SHORTCODE,
+            "PhoneNumber": phone_number,
+            "CallBackURL": CALLBACK_URL,
+            "AccountReference": f"Order-{order_id}",
+            "TransactionDesc": f"Payment for Order {order_id}"
+        }
+        return _post("/mpesa/stkpush/v1/processrequest", request_body)
+    except Exception as e:
+        logger.error(f"Failed to send STK push: {str(e)}")
+        raise e
+
+
+def query_stk_push(checkout_request_id):
+    try:
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
+
+        request_body = {
+            "BusinessShortCode": MPESA_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id
+        }
+        return _post("/mpesa/stkpushquery/v1/query", request_body)
+    except requests.RequestException as e:
+        logger.error(f"Failed to query STK status: {str(e)}")
+        return {"error": str(e)}
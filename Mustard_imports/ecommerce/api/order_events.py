@@ -0,0 +1,108 @@
+"""
+Order delivery status transitions and the notifications they trigger.
+
+A transition is ``(order_id, previous status, new status)``. Single saves
+report theirs from the Order signals, which read the stored status in
+``pre_save`` before the row changes. Bulk updates go through
+``bulk_set_delivery_status``, which reads every previous status in the same
+query that locks the rows and then issues one ``UPDATE``. Either way, the
+transitions of one operation that anyone is notified about become a single
+``orders.status_changed`` job. The job is enqueued in the same transaction,
+so a rolled-back update notifies nobody.
+
+The job loads the orders of each notified status in one query. It renders
+the email template once per distinct message shape (``mailer.render_many``)
+and queues the whole batch with a few inserts.
+"""
+
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Order
+from .jobs import enqueue, job
+from .mailer import display_name, queue_emails, render_many
+
+logger = logging.getLogger(__name__)
+
+
+def _notify_shipped(order_ids):
+    orders = Order.objects.filter(pk__in=order_ids, delivery_status='shipped').select_related(
+        'user', 'delivery_location'
+    ).exclude(user__email='').order_by('pk')
+    contexts = [
+        {
+            'user_name': display_name(order.user),
+            'order_number': order.order_number,
+            'delivery_location': order.delivery_location.address if order.delivery_location else 'N/A',
+            'site_url': settings.SITE_URL,
+            'year': 2025,
+        }
+        for order in orders
+    ]
+    bodies = render_many('shipped_email.html', contexts, fields=('user_name', 'order_number', 'delivery_location'))
+    queue_emails([
+        {
+            'subject': f"Your Order #{order.order_number} Has Arrived",
+            'message': "Your order has arrived and is ready for pickup.",
+            'recipient_list': [order.user.email],
+            'from_email': settings.DEFAULT_FROM_EMAIL,
+            'html_message': body,
+        }
+        for order, body in zip(orders, bodies)
+    ])
+    return len(bodies)
+
+
+# New delivery status -> notifier taking the ids of the orders that reached it
+NOTIFIERS = {
+    'shipped': _notify_shipped,
+}
+
+
+def record_transitions(transitions):
+    """Enqueue one notification job for the given transitions; returns how many it covers."""
+    notified = [
+        [order_id, previous, current] for order_id, previous, current in transitions
+        if current in NOTIFIERS and previous != current
+    ]
+    if notified:
+        enqueue('orders.status_changed', {'transitions': notified})
+    return len(notified)
+
+
+def bulk_set_delivery_status(order_ids, delivery_status):
+    """
+    Set the delivery status of many orders with one UPDATE and record their
+    transitions. Returns ``(matched, changed)``: ``(id, user_id)`` of every
+    order found, and the ids of those whose status actually changed.
+    """
+    with transaction.atomic():
+        rows = list(
+            Order.objects.select_for_update().filter(id__in=order_ids).values_list('id', 'user_id', 'delivery_status')
+        )
+        changed = [order_id for order_id, _, previous in rows if previous != delivery_status]
+        if changed:
+            Order.objects.filter(id__in=changed).update(delivery_status=delivery_status)
+            record_transitions(
+                (order_id, previous, delivery_status) for order_id, _, previous in rows if previous != delivery_status
+            )
+    return [(order_id, user_id) for order_id, user_id, _ in rows], changed
+
+
+@job('orders.status_changed', max_attempts=3)
+def notify_status_changes(events_job):
+    """Send the notifications for one operation's status transitions."""
+    by_status = defaultdict(list)
+    for order_id, previous, current in events_job.payload['transitions']:
+        by_status[current].append(order_id)
+
+    sent = {}
+    # All or nothing, so a retry doesn't queue the same emails twice
+    with transaction.atomic():
+        for current, order_ids in by_status.items():
+            sent[current] = NOTIFIERS[current](order_ids)
+            logger.info(f"Queued {sent[current]} '{current}' notifications for {len(order_ids)} orders")
+    events_job.result = {'notified': sent}
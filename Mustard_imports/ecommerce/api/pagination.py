@@ -0,0 +1,185 @@
+"""
+Keyset (cursor) pagination.
+
+Offset pagination makes the database read and discard every row before the
+requested page, and the page number links need a ``COUNT(*)`` of the whole
+result on every request. Keyset pagination remembers where the previous page
+ended instead: the next page is ``WHERE (created_at, id) < (last_created_at,
+last_id) ORDER BY created_at DESC, id DESC LIMIT n``, which an index on
+``(created_at, id)`` answers by reading only ``n`` rows however deep the page.
+
+Usage in a view that keeps its page-number behaviour by default::
+
+    paginator = KeysetPagination()
+    if paginator.is_requested(request):
+        rows = paginator.paginate_queryset(queryset, request)
+        return Response({'results': serialize(rows), **paginator.get_page_info()})
+
+Clients opt in with ``?pagination=cursor`` and then follow ``next_cursor`` or
+``previous_cursor`` (passed back as ``?cursor=``). Cursors are opaque: they
+encode the ordering values of the row the page ended on and a direction.
+Totals are only computed when asked for, with ``?count=exact`` or the
+planner's estimate with ``?count=approx``.
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def estimate_count(queryset):
+    """
+    Row count estimated by the PostgreSQL planner, from table statistics and
+    without reading the rows. Other databases get an exact count.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination:
+    """
+    Cursor pagination over a fixed ordering whose last field is unique.
+
+    The default ordering, newest first by ``(created_at, id)``, needs a
+    matching index (see ``Order.Meta.indexes``). Ordering fields must not be
+    nullable.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 10
+    max_page_size = 100
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'per_page'
+    count_query_param = 'count'
+    count_choices = ('exact', 'approx')
+
+    def __init__(self, ordering=None, page_size=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        if page_size is not None:
+            self.page_size = page_size
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.next_cursor = None
+        self.previous_cursor = None
+        self.total = None
+
+    def is_requested(self, request):
+        params = request.query_params
+        return params.get(self.mode_query_param) == 'cursor' or bool(params.get(self.cursor_query_param))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    # ---- cursors ----
+
+    def encode_cursor(self, obj, reverse):
+        # value_to_string keeps full precision (DjangoJSONEncoder would round
+        # datetimes to milliseconds and skip rows)
+        meta = obj._meta
+        values = [meta.get_field(field).value_to_string(obj) for field in self.fields]
+        payload = json.dumps([values, int(reverse)], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, token, model):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            values, reverse = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if len(values) != len(self.fields):
+                raise InvalidCursor('Invalid cursor')
+            meta = model._meta
+            values = [meta.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, binascii.Error, UnicodeError, ValidationError):
+            raise InvalidCursor('Invalid cursor')
+        return values, bool(reverse)
+
+    def _after(self, values, reverse):
+        """Rows strictly after ``values`` in the (possibly reversed) ordering."""
+        descending = [name.startswith('-') != reverse for name in self.ordering]
+        after = Q()
+        for position, field in enumerate(self.fields):
+            lookup = 'lt' if descending[position] else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[position]})
+            for previous in range(position):
+                step &= Q(**{self.fields[previous]: values[previous]})
+            after |= step
+        # A plain range on the leading column lets the index seek straight to
+        # the cursor; the OR above only refines the rows sharing its value.
+        leading = 'lte' if descending[0] else 'gte'
+        return Q(**{f'{self.fields[0]}__{leading}': values[0]}) & after
+
+    def _order_by(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering)
+
+    # ---- paging ----
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """The rows of the requested page; raises ``InvalidCursor`` for a bad cursor or count."""
+        return self.paginate(
+            queryset,
+            cursor=request.query_params.get(self.cursor_query_param),
+            page_size=self.get_page_size(request),
+            count=request.query_params.get(self.count_query_param) or None,
+        )
+
+    def paginate(self, queryset, cursor=None, page_size=None, count=None):
+        page_size = page_size or self.page_size
+        self.next_cursor = self.previous_cursor = self.total = None
+        if count is not None and count not in self.count_choices:
+            raise InvalidCursor(f"count must be one of: {', '.join(self.count_choices)}")
+
+        if count == 'exact':
+            self.total = queryset.count()
+        elif count == 'approx':
+            self.total = estimate_count(queryset)
+
+        values, reverse = self.decode_cursor(cursor, queryset.model) if cursor else (None, False)
+        page = queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            page = page.filter(self._after(values, reverse))
+
+        rows = list(page[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # Going forwards there is a previous page whenever we started from a
+        # cursor; going backwards there is always a next one.
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        if rows and has_next:
+            self.next_cursor = self.encode_cursor(rows[-1], reverse=False)
+        if rows and has_previous:
+            self.previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return rows
+
+    def get_page_info(self):
+        info = {'next_cursor': self.next_cursor, 'previous_cursor': self.previous_cursor}
+        if self.total is not None:
+            info['total'] = self.total
+        return info
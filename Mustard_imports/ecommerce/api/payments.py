@@ -0,0 +1,474 @@
+"""
+M-Pesa payment state, kept up to date off the request path.
+
+``process_payment`` records a pending ``Payment`` and enqueues a
+``payments.initiate`` job, which sends the STK push in the background. From
+then on the payment changes only through ``mark_paid`` and ``mark_failed``.
+These are called by the initiation job (if Daraja rejects the request),
+the callbacks stored by ``mpesa_callback`` (applied by the
+``payments.process_callback`` job), and the status query job that covers
+late callbacks.
+
+Each change bumps a per-order version in the shared cache. Clients read the
+payment from the database only, and ``wait_for_change`` lets a request block
+until that version moves (long polling). Waiters in the process that applied
+the change wake at once; waiters in other workers see it on their next cache
+poll. ``await_change`` is the same wait for async views, polling the cache
+without holding a thread. A poll on a payment whose callback is overdue may
+also ask Daraja for the status. It starts at most one query job per ``CheckoutRequestID`` every
+``QUERY_INTERVAL`` seconds, however many clients are polling.
+
+Payments nobody is polling are picked up by ``reconcile_pending_payments``
+(``manage.py reconcile_payments``), which queries them in batches and backs
+off per payment while Daraja still reports them as in progress.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import Payment, PaymentCallbackInbox
+from .http_client import request_not_sent
+from .jobs import RetryJob, enqueue, job
+from .mailer import display_name, queue_email
+from .metrics import get_counters, incr_counter
+from .mpesa import generate_access_token, query_stk_push, send_stk_push
+from .utils import invalidate_order_caches
+
+logger = logging.getLogger(__name__)
+
+VERSION_TTL = 60 * 60 * 24  # seconds a payment's change counter is kept
+
+# Long polling
+MAX_WAIT = 30  # seconds a status request may block
+WAIT_POLL_INTERVAL = 0.25  # seconds between cache checks for changes made by other workers
+
+# Status queries for payments whose callback hasn't arrived
+QUERY_AFTER = 30  # seconds after initiation before polls may trigger a query
+QUERY_INTERVAL = 15  # seconds between queries for one CheckoutRequestID
+
+# A callback can beat the initiation job to storing its CheckoutRequestID
+CALLBACK_RETRY_DELAY = 5  # seconds before looking for the payment again
+
+# Reconciler
+RECONCILE_AFTER = 120  # seconds after initiation before a payment is reconciled
+RECONCILE_BATCH_SIZE = 200
+RECONCILE_CONCURRENCY = 8  # Daraja queries in flight at once
+RECONCILE_BACKOFF = 60  # seconds before re-checking an in-progress payment, doubled per check
+RECONCILE_MAX_BACKOFF = 60 * 60
+
+# reconciled: completed, failed: Daraja reports the payment failed, pending:
+# still in progress, error: the query itself failed
+RECONCILE_OUTCOMES = ('reconciled', 'failed', 'pending', 'error')
+
+_changed = threading.Condition()
+
+
+def _version_key(order_id):
+    return f'payment:{order_id}:version'
+
+
+def status_version(order_id):
+    """Counter bumped on every change to the order's payment; 0 before the first."""
+    try:
+        return cache.get(_version_key(order_id)) or 0
+    except Exception as e:
+        logger.warning(f"Failed to read payment version for order {order_id}: {e}")
+        return 0
+
+
+def notify_change(order_id):
+    """Bump the order's payment version and wake the waiters in this process."""
+    key = _version_key(order_id)
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, timeout=VERSION_TTL):
+                cache.incr(key)
+    except Exception as e:
+        logger.warning(f"Failed to bump payment version for order {order_id}: {e}")
+    with _changed:
+        _changed.notify_all()
+
+
+def wait_for_change(order_id, version, timeout):
+    """Block until the payment version differs from ``version`` or ``timeout`` passes; returns the version."""
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while True:
+        current = status_version(order_id)
+        remaining = deadline - time.monotonic()
+        if current != version or remaining <= 0:
+            return current
+        with _changed:
+            _changed.wait(min(WAIT_POLL_INTERVAL, remaining))
+
+
+async def await_change(order_id, version, timeout):
+    """wait_for_change for async views: sleeps on the event loop instead of holding a thread."""
+    deadline = time.monotonic() + min(timeout, MAX_WAIT)
+    while True:
+        current = await sync_to_async(status_version, thread_sensitive=False)(order_id)
+        remaining = deadline - time.monotonic()
+        if current != version or remaining <= 0:
+            return current
+        await asyncio.sleep(min(WAIT_POLL_INTERVAL, remaining))
+
+
+def mark_paid(payment, receipt_number, amount=None, phone_number=None, on_paid=None):
+    """
+    Complete a payment and mark its order paid. Returns the updated payment,
+    or None if it was already completed (a repeated callback or query).
+    ``on_paid(payment)`` runs in the same transaction, only when the payment
+    actually changed.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('order').get(pk=payment.pk)
+        if payment.payment_status == 'completed':
+            return None
+        # Status query results carry no receipt; keep what is known
+        payment.amount = amount or payment.amount
+        payment.mpesa_receipt_number = receipt_number or payment.mpesa_receipt_number
+        payment.phone_number = phone_number or payment.phone_number
+        payment.payment_status = 'completed'
+        payment.error_message = None
+        payment.save()
+        # Order.save() updates the MOQ stats; keep it atomic with the payment
+        payment.order.payment_status = 'paid'
+        payment.order.save()
+        if on_paid is not None:
+            on_paid(payment)
+
+    invalidate_order_caches(payment.order.user_id, payment.order_id)
+    notify_change(payment.order_id)
+    return payment
+
+
+def backfill_receipt(payment, receipt_number):
+    """
+    Store the receipt of a payment completed by a status query, which
+    doesn't report one. Returns whether the payment was missing it.
+    """
+    if not receipt_number:
+        return False
+    updated = Payment.objects.filter(
+        Q(mpesa_receipt_number__isnull=True) | Q(mpesa_receipt_number=''),
+        pk=payment.pk, payment_status='completed',
+    ).update(mpesa_receipt_number=receipt_number)
+    if not updated:
+        return False
+    invalidate_order_caches(payment.order.user_id, payment.order_id)
+    notify_change(payment.order_id)
+    return True
+
+
+def mark_failed(payment, reason):
+    """Fail a pending payment. Returns the updated payment, or None if it was no longer pending."""
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('order').get(pk=payment.pk)
+        if payment.payment_status != 'pending':
+            return None
+        payment.payment_status = 'failed'
+        payment.error_message = (reason or 'Payment failed')[:255]
+        payment.save(update_fields=['payment_status', 'error_message'])
+
+    invalidate_order_caches(payment.order.user_id, payment.order_id)
+    notify_change(payment.order_id)
+    return payment
+
+
+def apply_query_result(payment, result):
+    """Apply an STK push query response; a request still being processed has no ResultCode yet."""
+    result_code = str(result.get('ResultCode', ''))
+    if result_code == '0':
+        return mark_paid(payment, result.get('MpesaReceiptNumber'), on_paid=_queue_confirmation)
+    if result_code:
+        return mark_failed(payment, result.get('ResultDesc', 'Payment failed'))
+    return None
+
+
+def request_status_query(payment):
+    """Queue a Daraja status query for an overdue pending payment, at most once per QUERY_INTERVAL."""
+    checkout_request_id = payment.mpesa_checkout_request_id
+    if payment.payment_status != 'pending' or not checkout_request_id:
+        return False
+    if (timezone.now() - payment.payment_date).total_seconds() < QUERY_AFTER:
+        return False
+    try:
+        if not cache.add(f'mpesa:query:{checkout_request_id}', 1, timeout=QUERY_INTERVAL):
+            return False
+    except Exception as e:
+        logger.warning(f"Failed to rate-limit status query for {checkout_request_id}: {e}")
+        return False
+    enqueue(
+        'payments.query_status', {'checkout_request_id': checkout_request_id},
+        key=f'mpesa-query:{checkout_request_id}',
+    )
+    return True
+
+
+def _initiation_failed(failed_job, exc):
+    payment = Payment.objects.filter(order_id=failed_job.payload['order_id']).first()
+    if payment is not None and not payment.mpesa_checkout_request_id:
+        mark_failed(payment, "Payment service unavailable, please try again")
+
+
+@job('payments.initiate', max_attempts=3, on_failure=_initiation_failed)
+def initiate_payment(payment_job):
+    """Send the STK push for a pending payment recorded by process_payment."""
+    payment = Payment.objects.select_related('order').get(order_id=payment_job.payload['order_id'])
+    if payment.payment_status != 'pending' or payment.mpesa_checkout_request_id:
+        return
+
+    # Without a token nothing has been sent to the customer, so retrying is safe
+    try:
+        generate_access_token()
+    except Exception as e:
+        raise RetryJob(f"No M-Pesa access token: {e}")
+
+    try:
+        response = send_stk_push(payment.phone_number, payment.amount, payment.order_id)
+    except ValueError as e:
+        mark_failed(payment, str(e))
+        return
+    except Exception as e:
+        if isinstance(e, requests.RequestException) and request_not_sent(e):
+            raise RetryJob(str(e))
+        # The prompt may have reached the phone; resending could charge twice
+        logger.error(f"STK push for order {payment.order_id} failed: {e}")
+        mark_failed(payment, "Failed to initiate payment")
+        return
+
+    logger.info(f"STK push response for order {payment.order_id}: {response}")
+    if isinstance(response, dict) and response.get('ResponseCode') == '0' and 'CheckoutRequestID' in response:
+        checkout_request_id = response['CheckoutRequestID']
+        Payment.objects.filter(pk=payment.pk).update(mpesa_checkout_request_id=checkout_request_id)
+        notify_change(payment.order_id)
+        logger.info(f"Payment initiated for order {payment.order_id}, CheckoutRequestID: {checkout_request_id}")
+    elif isinstance(response, dict):
+        mark_failed(payment, response.get('errorMessage', 'Failed to process payment request'))
+    else:
+        mark_failed(payment, 'Invalid response from payment gateway')
+
+
+@job('payments.query_status', max_attempts=1)
+def query_payment_status(query_job):
+    """Ask Daraja for the result of an STK push whose callback is late."""
+    checkout_request_id = query_job.payload['checkout_request_id']
+    payment = Payment.objects.filter(
+        mpesa_checkout_request_id=checkout_request_id, payment_status='pending'
+    ).first()
+    if payment is None:
+        return
+    result = query_stk_push(checkout_request_id)
+    query_job.result = {'result_code': result.get('ResultCode'), 'result_desc': result.get('ResultDesc')}
+    apply_query_result(payment, result)
+
+
+def _callback_items(stk_callback):
+    items = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+    return {item.get('Name'): item.get('Value') for item in items if isinstance(item, dict)}
+
+
+def _queue_confirmation(payment):
+    queue_order_confirmation(payment.order)
+
+
+def apply_callback(stk_callback):
+    """
+    Apply a stored ``stkCallback`` to its payment. Returns the outcome:
+    completed, failed, or duplicate/ignored when the payment had already
+    left the state the callback moves it out of.
+    """
+    checkout_request_id = stk_callback['CheckoutRequestID']
+    payment = Payment.objects.filter(mpesa_checkout_request_id=checkout_request_id).first()
+    if payment is None:
+        # Daraja can call back before the initiation job has stored the ID
+        raise RetryJob(f"No payment for CheckoutRequestID {checkout_request_id} yet", delay=CALLBACK_RETRY_DELAY)
+
+    if str(stk_callback.get('ResultCode')) == '0':
+        items = _callback_items(stk_callback)
+        paid = mark_paid(
+            payment, items.get('MpesaReceiptNumber'), amount=items.get('Amount'),
+            phone_number=items.get('PhoneNumber'), on_paid=_queue_confirmation,
+        )
+        if paid is None:
+            # Completed by a status query: the callback brings the receipt
+            if backfill_receipt(payment, items.get('MpesaReceiptNumber')):
+                logger.info(f"Stored M-Pesa receipt {items.get('MpesaReceiptNumber')} for Order {payment.order_id}")
+                return 'completed'
+            return 'duplicate'
+        logger.info(f"Payment completed for Order {payment.order_id} - M-Pesa Receipt: {paid.mpesa_receipt_number}")
+        return 'completed'
+
+    if mark_failed(payment, stk_callback.get('ResultDesc')) is None:
+        return 'ignored'
+    logger.warning(
+        f"Payment failed for Order {payment.order_id} - ResultCode: {stk_callback.get('ResultCode')}, "
+        f"Desc: {stk_callback.get('ResultDesc')}"
+    )
+    return 'failed'
+
+
+def _callback_unmatched(failed_job, exc):
+    PaymentCallbackInbox.objects.filter(
+        pk=failed_job.payload['inbox_id'], processed_at__isnull=True
+    ).update(processed_at=timezone.now(), outcome='unmatched')
+
+
+@job('payments.process_callback', max_attempts=8, on_failure=_callback_unmatched)
+def process_callback(callback_job):
+    """Apply a callback stored by mpesa_callback; each inbox row is applied once."""
+    entry = PaymentCallbackInbox.objects.get(pk=callback_job.payload['inbox_id'])
+    if entry.processed_at is not None:
+        return
+    outcome = apply_callback(entry.payload)
+    PaymentCallbackInbox.objects.filter(pk=entry.pk, processed_at__isnull=True).update(
+        processed_at=timezone.now(), outcome=outcome,
+    )
+    callback_job.result = {'outcome': outcome}
+
+
+def queue_order_confirmation(order):
+    """Queue the order confirmation email for a paid order."""
+    user = order.user
+    if not user.email:
+        logger.warning(f"No email address for user {user.username} for Order #{order.order_number}")
+        return
+
+    items = [
+        {
+            'product_name': item.product.name,
+            'quantity': item.quantity,
+            'price': str(item.price),
+            'line_total': str(item.quantity * item.price),
+        }
+        for item in order.items.select_related('product')
+    ]
+    email_context = {
+        'user_name': display_name(user),
+        'order_id': order.order_number,
+        'created_at': order.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'payment_status': order.get_payment_status_display(),
+        'delivery_status': order.get_delivery_status_display(),
+        'total_price': str(order.total_price),
+        'items': items,
+        'shipping_method': order.shipping_method.name if order.shipping_method else 'N/A',
+        'delivery_location': order.delivery_location.address if order.delivery_location else 'N/A',
+        'site_url': settings.SITE_URL,
+    }
+    items_text = '\n'.join(
+        f"- {item['product_name']} (Qty: {item['quantity']}, Price: ${item['price']}, Total: ${item['line_total']})"
+        for item in items
+    )
+    plain_message = f"""
+Dear {email_context['user_name']},
+
+Thank you for your order! Below are the details of your purchase:
+
+Order #{order.order_number}
+Placed on: {email_context['created_at']}
+Payment Status: {email_context['payment_status']}
+Delivery Status: {email_context['delivery_status']}
+Total: ${order.total_price}
+
+Items:
+{items_text}
+
+Shipping Method: {email_context['shipping_method']}
+Address: {email_context['delivery_location']}
+
+Regards,
+Mustard Imports Team
+"""
+    queue_email(
+        subject=f"Order Confirmation #{order.order_number}",
+        message=plain_message,
+        recipient_list=[user.email],
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        template='order_confirmation_email.html',
+        context=email_context,
+    )
+
+
+def _query_quietly(checkout_request_id):
+    """query_stk_push for the reconciler's threads: errors become an 'error' entry instead of raising."""
+    try:
+        result = query_stk_push(checkout_request_id)
+    except Exception as e:
+        return {'error': str(e)}
+    return result if isinstance(result, dict) else {'error': 'Invalid response from payment gateway'}
+
+
+def reconcile_pending_payments(older_than=RECONCILE_AFTER, limit=RECONCILE_BATCH_SIZE,
+                               concurrency=RECONCILE_CONCURRENCY):
+    """
+    Query Daraja for up to ``limit`` pending payments initiated more than
+    ``older_than`` seconds ago and apply the results. Returns a Counter of
+    RECONCILE_OUTCOMES.
+
+    Only the HTTP calls run on the thread pool; results are applied in this
+    thread through mark_paid/mark_failed, like callbacks. Payments still in
+    progress are re-checked after an exponential per-payment backoff.
+    """
+    now = timezone.now()
+    due = list(
+        Payment.objects.filter(
+            payment_status='pending',
+            mpesa_checkout_request_id__isnull=False,
+            payment_date__lte=now - timedelta(seconds=older_than),
+        ).filter(
+            Q(next_status_check__isnull=True) | Q(next_status_check__lte=now)
+        ).select_related('order').order_by('payment_date')[:limit]
+    )
+    outcomes = Counter()
+    if not due:
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as pool:
+        results = list(pool.map(_query_quietly, [payment.mpesa_checkout_request_id for payment in due]))
+
+    for payment, result in zip(due, results):
+        if 'error' in result:
+            outcome = 'error'
+        else:
+            result_code = str(result.get('ResultCode', ''))
+            outcome = 'reconciled' if result_code == '0' else 'failed' if result_code else 'pending'
+            apply_query_result(payment, result)
+
+        if outcome in ('pending', 'error'):
+            delay = min(RECONCILE_MAX_BACKOFF, RECONCILE_BACKOFF * 2 ** payment.status_checks)
+            Payment.objects.filter(pk=payment.pk).update(
+                status_checks=F('status_checks') + 1,
+                next_status_check=timezone.now() + timedelta(seconds=delay),
+            )
+        outcomes[outcome] += 1
+
+    for outcome, count in outcomes.items():
+        incr_counter(f'reconcile:{outcome}', count)
+    logger.info(f"Reconciled pending payments: {dict(outcomes)}")
+    return outcomes
+
+
+def reconcile_stats():
+    """Reconciler outcome totals across runs, plus the payments pending right now."""
+    counters = get_counters([f'reconcile:{outcome}' for outcome in RECONCILE_OUTCOMES])
+    overdue = timezone.now() - timedelta(seconds=RECONCILE_AFTER)
+    pending = Payment.objects.filter(payment_status='pending')
+    return {
+        **{outcome: counters[f'reconcile:{outcome}'] for outcome in RECONCILE_OUTCOMES},
+        'currently_pending': pending.count(),
+        'currently_overdue': pending.filter(payment_date__lte=overdue).count(),
+    }
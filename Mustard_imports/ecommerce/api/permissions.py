@@ -18,4 +18,14 @@ class IsAdminUser(permissions.BasePermission):
 class IsCartOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
     
-        return obj.user == request.user or request.user.is_staff
\ No newline at end of file
+        return obj.user == request.user or request.user.is_staff
+
+
+class IsCartUserOrStaff(permissions.BasePermission):
+    """
+    Allows access only to the user named by the ``user_id`` URL kwarg, or to staff.
+    """
+    message = "You do not have permission to access this cart."
+
+    def has_permission(self, request, view):
+        return request.user.is_staff or request.user.id == view.kwargs.get('user_id')
@@ -0,0 +1,327 @@
+"""
+Bulk product import from CSV and Excel files as a background job.
+
+``admin/bulk-import/`` stores the uploaded file, enqueues a
+``products.import`` job and answers with its id right away.
+``admin/bulk-import/<job_id>/`` reports the job's progress from
+``Job.result``.
+
+The job streams the file, so memory use does not grow with its length:
+
+1. A first pass reads only the ``name`` and ``attributes`` columns, counting
+   the rows and collecting every ``(attribute, value)`` pair of the file.
+   One ``AttributeLookup.resolve`` then loads or creates them all.
+2. Rows are read ``IMPORT_CHUNK_SIZE`` at a time (pandas' chunked reader for
+   CSV, openpyxl's read-only mode for .xlsx). Each chunk is checked like
+   ProductSerializer checks a product and saved with
+   ``bulk_products.create_products``, a fixed number of queries per chunk.
+3. The images named by the chunk's products are downloaded on the HTTP
+   client's I/O loop, ``IMPORT_IMAGE_CONCURRENCY`` at a time, and saved with
+   one ``bulk_create``.
+
+A chunk's products are committed together with the progress that counts
+them, so a retried job starts at the first row not imported yet. Images
+downloaded by an attempt that then failed are fetched again.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import pandas as pd
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from openpyxl import load_workbook
+
+from . import http_client
+from .bulk_products import AttributeLookup, create_images, create_products
+from .jobs import JobProgress, enqueue, error_summary, job
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 1000  # rows saved per transaction
+IMPORT_IMAGE_CONCURRENCY = 8  # image downloads in flight at once
+MAX_REPORTED_ERRORS = 100  # row errors kept in the job's progress
+IMPORT_UPLOAD_DIR = 'imports'
+IMPORT_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+MOQ_STATUSES = ('active', 'closed', 'completed', 'not_applicable')
+
+
+# ==================== Reading ====================
+
+def _chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _csv_chunks(file, start, columns):
+    # Every cell as text, blanks as '': the row converter does the typing
+    reader = pd.read_csv(
+        file, chunksize=IMPORT_CHUNK_SIZE, dtype=str, keep_default_na=False,
+        skiprows=range(1, start + 1), usecols=(lambda column: column in columns) if columns else None,
+    )
+    for frame in reader:
+        yield frame.to_dict('records')
+
+
+def _xlsx_chunks(file, start):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for chunk in _chunked(islice(rows, start, None), IMPORT_CHUNK_SIZE):
+            # Blank rows stay in the chunk, as None, so row numbers hold
+            yield [dict(zip(header, row)) if any(cell is not None for cell in row) else None for row in chunk]
+    finally:
+        workbook.close()
+
+
+def _xls_chunks(file, start):
+    # openpyxl can't read the old format; these files are small enough to load whole
+    frame = pd.read_excel(file, dtype=str, keep_default_na=False)
+    yield from _chunked(frame.iloc[start:].to_dict('records'), IMPORT_CHUNK_SIZE)
+
+
+def read_chunks(path, start=0, columns=None):
+    """
+    The rows of the stored file ``path`` after the first ``start``, as lists
+    of ``{column: value}`` dicts. ``columns`` limits the columns read, where
+    the format allows it.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with default_storage.open(path, 'rb') as file:
+        if extension == '.csv':
+            yield from _csv_chunks(file, start, columns)
+        elif extension == '.xlsx':
+            yield from _xlsx_chunks(file, start)
+        else:
+            yield from _xls_chunks(file, start)
+
+
+# ==================== Rows ====================
+
+def parse_attributes(text):
+    """``"Color: Red, Blue; Size: M"`` as ``(attribute name, value)`` pairs."""
+    pairs = []
+    for item in str(text or '').split(';'):
+        if ':' not in item:
+            continue
+        name, values = item.split(':', 1)
+        name = name.strip().capitalize()
+        if not name:
+            continue
+        for value in values.split(','):
+            value = value.strip()
+            if value and (name, value) not in pairs:
+                pairs.append((name, value))
+    return pairs
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _number(record, field, cast=Decimal):
+    value = _text(record.get(field))
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValueError({field: [f"A number is required, not {value!r}."]})
+    return cast(number)
+
+
+def _flag(value):
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    return _text(value).lower() in ('1', 'true', 'yes', 'y')
+
+
+def product_row(record):
+    """
+    The ``create_products`` row for one line of an import file, checked as
+    ProductSerializer checks a product. Raises ValueError with the errors.
+    """
+    name, price, category = _text(record.get('name')), _number(record, 'price'), _number(record, 'category_id', int)
+    if not name or price is None or category is None:
+        raise ValueError("Missing required fields: name, price, or category_id")
+
+    is_pick_and_pay = _flag(record.get('is_pick_and_pay'))
+    below_moq_price = _number(record, 'below_moq_price')
+    moq = _number(record, 'moq', int)
+    moq = 1 if moq is None else moq
+    moq_per_person = _number(record, 'moq_per_person', int)
+    moq_per_person = 1 if moq_per_person is None else moq_per_person
+    moq_status = _text(record.get('moq_status')) or 'active'
+    inventory_quantity = _number(record, 'inventory_quantity', int)
+
+    if moq_status not in MOQ_STATUSES:
+        raise ValueError({'moq_status': ["Invalid MOQ status."]})
+    if price < 0:
+        raise ValueError({'price': ["Price cannot be negative."]})
+    if below_moq_price is not None and below_moq_price < 0:
+        raise ValueError({'below_moq_price': ["Below MOQ price cannot be negative."]})
+    if moq < 1 or moq_per_person < 1:
+        raise ValueError({'moq': ["MOQ and MOQ per person must be at least 1."]})
+    if is_pick_and_pay:
+        if inventory_quantity is None:
+            raise ValueError({'inventory_quantity': ["Inventory quantity is required for Pick and Pay products."]})
+        if inventory_quantity < 0:
+            raise ValueError({'inventory_quantity': ["Inventory quantity cannot be negative."]})
+        # Pick and Pay products have no MOQ
+        below_moq_price, moq, moq_per_person, moq_status = None, 1, 1, 'not_applicable'
+    elif inventory_quantity is not None:
+        raise ValueError({'inventory_quantity': ["Inventory quantity should only be provided for Pick and Pay products."]})
+
+    return {
+        'name': name,
+        'description': _text(record.get('description')),
+        'price': price,
+        'below_moq_price': below_moq_price,
+        'moq': moq,
+        'moq_per_person': moq_per_person,
+        'moq_status': moq_status,
+        'is_pick_and_pay': is_pick_and_pay,
+        'category_id': category,
+        'supplier_id': _number(record, 'supplier_id', int),
+        'meta_title': _text(record.get('meta_title')),
+        'meta_description': _text(record.get('meta_description')),
+        'inventory_quantity': inventory_quantity,
+        'attributes': parse_attributes(record.get('attributes')),
+        'images': [url.strip() for url in _text(record.get('image_urls')).split(',') if url.strip()],
+    }
+
+
+# ==================== Images ====================
+
+async def fetch_image(semaphore, product_id, url):
+    """The image at ``url`` as a file, or None if it can't be fetched."""
+    async with semaphore:
+        try:
+            response = await http_client.aget('images', url)
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Failed to download image {url} for product {product_id}: {e}")
+            return None
+    return ContentFile(response.content, name=url.split('?')[0].rstrip('/').split('/')[-1] or f'image_{product_id}.jpg')
+
+
+async def fetch_images(wanted):
+    """Download ``(product id, url)`` pairs concurrently; returns a file or None per pair."""
+    semaphore = asyncio.Semaphore(IMPORT_IMAGE_CONCURRENCY)
+    return await asyncio.gather(*(fetch_image(semaphore, product_id, url) for product_id, url in wanted))
+
+
+def import_images(progress):
+    """Download and save the images pending in ``progress``, then clear them."""
+    wanted = [tuple(pair) for pair in progress['pending_images']]
+    if not wanted:
+        return
+    files = http_client.submit(fetch_images(wanted)).result()
+    images = [(product_id, image) for (product_id, _), image in zip(wanted, files) if image is not None]
+    with transaction.atomic():
+        create_images(images)
+        progress.update(
+            force=True,
+            pending_images=[],
+            images=progress['images'] + len(images),
+            failed_images=progress['failed_images'] + len(wanted) - len(images),
+        )
+
+
+# ==================== Job ====================
+
+def start_import(file):
+    """Store an uploaded import file and queue the job importing it."""
+    name = os.path.basename(file.name)
+    path = default_storage.save(f'{IMPORT_UPLOAD_DIR}/{uuid.uuid4().hex}_{name}', file)
+    return enqueue('products.import', {'path': path, 'name': name})
+
+
+def discard_upload(import_job, exc=None):
+    try:
+        default_storage.delete(import_job.payload['path'])
+    except Exception as e:
+        logger.warning(f"Failed to delete import file {import_job.payload['path']}: {e}")
+
+
+@job('products.import', max_attempts=3, on_failure=discard_upload)
+def import_products(import_job):
+    path = import_job.payload['path']
+    progress = JobProgress(
+        import_job, stage='reading', total=None, rows_done=0, created=0, failed=0, errors=[],
+        pending_images=[], images=0, failed_images=0,
+    )
+    # Images of the last chunk an earlier attempt saved
+    import_images(progress)
+
+    attributes = AttributeLookup()
+    pairs, total = set(), 0
+    for chunk in read_chunks(path, columns=['name', 'attributes']):
+        total += len(chunk)
+        pairs.update(pair for record in chunk if record for pair in parse_attributes(record.get('attributes')))
+    attributes.resolve(pairs)
+    progress.update(force=True, stage='importing', total=total)
+
+    for chunk in read_chunks(path, start=progress['rows_done']):
+        first_row = progress['rows_done'] + 2  # 1-based, after the header
+        rows, numbers, errors = [], [], []
+        for offset, record in enumerate(chunk):
+            if record is None:
+                continue
+            try:
+                rows.append(product_row(record))
+                numbers.append(first_row + offset)
+            except ValueError as e:
+                errors.append({'row': first_row + offset, 'error': e.args[0]})
+
+        with transaction.atomic():
+            created, rejected = create_products(rows, attributes)
+            errors.extend({'row': numbers[index], 'error': error} for index, error in rejected)
+            rejected_rows = {index for index, _ in rejected}
+            saved_rows = [row for index, row in enumerate(rows) if index not in rejected_rows]
+            pending = [[product.id, url] for row, product in zip(saved_rows, created) for url in row['images']]
+            progress.update(
+                force=True,
+                rows_done=progress['rows_done'] + len(chunk),
+                created=progress['created'] + len(created),
+                failed=progress['failed'] + len(errors),
+                errors=(progress['errors'] + sorted(errors, key=lambda error: error['row']))[:MAX_REPORTED_ERRORS],
+                pending_images=pending,
+            )
+        logger.info(
+            f"Import job {import_job.id}: {progress['rows_done']}/{total} rows, "
+            f"{len(created)} products created, {len(errors)} rows rejected"
+        )
+        import_images(progress)
+
+    progress.update(force=True, stage='done')
+    import_job.result = progress.state
+    discard_upload(import_job)
+
+
+def import_status(import_job):
+    """What the progress endpoint reports for an import job."""
+    state = import_job.result or {}
+    return {
+        'job_id': import_job.id,
+        'status': import_job.status,
+        'stage': state.get('stage', 'queued'),
+        'total': state.get('total'),
+        'rows_done': state.get('rows_done', 0),
+        'created': state.get('created', 0),
+        'failed': state.get('failed', 0),
+        'errors': state.get('errors', []),
+        'images': state.get('images', 0),
+        'failed_images': state.get('failed_images', 0),
+        'error': error_summary(import_job),
+    }
@@ -0,0 +1,347 @@
+"""
+Product scraping from Shein and Alibaba as a background job.
+
+``admin/scrape-products/`` enqueues a ``products.scrape`` job and answers
+with its id right away. ``admin/scrape-products/<job_id>/`` reports the
+job's progress from ``Job.result``.
+
+The job is a three-stage pipeline:
+
+1. fetch: the category listing page (category imports), then every product
+   page. Pages come from Firecrawl as rendered HTML. The fetches run on the
+   HTTP client's I/O loop with at most ``SCRAPE_CONCURRENCY`` in flight, and
+   requests for pages of one host start at most ``HOST_RATE`` per second.
+   The rate limit is per process and shared by all scrape jobs in it.
+2. parse: the job thread reads each page with the platform's CSS selectors
+   into a plain product dict as soon as it arrives. Parsers are pure
+   functions of the HTML, so tests run them on saved pages.
+3. persist: parsed products are saved ``SAVE_BATCH_SIZE`` at a time through
+   ``bulk_products.create_products``, a fixed number of queries per batch.
+
+Progress is written to the job row through ``jobs.JobProgress``, after
+every saved batch and at most every second in between. The URLs already handled are part of
+it, so a retried job picks up where the failed attempt stopped.
+"""
+
+import asyncio
+import logging
+import queue
+import re
+import time
+from urllib.parse import urljoin, urlsplit
+
+from bs4 import BeautifulSoup
+from django.conf import settings
+
+from . import http_client
+from .bulk_products import AttributeLookup, category_id, create_products
+from .jobs import JobProgress, enqueue, error_summary, job
+
+logger = logging.getLogger(__name__)
+
+FIRECRAWL_SCRAPE_URL = 'https://api.firecrawl.dev/v1/scrape'
+
+SCRAPE_CONCURRENCY = 5  # product pages fetched at once per job
+HOST_RATE = 2  # page requests per second to one scraped host, per process
+SAVE_BATCH_SIZE = 20
+MAX_IMPORT_COUNT = 200
+
+USD_TO_KES_RATE = 130.50
+
+PRODUCT_LINK_SELECTOR = 'a[href*="/product/"]'
+
+
+# ==================== Fetch ====================
+
+class HostRateLimiter:
+    """Spaces the requests to each host ``1 / rate`` seconds apart. Only use it on one event loop."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=asyncio.sleep):
+        self.interval = 1 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next_slot = {}
+
+    async def wait(self, url):
+        host = urlsplit(url).hostname
+        now = self.clock()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await self.sleep(slot - now)
+
+
+host_limiter = HostRateLimiter(HOST_RATE)
+
+
+async def fetch_html(url):
+    """The rendered HTML of ``url``, scraped through Firecrawl."""
+    await host_limiter.wait(url)
+    response = await http_client.apost(
+        'firecrawl',
+        FIRECRAWL_SCRAPE_URL,
+        headers={'Authorization': f'Bearer {settings.FIRECRAWL_API_KEY}'},
+        json={'url': url, 'formats': ['rawHtml']},
+    )
+    response.raise_for_status()
+    data = response.json()
+    if not data.get('success'):
+        raise ValueError(data.get('error') or 'Firecrawl could not scrape the page')
+    return data['data']['rawHtml']
+
+
+async def fetch_pages(urls, deliver):
+    """Fetch ``urls`` concurrently, calling ``deliver((url, html, error))`` as each one finishes."""
+    semaphore = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+
+    async def fetch(url):
+        async with semaphore:
+            try:
+                html = await fetch_html(url)
+            except Exception as e:
+                logger.warning(f"Failed to scrape {url}: {e}")
+                deliver((url, None, str(e)))
+            else:
+                deliver((url, html, None))
+
+    await asyncio.gather(*(fetch(url) for url in urls))
+
+
+# ==================== Parse ====================
+
+def _text(soup, selector):
+    element = soup.select_one(selector)
+    return element.get_text(' ', strip=True) if element else ''
+
+
+def _src(element):
+    if element is None:
+        return ''
+    return element.get('src') or element.get('data-src') or ''
+
+
+def _sku_attributes(soup, selector):
+    pairs = []
+    for item in soup.select(selector):
+        name = _text(item, '.sku-title').replace(':', '').strip().lower()[:100]
+        if not name:
+            continue
+        for option in item.select('.sku-item-option'):
+            value = option.get_text(strip=True).lower()[:100]
+            if value and (name, value) not in pairs:
+                pairs.append((name, value))
+    return pairs
+
+
+def _prices(price_text, markup):
+    """(price, below MOQ price) in KES from a USD price or range."""
+    try:
+        if '-' in price_text:
+            prices = price_text.split('-')
+            price_usd = float(prices[0].strip()) * markup
+            below_moq_price_usd = float(prices[1].strip()) * markup
+        else:
+            price_usd = float(price_text) * markup
+            below_moq_price_usd = price_usd * 1.2
+    except ValueError:
+        price_usd = below_moq_price_usd = 0.0
+    return round(price_usd * USD_TO_KES_RATE), round(below_moq_price_usd * USD_TO_KES_RATE)
+
+
+def _product(name, description, price, below_moq_price, category, thumbnail, images, attributes, **extra):
+    description = description or 'No description available'
+    return {
+        'name': name[:255],
+        'description': description,
+        'price': price,
+        'below_moq_price': below_moq_price,
+        'moq': 1,
+        'moq_per_person': 1,
+        'moq_status': 'not_applicable',
+        'category': category,
+        'meta_title': name[:255],
+        'meta_description': description[:150] + "...",
+        'attributes': attributes,
+        'thumbnail': thumbnail,
+        'images': images,
+        **extra,
+    }
+
+
+def parse_alibaba_product(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    name = _text(soup, 'h1.module-pdp-title')
+    if not name:
+        return None
+
+    price, below_moq_price = _prices(
+        _text(soup, 'span.price-number').replace('$', '').replace('US', '').replace(',', ''), markup=1.35
+    )
+    try:
+        moq = int(re.search(r'\d+', _text(soup, 'div.moq-value')).group())
+    except (AttributeError, ValueError):
+        moq = 1
+    thumbnail = _src(soup.select_one('img.magnifier-image'))
+    images = [src for src in (_src(img) for img in soup.select('div.product-images img')) if src]
+    return _product(
+        name, _text(soup, 'div.module-pdp-description'), price, below_moq_price,
+        category=('Alibaba', 'alibaba', 'Category for Alibaba'),
+        thumbnail=thumbnail,
+        images=(images or [thumbnail]) if thumbnail else [],
+        attributes=_sku_attributes(soup, 'div.sku-item'),
+        moq=moq,
+        supplier_name=_text(soup, 'a.supplier-name') or 'N/A',
+    )
+
+
+def parse_shein_product(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    name = _text(soup, 'h1.product-intro__head-name')
+    if not name:
+        return None
+
+    price, below_moq_price = _prices(
+        _text(soup, 'div.product-intro__head-mainprice').replace('€', '').replace('$', '').replace(',', ''), markup=1
+    )
+    thumbnail = _src(soup.select_one('img.product-intro__main-image'))
+    return _product(
+        name, _text(soup, 'div.product-intro__description'), price, below_moq_price,
+        category=('Shein', 'shein', 'Products scraped from Shein'),
+        thumbnail=thumbnail,
+        images=[thumbnail] if thumbnail else [],
+        attributes=_sku_attributes(soup, 'div.product-intro__sku-item'),
+    )
+
+
+PARSERS = {
+    'alibaba': parse_alibaba_product,
+    'shein': parse_shein_product,
+}
+
+
+def parse_product_links(html, page_url):
+    """Absolute product page URLs linked from a category page, in page order."""
+    links = []
+    for anchor in BeautifulSoup(html, 'html.parser').select(PRODUCT_LINK_SELECTOR):
+        link = urljoin(page_url, anchor['href'])
+        if link not in links:
+            links.append(link)
+    return links
+
+
+# ==================== Persist ====================
+
+def save_products(parsed, categories, attributes):
+    """
+    Save a batch of parsed products; returns ``(created, errors)`` like
+    create_products. ``categories`` and ``attributes`` carry the lookups
+    from one batch to the next.
+    """
+    rows = []
+    for product in parsed:
+        spec = product['category']
+        if spec not in categories:
+            categories[spec] = category_id(*spec)
+        rows.append({**product, 'category_id': categories[spec]})
+    return create_products(rows, attributes)
+
+
+# ==================== Job ====================
+
+def start_scrape(platform, url, import_type, import_count=1):
+    """Queue a scrape; the same scrape already queued or running is returned instead."""
+    return enqueue('products.scrape', {
+        'platform': platform,
+        'url': url,
+        'import_type': import_type,
+        'import_count': import_count,
+    }, key=f'scrape:{platform}:{import_type}:{import_count}:{url}'[:200])
+
+
+@job('products.scrape', max_attempts=3)
+def scrape(scrape_job):
+    payload = scrape_job.payload
+    parse = PARSERS[payload['platform']]
+    progress = JobProgress(
+        scrape_job, stage='listing', urls=None, done=[], fetched=0, saved=0, product_ids=[], failed=[],
+    )
+
+    if progress['urls'] is None:
+        if payload['import_type'] == 'category':
+            listing = http_client.submit(fetch_html(payload['url'])).result()
+            urls = parse_product_links(listing, payload['url'])[:payload['import_count']]
+        else:
+            urls = [payload['url']]
+        progress.update(force=True, stage='fetching', urls=urls)
+
+    done = set(progress['done'])
+    todo = [url for url in progress['urls'] if url not in done]
+    # Pages fetched by an earlier attempt but not saved are fetched again
+    progress.update(fetched=len(done))
+
+    categories, attributes = {}, AttributeLookup()
+    batch = []  # (url, parsed product)
+
+    def save_batch():
+        created, errors = save_products([product for _, product in batch], categories, attributes)
+        rejected = {index for index, _ in errors}
+        failed = [{'url': batch[index][0], 'error': str(error)} for index, error in errors]
+        progress.update(
+            force=True,
+            done=progress['done'] + [url for url, _ in batch],
+            saved=progress['saved'] + len(created),
+            product_ids=progress['product_ids'] + [product.id for product in created],
+            failed=progress['failed'] + failed,
+        )
+        logger.info(f"Scrape job {scrape_job.id}: saved {len(created)} products, {len(rejected)} rejected")
+        batch.clear()
+
+    pages = queue.Queue()
+    fetching = http_client.submit(fetch_pages(todo, pages.put))
+    fetching.add_done_callback(lambda _: pages.put(None))
+    try:
+        while (page := pages.get()) is not None:
+            url, html, error = page
+            if error is None:
+                try:
+                    product = parse(html)
+                except Exception as e:
+                    product, error = None, f"Could not parse the page: {e}"
+                else:
+                    if product is None:
+                        error = "No product found on the page"
+            if error is None:
+                batch.append((url, product))
+                progress.update(fetched=progress['fetched'] + 1)
+            else:
+                progress.update(
+                    fetched=progress['fetched'] + 1,
+                    done=progress['done'] + [url],
+                    failed=progress['failed'] + [{'url': url, 'error': error}],
+                )
+            if len(batch) >= SAVE_BATCH_SIZE:
+                save_batch()
+    finally:
+        fetching.cancel()  # no-op unless saving failed mid-way
+
+    fetching.result()  # raise what broke the fetch stage, if anything
+    if batch:
+        save_batch()
+    progress.update(force=True, stage='done')
+    scrape_job.result = progress.state
+
+
+def scrape_status(scrape_job):
+    """What the progress endpoint reports for a scrape job."""
+    state = scrape_job.result or {}
+    return {
+        'job_id': scrape_job.id,
+        'status': scrape_job.status,
+        'stage': state.get('stage', 'queued' if scrape_job.status == 'queued' else 'listing'),
+        'total': len(state['urls']) if state.get('urls') is not None else None,
+        'fetched': state.get('fetched', 0),
+        'saved': state.get('saved', 0),
+        'product_ids': state.get('product_ids', []),
+        'failed': state.get('failed', []),
+        'error': error_summary(scrape_job),
+    }
@@ -0,0 +1,362 @@
+"""
+Ranked product search.
+
+``search_products()`` matches a free-text query against product names and
+descriptions, ranks the matches, applies the category / pick-and-pay /
+price band filters and returns one page of product ids together with facet
+counts for the whole text match.
+
+The matching is done by a backend chosen from ``settings.SEARCH_BACKEND``
+(``auto`` by default):
+
+- ``postgres``: a weighted tsvector (name A, description B) matched with a
+  prefix tsquery and ranked with ts_rank. Terms that match nothing fall back
+  to pg_trgm similarity on the name, which absorbs typos. ``setup_search``
+  creates the GIN indexes both queries use.
+- ``sqlite``: an FTS5 table (``product_search``) ranked with bm25, name
+  weighted 10x. Terms are prefix-matched and a term that is not a prefix of
+  anything indexed is widened with its closest indexed spellings. Product
+  signals keep the table current; ``setup_search`` creates and fills it.
+- ``icontains``: the original substring match, used when neither index is
+  available.
+"""
+
+import difflib
+import logging
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, Case, Count, FloatField, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from ..models import Product
+
+logger = logging.getLogger(__name__)
+
+MAX_SEARCH_TERMS = 8
+
+# Accepted values of the ``ordering`` parameter
+SEARCH_ORDERINGS = {
+    'relevance': None,
+    '-created_at': ('-created_at',),
+    'created_at': ('created_at',),
+    'price': ('price',),
+    '-price': ('-price',),
+    'name': ('name',),
+    '-name': ('-name',),
+    '-rating': ('-rating',),
+}
+
+# Price bands offered as a facet, (min, max) in KES with max exclusive
+PRICE_BANDS = {
+    '0-1000': (Decimal('0'), Decimal('1000')),
+    '1000-5000': (Decimal('1000'), Decimal('5000')),
+    '5000-20000': (Decimal('5000'), Decimal('20000')),
+    '20000+': (Decimal('20000'), None),
+}
+
+SearchPage = namedtuple('SearchPage', ['ids', 'total', 'facets', 'backend'])
+
+
+def parse_terms(query):
+    """Lower-cased word terms of ``query``, at most MAX_SEARCH_TERMS of them."""
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def price_band_q(band):
+    low, high = PRICE_BANDS[band]
+    q = Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+class IContainsSearchBackend:
+    """Substring match on name/description; names that match rank first."""
+    name = 'icontains'
+
+    def is_available(self):
+        return True
+
+    def setup(self):
+        pass
+
+    def index_products(self, products):
+        pass
+
+    def unindex_products(self, product_ids):
+        pass
+
+    def filter(self, queryset, terms, query):
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+    def ranked_ids(self, queryset, terms, query, offset, limit):
+        ranked = queryset.annotate(
+            search_rank=Case(When(name__icontains=query, then=Value(1)), default=Value(0), output_field=IntegerField())
+        ).order_by('-search_rank', '-created_at', 'id')
+        return list(ranked.values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteSearchBackend:
+    """FTS5 index with bm25 ranking and vocabulary-based spelling correction."""
+    name = 'sqlite'
+    table = 'product_search'
+    vocab_table = 'product_search_vocab'
+    max_corrections = 3
+    correction_cutoff = 0.75
+
+    def __init__(self):
+        self._expressions = {}
+
+    def is_available(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+            return cursor.fetchone() is not None
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.vocab_table}")
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+                f"name, description, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(f"CREATE VIRTUAL TABLE {self.vocab_table} USING fts5vocab({self.table}, 'row')")
+            # ORDER BY rank then means bm25 with name hits weighted 10x
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, description) "
+                f"SELECT id, name, COALESCE(description, '') FROM {Product._meta.db_table}"
+            )
+
+    def index_products(self, products):
+        products = list(products)
+        if not products:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {self.table} WHERE rowid = %s", [(product.pk,) for product in products]
+            )
+            cursor.executemany(
+                f"INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)",
+                [(product.pk, product.name, product.description or '') for product in products]
+            )
+
+    def unindex_products(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [(pk,) for pk in product_ids])
+
+    def _has_prefix(self, cursor, term):
+        cursor.execute(
+            f"SELECT 1 FROM {self.vocab_table} WHERE term >= %s AND term < %s LIMIT 1",
+            [term, term + '\U0010ffff']
+        )
+        return cursor.fetchone() is not None
+
+    def _corrections(self, cursor, term):
+        # Only indexed terms with the same first letter and a similar length
+        # are compared, which keeps the candidate list short.
+        cursor.execute(
+            f"SELECT term FROM {self.vocab_table} WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s",
+            [term[0], term[0] + '\U0010ffff', len(term) - 2, len(term) + 2]
+        )
+        candidates = [row[0] for row in cursor.fetchall()]
+        return difflib.get_close_matches(term, candidates, n=self.max_corrections, cutoff=self.correction_cutoff)
+
+    def match_expression(self, terms):
+        """FTS5 query: every term must match as a prefix or as a close spelling."""
+        key = tuple(terms)
+        if key in self._expressions:
+            return self._expressions[key]
+        clauses = []
+        with connection.cursor() as cursor:
+            for term in terms:
+                alternatives = [f'"{term}"*']
+                if len(term) > 2 and not self._has_prefix(cursor, term):
+                    alternatives += [f'"{correction}"' for correction in self._corrections(cursor, term)]
+                clauses.append(f"({' OR '.join(alternatives)})")
+        self._expressions[key] = ' AND '.join(clauses)
+        return self._expressions[key]
+
+    def filter(self, queryset, terms, query):
+        expression = self.match_expression(terms)
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [expression]
+        ))
+
+    def ranked_ids(self, queryset, terms, query, offset, limit):
+        candidates_sql, candidates_params = queryset.order_by().values('id').query.sql_with_params()
+        # Score every hit once, then filter; a rowid IN (...) constraint on the
+        # FTS table itself would re-run the match for each candidate.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH hits AS MATERIALIZED ("
+                f"SELECT rowid AS id, rank AS score FROM {self.table} WHERE {self.table} MATCH %s) "
+                f"SELECT id FROM hits WHERE id IN ({candidates_sql}) ORDER BY score, id LIMIT %s OFFSET %s",
+                [self.match_expression(terms), *candidates_params, limit, offset]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """tsvector search with a pg_trgm fallback for misspelled names."""
+    name = 'postgres'
+    trigram_threshold = 0.3
+    _has_trigram = None
+
+    @staticmethod
+    def vector_sql(table=None):
+        prefix = f'"{table}".' if table else ''
+        return (
+            f"setweight(to_tsvector('english', COALESCE({prefix}\"name\", '')), 'A') || "
+            f"setweight(to_tsvector('english', COALESCE({prefix}\"description\", '')), 'B')"
+        )
+
+    def is_available(self):
+        return True
+
+    def has_trigram(self):
+        if PostgresSearchBackend._has_trigram is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                PostgresSearchBackend._has_trigram = cursor.fetchone() is not None
+        return PostgresSearchBackend._has_trigram
+
+    def setup(self):
+        table = Product._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS product_search_vector_idx ON {table} USING GIN (({self.vector_sql()}))"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS product_name_trgm_idx ON {table} USING GIN (name gin_trgm_ops)"
+            )
+        PostgresSearchBackend._has_trigram = None
+
+    def index_products(self, products):
+        pass  # expression indexes are maintained by PostgreSQL
+
+    def unindex_products(self, product_ids):
+        pass
+
+    @staticmethod
+    def tsquery(terms):
+        # Terms are \w+ only, so they cannot carry tsquery operators
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def _vector_match(self, terms):
+        return RawSQL(
+            f"({self.vector_sql(Product._meta.db_table)}) @@ to_tsquery('english', %s)",
+            [self.tsquery(terms)], output_field=BooleanField()
+        )
+
+    def _trigram_match(self, query):
+        return RawSQL(
+            f"\"{Product._meta.db_table}\".\"name\" %% %s", [query], output_field=BooleanField()
+        )
+
+    def filter(self, queryset, terms, query):
+        matches = queryset.filter(self._vector_match(terms))
+        if matches.exists() or not self.has_trigram():
+            return matches
+        return queryset.filter(self._trigram_match(query))
+
+    def ranked_ids(self, queryset, terms, query, offset, limit):
+        table = Product._meta.db_table
+        rank_sql = f"ts_rank({self.vector_sql(table)}, to_tsquery('english', %s))"
+        params = [self.tsquery(terms)]
+        if self.has_trigram():
+            rank_sql += f" + similarity(\"{table}\".\"name\", %s)"
+            params.append(query)
+        ranked = queryset.annotate(
+            search_rank=RawSQL(rank_sql, params, output_field=FloatField())
+        ).order_by('-search_rank', '-created_at', 'id')
+        return list(ranked.values_list('id', flat=True)[offset:offset + limit])
+
+
+BACKENDS = {
+    'postgres': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+    'icontains': IContainsSearchBackend,
+}
+
+
+def get_search_backend():
+    """The configured backend, or the best available one for ``auto``."""
+    choice = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if choice != 'auto':
+        return BACKENDS[choice]()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        backend = SQLiteSearchBackend()
+        if backend.is_available():
+            return backend
+    return IContainsSearchBackend()
+
+
+def facet_counts(queryset):
+    """Category, pick-and-pay and price band counts over ``queryset``."""
+    categories = queryset.order_by().values('category__slug', 'category__name').annotate(
+        count=Count('id')
+    ).order_by('-count', 'category__name')
+    totals = queryset.order_by().aggregate(
+        pick_and_pay=Count('id', filter=Q(is_pick_and_pay=True)),
+        group_buy=Count('id', filter=Q(is_pick_and_pay=False)),
+        **{f'band_{band}': Count('id', filter=price_band_q(band)) for band in PRICE_BANDS}
+    )
+    return {
+        'categories': [
+            {'slug': row['category__slug'], 'name': row['category__name'], 'count': row['count']}
+            for row in categories
+        ],
+        'is_pick_and_pay': {'true': totals['pick_and_pay'], 'false': totals['group_buy']},
+        'price_bands': {band: totals[f'band_{band}'] for band in PRICE_BANDS},
+    }
+
+
+def search_products(query, category=None, pick_and_pay=None, price_band=None,
+                    ordering='relevance', page=1, per_page=10, backend=None, paginator=None, request=None):
+    """
+    Search products and return one ``SearchPage``.
+
+    Facets are counted over every text match, before the category, pick and
+    pay and price band filters, so the client can show how many results each
+    alternative would give.
+
+    With a ``KeysetPagination`` (ordered by one of the non-relevance
+    orderings) the page comes from the cursor in ``request`` instead of
+    ``page``, and ``total`` is None unless the client asked for a count.
+    """
+    backend = backend or get_search_backend()
+    terms = parse_terms(query)
+    if not terms:
+        return SearchPage(ids=[], total=0, facets=None, backend=backend.name)
+
+    text_matches = backend.filter(Product.objects.all(), terms, query)
+    facets = facet_counts(text_matches)
+
+    matches = text_matches
+    if category:
+        matches = matches.filter(category__slug=category)
+    if pick_and_pay is not None:
+        matches = matches.filter(is_pick_and_pay=pick_and_pay)
+    if price_band:
+        matches = matches.filter(price_band_q(price_band))
+
+    if paginator is not None:
+        rows = paginator.paginate_queryset(matches.only(*paginator.fields), request)
+        return SearchPage(ids=[row.id for row in rows], total=paginator.total, facets=facets, backend=backend.name)
+
+    total = matches.count()
+    offset = (page - 1) * per_page
+    if SEARCH_ORDERINGS[ordering] is None:
+        ids = backend.ranked_ids(matches, terms, query, offset, per_page)
+    else:
+        ordered = matches.order_by(*SEARCH_ORDERINGS[ordering], 'id')
+        ids = list(ordered.values_list('id', flat=True)[offset:offset + per_page])
+    return SearchPage(ids=ids, total=total, facets=facets, backend=backend.name)
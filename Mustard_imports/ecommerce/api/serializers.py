@@ -4,6 +4,8 @@ from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate
 import logging
 from rest_framework.pagination import PageNumberPagination
+from django.db.models import Prefetch
+from .attributes import attribute_index, index_from_values
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
@@ -164,7 +166,7 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_primary_image(self, obj):
         """Get the primary image URL for the category"""
-        first_image = obj.images.first()
+        first_image = obj.first_image()
         if first_image and first_image.image:
             return first_image.get_image()
         return None
@@ -233,7 +235,36 @@ class InventorySerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({"low_stock_threshold": "Low stock threshold cannot be negative."})
         return data
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """
+    Renders a subset of the serializer's fields.
+
+    ``fields`` replaces the default set and ``expand`` adds to it; unknown
+    names are ignored. ``default_fields`` (all fields when None) is what is
+    rendered when neither is given.
+    """
+    default_fields = None
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = set(fields or self.default_fields or self.fields) | set(expand or ())
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+def sparse_fieldset(request):
+    """Serializer kwargs from the comma separated ?fields= and ?expand= query parameters."""
+    if request is None:
+        return {}
+    fieldset = {}
+    for param in ('fields', 'expand'):
+        names = [name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()]
+        if names:
+            fieldset[param] = names
+    return fieldset
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), source='category', write_only=True
@@ -361,22 +392,17 @@ class ProductSerializer(serializers.ModelSerializer):
         return instance
 
     def get_attributes(self, obj):
-        attributes = {}
-        for attr_value in obj.attribute_values.select_related('attribute').all():
-            attr_name = attr_value.attribute.name
-            if attr_name not in attributes:
-                attributes[attr_name] = []
-            attributes[attr_name].append({
-                'id': attr_value.id,
-                'value': attr_value.value
-            })
+        if 'attribute_values' in getattr(obj, '_prefetched_objects_cache', {}):
+            index = index_from_values(obj.attribute_values.all())
+        else:
+            index = attribute_index([obj.id])[obj.id]
         return [
             {
                 'id': idx + 1,
                 'name': name,
-                'values': sorted(values, key=lambda x: x['value'])
+                'values': [{'id': value_id, 'value': value} for value_id, value in values]
             }
-            for idx, (name, values) in enumerate(sorted(attributes.items()))
+            for idx, (name, values) in enumerate(sorted(index.items()))
         ]
 
     def get_moq_progress(self, obj):
@@ -390,15 +416,57 @@ class ProductSerializer(serializers.ModelSerializer):
 
     def get_thumbnail(self, obj):
         return obj.get_primary_thumbnail()
+
+
+# What a product tile on a listing page shows
+CARD_FIELDS = [
+    'id', 'name', 'slug', 'category_slug', 'price', 'below_moq_price', 'moq', 'moq_status',
+    'moq_progress', 'is_pick_and_pay', 'rating', 'thumbnail', 'image', 'inventory',
+]
+
+
+class ProductCardSerializer(ProductSerializer):
+    """
+    ProductSerializer trimmed to CARD_FIELDS for listings; any other product
+    field can be added back with ``expand``.
+    """
+    default_fields = CARD_FIELDS
+    image = serializers.SerializerMethodField()
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ['image']
+
+    def get_image(self, obj):
+        return obj.get_primary_image()
+
+
+def product_listing_queryset(fieldset=None):
+    """Product.objects.for_cards(), or for_listing() when ``fieldset`` asks for more than a card."""
+    fieldset = fieldset or {}
+    wanted = set(fieldset.get('fields') or CARD_FIELDS) | set(fieldset.get('expand', ()))
+    if wanted <= set(CARD_FIELDS):
+        return Product.objects.for_cards()
+    return Product.objects.for_listing()
+
+
+# What the cart shows of a product: the card plus the per-person MOQ its pricing depends on
+CART_PRODUCT_FIELDS = CARD_FIELDS + ['moq_per_person']
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source='product.name')
+    is_pick_and_pay = serializers.ReadOnlyField(source='product.is_pick_and_pay')
     line_total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     price_per_piece = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
-    product = ProductSerializer(read_only=True)
+    # Products are read with Product.objects.for_cards(); see Cart.objects.for_display()
+    product = ProductCardSerializer(read_only=True, fields=CART_PRODUCT_FIELDS)
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'product_name', 'attributes', 'quantity', 'line_total', 'added_at', 'price_per_piece']
+        fields = [
+            'id', 'product', 'product_name', 'is_pick_and_pay', 'attributes', 'quantity', 'line_total', 'added_at',
+            'price_per_piece',
+        ]
         read_only_fields = ['line_total', 'price_per_piece']
 
     def validate(self, data):
@@ -457,6 +525,8 @@ class SimpleUserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'phone_number']
 
+HOME_CATEGORY_PRODUCTS = 6  # Products shown per category on the home page
+
 class HomeCategoriesPagination(PageNumberPagination):
     page_size = 4  # Load 4 categories per page
     page_size_query_param = 'page_size'
@@ -470,6 +540,11 @@ class HomeCategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'products']
 
     def get_products(self, obj):
+        fieldset = sparse_fieldset(self.context.get('request'))
+        # Views prefetch the products with home_products_prefetch()
+        if hasattr(obj, 'home_products'):
+            return ProductCardSerializer(obj.home_products, many=True, context=self.context, **fieldset).data
+
         pickup_only = self.context.get('pickup_only', False)
         # Get only active products
         products = obj.products.all().order_by('-created_at')
@@ -477,8 +552,16 @@ class HomeCategorySerializer(serializers.ModelSerializer):
             products = products.filter(is_pick_and_pay=True)
         
         # Return empty list if no products, don't return None
-        product_list = products[:6]
-        return ProductSerializer(product_list, many=True, context=self.context).data
+        product_list = products[:HOME_CATEGORY_PRODUCTS]
+        return ProductCardSerializer(product_list, many=True, context=self.context, **fieldset).data
+
+
+def home_products_prefetch(pickup_only=False, fieldset=None):
+    """Prefetch the newest products of each category into ``home_products``."""
+    products = product_listing_queryset(fieldset).order_by('-created_at')
+    if pickup_only:
+        products = products.filter(is_pick_and_pay=True)
+    return Prefetch('products', queryset=products[:HOME_CATEGORY_PRODUCTS], to_attr='home_products')
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
@@ -1,10 +1,19 @@
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.db import DatabaseError, transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
 from django.conf import settings
-from ecommerce.models import Order
+from ecommerce.models import (
+    Order, OrderItem, Product, ProductImage, Category, CategoryImage, Inventory,
+    CustomerReview, CompletedOrder, ProductMOQStats, Attribute, AttributeValue
+)
+from .attributes import forget_attributes
+from .caching import bump_tags_on_commit
+from .mailer import queue_email
+from .order_events import record_transitions
+from .search import get_search_backend
+from .stock import forget_stock
+from .suggest import publish_change
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,52 +22,288 @@ User = get_user_model()
 
 @receiver(post_save, sender=User, dispatch_uid='send_welcome_email')
 def send_welcome_email(sender, instance, created, **kwargs):
-    logger.info('Sending welcome email...')
     if created:
-        try:
-            send_mail(
-                'Welcome',
-                'Thank you for signing up!',
-                settings.DEFAULT_FROM_EMAIL,
-                [instance.email],
-                fail_silently=False,
-            )
-            logger.info(f"Welcome email sent to {instance.email}")
-        except Exception as e:
-            logger.error(f"Failed to send welcome email to {instance.email}: {str(e)}", exc_info=True)
-
-@receiver(post_save, sender=Order, dispatch_uid='send_shipped_email')
-def send_shipped_email(sender, instance, created, raw, **kwargs):
-    if raw:  # Skip if loading fixtures
+        queue_email(
+            'Welcome',
+            'Thank you for signing up!',
+            [instance.email],
+            from_email=settings.DEFAULT_FROM_EMAIL,
+        )
+        logger.info(f"Welcome email queued for {instance.email}")
+
+
+# ==================== Cache invalidation ====================
+# Cached responses are tagged (see caching.py); bumping a tag invalidates
+# every page and variant of the endpoints carrying it.
+
+def product_cache_tags(product):
+    """Tags of every cached response that renders ``product``."""
+    tags = ['catalog', f'product:{product.slug}']
+    category_slug = Category.objects.filter(pk=product.category_id).values_list('slug', flat=True).first()
+    if category_slug:
+        tags.append(f'category:{category_slug}')
+    return tags
+
+
+@receiver(pre_save, sender=Product, dispatch_uid='remember_product_cache_tags')
+def remember_product_cache_tags(sender, instance, raw, **kwargs):
+    """Keep the stored slug/category so a moved or renamed product also invalidates its old pages."""
+    instance._previous_cache_tags = []
+    if raw or not instance.pk:
+        return
+    previous = Product.objects.filter(pk=instance.pk).values_list('slug', 'category__slug').first()
+    if previous:
+        instance._previous_cache_tags = [f'product:{previous[0]}', f'category:{previous[1]}']
+
+
+@receiver(post_save, sender=Product, dispatch_uid='invalidate_product_cache_on_save')
+@receiver(post_delete, sender=Product, dispatch_uid='invalidate_product_cache_on_delete')
+def invalidate_product_cache(sender, instance, **kwargs):
+    bump_tags_on_commit(*product_cache_tags(instance), *getattr(instance, '_previous_cache_tags', []))
+
+
+@receiver(post_save, sender=Inventory, dispatch_uid='invalidate_inventory_cache_on_save')
+@receiver(post_delete, sender=Inventory, dispatch_uid='invalidate_inventory_cache_on_delete')
+@receiver(post_save, sender=ProductImage, dispatch_uid='invalidate_product_image_cache_on_save')
+@receiver(post_delete, sender=ProductImage, dispatch_uid='invalidate_product_image_cache_on_delete')
+def invalidate_product_related_cache(sender, instance, **kwargs):
+    product = Product.objects.filter(pk=instance.product_id).only('slug', 'category_id').first()
+    if product:
+        bump_tags_on_commit(*product_cache_tags(product))
+
+
+@receiver(post_save, sender=Inventory, dispatch_uid='forget_stock_counter_on_save')
+@receiver(post_delete, sender=Inventory, dispatch_uid='forget_stock_counter_on_delete')
+def forget_stock_counter(sender, instance, **kwargs):
+    """A stock level set by hand replaces the counted one; see stock.py."""
+    forget_stock(instance.product_id)
+
+
+@receiver(m2m_changed, sender=Product.attribute_values.through, dispatch_uid='forget_attributes_on_change')
+def forget_product_attributes(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_attributes([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        forget_attributes(pk_set)
+    elif action == 'pre_clear':
+        # The links are gone by post_clear
+        forget_attributes(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=AttributeValue, dispatch_uid='forget_attributes_on_value_save')
+@receiver(pre_delete, sender=AttributeValue, dispatch_uid='forget_attributes_on_value_delete')
+def forget_attribute_value_products(sender, instance, raw=False, **kwargs):
+    # A new value belongs to no product yet
+    if not raw and not kwargs.get('created'):
+        forget_attributes(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Attribute, dispatch_uid='forget_attributes_on_attribute_save')
+@receiver(pre_delete, sender=Attribute, dispatch_uid='forget_attributes_on_attribute_delete')
+def forget_attribute_products(sender, instance, raw=False, **kwargs):
+    if not raw and not kwargs.get('created'):
+        forget_attributes(Product.objects.filter(attribute_values__attribute=instance).values_list('id', flat=True))
+
+
+def category_cache_tags(category_id, category_slug):
+    """Tags of every cached response that renders the category, its products' detail pages included."""
+    tags = ['catalog', f'category:{category_slug}']
+    tags.extend(f'product:{slug}' for slug in Product.objects.filter(category_id=category_id).values_list('slug', flat=True))
+    return tags
+
+
+@receiver(pre_save, sender=Category, dispatch_uid='remember_category_cache_tags')
+def remember_category_cache_tags(sender, instance, raw, **kwargs):
+    """Keep the stored slug so a renamed category also invalidates its old pages."""
+    instance._previous_cache_tags = []
+    if raw or not instance.pk:
+        return
+    previous = Category.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+    if previous:
+        instance._previous_cache_tags = [f'category:{previous}']
+
+
+@receiver(post_save, sender=Category, dispatch_uid='invalidate_category_cache_on_save')
+@receiver(post_delete, sender=Category, dispatch_uid='invalidate_category_cache_on_delete')
+def invalidate_category_cache(sender, instance, **kwargs):
+    bump_tags_on_commit(*category_cache_tags(instance.pk, instance.slug), *getattr(instance, '_previous_cache_tags', []))
+
+
+@receiver(post_save, sender=CategoryImage, dispatch_uid='invalidate_category_image_cache_on_save')
+@receiver(post_delete, sender=CategoryImage, dispatch_uid='invalidate_category_image_cache_on_delete')
+def invalidate_category_image_cache(sender, instance, **kwargs):
+    category_slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+    bump_tags_on_commit(*category_cache_tags(instance.category_id, category_slug))
+
+
+@receiver(post_save, sender=CustomerReview, dispatch_uid='invalidate_review_cache_on_save')
+@receiver(post_delete, sender=CustomerReview, dispatch_uid='invalidate_review_cache_on_delete')
+def invalidate_review_cache(sender, instance, **kwargs):
+    tags = [f'product_reviews:{instance.product_id}']
+    product_slug = Product.objects.filter(pk=instance.product_id).values_list('slug', flat=True).first()
+    if product_slug:
+        tags.append(f'product:{product_slug}')
+    bump_tags_on_commit(*tags)
+
+
+@receiver(post_save, sender=Order, dispatch_uid='invalidate_order_cache_on_save')
+@receiver(post_delete, sender=Order, dispatch_uid='invalidate_order_cache_on_delete')
+def invalidate_order_cache(sender, instance, **kwargs):
+    bump_tags_on_commit(f'user_orders:{instance.user_id}', 'admin_orders', 'completed_orders')
+
+
+@receiver(post_save, sender=CompletedOrder, dispatch_uid='invalidate_completed_order_cache_on_save')
+@receiver(post_delete, sender=CompletedOrder, dispatch_uid='invalidate_completed_order_cache_on_delete')
+def invalidate_completed_order_cache(sender, instance, **kwargs):
+    bump_tags_on_commit('completed_orders')
+
+
+@receiver(post_save, sender=User, dispatch_uid='invalidate_user_cache')
+def invalidate_user_cache(sender, instance, **kwargs):
+    bump_tags_on_commit(f'user:{instance.pk}')
+
+
+# ==================== MOQ stats ====================
+# ProductMOQStats holds the paid quantity per product. An order counts while
+# it is paid and not cancelled; these receivers apply the difference whenever
+# an order enters or leaves that state or a counted order's items change.
+
+def _stored_row(model, pk, fields):
+    queryset = model.objects.filter(pk=pk)
+    if transaction.get_connection().in_atomic_block:
+        # Lock the row so two concurrent flips cannot both see the old state
+        queryset = queryset.select_for_update()
+    return queryset.values_list(*fields).first()
+
+
+@receiver(pre_save, sender=Order, dispatch_uid='remember_order_state')
+def remember_order_state(sender, instance, raw, **kwargs):
+    """Read the stored order once for the MOQ stats and the status transition receivers."""
+    instance._counted_toward_moq = False
+    instance._previous_delivery_status = None
+    if raw or not instance.pk:
+        return
+    previous = _stored_row(Order, instance.pk, ('payment_status', 'is_cancelled', 'delivery_status'))
+    if previous:
+        instance._counted_toward_moq = previous[:2] == ('paid', False)
+        instance._previous_delivery_status = previous[2]
+
+
+@receiver(post_save, sender=Order, dispatch_uid='update_moq_stats_for_order')
+def update_moq_stats_for_order(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    counted = instance.counts_toward_moq
+    if counted != getattr(instance, '_counted_toward_moq', False):
+        ProductMOQStats.apply_order(instance, 1 if counted else -1)
+
+
+def _other_items_of_product(item, product_id):
+    return OrderItem.objects.filter(order_id=item.order_id, product_id=product_id).exclude(pk=item.pk).exists()
+
+
+@receiver(pre_save, sender=OrderItem, dispatch_uid='remember_order_item_moq_state')
+def remember_order_item_moq_state(sender, instance, raw, **kwargs):
+    instance._previous_moq_line = None
+    if raw or not instance.pk:
+        return
+    instance._previous_moq_line = _stored_row(OrderItem, instance.pk, ('product_id', 'quantity'))
+
+
+@receiver(post_save, sender=OrderItem, dispatch_uid='update_moq_stats_for_order_item')
+def update_moq_stats_for_order_item(sender, instance, raw, **kwargs):
+    if raw or not instance.order.counts_toward_moq:
+        return
+    previous = getattr(instance, '_previous_moq_line', None)
+    if previous:
+        previous_product_id, previous_quantity = previous
+        if previous_product_id == instance.product_id:
+            ProductMOQStats.apply_delta(instance.product_id, instance.quantity - previous_quantity, 0)
+            return
+        ProductMOQStats.apply_delta(
+            previous_product_id, -previous_quantity,
+            0 if _other_items_of_product(instance, previous_product_id) else -1
+        )
+    ProductMOQStats.apply_delta(
+        instance.product_id, instance.quantity,
+        0 if _other_items_of_product(instance, instance.product_id) else 1
+    )
+
+
+@receiver(post_delete, sender=OrderItem, dispatch_uid='update_moq_stats_for_deleted_order_item')
+def update_moq_stats_for_deleted_order_item(sender, instance, **kwargs):
+    order = Order.objects.filter(pk=instance.order_id).only('payment_status', 'is_cancelled').first()
+    if order and order.counts_toward_moq:
+        ProductMOQStats.apply_delta(
+            instance.product_id, -instance.quantity,
+            0 if _other_items_of_product(instance, instance.product_id) else -1
+        )
+
+
+# ==================== Status transitions ====================
+# Delivery status changes made through Order.save(); bulk updates report
+# theirs through order_events.bulk_set_delivery_status.
+
+@receiver(post_save, sender=Order, dispatch_uid='record_order_status_transition')
+def record_order_status_transition(sender, instance, created, raw, **kwargs):
+    previous = getattr(instance, '_previous_delivery_status', None)
+    if raw or created or previous is None:
         return
-    if not created:  # Only handle updates, not new orders
-        try:
-            # Get the previous state of the order
-            old_instance = Order.objects.get(pk=instance.pk)
-            if old_instance.delivery_status != 'shipped' and instance.delivery_status == 'shipped' and instance.user.email:
-                logger.info(f"Sending shipped email for order {instance.order_number} to {instance.user.email}")
-                try:
-                    html_message = render_to_string('emails/shipped_email.html', {
-                        'user_name': instance.user.get_full_name() or instance.user.username,
-                        'order_number': instance.order_number,
-                        'delivery_location': instance.delivery_location.address if instance.delivery_location else 'N/A',
-                        'site_url': settings.SITE_URL,
-                        'year': 2025,
-                    })
-                    logger.info("Successfully rendered shipped_email.html")
-                except Exception as e:
-                    logger.error(f"Failed to render template emails/shipped_email.html: {str(e)}", exc_info=True)
-                    return
-                send_mail(
-                    subject=f"Your Order #{instance.order_number} Has Arrived",
-                    message="Your order has arrived and is ready for pickup.",
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[instance.user.email],
-                    html_message=html_message,
-                    fail_silently=False,
-                )
-                logger.info(f"Shipped email sent for order {instance.order_number} to {instance.user.email}")
-        except Order.DoesNotExist:
-            logger.error(f"Order {instance.pk} not found during shipped email signal", exc_info=True)
-        except Exception as e:
-            logger.error(f"Failed to send shipped email for order {instance.order_number}: {str(e)}", exc_info=True)
\ No newline at end of file
+    record_transitions([(instance.pk, previous, instance.delivery_status)])
+
+
+# ==================== Search index ====================
+# Backends with their own index (SQLite FTS5) are updated on every product
+# write; the PostgreSQL backend relies on expression indexes instead.
+
+SEARCHABLE_FIELDS = {'name', 'description'}
+
+
+@receiver(post_save, sender=Product, dispatch_uid='index_product_for_search')
+def index_product_for_search(sender, instance, raw, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields)):
+        return
+    try:
+        get_search_backend().index_products([instance])
+    except DatabaseError as e:
+        logger.error(f"Failed to index product {instance.pk} for search: {e}")
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='unindex_product_for_search')
+def unindex_product_for_search(sender, instance, **kwargs):
+    try:
+        get_search_backend().unindex_products([instance.pk])
+    except DatabaseError as e:
+        logger.error(f"Failed to remove product {instance.pk} from search: {e}")
+
+
+# ==================== Suggestions ====================
+# Every worker keeps its own prefix index (see suggest.py); these publish the
+# changes it has to pick up.
+
+SUGGESTION_FIELDS = {'name', 'slug', 'category'}
+
+@receiver(post_save, sender=Product, dispatch_uid='publish_product_suggestion_change_on_save')
+def publish_product_suggestion_change(sender, instance, raw, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not SUGGESTION_FIELDS & set(update_fields)):
+        return
+    publish_change(instance.pk)
+
+
+@receiver(post_delete, sender=Product, dispatch_uid='publish_product_suggestion_change_on_delete')
+def publish_deleted_product_suggestion_change(sender, instance, **kwargs):
+    publish_change(instance.pk)
+
+
+@receiver(post_save, sender=ProductImage, dispatch_uid='publish_image_suggestion_change_on_save')
+@receiver(post_delete, sender=ProductImage, dispatch_uid='publish_image_suggestion_change_on_delete')
+def publish_image_suggestion_change(sender, instance, **kwargs):
+    publish_change(instance.product_id)
+
+
+@receiver(post_save, sender=Category, dispatch_uid='publish_category_suggestion_change_on_save')
+@receiver(post_delete, sender=Category, dispatch_uid='publish_category_suggestion_change_on_delete')
+def publish_category_suggestion_change(sender, instance, **kwargs):
+    # Category names are indexed on every product of the category
+    publish_change()
@@ -0,0 +1,310 @@
+"""
+Stock reservations for Pick and Pay products.
+
+Adding a Pick and Pay product to a cart holds its units for
+``RESERVATION_TTL``, as a ``StockReservation`` row. The sweeper
+(``manage.py release_reservations``) deletes expired holds in batches and
+checkout turns the cart's holds into an order.
+
+Whether units are free is answered by a counter per product in the shared
+cache, not by the inventory row:
+
+    counter = Inventory.quantity - every StockReservation of the product
+
+A hold is taken with an atomic ``DECR`` that is undone if it went below
+zero, so shoppers competing for a hot product never queue on its inventory
+row. Missing counters are rebuilt from the database with ``add``, two
+queries for any number of products.
+
+The database stays the source of truth. Counters expire after
+``COUNTER_TTL`` and are rebuilt, so a change applied to one but not the
+other (a hold whose transaction rolled back after the ``DECR``, an edit
+made outside these helpers) is undone within minutes. Checkout still takes
+stock with a conditional ``UPDATE`` of the inventory rows, so a counter that
+is briefly too high can't sell units that aren't there. While the cache is
+unreachable, holds are checked against the database instead, under the lock
+of the product's inventory row.
+"""
+
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from ..models import Inventory, Product, StockReservation
+from .caching import bump_tags
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = timedelta(minutes=15)  # how long a cart holds its Pick and Pay units
+COUNTER_TTL = 60 * 5  # seconds before a counter is rebuilt from the database
+SWEEP_BATCH_SIZE = 500  # expired holds released per transaction
+
+COUNTER_KEY = 'stock:available:{}'
+
+
+class OutOfStock(ValueError):
+    """Fewer units are free than were asked for."""
+
+    def __init__(self, product, available, requested):
+        self.product, self.available, self.requested = product, available, requested
+        super().__init__(
+            f"Requested quantity ({requested}) exceeds available stock ({available})"
+        )
+
+
+# ==================== Counters ====================
+
+def _stored_stock(product_ids):
+    """{product id: inventory quantity minus every hold}, from the database."""
+    stock = dict(Inventory.objects.filter(product_id__in=product_ids).values_list('product_id', 'quantity'))
+    held = (
+        StockReservation.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(held=Sum('quantity')).values_list('product_id', 'held')
+    )
+    for product_id, quantity in held:
+        stock[product_id] = stock.get(product_id, 0) - quantity
+    return {product_id: stock.get(product_id, 0) for product_id in product_ids}
+
+
+def available_stock(product_ids):
+    """{product id: units free to reserve}, from the counters, rebuilding the missing ones."""
+    product_ids = list(product_ids)
+    keys = {product_id: COUNTER_KEY.format(product_id) for product_id in product_ids}
+    counters = cache.get_many(list(keys.values()))
+    available = {product_id: counters[key] for product_id, key in keys.items() if key in counters}
+    missing = [product_id for product_id in product_ids if product_id not in available]
+    if missing:
+        for product_id, quantity in _stored_stock(missing).items():
+            # add() keeps a counter another worker rebuilt or changed meanwhile
+            if not cache.add(keys[product_id], quantity, timeout=COUNTER_TTL):
+                quantity = cache.get(keys[product_id], quantity)
+            available[product_id] = quantity
+    # A counter is briefly negative while a DECR that overshot is undone
+    return {product_id: max(available[product_id], 0) for product_id in product_ids}
+
+
+def _take(product, quantity):
+    """Take ``quantity`` from the counter of ``product``; False if the cache is unreachable."""
+    key = COUNTER_KEY.format(product.id)
+    try:
+        left = cache.decr(key, quantity)
+    except ValueError:
+        available_stock([product.id])
+        left = cache.decr(key, quantity)
+    if left is None:
+        # IGNORE_EXCEPTIONS turns a cache outage into None
+        return False
+    if left < 0:
+        cache.incr(key, quantity)
+        raise OutOfStock(product, max(left + quantity, 0), quantity)
+    return True
+
+
+def _check_stored(product, quantity):
+    """
+    Without a counter: raise OutOfStock if the stock written so far in this
+    transaction, ``quantity`` units of it just taken, is below zero.
+    """
+    list(Inventory.objects.select_for_update().filter(product_id=product.id).values_list('id'))
+    left = _stored_stock([product.id])[product.id]
+    if left < 0:
+        raise OutOfStock(product, max(left + quantity, 0), quantity)
+
+
+def give_back(quantities):
+    """Add ``quantities`` (product id -> units) to the counters that exist."""
+    for product_id, quantity in quantities.items():
+        if not quantity:
+            continue
+        try:
+            cache.incr(COUNTER_KEY.format(product_id), quantity)
+        except ValueError:
+            pass  # not cached: the rebuild reads the database
+        except Exception as e:
+            logger.error(f"Failed to update the stock counter of product {product_id}: {e}")
+
+
+def stock_changed(quantities):
+    """
+    Record that the inventory of ``quantities`` (product id -> units added,
+    negative when taken) changed in SQL: once committed, the counters move by
+    as much and the cached pages showing those products are invalidated.
+    """
+    def apply():
+        give_back(quantities)
+        tags = {'catalog'}
+        for slug, category_slug in Product.objects.filter(pk__in=quantities).values_list('slug', 'category__slug'):
+            tags.update([f'product:{slug}', f'category:{category_slug}'])
+        bump_tags(*tags)
+    transaction.on_commit(apply)
+
+
+def forget_stock(product_id):
+    """Drop the counter of ``product_id`` once committed; the next read rebuilds it."""
+    transaction.on_commit(lambda: cache.delete(COUNTER_KEY.format(product_id)))
+
+
+# ==================== Holds ====================
+
+def reserve(cart_item, quantity):
+    """
+    Hold ``quantity`` units for ``cart_item``, replacing the hold it had, and
+    restart its expiry. Raises OutOfStock if the units aren't free.
+    """
+    reserve_items({cart_item: quantity})
+
+
+def reserve_items(quantities):
+    """
+    Hold ``quantities`` (cart item -> units) for each cart item, replacing the
+    holds they had, and restart their expiry, with one lock and two writes
+    however many items there are. Raises OutOfStock, holding nothing new, if
+    the units of a product aren't free.
+
+    Call it last in the transaction saving the items: units taken from the
+    counters by a transaction that then rolls back stay missing until the
+    counters are rebuilt.
+    """
+    if not quantities:
+        return
+    with transaction.atomic():
+        holds = {
+            hold.cart_item_id: hold
+            for hold in StockReservation.objects.select_for_update().filter(cart_item__in=list(quantities))
+        }
+        wanted, held, products = Counter(), Counter(), {}
+        for cart_item, quantity in quantities.items():
+            wanted[cart_item.product_id] += quantity
+            if cart_item.id in holds:
+                held[cart_item.product_id] += holds[cart_item.id].quantity
+            products[cart_item.product_id] = cart_item.product
+        available_stock(wanted)
+
+        expires_at = timezone.now() + RESERVATION_TTL
+        new = []
+        for cart_item, quantity in quantities.items():
+            hold = holds.get(cart_item.id)
+            if hold is None:
+                new.append(StockReservation(
+                    product_id=cart_item.product_id, cart_item=cart_item, quantity=quantity, expires_at=expires_at,
+                ))
+            else:
+                hold.quantity, hold.expires_at = quantity, expires_at
+        StockReservation.objects.bulk_update(holds.values(), ['quantity', 'expires_at'])
+        StockReservation.objects.bulk_create(new)
+        take_unheld(wanted, held, products)
+
+
+def release(cart_item_ids):
+    """Delete the holds of the given cart items; their units are free once committed."""
+    with transaction.atomic():
+        holds = list(
+            StockReservation.objects.select_for_update().filter(cart_item_id__in=cart_item_ids)
+            .values_list('id', 'product_id', 'quantity')
+        )
+        if holds:
+            _delete_holds(holds)
+    return len(holds)
+
+
+def _delete_holds(holds):
+    StockReservation.objects.filter(id__in=[hold_id for hold_id, _, _ in holds]).delete()
+    freed = Counter()
+    for _, product_id, quantity in holds:
+        freed[product_id] += quantity
+    transaction.on_commit(lambda: give_back(freed))
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Release every expired hold, ``batch_size`` per transaction; returns how
+    many were released. Holds locked by a checkout or another sweeper are
+    skipped rather than waited for.
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=timezone.now()).order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            if holds:
+                _delete_holds(holds)
+        released += len(holds)
+        if len(holds) < batch_size:
+            if released:
+                logger.info(f"Released {released} expired stock reservations")
+            return released
+
+
+def claim_holds(cart_item_ids):
+    """Lock the holds of the given cart items for checkout; {product id: units held}."""
+    held = Counter()
+    for product_id, quantity in (
+        StockReservation.objects.select_for_update().filter(cart_item_id__in=cart_item_ids)
+        .values_list('product_id', 'quantity')
+    ):
+        held[product_id] += quantity
+    return held
+
+
+def take_unheld(wanted, held, products):
+    """
+    Take from the counters the units of ``wanted`` (product id -> units) the
+    cart doesn't hold, and schedule the units it holds beyond ``wanted`` to be
+    given back on commit. Returns what was taken, for ``give_back`` to undo.
+    Raises OutOfStock, having undone its own takes.
+
+    Read the counters with ``available_stock`` before changing the inventory
+    or holds in the same transaction: one rebuilt afterwards would count the
+    change twice. Call it after writing them: a product whose counter can't be
+    reached is checked against the database, which must already show them.
+    """
+    missing = {product_id: quantity - held.get(product_id, 0) for product_id, quantity in wanted.items()}
+    missing = {product_id: quantity for product_id, quantity in missing.items() if quantity > 0}
+    taken = {}
+    try:
+        for product_id, quantity in missing.items():
+            if _take(products[product_id], quantity):
+                taken[product_id] = quantity
+            else:
+                _check_stored(products[product_id], quantity)
+    except OutOfStock:
+        give_back(taken)
+        raise
+    surplus = {product_id: quantity - wanted.get(product_id, 0) for product_id, quantity in held.items()}
+    surplus = {product_id: quantity for product_id, quantity in surplus.items() if quantity > 0}
+    if surplus:
+        transaction.on_commit(lambda: give_back(surplus))
+    return taken
+
+
+# ==================== Returns ====================
+
+def order_stock(order):
+    """{product id: units} of the Pick and Pay products on ``order``."""
+    return dict(
+        order.items.filter(product__is_pick_and_pay=True).order_by()
+        .values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')
+    )
+
+
+def return_stock(quantities):
+    """Put ``quantities`` (product id -> units) back into the inventory with one UPDATE."""
+    stocked = set(Inventory.objects.filter(product_id__in=quantities).values_list('product_id', flat=True))
+    for product_id in set(quantities) - stocked:
+        logger.warning(f"No inventory record for product {product_id}")
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity and product_id in stocked}
+    if not quantities:
+        return
+    Inventory.objects.filter(product_id__in=quantities).update(
+        quantity=Case(*(When(product_id=product_id, then=F('quantity') + quantity) for product_id, quantity in quantities.items())),
+        last_updated=timezone.now(),
+    )
+    stock_changed(quantities)
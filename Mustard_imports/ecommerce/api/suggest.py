@@ -0,0 +1,299 @@
+"""
+Search-as-you-type suggestions served from an in-process prefix index.
+
+``PrefixIndex`` keeps every word of every product's name, slug and category
+name in one sorted list, with parallel arrays holding the product id and a
+rank tier for each word. A lookup is two bisects and a short scan, with no
+database or cache round trip.
+
+Each worker process holds its own copy. Product, ProductImage and Category
+signals publish changes through the shared cache: a version counter plus one
+key per change. Before answering, a worker compares the version with its own
+and re-reads only the changed products. It rebuilds from scratch when it has
+fallen too far behind, a change has been evicted, or a category changed.
+
+Lookups don't take the lock. An index is never changed once other threads
+can see it: changes are applied to a copy, which then replaces it.
+"""
+
+import logging
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from ..models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'suggest:version'
+CHANGE_KEY = 'suggest:change:{}'
+CHANGE_TTL = 60 * 60  # 1 hour
+MAX_REPLAY = 500  # changes a worker replays before it rebuilds instead
+REBUILD = 'rebuild'
+
+# Rank tiers, lower ranks first
+TIER_FIRST_WORD = 0
+TIER_NAME = 1
+TIER_CATEGORY = 2
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _words(text):
+    return [sys.intern(word) for word in _WORD_RE.findall((text or '').lower())]
+
+
+def _joined(words):
+    return ''.join(' ' + word for word in words)
+
+
+def _thumbnail_url(path):
+    return settings.SITE_URL + path.lstrip('/') if path else ''
+
+
+class PrefixIndex:
+    """
+    Sorted word -> product id index answering prefix queries.
+
+    Entries are kept in three parallel sequences sorted by word: ``_keys``
+    (interned strings), ``_ids`` and ``_tiers``. Product details are kept
+    once per product in ``_products``, with the product's words joined into
+    one space-prefixed string so extra query terms are checked with a single
+    substring search.
+    """
+
+    def __init__(self, max_scan=400):
+        self.max_scan = max_scan  # entries scanned per lookup
+        self._keys = []
+        self._ids = array('q')
+        self._tiers = array('b')
+        self._products = {}  # id -> (name, slug, thumbnail path, ' word word ...')
+
+    def __len__(self):
+        return len(self._products)
+
+    @staticmethod
+    def _entries(name, slug, category_name):
+        """{word: best tier} for one product."""
+        entries = {}
+        for position, word in enumerate(_words(name)):
+            entries.setdefault(word, TIER_FIRST_WORD if position == 0 else TIER_NAME)
+        for word in _words(slug):
+            entries.setdefault(word, TIER_NAME)
+        for word in _words(category_name):
+            entries.setdefault(word, TIER_CATEGORY)
+        return entries
+
+    def load(self, rows):
+        """Replace the contents with ``rows`` of (id, name, slug, thumbnail, category name)."""
+        entries = []
+        products = {}
+        for product_id, name, slug, thumbnail, category_name in rows:
+            words = self._entries(name, slug, category_name)
+            products[product_id] = (name, slug or '', thumbnail or '', _joined(words))
+            entries.extend((word, tier, product_id) for word, tier in words.items())
+        # Within a word, better tiers come first so a capped scan keeps them
+        entries.sort()
+        self._keys = [word for word, _, _ in entries]
+        self._ids = array('q', (product_id for _, _, product_id in entries))
+        self._tiers = array('b', (tier for _, tier, _ in entries))
+        self._products = products
+
+    def copy(self):
+        """A copy that can be changed without affecting this index."""
+        other = PrefixIndex(self.max_scan)
+        other._keys = list(self._keys)
+        other._ids = array('q', self._ids)
+        other._tiers = array('b', self._tiers)
+        other._products = dict(self._products)
+        return other
+
+    def add(self, product_id, name, slug, thumbnail, category_name):
+        self.remove(product_id)
+        words = self._entries(name, slug, category_name)
+        for word, tier in words.items():
+            position = bisect_left(self._keys, word)
+            self._keys.insert(position, word)
+            self._ids.insert(position, product_id)
+            self._tiers.insert(position, tier)
+        self._products[product_id] = (name, slug or '', thumbnail or '', _joined(words))
+
+    def remove(self, product_id):
+        product = self._products.pop(product_id, None)
+        if product is None:
+            return
+        for word in product[3].split():
+            position = bisect_left(self._keys, word)
+            while position < len(self._keys) and self._keys[position] == word:
+                if self._ids[position] == product_id:
+                    del self._keys[position]
+                    del self._ids[position]
+                    del self._tiers[position]
+                    break
+                position += 1
+
+    def _range(self, prefix):
+        return bisect_left(self._keys, prefix), bisect_left(self._keys, prefix + '\U0010ffff')
+
+    def lookup(self, query, limit=8):
+        """Products whose words start with every word of ``query``, best first."""
+        terms = _words(query)
+        if not terms or not self._keys:
+            return []
+
+        # Scan the narrowest term's range and check the other terms per product
+        ranges = [(self._range(term), term) for term in terms]
+        (start, end), driver = min(ranges, key=lambda item: item[0][1] - item[0][0])
+        others = [' ' + term for term in terms]
+        others.remove(' ' + driver)
+
+        best = {}
+        stop = min(end, start + self.max_scan)
+        for product_id, tier in zip(self._ids[start:stop], self._tiers[start:stop]):
+            if best.get(product_id, tier + 1) <= tier:
+                continue
+            if others:
+                words = self._products[product_id][3]
+                if not all(term in words for term in others):
+                    continue
+            best[product_id] = tier
+
+        ranked = sorted(best, key=lambda product_id: (best[product_id], len(self._products[product_id][0])))
+        results = []
+        for product_id in ranked[:limit]:
+            name, slug, thumbnail, _ = self._products[product_id]
+            results.append({'id': product_id, 'name': name, 'slug': slug, 'thumbnail': _thumbnail_url(thumbnail)})
+        return results
+
+    def memory_usage(self):
+        """Approximate bytes held by the index, strings counted once."""
+        seen = set()
+        total = sys.getsizeof(self._keys) + sys.getsizeof(self._ids) + sys.getsizeof(self._tiers)
+        total += sys.getsizeof(self._products)
+
+        def count(obj):
+            nonlocal total
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+
+        for word in self._keys:
+            count(word)
+        for product_id, product in self._products.items():
+            total += sys.getsizeof(product_id) + sys.getsizeof(product)
+            name, slug, thumbnail, words = product
+            for value in (name, slug, thumbnail, words):
+                count(value)
+        return total
+
+
+def load_rows(product_ids=None):
+    """(id, name, slug, thumbnail path, category name) for the given or all products."""
+    products = Product.objects.order_by().values_list('id', 'name', 'slug', 'category__name')
+    images = ProductImage.objects.order_by('product_id', 'id').values_list('product_id', 'thumbnail', 'image')
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        images = images.filter(product_id__in=product_ids)
+
+    thumbnails = {}
+    for product_id, thumbnail, image in images:
+        thumbnails.setdefault(product_id, thumbnail or image or '')
+    return [
+        (product_id, name, slug, thumbnails.get(product_id, ''), category_name)
+        for product_id, name, slug, category_name in products
+    ]
+
+
+# ---- per-process index, kept in step through the shared cache ----
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def _new_version():
+    # Like cache generations: start from the clock so a recreated counter
+    # never repeats a version a worker has already seen.
+    return time.time_ns() // 1000
+
+
+def _current_version():
+    try:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, _new_version(), timeout=None)
+            version = cache.get(VERSION_KEY)
+        return version
+    except Exception as e:
+        logger.warning(f"Failed to read suggestion index version: {e}")
+        return None
+
+
+def _pending_changes(since, version):
+    """Product ids changed after ``since``, or None when a rebuild is needed."""
+    if since is None or version < since or version - since > MAX_REPLAY:
+        return None
+    keys = [CHANGE_KEY.format(number) for number in range(since + 1, version + 1)]
+    try:
+        changes = cache.get_many(keys)
+    except Exception as e:
+        logger.warning(f"Failed to read suggestion index changes: {e}")
+        return None
+    if len(changes) != len(keys) or REBUILD in changes.values():
+        return None
+    return set(changes.values())
+
+
+def get_suggest_index():
+    """This process's index, brought up to date with the published changes."""
+    global _index, _index_version
+    version = _current_version()
+    with _index_lock:
+        if _index is not None and (version is None or version == _index_version):
+            return _index
+
+        changed = _pending_changes(_index_version, version) if _index is not None else None
+        if changed is None:
+            index = PrefixIndex()
+            index.load(load_rows())
+            logger.info(f"Built suggestion index with {len(index)} products")
+        else:
+            # Other threads may be reading _index, so change a copy
+            index = _index.copy()
+            rows = {row[0]: row for row in load_rows(changed)}
+            for product_id in changed:
+                if product_id in rows:
+                    index.add(*rows[product_id])
+                else:
+                    index.remove(product_id)
+        _index = index
+        _index_version = version
+        return _index
+
+
+def publish_change(product_id=None):
+    """
+    Tell every worker that ``product_id`` changed (None: rebuild everything).
+
+    Published after the surrounding transaction commits, so workers never
+    re-read a row before the change is visible.
+    """
+    def publish():
+        try:
+            try:
+                version = cache.incr(VERSION_KEY)
+            except ValueError:
+                cache.add(VERSION_KEY, _new_version(), timeout=None)
+                version = cache.incr(VERSION_KEY)
+            cache.set(CHANGE_KEY.format(version), REBUILD if product_id is None else product_id, CHANGE_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to publish suggestion index change for {product_id}: {e}")
+
+    transaction.on_commit(publish)
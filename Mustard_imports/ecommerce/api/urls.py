@@ -5,18 +5,18 @@ from rest_framework import routers
 from .views_auth import (
     SendOTPView, VerifyOTPView, ForgotPasswordView, ResetPasswordView,
     AdminRegisterView, AdminLoginView, AdminLogoutView, AdminProfileView,
-    GoogleAuthView, UserViewSet, LoginView, logout_view, RegisterView,
+    google_auth, UserViewSet, LoginView, logout_view, RegisterView,
     ChangePasswordView, get_current_user
 )
 
 # Product views
 from .views_products import (
-    search, random_products, latest_products, RelatedProductsView,
+    search, suggest, product_stock, random_products, latest_products, RelatedProductsView,
     CategoryProductsView, CategoryViewSet, CategoriesWithProductsViewSet,
     CategoryListView, AllCategoriesWithProductsView, pickup_home_categories,
     ProductDetail, ProductViewSet, SupplierView, AttributeView,
-    AttributeValueView, AttributeValueByAttributeView, BulkProductImportView,
-    HomeCategoriesView, ScrapeProductsView
+    AttributeValueView, AttributeValueByAttributeView, bulk_product_import,
+    HomeCategoriesView, bulk_import_progress, scrape_products, scrape_progress
 )
 
 # Order views
@@ -33,12 +33,15 @@ from .views_orders import (
 # Cart views
 from .views_cart import (
     create_cart, get_user_cart, add_item_to_cart,
-    update_cart_shipping_method, update_cart_item_quantity, remove_cart_item,
+    update_cart_shipping_method, update_cart_item_quantity, remove_cart_item, update_cart_items,
     get_shipping_methods, shipping_methods1, shipping_method_detail1
 )
 
 # Admin views
-from .views_admin import admin_dashboard
+from .views_admin import (
+    admin_dashboard, cache_stats, mpesa_token_stats, upstream_stats, job_stats,
+    reconcile_stats, email_stats
+)
 
 router = routers.DefaultRouter()
 router.register(r'categories', CategoryViewSet, basename='category')
@@ -55,6 +58,12 @@ urlpatterns = [
     path('admin-page/logout/', AdminLogoutView.as_view(), name='admin_logout'),
     path('admin-page/profile/', AdminProfileView.as_view(), name='admin_profile'),
     path('admin-page/dashboard/', admin_dashboard, name='admin_dashboard'),
+    path('admin/cache-stats/', cache_stats, name='cache_stats'),
+    path('admin/mpesa-token-stats/', mpesa_token_stats, name='mpesa_token_stats'),
+    path('admin/upstream-stats/', upstream_stats, name='upstream_stats'),
+    path('admin/job-stats/', job_stats, name='job_stats'),
+    path('admin/reconcile-stats/', reconcile_stats, name='reconcile_stats'),
+    path('admin/email-stats/', email_stats, name='email_stats'),
     path('admin/orders/', get_all_orders, name='get_all_orders'),
     path('admin/moq-fulfilled-products/', get_moq_fulfilled_products, name='get_moq_fulfilled_products'),
     path('admin/products/<int:product_id>/place-order/', place_order_for_product, name='place_order_for_product'),
@@ -67,8 +76,10 @@ urlpatterns = [
     path('admin/attribute-values/', AttributeValueView.as_view(), name='attribute-value-list'),
     path('admin/attribute-values/<int:pk>/', AttributeValueView.as_view(), name='attribute-value-detail'),
     path('admin/attribute-values/by-attribute/<int:attribute_id>/', AttributeValueByAttributeView.as_view(), name='attribute-values-by-attribute'),
-    path('admin/bulk-import/', BulkProductImportView.as_view(), name='bulk-import'),
-    path('admin/scrape-products/', ScrapeProductsView.as_view(), name='scrape-products'),
+    path('admin/bulk-import/', bulk_product_import, name='bulk-import'),
+    path('admin/bulk-import/<int:job_id>/', bulk_import_progress, name='bulk-import-progress'),
+    path('admin/scrape-products/', scrape_products, name='scrape-products'),
+    path('admin/scrape-products/<int:job_id>/', scrape_progress, name='scrape-progress'),
     path('shipping_methods1/', shipping_methods1, name='shipping_methods1'),
     path('shipping_methods1/<int:shipping_method_id>/', shipping_method_detail1, name='shipping_method_detail1'),
 
@@ -77,7 +88,7 @@ urlpatterns = [
     path('auth/logout/', logout_view, name='logout'),
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('auth/login/', LoginView.as_view(), name='login'),
-    path('auth/google/', GoogleAuthView.as_view(), name='google-auth'),
+    path('auth/google/', google_auth, name='google-auth'),
     path('auth/change-password/', ChangePasswordView.as_view(), name='change-password'),
     path('auth/user/me', get_current_user, name='get_current_user'),
     path('auth/send-otp/', SendOTPView.as_view(), name='send-otp'),
@@ -87,6 +98,8 @@ urlpatterns = [
 
     # Products and search
     path('products/search/', search, name='search'), 
+    path('products/suggest/', suggest, name='suggest'),
+    path('products/stock/', product_stock, name='product-stock'),
     path('products/random/', random_products, name='random-products'),
     path('products/latest/', latest_products, name='latest-products'),
     path('products/<int:product_id>/reviews/', ProductReviewsView.as_view(), name='product-reviews'),
@@ -109,6 +122,7 @@ urlpatterns = [
     path('carts/<int:cart_id>/add_item/', add_item_to_cart, name='add-item-to-cart'),
     path('cart-items/<int:item_id>/update_cart_item_quantity/', update_cart_item_quantity, name='update-cart-item-quantity'),
     path('carts/<int:cart_id>/remove_item/', remove_cart_item, name='remove-cart-item'),
+    path('carts/<int:cart_id>/items/', update_cart_items, name='update-cart-items'),
 
     path('carts/<int:cart_id>/create-order/', create_order_from_cart, name='create-order-from-cart'),
  
@@ -1,36 +1,46 @@
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
 import logging
 import re
 
+from .caching import bump_tags
+
 logger = logging.getLogger(__name__)
 
 # Pagination Constants
 MAX_RECENT_ITEMS = 5
 MAX_DASHBOARD_ITEMS = 5
 
+# Longer search strings are truncated before they reach the database
+MAX_SEARCH_QUERY_LENGTH = 100
+
 
-def invalidate_order_caches(user_id, order_id):
+def invalidate_order_caches(user_id, order_id=None):
     """
     Invalidate cached order data for a specific user and order.
 
+    Order saves already do this through the post_save signal; call it after
+    queryset.update(), which bypasses signals.
+
     Args:
         user_id: ID of the user whose cache to invalidate
-        order_id: ID of the specific order to invalidate
+        order_id: ID of the specific order (kept for callers, every order of
+            the user shares one tag)
     """
-    cache_keys = [
-        f'user_orders_{user_id}',
-        f'user_order_{user_id}_{order_id}',
-        f'completed_orders_{user_id}',
-        f'completed_order_{user_id}_{order_id}',
-    ]
-
-    for key in cache_keys:
-        try:
-            cache.delete(key)
-            logger.debug(f"Invalidated cache key: {key}")
-        except (InvalidCacheBackendError, Exception) as e:
-            logger.error(f"Failed to invalidate cache key {key}: {e}")
+    bump_tags(f'user_orders:{user_id}', 'admin_orders', 'completed_orders')
+
+
+def invalidate_orders_caches(user_ids):
+    """invalidate_order_caches for many users at once, e.g. after a bulk update."""
+    bump_tags('admin_orders', 'completed_orders', *(f'user_orders:{user_id}' for user_id in set(user_ids)))
+
+
+def invalidate_user_caches(user_id):
+    """Invalidate the cached profile endpoints of a user."""
+    bump_tags(f'user:{user_id}')
+
+
+def invalidate_cart_cache(user_id):
+    """Invalidate the cached cart of a user."""
+    bump_tags(f'cart:{user_id}')
 
 
 def format_phone_number(phone_number):
@@ -27,7 +27,7 @@ from django.http import JsonResponse, Http404, FileResponse, HttpResponseBadRequ
 from django.db import IntegrityError, transaction, connection
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
-import requests, os, logging, re, json, base64
+import requests, os, logging, re, json
 from dotenv import load_dotenv
 from PIL import Image
 from io import BytesIO
@@ -51,19 +51,12 @@ from django.utils.crypto import get_random_string
 from ecommerce.models import User
 from google.auth.transport.requests import Request
 from .utils import invalidate_order_caches, format_phone_number, MAX_RECENT_ITEMS, MAX_DASHBOARD_ITEMS
+from .mpesa import send_stk_push, query_stk_push
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 load_dotenv()
 
-# Retrieve secrets from .env
-CONSUMER_KEY = os.getenv('CONSUMER_KEY')
-CONSUMER_SECRET = os.getenv('CONSUMER_SECRET')
-MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
-MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE')
-CALLBACK_URL = os.getenv('CALLBACK_URL')
-MPESA_BASE_URL = os.getenv('MPESA_BASE_URL')
-
 
 class SendOTPView(APIView):
     permission_classes = [permissions.AllowAny]  
@@ -143,97 +136,6 @@ class ResetPasswordView(APIView):
         except User.DoesNotExist:
             return Response({'error': 'Invalid token'}, status=status.HTTP_400_BAD_REQUEST)
 
-# M-Pesa Helper Functions
-def generate_access_token():
-    try:
-        encoded_credentials = base64.b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode()
-        headers = {
-            "Authorization": f"Basic {encoded_credentials}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(
-            f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials",
-            headers=headers
-        ).json()
-
-        if "access_token" in response:
-            return response["access_token"]
-        else:
-            raise Exception(f"Failed to get access token: {response.get('errorMessage', 'Unknown error')}")
-    except Exception as e:
-        logger.error(f"Failed to generate access token: {str(e)}")
-        raise Exception(f"Failed to get access token: {str(e)}")
-
-def send_stk_push(phone_number, amount, order_id):
-    try:
-        try:
-            amount = float(amount)  # Ensure amount is numeric
-            if amount <= 0:
-                raise ValueError("Amount must be greater than 0")
-            amount = int(amount)
-        except (ValueError, TypeError) as e:
-            logger.error(f"Invalid amount value: {amount} - {str(e)}")
-            raise ValueError("Invalid amount format")
-
-        logger.info(f"Formatted amount for STK push: {amount}")
-        token = generate_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        stk_password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": stk_password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": str(amount),
-            "PartyA": phone_number,
-            "PartyB": MPESA_SHORTCODE,
-            "PhoneNumber": phone_number,
-            "CallBackURL": CALLBACK_URL,
-            "AccountReference": f"Order-{order_id}",
-            "TransactionDesc": f"Payment for Order {order_id}"
-        }
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
-            json=request_body,
-            headers=headers
-        ).json()
-
-        return response
-    except Exception as e:
-        logger.error(f"Failed to send STK push: {str(e)}")
-        raise e
-
-def query_stk_push(checkout_request_id):
-    try:
-        token = generate_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "CheckoutRequestID": checkout_request_id
-        }
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
-            json=request_body,
-            headers=headers
-        ).json()
-        return response
-    except requests.RequestException as e:
-        logger.error(f"Failed to query STK status: {str(e)}")
-        return {"error": str(e)}
-
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_order_from_cart(request, cart_id):
@@ -2127,19 +2029,6 @@ def place_order_for_product(request, product_id):
         print(f"Failed to invalidate cache: {e}")
     return Response({'message': 'Orders updated to processing'})
 
-def invalidate_order_caches(user_id, order_id=None):
-    """Centralized function to invalidate order-related caches."""
-    cache_keys = [f'user_orders_{user_id}']
-    if order_id:
-        cache_keys.append(f'user_order_{user_id}_{order_id}')
-    cache_keys.append('admin_orders')
-    for key in cache_keys:
-        try:
-            cache.delete(key)
-            logger.info(f"Cache invalidated: {key}")
-        except (InvalidCacheBackendError, Exception) as e:
-            logger.error(f"Failed to invalidate cache {key}: {e}")
-
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
 def bulk_update_order_status(request):
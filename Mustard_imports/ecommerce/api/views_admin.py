@@ -2,11 +2,17 @@ from django.db.models import Q, Sum, Count
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import permissions, status
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
 from ..models import User, Order, Product
 from .serializers import ProductSerializer
+from .permissions import IsAdminUser
 from .utils import MAX_DASHBOARD_ITEMS
+from .caching import cached_response
+from .metrics import cache_stats as get_cache_stats
+from .mpesa import token_stats
+from .http_client import upstream_stats as get_upstream_stats
+from .jobs import job_stats as get_job_stats
+from .payments import reconcile_stats as get_reconcile_stats
+from .mailer import email_stats as get_email_stats
 from datetime import datetime, timedelta
 import logging
 
@@ -15,6 +21,8 @@ logger = logging.getLogger(__name__)
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+# The admin check below runs inside the view, so entries are kept per user
+@cached_response(ttl=60 * 5, vary_on_user=True, tags=['admin_orders', 'catalog'])  # Cache for 5 minutes
 def admin_dashboard(request):
     logger.info(f"Admin dashboard accessed by user: {request.user.username} (ID: {request.user.id}, Type: {request.user.user_type})")
 
@@ -25,14 +33,6 @@ def admin_dashboard(request):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    cache_key = 'admin_dashboard'
-    try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
     try:
         total_sales = Order.objects.count()
         total_revenue = Order.objects.aggregate(Sum('total_price'))['total_price__sum'] or 0
@@ -83,16 +83,11 @@ def admin_dashboard(request):
             'total_sales_breakdown': total_sales_breakdown,
             'active_orders': active_orders,
             'recent_orders': list(recent_orders),
-            'user_leaderboard': User.objects.filter(user_type='customer').annotate(
+            'user_leaderboard': list(User.objects.filter(user_type='customer').annotate(
                 total_purchases=Count('order')
-            ).order_by('-total_purchases').values('id', 'username', 'email', 'total_purchases')[:MAX_DASHBOARD_ITEMS]
+            ).order_by('-total_purchases').values('id', 'username', 'email', 'total_purchases')[:MAX_DASHBOARD_ITEMS])
         }
 
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 5)  # Cache for 5 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
         logger.info(f"Dashboard data retrieved successfully for user: {request.user.username}")
         return Response(response_data)
     except Exception as e:
@@ -101,3 +96,45 @@ def admin_dashboard(request):
             {'error': 'Internal server error while fetching dashboard data'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """Per-endpoint response cache hit/miss counters, aggregated across workers."""
+    return Response(get_cache_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def mpesa_token_stats(request):
+    """M-Pesa OAuth token cache hits, fetches and fetch latency, aggregated across workers."""
+    return Response(token_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def upstream_stats(request):
+    """Outbound call outcomes and latency histograms per upstream, plus circuit breaker states."""
+    return Response(get_upstream_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def job_stats(request):
+    """Queued and running jobs per job name, plus done/retry/failed counts across workers."""
+    return Response(get_job_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def reconcile_stats(request):
+    """Payments reconciled, failed and still pending according to the M-Pesa reconciler."""
+    return Response(get_reconcile_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def email_stats(request):
+    """Outbox messages by status, plus sent/retry/dead counts across workers."""
+    return Response(get_email_stats())
@@ -5,18 +5,16 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import login, logout, authenticate, get_user_model, update_session_auth_hash
-from django.core.mail import send_mail
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
 from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.views.decorators.csrf import csrf_exempt
-from google.oauth2 import id_token
-from google.auth.transport.requests import Request
+from asgiref.sync import sync_to_async
+from google.auth import jwt
 import random
 import logging
+import re
 import time
 
 from ..models import User, OTP
@@ -24,7 +22,12 @@ from .serializers import (
     UserSerializer, UserUpdateSerializer,
     LoginSerializer, RegisterSerializer, AdminLoginSerializer, AdminRegisterSerializer
 )
+from . import http_client
+from .async_views import async_api_view
 from .permissions import IsOwnerOrAdmin, IsAdminUser
+from .caching import cached_response
+from .mailer import queue_email
+from .utils import invalidate_user_caches
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -39,16 +42,12 @@ class SendOTPView(APIView):
             if not user.is_verified:
                 otp = get_random_string(length=6, allowed_chars='0123456789')
                 OTP.objects.create(user=user, otp=otp)
-                try:
-                    send_mail(
-                        'Your OTP',
-                        f'Your OTP is {otp}',
-                        'sales@mustardimports.co.ke',
-                        [email],
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send OTP email to {email}: {e}")
-                    # Don't fail the API - OTP was created successfully
+                queue_email(
+                    'Your OTP',
+                    f'Your OTP is {otp}',
+                    [email],
+                    from_email='sales@mustardimports.co.ke',
+                )
                 return Response({'message': 'OTP sent'}, status=status.HTTP_200_OK)
             return Response({'message': 'User already verified'}, status=status.HTTP_400_BAD_REQUEST)
         except User.DoesNotExist:
@@ -67,16 +66,12 @@ class VerifyOTPView(APIView):
             user.save()
             otp_obj.delete()
             # Send welcome email after verification
-            try:
-                send_mail(
-                    'Welcome to Our Platform',
-                    'Your registration is complete. Welcome aboard!',
-                    'sales@mustardimports.co.ke',
-                    [email],
-                )
-            except Exception as e:
-                logger.error(f"Failed to send welcome email to {email}: {e}")
-                # Don't fail the API - verification was successful
+            queue_email(
+                'Welcome to Our Platform',
+                'Your registration is complete. Welcome aboard!',
+                [email],
+                from_email='sales@mustardimports.co.ke',
+            )
             return Response({'message': 'OTP verified'}, status=status.HTTP_200_OK)
         except (User.DoesNotExist, OTP.DoesNotExist):
             return Response({'error': 'Invalid OTP'}, status=status.HTTP_400_BAD_REQUEST)
@@ -93,16 +88,12 @@ class ForgotPasswordView(APIView):
             user.save()
             # Change this to point to the Vue frontend route
             reset_link = f'http://localhost:5173/reset-password/{token}'  # Adjust port if needed
-            try:
-                send_mail(
-                    'Password Reset',
-                    f'Click here to reset your password: {reset_link}\nIf you did not request this, please ignore this email.',
-                    'sales@mustardimports.co.ke',
-                    [email],
-                )
-            except Exception as e:
-                logger.error(f"Failed to send password reset email to {email}: {e}")
-                # Don't fail - token was saved successfully
+            queue_email(
+                'Password Reset',
+                f'Click here to reset your password: {reset_link}\nIf you did not request this, please ignore this email.',
+                [email],
+                from_email='sales@mustardimports.co.ke',
+            )
         except User.DoesNotExist:
             pass  # Don't reveal if email exists
         return Response({'message': 'If the email exists, a reset link has been sent'}, status=status.HTTP_200_OK)
@@ -188,27 +179,13 @@ class AdminLogoutView(APIView):
 class AdminProfileView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_response(ttl=60 * 5, vary_on_user=True, tags=['user:{user}'])  # Cache for 5 minutes
     def get(self, request):
         if request.user.user_type != 'admin':
             return Response({'error': 'Only admins can access this endpoint'}, status=status.HTTP_403_FORBIDDEN)
 
-        cache_key = f'admin_profile_{request.user.id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         serializer = UserSerializer(request.user)
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 5)  # Cache for 5 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
 
     def put(self, request):
         if request.user.user_type != 'admin':
@@ -217,100 +194,115 @@ class AdminProfileView(APIView):
         if serializer.is_valid():
             serializer.save()
 
-            # Invalidate cache
-            cache_key = f'admin_profile_{request.user.id}'
-            try:
-                cache.delete(cache_key)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to invalidate cache: {e}")
+            invalidate_user_caches(request.user.id)
 
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class GoogleAuthView(APIView):
-    permission_classes = [AllowAny]
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
 
-    def post(self, request):
-        id_token_str = request.data.get('id_token')
-        if not id_token_str:
-            logger.error('No ID token provided in Google auth request')
-            return Response(
-                {'error': 'No ID token provided'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+# Google's signing certificates, kept for as long as its Cache-Control allows
+_google_certs = {'certs': None, 'expires': 0}
 
-        try:
-            server_time = timezone.now()
-            server_timestamp = int(time.time())
-            logger.info(f'Server time: {server_time} (UTC timestamp: {server_timestamp})')
-
-            # Verify the Google ID token with clock skew tolerance
-            idinfo = id_token.verify_oauth2_token(
-                id_token_str,
-                Request(),
-                settings.GOOGLE_CLIENT_ID,
-                clock_skew_in_seconds=60  # Allow up to 60 seconds of clock skew
-            )
-            logger.info(f'Token info: {idinfo}')
-
-            # Validate the token issuer
-            if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-                logger.error(f'Invalid token issuer: {idinfo["iss"]}')
-                return Response(
-                    {'error': 'Invalid token issuer'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
 
-            email = idinfo['email']
-            name = idinfo.get('name', '')
-            logger.info(f'Google token verified for email: {email}')
-
-            # Get or create user
-            try:
-                user = User.objects.get(email=email)
-                logger.info(f'Existing user found: {email}')
-            except User.DoesNotExist:
-                # Generate a unique username from email
-                username = email.split('@')[0]
-                counter = 1
-                while User.objects.filter(username=username).exists():
-                    username = f"{email.split('@')[0]}_{counter}"
-                    counter += 1
-
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    first_name=name.split()[0] if name else '',
-                    last_name=' '.join(name.split()[1:]) if name and len(name.split()) > 1 else '',
-                    user_type='customer',
-                    is_verified=True
-                )
-                logger.info(f'Created new user: {email}')
+async def google_certs():
+    if _google_certs['certs'] is None or time.monotonic() >= _google_certs['expires']:
+        response = await http_client.aget('google', GOOGLE_CERTS_URL)
+        response.raise_for_status()
+        max_age = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        _google_certs['certs'] = response.json()
+        _google_certs['expires'] = time.monotonic() + (int(max_age.group(1)) if max_age else 0)
+    return _google_certs['certs']
 
-            # Get or create token
-            token, created = Token.objects.get_or_create(user=user)
-            logger.info(f'Generated token for user: {email}, created: {created}')
 
-            return Response({
-                'message': 'Google login successful',
-                'user_id': user.id,
-                'username': user.username,
-                'token': token.key
-            }, status=status.HTTP_200_OK)
+def google_user(email, name):
+    """The user signing in with a verified Google email, created on first sign-in, and their token."""
+    try:
+        user = User.objects.get(email=email)
+        logger.info(f'Existing user found: {email}')
+    except User.DoesNotExist:
+        # Generate a unique username from email
+        username = email.split('@')[0]
+        counter = 1
+        while User.objects.filter(username=username).exists():
+            username = f"{email.split('@')[0]}_{counter}"
+            counter += 1
+
+        user = User.objects.create_user(
+            username=username,
+            email=email,
+            first_name=name.split()[0] if name else '',
+            last_name=' '.join(name.split()[1:]) if name and len(name.split()) > 1 else '',
+            user_type='customer',
+            is_verified=True
+        )
+        logger.info(f'Created new user: {email}')
+
+    # Get or create token
+    token, created = Token.objects.get_or_create(user=user)
+    logger.info(f'Generated token for user: {email}, created: {created}')
+    return user, token
+
+
+@async_api_view(['POST'], permission_classes=[AllowAny])
+async def google_auth(request):
+    id_token_str = request.data.get('id_token')
+    if not id_token_str:
+        logger.error('No ID token provided in Google auth request')
+        return Response(
+            {'error': 'No ID token provided'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
-        except ValueError as e:
-            logger.error(f'Invalid Google token: {str(e)}')
+    try:
+        server_time = timezone.now()
+        server_timestamp = int(time.time())
+        logger.info(f'Server time: {server_time} (UTC timestamp: {server_timestamp})')
+
+        # Verify the Google ID token with clock skew tolerance
+        idinfo = jwt.decode(
+            id_token_str,
+            certs=await google_certs(),
+            audience=settings.GOOGLE_CLIENT_ID,
+            clock_skew_in_seconds=60  # Allow up to 60 seconds of clock skew
+        )
+        logger.info(f'Token info: {idinfo}')
+
+        # Validate the token issuer
+        if idinfo['iss'] not in GOOGLE_ISSUERS:
+            logger.error(f'Invalid token issuer: {idinfo["iss"]}')
             return Response(
-                {'error': f'Invalid Google token: {str(e)}'},
+                {'error': 'Invalid token issuer'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        except Exception as e:
-            logger.error(f'Unexpected error during Google auth: {str(e)}', exc_info=True)
-            return Response(
-                {'error': 'Internal server error'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+
+        email = idinfo['email']
+        name = idinfo.get('name', '')
+        logger.info(f'Google token verified for email: {email}')
+
+        user, token = await sync_to_async(google_user)(email, name)
+
+        return Response({
+            'message': 'Google login successful',
+            'user_id': user.id,
+            'username': user.username,
+            'token': token.key
+        }, status=status.HTTP_200_OK)
+
+    except ValueError as e:
+        logger.error(f'Invalid Google token: {str(e)}')
+        return Response(
+            {'error': f'Invalid Google token: {str(e)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        logger.error(f'Unexpected error during Google auth: {str(e)}', exc_info=True)
+        return Response(
+            {'error': 'Internal server error'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -332,13 +324,7 @@ class UserViewSet(viewsets.ModelViewSet):
         self.perform_update(serializer)
 
         # Invalidate user profile and current user cache
-        cache_key_profile = f'user_profile_{request.user.id}'
-        cache_key_current = f'current_user_{request.user.id}'
-        try:
-            cache.delete(cache_key_profile)
-            cache.delete(cache_key_current)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_user_caches(request.user.id)
 
         return Response(serializer.data)
 
@@ -416,21 +402,14 @@ class RegisterView(APIView):
             OTP.objects.filter(user=user).delete()  # Clear any existing OTPs
             OTP.objects.create(user=user, otp=otp)
 
-            # Send OTP email
-            try:
-                send_mail(
-                    'Verify Your Account - OTP',
-                    f'Your verification OTP is: {otp}\n\nThis OTP will expire in 10 minutes.',
-                    'sales@mustardimports.co.ke',
-                    [user.email],
-                    fail_silently=False,
-                )
-            except Exception as e:
-                print(f"Failed to send OTP email: {e}")
-                user.delete()  # Remove user if email fails
-                return Response({
-                    'error': 'Failed to send verification email. Please try again.'
-                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # Send OTP email. Delivery happens in the background; if it never
+            # arrives the user can ask for a new OTP (SendOTPView).
+            queue_email(
+                'Verify Your Account - OTP',
+                f'Your verification OTP is: {otp}\n\nThis OTP will expire in 10 minutes.',
+                [user.email],
+                from_email='sales@mustardimports.co.ke',
+            )
 
             return Response({
                 'message': 'User registered successfully. Please check your email for OTP verification.',
@@ -465,24 +444,10 @@ class ChangePasswordView(APIView):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response(ttl=60 * 5, vary_on_user=True, tags=['user:{user}'])  # Cache for 5 minutes
 def get_current_user(request):
-    cache_key = f'current_user_{request.user.id}'
-    try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return JsonResponse(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
     user = request.user
-    response_data = {
+    return Response({
         'id': user.id,
         'username': user.username,
-    }
-
-    try:
-        cache.set(cache_key, response_data, timeout=60 * 5)  # Cache for 5 minutes
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to cache response: {e}")
-
-    return JsonResponse(response_data)
+    })
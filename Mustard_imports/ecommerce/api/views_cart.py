@@ -2,17 +2,33 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
 from ..models import Cart, CartItem, Product, ShippingMethod, Inventory, User
 from .serializers import CartSerializer, CartItemSerializer, ShippingMethodSerializer
-from .permissions import IsAdminUser
+from .permissions import IsAdminUser, IsCartUserOrStaff
+from .caching import cached_response
+from .attributes import allowed_attributes
+from .cart_batch import CartBatchError, apply_operations, attribute_error
+from .stock import release, reserve
+from .utils import invalidate_cart_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def cart_data(cart_id):
+    """The cart as CartSerializer renders it, read with Cart.objects.for_display()."""
+    return CartSerializer(Cart.objects.for_display().get(pk=cart_id)).data
+
+
+def cart_item_data(item_id):
+    """One cart item as CartItemSerializer renders it, its product read like the cart's."""
+    item = CartItem.objects.prefetch_related(Prefetch('product', queryset=Product.objects.for_cards())).get(pk=item_id)
+    return CartItemSerializer(item).data
+
+
 def create_cart(request, user_id=None):
     if user_id:
         try:
@@ -26,40 +42,20 @@ def create_cart(request, user_id=None):
         return Response({"error": "Authentication required"}, status=status.HTTP_401_UNAUTHORIZED)
 
     try:
-        cart, created = Cart.objects.get_or_create(user=user)
+        cart, created = Cart.objects.for_display().get_or_create(user=user)
         serializer = CartSerializer(cart)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
-@permission_classes([IsAuthenticated])
+@permission_classes([IsAuthenticated, IsCartUserOrStaff])
+@cached_response(ttl=60 * 2, tags=['cart:{user_id}'])  # Cache for 2 minutes
 def get_user_cart(request, user_id):
-    if request.user.id != user_id and not request.user.is_staff:
-        return Response(
-            {"detail": "You do not have permission to access this cart."},
-            status=status.HTTP_403_FORBIDDEN
-        )
-
-    cache_key = f'user_cart_{user_id}'
-    try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
     try:
-        cart, created = Cart.objects.get_or_create(user_id=user_id)
+        cart, created = Cart.objects.for_display().get_or_create(user_id=user_id)
         serializer = CartSerializer(cart)
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 2)  # Cache for 2 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -78,25 +74,9 @@ def add_item_to_cart(request, cart_id):
 
         # Validate attributes against product attribute_values
         if attributes:
-            product_attribute_values = product.attribute_values.all()
-            product_attributes = {}
-            for attr_value in product_attribute_values:
-                attr_name = attr_value.attribute.name
-                if attr_name not in product_attributes:
-                    product_attributes[attr_name] = []
-                product_attributes[attr_name].append(attr_value.value)
-
-            for attr_name, attr_value in attributes.items():
-                if attr_name not in product_attributes:
-                    return Response(
-                        {"error": f"Invalid attribute: {attr_name}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                if attr_value not in product_attributes[attr_name]:
-                    return Response(
-                        {"error": f"Invalid value for {attr_name}: {attr_value}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+            error = attribute_error(attributes, allowed_attributes([product.id])[product.id])
+            if error:
+                return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
         # Validate inventory for Pick and Pay products
         quantity = int(quantity)
@@ -106,11 +86,6 @@ def add_item_to_cart(request, cart_id):
                     {"error": "No inventory available for this product"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if quantity > product.inventory.quantity:
-                return Response(
-                    {"error": f"Requested quantity ({quantity}) exceeds available stock ({product.inventory.quantity})"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
 
         # Update shipping method if provided
         if shipping_method_id:
@@ -131,28 +106,27 @@ def add_item_to_cart(request, cart_id):
         moq_per_person = product.moq_per_person or 1
         price = product.price if quantity >= moq_per_person else product.below_moq_price or product.price
 
-        # Create or update cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            attributes=attributes,
-            defaults={'quantity': quantity, 'attributes': attributes}
-        )
-
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.attributes = attributes
-            cart_item.save()
+        # Create or update cart item, holding the stock of Pick and Pay products
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.get_or_create(
+                cart=cart,
+                product=product,
+                attributes=attributes,
+                defaults={'quantity': quantity, 'attributes': attributes}
+            )
+
+            if not created:
+                cart_item.quantity += quantity
+                cart_item.attributes = attributes
+                cart_item.save()
+
+            if product.is_pick_and_pay:
+                reserve(cart_item, cart_item.quantity)
 
         # Invalidate cart cache
-        cache_key = f'user_cart_{cart.user.id}'
-        try:
-            cache.delete(cache_key)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_cart_cache(cart.user_id)
 
-        serializer = CartItemSerializer(cart_item)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(cart_item_data(cart_item.id), status=status.HTTP_201_CREATED)
     except Cart.DoesNotExist:
         return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
     except Product.DoesNotExist:
@@ -162,6 +136,28 @@ def add_item_to_cart(request, cart_id):
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['PATCH'])
+@permission_classes([IsAuthenticated])
+def update_cart_items(request, cart_id):
+    """Add, update and remove many cart items at once; see cart_batch.py."""
+    try:
+        cart = Cart.objects.get(id=cart_id, user=request.user)
+        apply_operations(cart, request.data.get('operations'))
+
+        # Invalidate cart cache
+        invalidate_cart_cache(cart.user_id)
+
+        return Response(cart_data(cart.id), status=status.HTTP_200_OK)
+    except Cart.DoesNotExist:
+        return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
+    except CartBatchError as e:
+        error = {"error": str(e)}
+        if e.operation is not None:
+            error["operation"] = e.operation
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
 def update_cart_shipping_method(request, cart_id):
@@ -177,14 +173,9 @@ def update_cart_shipping_method(request, cart_id):
         cart.save()
 
         # Invalidate cart cache
-        cache_key = f'user_cart_{cart.user.id}'
-        try:
-            cache.delete(cache_key)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_cart_cache(cart.user_id)
 
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(cart_data(cart.id), status=status.HTTP_200_OK)
     except Cart.DoesNotExist:
         return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
     except ShippingMethod.DoesNotExist:
@@ -208,21 +199,19 @@ def update_cart_item_quantity(request, item_id):
         else:
             cart_item = CartItem.objects.get(id=item_id)
 
-        if cart_item.cart.user != request.user:
+        if cart_item.cart.user_id != request.user.id:
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        cart_item.quantity = new_quantity
-        cart_item.save()
+        with transaction.atomic():
+            cart_item.quantity = new_quantity
+            cart_item.save()
+            if cart_item.product.is_pick_and_pay:
+                reserve(cart_item, new_quantity)
 
         # Invalidate cart cache
-        cache_key = f'user_cart_{cart_item.cart.user.id}'
-        try:
-            cache.delete(cache_key)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_cart_cache(cart_item.cart.user_id)
 
-        serializer = CartItemSerializer(cart_item)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(cart_item_data(cart_item.id), status=status.HTTP_200_OK)
     except CartItem.DoesNotExist:
         return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
@@ -239,21 +228,17 @@ def remove_cart_item(request, cart_id):
 
         cart_item = CartItem.objects.get(id=item_id, cart_id=cart_id)
 
-        if cart_item.cart.user != request.user:
+        if cart_item.cart.user_id != request.user.id:
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        cart_item.delete()
+        with transaction.atomic():
+            release([cart_item.id])
+            cart_item.delete()
 
         # Invalidate cart cache
-        cache_key = f'user_cart_{cart_item.cart.user.id}'
-        try:
-            cache.delete(cache_key)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_cart_cache(cart_item.cart.user_id)
 
-        cart = Cart.objects.get(id=cart_id)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(cart_data(cart_id), status=status.HTTP_200_OK)
     except CartItem.DoesNotExist:
         return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
@@ -1,249 +1,74 @@
-from django.db.models import Q, Sum, Count, F
+from django.db.models import Q, Count, F, Prefetch
 from django.core.paginator import Paginator
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, permissions, status, filters
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from django.conf import settings
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
+from rest_framework.throttling import UserRateThrottle
 from ..models import (
-    Order, OrderItem, Payment, Cart, CartItem, Product, Inventory,
+    Order, Payment, Cart, CartItem, Product,
     DeliveryLocation, ShippingMethod, CustomerReview, MOQRequest,
-    CompletedOrder
+    CompletedOrder, PaymentCallbackInbox
 )
 from .serializers import (
     OrderSerializer, PaymentSerializer, CustomerReviewSerializer,
     MOQRequestSerializer, CompletedOrderSerializer, DeliveryLocationSerializer
 )
 from .permissions import IsOwnerOrAdmin, IsAdminUser
-from .utils import invalidate_order_caches, format_phone_number, MAX_RECENT_ITEMS, MAX_DASHBOARD_ITEMS
+from .utils import invalidate_cart_cache, invalidate_order_caches, invalidate_orders_caches, invalidate_user_caches, format_phone_number, MAX_DASHBOARD_ITEMS
+from .caching import cached_response
+from .async_views import async_api_view
+from .checkout import CheckoutError, place_order
+from .jobs import enqueue
+from .order_events import bulk_set_delivery_status
+from .payments import (
+    MAX_WAIT as MAX_PAYMENT_WAIT, await_change, notify_change, request_status_query, status_version
+)
+from .pagination import InvalidCursor, KeysetPagination
+from .stock import order_stock, return_stock
 from .locations import COUNTIES_AND_WARDS
-from datetime import datetime
 from django.http import JsonResponse, FileResponse, HttpResponseBadRequest
 from django.db import IntegrityError, transaction, connection
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_protect
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-import requests
 import os
 import logging
 import json
-import base64
-from dotenv import load_dotenv
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
-load_dotenv()
-
-# M-Pesa Configuration
-CONSUMER_KEY = os.getenv('CONSUMER_KEY')
-CONSUMER_SECRET = os.getenv('CONSUMER_SECRET')
-MPESA_PASSKEY = os.getenv('MPESA_PASSKEY')
-MPESA_SHORTCODE = os.getenv('MPESA_SHORTCODE')
-CALLBACK_URL = os.getenv('CALLBACK_URL')
-MPESA_BASE_URL = os.getenv('MPESA_BASE_URL')
-
-
-# M-Pesa Payment Integration Functions
-
-def generate_access_token():
-    try:
-        encoded_credentials = base64.b64encode(f"{CONSUMER_KEY}:{CONSUMER_SECRET}".encode()).decode()
-        headers = {
-            "Authorization": f"Basic {encoded_credentials}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(
-            f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials",
-            headers=headers
-        ).json()
-
-        if "access_token" in response:
-            return response["access_token"]
-        else:
-            raise Exception(f"Failed to get access token: {response.get('errorMessage', 'Unknown error')}")
-    except Exception as e:
-        logger.error(f"Failed to generate access token: {str(e)}")
-        raise Exception(f"Failed to get access token: {str(e)}")
-
-def send_stk_push(phone_number, amount, order_id):
-    try:
-        try:
-            amount = float(amount)  # Ensure amount is numeric
-            if amount <= 0:
-                raise ValueError("Amount must be greater than 0")
-            amount = int(amount)
-        except (ValueError, TypeError) as e:
-            logger.error(f"Invalid amount value: {amount} - {str(e)}")
-            raise ValueError("Invalid amount format")
-
-        logger.info(f"Formatted amount for STK push: {amount}")
-        token = generate_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        stk_password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": stk_password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": str(amount),
-            "PartyA": phone_number,
-            "PartyB": MPESA_SHORTCODE,
-            "PhoneNumber": phone_number,
-            "CallBackURL": CALLBACK_URL,
-            "AccountReference": f"Order-{order_id}",
-            "TransactionDesc": f"Payment for Order {order_id}"
-        }
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
-            json=request_body,
-            headers=headers
-        ).json()
-
-        return response
-    except Exception as e:
-        logger.error(f"Failed to send STK push: {str(e)}")
-        raise e
-
-def query_stk_push(checkout_request_id):
-    try:
-        token = generate_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        password = base64.b64encode(f"{MPESA_SHORTCODE}{MPESA_PASSKEY}{timestamp}".encode()).decode()
-
-        request_body = {
-            "BusinessShortCode": MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "CheckoutRequestID": checkout_request_id
-        }
-        response = requests.post(
-            f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query",
-            json=request_body,
-            headers=headers
-        ).json()
-        return response
-    except requests.RequestException as e:
-        logger.error(f"Failed to query STK status: {str(e)}")
-        return {"error": str(e)}
-
 
 # Order Creation & Management
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_order_from_cart(request, cart_id):
+    """Place an order for everything in the cart; see checkout.py."""
     try:
-        cart = Cart.objects.get(id=cart_id, user=request.user)
+        order = place_order(request.user, cart_id)
     except Cart.DoesNotExist:
         return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
-
-    if cart.items.count() == 0:
-        return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-
-    # Validate shipping method and Pick and Pay requirements
-    all_pick_and_pay = all(item.product.is_pick_and_pay for item in cart.items.all())
-    if all_pick_and_pay:
-        if cart.shipping_method:
-            return Response({"error": "Shipping method must be null for carts with only Pick and Pay products"}, status=status.HTTP_400_BAD_REQUEST)
-    else:
-        if not cart.shipping_method:
-            return Response({"error": "No shipping method selected for non-Pick and Pay products"}, status=status.HTTP_400_BAD_REQUEST)
-
-    shipping_method = cart.shipping_method  # Already a ShippingMethod instance
-
-    def create_order():
-        with transaction.atomic():
-            # Clean up incomplete orders
-            existing_orders = Order.objects.filter(user=request.user).select_for_update().order_by('-created_at')[:MAX_RECENT_ITEMS]
-            for existing_order in existing_orders:
-                if not existing_order.items.exists() and (timezone.now() - existing_order.created_at).seconds < 300:
-                    logger.info(f"Found incomplete order #MI{existing_order.id}, deleting it")
-                    existing_order.delete()
-
-            # Validate inventory for Pick and Pay products
-            for cart_item in cart.items.all():
-                if cart_item.product.is_pick_and_pay:
-                    inventory = Inventory.objects.filter(product=cart_item.product).select_for_update().first()
-                    if not inventory:
-                        raise ValueError(f"No inventory record found for Pick and Pay product {cart_item.product.name}")
-                    if cart_item.quantity > inventory.quantity:
-                        raise ValueError(f"Insufficient stock for {cart_item.product.name}: {inventory.quantity} available, {cart_item.quantity} requested")
-
-            # Create order without items
-            order = Order(
-                user=request.user,
-                shipping_method=None if all_pick_and_pay else shipping_method,
-                payment_status='pending',
-                delivery_status='ready_for_pickup' if all_pick_and_pay else 'processing',
-            )
-            logger.info(f"Saving new order for user {request.user.username}")
-            order.save()
-            logger.info(f"Order saved with ID {order.id}, order_number MI{order.id}")
-
-            if not order.pk:
-                raise ValueError("Order was not saved properly, no primary key assigned")
-
-            # Create order items and update inventory
-            for cart_item in cart.items.all():
-                logger.info(f"Creating OrderItem for product {cart_item.product.name}")
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    attributes=cart_item.attributes,
-                    quantity=cart_item.quantity,
-                    price=cart_item.price_per_piece,
-                )
-                if cart_item.product.is_pick_and_pay:
-                    inventory = Inventory.objects.get(product=cart_item.product)
-                    inventory.quantity -= cart_item.quantity
-                    inventory.last_updated = timezone.now()
-                    inventory.save()
-                    logger.info(f"Updated inventory for {cart_item.product.name}: quantity={inventory.quantity}, last_updated={inventory.last_updated}")
-
-            # Update total price after adding items
-            order.update_total_price()
-            # Clear cart items
-            cart.items.all().delete()
-
-            return order
-
-    try:
-        order = create_order()
-        # Invalidate cache
-        cache_key_orders = f'user_orders_{request.user.id}'
-        cache_key_order = f'user_order_{request.user.id}_{order.id}'
-        try:
-            cache.delete(cache_key_orders)
-            cache.delete(cache_key_order)
-        except (InvalidCacheBackendError, Exception) as e:
-            logger.error(f"Failed to invalidate cache: {e}")
-
-        serializer = OrderSerializer(order)
-        logger.info(f"Order created successfully: MI{order.id}")
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    except ValueError as e:
+    except CheckoutError as e:
         logger.error(f"Validation error during order creation: {str(e)}")
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Unexpected error during order creation: {str(e)}", exc_info=True)
         return Response({"error": f"Failed to create order: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    invalidate_order_caches(request.user.id, order.id)
+    invalidate_cart_cache(request.user.id)  # now empty
+    order = Order.objects.select_related('user', 'shipping_method').prefetch_related(
+        Prefetch('items__product', queryset=Product.objects.for_listing())
+    ).get(pk=order.pk)
+    serializer = OrderSerializer(order)
+    logger.info(f"Order created successfully: MI{order.id}")
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
@@ -273,13 +98,7 @@ def update_order_shipping(request, order_id):
     order.save()
 
     # Invalidate orders cache
-    cache_key_orders = f'user_orders_{request.user.id}'
-    cache_key_order = f'user_order_{request.user.id}_{order_id}'
-    try:
-        cache.delete(cache_key_orders)
-        cache.delete(cache_key_order)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to invalidate cache: {e}")
+    invalidate_order_caches(request.user.id, order.id)
 
     serializer = OrderSerializer(order)
     return Response(serializer.data, status=status.HTTP_200_OK)
@@ -287,9 +106,35 @@ def update_order_shipping(request, order_id):
 
 # Payment Processing
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def process_payment(request):
+class PaymentStatusThrottle(UserRateThrottle):
+    scope = 'payment_status'
+
+
+def _record_payment(order, phone_number):
+    # The STK push runs in the payments.initiate job; clients follow the
+    # payment through get_payment_details
+    with transaction.atomic():
+        Payment.objects.update_or_create(
+            order=order,
+            defaults={
+                'phone_number': phone_number,
+                'payment_method': 'mpesa',
+                'amount': order.total_price,
+                'payment_status': 'pending',
+                'payment_date': timezone.now(),
+                'mpesa_checkout_request_id': None,
+                'error_message': None,
+                'status_checks': 0,
+                'next_status_check': None,
+            }
+        )
+        enqueue('payments.initiate', {'order_id': order.id}, key=f'payment:{order.id}')
+    notify_change(order.id)
+    return status_version(order.id)
+
+
+@async_api_view(['POST'], permission_classes=[IsAuthenticated])
+async def process_payment(request):
     logger.info(f"Received payment request: {request.data}")
     order_id = request.data.get('order_id')
     phone_number = request.data.get('phone_number')
@@ -306,7 +151,7 @@ def process_payment(request):
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        order = Order.objects.get(id=order_id, user=request.user)
+        order = await Order.objects.aget(id=order_id, user=request.user)
     except Order.DoesNotExist:
         logger.error(f"Order {order_id} not found for user {request.user}")
         return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -315,62 +160,42 @@ def process_payment(request):
         logger.warning(f"Order {order_id} payment status is {order.payment_status}, cannot process")
         return Response({"error": "Order already paid or cancelled"}, status=status.HTTP_400_BAD_REQUEST)
 
+    version = await sync_to_async(_record_payment)(order, phone_number)
+    logger.info(f"Payment initiation queued for order {order_id}")
 
+    return Response({
+        "message": "Payment initiated",
+        "payment_status": "pending",
+        "version": version,
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@async_api_view(['GET'], permission_classes=[IsAuthenticated], throttle_classes=[PaymentStatusThrottle])
+async def get_payment_details(request, order_id):
+    """
+    The order's payment as last recorded locally. Pass the ``version`` from a
+    previous response with ``wait=<seconds>`` to long-poll: the request
+    returns as soon as the payment changes, or after ``wait`` seconds, without
+    holding a worker thread while it waits.
+    """
     try:
-        logger.info(f"Order total_price: {order.total_price} (type: {type(order.total_price)})")
-        response = send_stk_push(phone_number, order.total_price, order_id)
-        logger.info(f"STK push response: {response}")
-        if not isinstance(response, dict):
-            logger.error("Invalid STK push response format")
-            return Response({"error": "Invalid response from payment gateway"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        if response.get("ResponseCode") == "0" and "CheckoutRequestID" in response:
-            checkout_request_id = response["CheckoutRequestID"]
-            Payment.objects.update_or_create(
-                order=order,
-                defaults={
-                    'phone_number': phone_number,
-                    'payment_method': 'mpesa',
-                    'amount': order.total_price,
-                    'payment_status': 'pending',
-                    'mpesa_checkout_request_id': checkout_request_id
-                }
-            )
-            logger.info(f"Payment initiated for order {order_id}, CheckoutRequestID: {checkout_request_id}")
-            return Response({
-                "message": "Payment initiated",
-                "checkout_request_id": checkout_request_id
-            }, status=status.HTTP_200_OK)
-        else:
-            error_message = response.get("errorMessage", "Failed to process payment request")
-            logger.error(f"STK push failed: {error_message}")
-            return Response({"error": error_message}, status=status.HTTP_400_BAD_REQUEST)
-    except Exception as e:
-        logger.error(f"Payment initiation failed: {str(e)}")
-        return Response({"error": "Failed to initiate payment"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        wait = min(float(request.query_params.get('wait', 0)), MAX_PAYMENT_WAIT)
+        known_version = request.query_params.get('version')
+        known_version = int(known_version) if known_version is not None else None
+    except ValueError:
+        return Response({"error": "Invalid wait or version"}, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['GET'])
-@permission_classes([IsAuthenticated])
-def get_payment_details(request, order_id):
-    try:
-        payment = Payment.objects.get(order_id=order_id, order__user=request.user)
-    except Payment.DoesNotExist:
+    if not await Payment.objects.filter(order_id=order_id, order__user=request.user).aexists():
         return Response({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
 
-    if payment.payment_status == 'pending' and payment.mpesa_checkout_request_id:
-        try:
-            status_response = query_stk_push(payment.mpesa_checkout_request_id)
-            if status_response.get("ResultCode") == "0":
-                payment.payment_status = 'completed'
-                payment.mpesa_receipt_number = status_response.get("MpesaReceiptNumber")
-                payment.order.payment_status = 'paid'
-                payment.save()
-                payment.order.save()
-            elif status_response.get("ResultCode"):
-                payment.payment_status = 'failed'
-                payment.error_message = status_response.get("ResultDesc", "Payment failed")
-                payment.save()
-        except Exception as e:
-            logger.error(f"Failed to query payment status: {str(e)}")
+    # Read the version before the row: a change in between is reported with
+    # the older version, so the next wait returns at once instead of missing it
+    if known_version is not None and wait > 0:
+        version = await await_change(order_id, known_version, wait)
+    else:
+        version = await sync_to_async(status_version)(order_id)
+    payment = await Payment.objects.aget(order_id=order_id)
+    await sync_to_async(request_status_query)(payment)
 
     return Response({
         "payment_status": payment.payment_status,
@@ -379,11 +204,12 @@ def get_payment_details(request, order_id):
         "payment_method": payment.payment_method,
         "payment_date": payment.payment_date,
         "mpesa_receipt_number": payment.mpesa_receipt_number,
-        "error_message": payment.error_message
+        "error_message": payment.error_message,
+        "checkout_request_id": payment.mpesa_checkout_request_id,
+        "version": version,
     }, status=status.HTTP_200_OK)
 
 
-
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def mpesa_callback(request):
@@ -398,115 +224,25 @@ def mpesa_callback(request):
         stk_callback = callback_data.get("Body", {}).get("stkCallback", {})
         checkout_request_id = stk_callback.get("CheckoutRequestID")
         result_code = stk_callback.get("ResultCode")
-        result_desc = stk_callback.get("ResultDesc")
 
         if not checkout_request_id or result_code is None:
             logger.error("Missing CheckoutRequestID or ResultCode in callback")
             return HttpResponseBadRequest("Invalid callback data: Missing required fields")
 
-        try:
-            from ecommerce.models import Payment  # Import here to avoid circular imports
-            payment = Payment.objects.get(mpesa_checkout_request_id=checkout_request_id)
-        except Payment.DoesNotExist:
-            logger.error(f"No payment found for CheckoutRequestID: {checkout_request_id}")
-            return Response({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        if result_code == 0:
-            callback_metadata = stk_callback.get("CallbackMetadata", {}).get("Item", [])
-            amount = next((item["Value"] for item in callback_metadata if item["Name"] == "Amount"), None)
-            mpesa_receipt = next((item["Value"] for item in callback_metadata if item["Name"] == "MpesaReceiptNumber"), None)
-            phone_number = next((item["Value"] for item in callback_metadata if item["Name"] == "PhoneNumber"), None)
-
-            payment.amount = amount or payment.amount
-            payment.mpesa_receipt_number = mpesa_receipt
-            payment.phone_number = phone_number or payment.phone_number
-            payment.payment_status = "completed"
-            payment.save()
-
-            payment.order.payment_status = "paid"
-            payment.order.save()
-
-            # Send order confirmation email
-            try:
-                order = payment.order
-                user = order.user
-                if user.email:
-                    items = [
-                        {
-                            'product_name': item.product.name,
-                            'quantity': item.quantity,
-                            'price': str(item.price),
-                            'line_total': str(item.quantity * item.price)
-                        }
-                        for item in order.items.all()
-                    ]
-                    email_context = {
-                        'user_name': user.get_full_name() or user.username,
-                        'order_id': order.order_number,
-                        'created_at': order.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                        'payment_status': order.get_payment_status_display(),
-                        'delivery_status': order.get_delivery_status_display(),
-                        'total_price': str(order.total_price),
-                        'items': items,
-                        'shipping_method': order.shipping_method.name if order.shipping_method else 'N/A',
-                        'delivery_location': order.delivery_location.address if order.delivery_location else 'N/A',
-                        'site_url': settings.SITE_URL,
-                    }
-                    # Build items string for plain text email
-                    items_text = '\n'.join(
-                        f"- {item['product_name']} (Qty: {item['quantity']}, Price: ${item['price']}, Total: ${item['line_total']})"
-                        for item in items
-                    )
-                    html_message = render_to_string('order_confirmation.html', email_context)
-                    plain_message = f"""
-Dear {user.get_full_name() or user.username},
-
-Thank you for your order! Below are the details of your purchase:
-
-Order #{order.order_number}
-Placed on: {order.created_at.strftime('%Y-%m-%d %H:%M:%S')}
-Payment Status: {order.get_payment_status_display()}
-Delivery Status: {order.get_delivery_status_display()}
-Total: ${order.total_price}
-
-Items:
-{items_text}
-
-Shipping Method: {order.shipping_method.name if order.shipping_method else 'N/A'}
-Address: {order.delivery_location.address if order.delivery_location else 'N/A'}
-
-Regards,
-Mustard Imports Team
-"""
-                    send_mail(
-                        subject=f"Order Confirmation #{order.order_number}",
-                        message=plain_message,
-                        from_email=settings.DEFAULT_FROM_EMAIL,
-                        recipient_list=[user.email],
-                        html_message=html_message,
-                        fail_silently=False,
-                    )
-                    logger.info(f"Order confirmation email sent to {user.email} for Order #{order.order_number}")
-                else:
-                    logger.warning(f"No email address for user {user.username} for Order #{order.order_number}")
-            except Exception as e:
-                logger.error(f"Failed to send order confirmation email for Order #{order.order_number}: {str(e)}", exc_info=True)
-
-            # Invalidate orders cache
-            invalidate_order_caches(order.user.id, order.id)
-
-            logger.info(f"Payment completed for Order {order.id} - M-Pesa Receipt: {mpesa_receipt}")
-            return JsonResponse({"ResultCode": 0, "ResultDesc": "Success"}, status=status.HTTP_200_OK)
-        else:
-            payment.payment_status = "failed"
-            payment.error_message = result_desc
-            payment.save()
-
-            # Invalidate orders cache
-            invalidate_order_caches(payment.order.user.id, payment.order.id)
+        # Store the callback and answer at once; the payments.process_callback
+        # job applies it. Daraja's redeliveries land on the same inbox row.
+        with transaction.atomic():
+            entry, created = PaymentCallbackInbox.objects.get_or_create(
+                checkout_request_id=checkout_request_id,
+                defaults={'payload': stk_callback, 'result_code': result_code},
+            )
+            if created:
+                enqueue('payments.process_callback', {'inbox_id': entry.id}, key=f'mpesa-callback:{entry.id}')
+            else:
+                PaymentCallbackInbox.objects.filter(pk=entry.pk).update(deliveries=F('deliveries') + 1)
+                logger.info(f"Repeated callback for CheckoutRequestID {checkout_request_id} (ResultCode {result_code})")
 
-            logger.warning(f"Payment failed for Order {payment.order.id} - ResultCode: {result_code}, Desc: {result_desc}")
-            return JsonResponse({"ResultCode": result_code, "ResultDesc": result_desc}, status=status.HTTP_200_OK)
+        return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"}, status=status.HTTP_200_OK)
 
     except json.JSONDecodeError as e:
         logger.error(f"Invalid JSON in callback: {str(e)}")
@@ -540,51 +276,22 @@ def reset_order_id_sequence():
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response(ttl=60 * 5, vary_on_user=True, tags=['user_orders:{user}'])  # Cache for 5 minutes
 def get_user_orders(request, order_id=None, user_id=None):
     if order_id:
-        cache_key = f'user_order_{request.user.id}_{order_id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
             order = Order.objects.get(id=order_id, user=request.user)
             serializer = OrderSerializer(order)
-            response_data = serializer.data
-
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 5)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK)
         except Order.DoesNotExist:
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     else:
-        cache_key = f'user_orders_{request.user.id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
             orders = Order.objects.filter(user=request.user).prefetch_related('items', 'items__product').order_by('-created_at')
             serializer = OrderSerializer(orders, many=True)
-            response_data = serializer.data
-
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 5)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -609,15 +316,7 @@ def cancel_order(request, order_id):
 
     with transaction.atomic():
         # Restore inventory for Pick & Pay products
-        for item in order.items.all():
-            if hasattr(item.product, 'is_pick_and_pay') and item.product.is_pick_and_pay:
-                try:
-                    inventory = Inventory.objects.get(product=item.product)
-                    inventory.quantity += item.quantity
-                    inventory.save()
-                    logger.info(f"Restored {item.quantity} units to inventory for product {item.product.id}")
-                except Inventory.DoesNotExist:
-                    logger.warning(f"No inventory record for product {item.product.id}")
+        return_stock(order_stock(order))
 
         order.is_cancelled = True
         order.delivery_status = 'cancelled'
@@ -657,15 +356,7 @@ class OrderViewSet(viewsets.ModelViewSet):
 
         with transaction.atomic():
             # Restore inventory for Pick & Pay products
-            for item in order.items.all():
-                if hasattr(item.product, 'is_pick_and_pay') and item.product.is_pick_and_pay:
-                    try:
-                        inventory = Inventory.objects.get(product=item.product)
-                        inventory.quantity += item.quantity
-                        inventory.save()
-                        logger.info(f"Restored {item.quantity} units to inventory for product {item.product.id}")
-                    except Inventory.DoesNotExist:
-                        logger.warning(f"No inventory record for product {item.product.id}")
+            return_stock(order_stock(order))
 
             order.is_cancelled = True
             order.delivery_status = 'cancelled'
@@ -688,45 +379,18 @@ class CompletedOrderViewSet(viewsets.ReadOnlyModelViewSet):
             return CompletedOrder.objects.all()
         return CompletedOrder.objects.filter(user=self.request.user)
 
+    # get_queryset() depends on the X-User-Id header, so it is part of the key
+    @cached_response(ttl=60 * 15, vary_on_user=True, key_headers=['X-User-Id'], tags=['completed_orders'])  # Cache for 15 minutes
     def list(self, request, *args, **kwargs):
-        cache_key = f'completed_orders_{request.user.id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
 
+    @cached_response(ttl=60 * 15, vary_on_user=True, key_headers=['X-User-Id'], tags=['completed_orders'])  # Cache for 15 minutes
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        cache_key = f'completed_order_{request.user.id}_{instance.pk}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         serializer = self.get_serializer(instance)
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
 
 
 # Review Management
@@ -747,35 +411,33 @@ class CustomerReviewViewSet(viewsets.ModelViewSet):
 class ProductReviewsView(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    @cached_response(
+        key_params={'page': '1', 'per_page': '5', 'pagination': '', 'cursor': '', 'count': ''},
+        ttl=60 * 15,  # Cache for 15 minutes
+        tags=['product_reviews:{product_id}'],
+    )
     def get(self, request, product_id):
-        cache_key = f'product_reviews_{product_id}_page_{request.query_params.get("page", 1)}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
             product = Product.objects.get(id=product_id)
             reviews = product.reviews.all()
-            page = int(request.query_params.get('page', 1))
-            per_page = int(request.query_params.get('per_page', 5))
-            total = reviews.count()
-            start = (page - 1) * per_page
-            end = start + per_page
-            reviews = reviews[start:end]
+            paginator = KeysetPagination(page_size=5)
+            if paginator.is_requested(request):
+                reviews = paginator.paginate_queryset(reviews, request)
+                page_info = paginator.get_page_info()
+            else:
+                page = int(request.query_params.get('page', 1))
+                per_page = int(request.query_params.get('per_page', 5))
+                total = reviews.count()
+                start = (page - 1) * per_page
+                end = start + per_page
+                reviews = reviews[start:end]
+                page_info = {'total': total}
             serializer = CustomerReviewSerializer(reviews, many=True, context={'request': request})
-            response_data = {'reviews': serializer.data, 'total': total}
-
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
-            return Response(response_data)
+            return Response({'reviews': serializer.data, **page_info})
         except Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': f'Server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -788,22 +450,8 @@ class ProductReviewsView(APIView):
             if serializer.is_valid():
                 serializer.save(user=request.user, product=product)
 
-                # Invalidate reviews cache
-                cache_key_reviews = f'product_reviews_{product_id}_page_1'
-                try:
-                    cache.delete(cache_key_reviews)
-                except (InvalidCacheBackendError, Exception) as e:
-                    print(f"Failed to invalidate reviews cache: {e}")
-
-                # Invalidate product detail cache
-                cache_key_product = f'product_detail_{product.category.slug}_{product.slug}'
-                try:
-                    cache.delete(cache_key_product)
-                except (InvalidCacheBackendError, Exception) as e:
-                    print(f"Failed to invalidate product cache: {e}")
-
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
-            print(f"Serializer errors: {serializer.errors}")
+            logger.warning(f"Review serializer errors: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Product.DoesNotExist:
             return Response({"error": "Product not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -869,15 +517,8 @@ class MOQRequestViewSet(viewsets.ModelViewSet):
 class UserProfileView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @cached_response(ttl=60 * 5, vary_on_user=True, tags=['user:{user}'])  # Cache for 5 minutes
     def get(self, request):
-        cache_key = f'user_profile_{request.user.id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         user = request.user
         response_data = {
             'id': user.id,
@@ -891,12 +532,6 @@ class UserProfileView(APIView):
             'points': getattr(user, 'points', 0),
             'affiliate_code': getattr(user, 'affiliate_code', ''),
         }
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 5)  # Cache for 5 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
         return Response(response_data)
 
     def put(self, request):
@@ -911,14 +546,7 @@ class UserProfileView(APIView):
             user.avatar = data['profile_photo']
         user.save()
 
-        # Invalidate cache
-        cache_key_profile = f'user_profile_{user.id}'
-        cache_key_current = f'current_user_{user.id}'
-        try:
-            cache.delete(cache_key_profile)
-            cache.delete(cache_key_current)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to invalidate cache: {e}")
+        invalidate_user_caches(user.id)
 
         return Response({
             'id': user.id,
@@ -963,7 +591,14 @@ class WardsView(APIView):
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-@cache_page(60 * 15)
+@cached_response(
+    key_params={
+        'page': '1', 'per_page': '10', 'payment_status': '', 'delivery_status': '', 'search': '',
+        'pagination': '', 'cursor': '', 'count': '',
+    },
+    ttl=60 * 15,  # Cache for 15 minutes
+    tags=['admin_orders'],
+)
 def get_all_orders(request):
     page = int(request.query_params.get('page', 1))
     per_page = int(request.query_params.get('per_page', 10))
@@ -979,6 +614,15 @@ def get_all_orders(request):
     if search:
         orders = orders.filter(order_number__icontains=search)
 
+    keyset = KeysetPagination()
+    if keyset.is_requested(request):
+        try:
+            page_orders = keyset.paginate_queryset(orders, request)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = OrderSerializer(page_orders, many=True)
+        return Response({'results': serializer.data, **keyset.get_page_info()})
+
     paginator = Paginator(orders, per_page)
     page_obj = paginator.get_page(page)
     serializer = OrderSerializer(page_obj, many=True)
@@ -991,11 +635,12 @@ def get_all_orders(request):
 
 @api_view(['GET'])
 @permission_classes([IsAdminUser])
-@cache_page(60 * 15)
+@cached_response(ttl=60 * 15, tags=['admin_orders', 'catalog'])  # Cache for 15 minutes
 def get_moq_fulfilled_products(request):
-    products = Product.objects.filter(moq_status='active').annotate(
-        current_moq=Sum('orderitem__quantity', filter=Q(orderitem__order__payment_status='paid'))
-    ).filter(current_moq__gte=F('moq'))
+    products = Product.objects.for_listing().filter(
+        moq_status='active',
+        moq_stats__paid_quantity__gte=F('moq')
+    )
     from .serializers import ProductSerializer
     serializer = ProductSerializer(products, many=True)
     return Response(serializer.data)
@@ -1008,12 +653,9 @@ def place_order_for_product(request, product_id):
     if not orders.exists():
         return Response({'error': 'No paid orders for this product'}, status=status.HTTP_400_BAD_REQUEST)
 
-    orders.update(delivery_status='processing')
-    cache_key = 'admin_orders'
-    try:
-        cache.delete(cache_key)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to invalidate cache: {e}")
+    # update() bypasses the post_save signals
+    for user_id, order_id in orders.values_list('user_id', 'id'):
+        invalidate_order_caches(user_id, order_id)
     return Response({'message': 'Orders updated to processing'})
 
 @api_view(['POST'])
@@ -1041,35 +683,26 @@ def bulk_update_order_status(request):
         )
 
     try:
-        with transaction.atomic():
-            orders = Order.objects.select_for_update().filter(id__in=order_ids)
-            if not orders.exists():
-                logger.error("No orders found for the provided IDs")
-                return Response(
-                    {'error': 'No orders found for the provided IDs'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-
-            logger.info(f"Found {orders.count()} orders: {[o.id for o in orders]}")
-
-            updated_count = orders.update(delivery_status=delivery_status)
-            logger.info(f"Updated {updated_count} orders to {delivery_status}")
-
-            if updated_count == 0:
-                logger.error("No orders were updated")
-                return Response(
-                    {'error': 'No orders were updated'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        # One locking read and one UPDATE; the shipped notifications go out as
+        # a single background job (see order_events)
+        matched, changed = bulk_set_delivery_status(order_ids, delivery_status)
+        if not matched:
+            logger.error("No orders found for the provided IDs")
+            return Response(
+                {'error': 'No orders found for the provided IDs'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        updated_count = len(matched)
+        logger.info(f"Updated {updated_count} orders to {delivery_status} ({len(changed)} changed)")
 
-            updated_orders = Order.objects.filter(id__in=order_ids)
-            serializer = OrderSerializer(updated_orders, many=True)
+        invalidate_orders_caches(user_id for _, user_id in matched)
 
-            user_ids = set(orders.values_list('user_id', flat=True))
-            for user_id in user_ids:
-                invalidate_order_caches(user_id)
-                for order in orders.filter(user_id=user_id):
-                    invalidate_order_caches(user_id, order.id)
+        updated_orders = Order.objects.filter(id__in=[order_id for order_id, _ in matched]).select_related(
+            'user', 'shipping_method'
+        ).prefetch_related(
+            Prefetch('items__product', queryset=Product.objects.for_listing())
+        ).order_by('id')
+        serializer = OrderSerializer(updated_orders, many=True)
 
         return Response(
             {
@@ -1126,12 +759,7 @@ def update_single_order_status(request, order_id):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
-        cache_key = 'admin_orders'
-        try:
-            cache.delete(cache_key)
-            logger.info(f"Cache invalidated: {cache_key}")
-        except (InvalidCacheBackendError, Exception) as e:
-            logger.error(f"Failed to invalidate cache: {e}")
+        invalidate_order_caches(order.user_id, order.id)
 
         serializer = OrderSerializer(order)
         return Response({
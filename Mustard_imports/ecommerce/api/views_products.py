@@ -4,23 +4,15 @@ This module contains all product, category, and product-related endpoints.
 """
 
 import random
-import re
 import logging
-import pandas as pd
-import requests
 from io import BytesIO
 from PIL import Image
 from bs4 import BeautifulSoup
 
-from django.conf import settings
-from django.core.cache import cache
-from django.core.cache.backends.base import InvalidCacheBackendError
-from django.core.files.base import ContentFile
-from django.core.paginator import Paginator
-from django.db.models import Q, Count, Prefetch
+from django.db.models import Count, Prefetch
 from django.http import Http404
 from django.shortcuts import get_object_or_404
-from django.utils.text import slugify
+from django.urls import reverse
 from django.core.exceptions import ObjectDoesNotExist
 
 from rest_framework import viewsets, status, filters, permissions
@@ -35,132 +27,207 @@ from django_filters.rest_framework import DjangoFilterBackend
 
 from ..models import (
     Product, Category, Attribute, AttributeValue,
-    ProductImage, Supplier, Inventory
+    ProductImage, Supplier, Inventory, Job
 )
 from .serializers import (
     ProductSerializer, CategorySerializer, AttributeSerializer,
     AttributeValueSerializer, SupplierSerializer,
-    CategoriesProductsSerializer, HomeCategorySerializer,
-    HomeCategoriesPagination
+    CategoriesProductsSerializer, HomeCategorySerializer, ProductCardSerializer,
+    HomeCategoriesPagination, home_products_prefetch, product_listing_queryset, sparse_fieldset
 )
 from .permissions import IsAdminUser
+from .caching import cached_response
+from .pagination import InvalidCursor, KeysetPagination
+from .utils import MAX_SEARCH_QUERY_LENGTH
+from .product_import import IMPORT_EXTENSIONS, import_status, start_import
+from .scraping import MAX_IMPORT_COUNT, PARSERS, scrape_status, start_scrape
+from .search import PRICE_BANDS, SEARCH_ORDERINGS, search_products
+from .stock import available_stock
+from .suggest import get_suggest_index
 
 
 logger = logging.getLogger(__name__)
 
+# Suggestions returned by the autocomplete endpoint
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+
+# Products per live stock request
+MAX_STOCK_IDS = 100
+
+# Products per search results page
+DEFAULT_SEARCH_PER_PAGE = 10
+MAX_SEARCH_PER_PAGE = 100
+
 
 # ==================== SEARCH & DISCOVERY ENDPOINTS ====================
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@cached_response(
+    key_params={
+        'search': '', 'page': '1', 'per_page': '10', 'ordering': 'relevance',
+        'category': '', 'is_pick_and_pay': '', 'price_band': '',
+        'pagination': '', 'cursor': '', 'count': '', 'fields': '', 'expand': '',
+    },
+    ttl=60 * 10,  # Cache for 10 minutes
+    tags=['catalog'],
+)
 def search(request):
     """
     Search for products by name or description.
-    Supports pagination and ordering.
-    """
-    query = request.GET.get('search', '')
-    page = int(request.GET.get('page', 1))
-    per_page = int(request.GET.get('per_page', 10))
-    ordering = request.GET.get('ordering', '-created_at')
+    Results are ranked by relevance unless another ordering is requested and
+    can be narrowed by category, is_pick_and_pay and price_band; facet counts
+    for those filters are returned with every page.
 
-    cache_key = f'search_{query}_{page}_{per_page}_{ordering}'
+    ``?pagination=cursor`` switches the explicit orderings to keyset pages
+    (see pagination.py); relevance ranked results stay page-numbered.
+    """
+    query = request.GET.get('search', '')[:MAX_SEARCH_QUERY_LENGTH]
     try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
-    if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        ).order_by(ordering)
-
-        paginator = Paginator(products, per_page)
-        page_obj = paginator.get_page(page)
-
-        serializer = ProductSerializer(page_obj, many=True, context={'request': request})
-
-        response_data = {
-            'results': serializer.data,
-            'total': paginator.count,
-            'pages': paginator.num_pages,
-            'current_page': page
-        }
-    else:
-        response_data = {
-            "results": [],
-            "total": 0,
-            "pages": 0,
-            "current_page": 1
-        }
+        page = int(request.GET.get('page', 1))
+        per_page = int(request.GET.get('per_page', DEFAULT_SEARCH_PER_PAGE))
+    except ValueError:
+        return Response({'error': 'page and per_page must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    page = max(page, 1)
+    per_page = max(1, min(per_page, MAX_SEARCH_PER_PAGE))
+    ordering = request.GET.get('ordering') or 'relevance'
+    category = request.GET.get('category') or None
+    price_band = request.GET.get('price_band') or None
+    pick_and_pay = request.GET.get('is_pick_and_pay') or None
+
+    if ordering not in SEARCH_ORDERINGS:
+        return Response(
+            {'error': f"Invalid ordering. Must be one of: {', '.join(SEARCH_ORDERINGS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if price_band and price_band not in PRICE_BANDS:
+        return Response(
+            {'error': f"Invalid price_band. Must be one of: {', '.join(PRICE_BANDS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if pick_and_pay is not None:
+        if pick_and_pay not in ('true', 'false'):
+            return Response({'error': "is_pick_and_pay must be 'true' or 'false'"}, status=status.HTTP_400_BAD_REQUEST)
+        pick_and_pay = pick_and_pay == 'true'
+
+    paginator = None
+    if KeysetPagination().is_requested(request):
+        if SEARCH_ORDERINGS[ordering] is None:
+            return Response(
+                {'error': 'Cursor pagination needs an explicit ordering, not relevance'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        paginator = KeysetPagination(ordering=(*SEARCH_ORDERINGS[ordering], 'id'))
 
     try:
-        cache.set(cache_key, response_data, timeout=60 * 10)  # Cache for 10 minutes
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to cache response: {e}")
+        result = search_products(
+            query, category=category, pick_and_pay=pick_and_pay, price_band=price_band,
+            ordering=ordering, page=page, per_page=per_page, paginator=paginator, request=request
+        )
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    products = Product.objects.for_listing().in_bulk(result.ids)
+    serializer = ProductSerializer(
+        [products[product_id] for product_id in result.ids if product_id in products],
+        many=True, context={'request': request}, **sparse_fieldset(request)
+    )
+
+    if paginator is not None:
+        return Response({'results': serializer.data, 'facets': result.facets, **paginator.get_page_info()})
 
+    response_data = {
+        'results': serializer.data,
+        'total': result.total,
+        'pages': (result.total + per_page - 1) // per_page,
+        'current_page': page if result.total else 1,
+        'facets': result.facets,
+    }
     return Response(response_data)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
-def random_products(request):
+def suggest(request):
     """
-    Get a random selection of products (default 3).
+    Search-as-you-type suggestions (id, name, slug, thumbnail) for the query
+    in 'q'. Served from the in-process prefix index, so it is not cached.
     """
-    cache_key = 'random_products'
+    query = request.GET.get('q', '')[:MAX_SEARCH_QUERY_LENGTH]
     try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
-    products = list(Product.objects.all())
-    random_products_list = random.sample(products, min(3, len(products)))
-    serializer = ProductSerializer(random_products_list, many=True, context={'request': request})
+        limit = max(1, min(int(request.GET.get('limit', DEFAULT_SUGGESTIONS)), MAX_SUGGESTIONS))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({'results': get_suggest_index().lookup(query, limit)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def product_stock(request):
+    """
+    Units free to add to a cart for the Pick and Pay products in 'ids'
+    (comma-separated). Read from the stock counters, so it is not cached.
+    """
+    try:
+        ids = [int(product_id) for product_id in request.GET.get('ids', '').split(',') if product_id.strip()]
+    except ValueError:
+        return Response({'error': 'ids must be comma-separated numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    if not ids or len(ids) > MAX_STOCK_IDS:
+        return Response({'error': f'Between 1 and {MAX_STOCK_IDS} ids are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    pick_and_pay = Product.objects.filter(id__in=ids, is_pick_and_pay=True).values_list('id', flat=True)
+    return Response({'stock': available_stock(pick_and_pay)})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@cached_response(
+    key_params={'fields': '', 'expand': ''},
+    ttl=60 * 30,  # Cache for 30 minutes
+    stale_ttl=60 * 30,
+    single_flight=True,
+    tags=['catalog'],
+)
+def random_products(request):
+    """
+    Get a random selection of products (default 3) as product cards.
+    """
+    fieldset = sparse_fieldset(request)
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    random_ids = random.sample(product_ids, min(3, len(product_ids)))
+    random_products_list = list(product_listing_queryset(fieldset).filter(id__in=random_ids))
+    random.shuffle(random_products_list)
+    serializer = ProductCardSerializer(random_products_list, many=True, context={'request': request}, **fieldset)
     response_data = {
         'results': serializer.data,
         'total': len(random_products_list)
     }
 
-    try:
-        cache.set(cache_key, response_data, timeout=60 * 30)  # Cache for 30 minutes
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to cache response: {e}")
-
     return Response(response_data)
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@cached_response(
+    key_params={'limit': '3', 'fields': '', 'expand': ''},
+    ttl=60 * 15,  # Cache for 15 minutes
+    tags=['catalog'],
+)
 def latest_products(request):
     """
-    Get the latest products ordered by creation date.
+    Get the latest products ordered by creation date, as product cards.
     Supports a 'limit' parameter (default 3).
     """
     limit = int(request.GET.get('limit', 3))
-    cache_key = f'latest_products_{limit}'
-    try:
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Cache error: {e}. Falling back to direct query.")
-
-    products = Product.objects.order_by('-created_at')[:limit]
-    serializer = ProductSerializer(products, many=True, context={'request': request})
+    fieldset = sparse_fieldset(request)
+    products = list(product_listing_queryset(fieldset).order_by('-created_at')[:limit])
+    serializer = ProductCardSerializer(products, many=True, context={'request': request}, **fieldset)
     response_data = {
         'results': serializer.data,
         'total': len(products)
     }
 
-    try:
-        cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-    except (InvalidCacheBackendError, Exception) as e:
-        print(f"Failed to cache response: {e}")
-
     return Response(response_data)
 
 
@@ -172,33 +239,26 @@ class RelatedProductsView(APIView):
     """
     permission_classes = [permissions.AllowAny]
 
+    @cached_response(
+        key_params={'fields': '', 'expand': ''},
+        ttl=60 * 15,  # Cache for 15 minutes
+        tags=['category:{category_slug}'],
+    )
     def get(self, request, category_slug, product_id):
-        cache_key = f'related_products_{category_slug}_{product_id}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
-            queryset = Product.objects.filter(
+            fieldset = sparse_fieldset(request)
+            queryset = list(product_listing_queryset(fieldset).filter(
                 category__slug=category_slug,
                 moq_status='active'
-            ).exclude(id=product_id)[:5]
-            if not queryset.exists():
+            ).exclude(id=product_id)[:5])
+            if not queryset:
                 response_data = {"detail": "No related products found."}
                 status_code = status.HTTP_204_NO_CONTENT
             else:
-                serializer = ProductSerializer(queryset, many=True, context={'request': request})
+                serializer = ProductCardSerializer(queryset, many=True, context={'request': request}, **fieldset)
                 response_data = serializer.data
                 status_code = status.HTTP_200_OK
 
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
             return Response(response_data, status=status_code)
         except ObjectDoesNotExist:
             raise Http404("Category or product not found.")
@@ -212,11 +272,7 @@ class ProductDetail(APIView):
 
     def get_object(self, category_slug, product_slug):
         try:
-            return Product.objects.select_related(
-                'category', 'supplier'
-            ).prefetch_related(
-                'images', 'attribute_values__attribute', 'reviews__user'
-            ).filter(
+            return Product.objects.for_listing().filter(
                 category__slug=category_slug
             ).get(
                 slug=product_slug
@@ -224,26 +280,16 @@ class ProductDetail(APIView):
         except Product.DoesNotExist:
             raise Http404
 
+    @cached_response(
+        key_params={'fields': '', 'expand': ''},
+        ttl=60 * 15,  # Cache for 15 minutes
+        tags=['product:{product_slug}'],
+    )
     def get(self, request, category_slug, product_slug, format=None):
-        cache_key = f'product_detail_{category_slug}_{product_slug}'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            logger.warning(f"Cache error: {e}. Falling back to direct query.")
-
         try:
             product = self.get_object(category_slug, product_slug)
-            serializer = ProductSerializer(product, context={'request': request})
-            response_data = serializer.data
-
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-            except (InvalidCacheBackendError, Exception) as e:
-                logger.warning(f"Failed to cache response: {e}")
-
-            return Response(response_data)
+            serializer = ProductSerializer(product, context={'request': request}, **sparse_fieldset(request))
+            return Response(serializer.data)
         except Exception as e:
             logger.error(f"Error serializing product {category_slug}/{product_slug}: {e}")
             return Response({"detail": "Error processing product data."}, status=500)
@@ -257,43 +303,46 @@ class CategoryProductsView(APIView):
     """
     permission_classes = [permissions.AllowAny]
 
+    @cached_response(
+        key_params={
+            'page': '1', 'per_page': '5', 'pagination': '', 'cursor': '', 'count': '', 'fields': '', 'expand': '',
+        },
+        ttl=60 * 15,  # Cache for 15 minutes
+        tags=['category:{category_slug}'],
+    )
     def get(self, request, category_slug, *args, **kwargs):
-        cache_key = f'category_products_{category_slug}_page_{request.query_params.get("page", 1)}'
         try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
-        try:
-            category = get_object_or_404(Category, slug=category_slug)
-            products = Product.objects.filter(category=category).order_by('-created_at')
-
-            page = int(request.query_params.get('page', 1))
-            per_page = int(request.query_params.get('per_page', 5))
-            total = products.count()
-            start = (page - 1) * per_page
-            end = start + per_page
-            products = products[start:end]
+            category = get_object_or_404(Category.objects.prefetch_related('images'), slug=category_slug)
+            fieldset = sparse_fieldset(request)
+            products = product_listing_queryset(fieldset).filter(category=category).order_by('-created_at')
+
+            paginator = KeysetPagination(page_size=5)
+            if paginator.is_requested(request):
+                products = paginator.paginate_queryset(products, request)
+                page_info = paginator.get_page_info()
+            else:
+                page = int(request.query_params.get('page', 1))
+                per_page = int(request.query_params.get('per_page', 5))
+                total = products.count()
+                start = (page - 1) * per_page
+                end = start + per_page
+                products = products[start:end]
+                page_info = {'total': total}
 
             category_serializer = CategorySerializer(category, context={'request': request})
-            product_serializer = ProductSerializer(products, many=True, context={'request': request})
+            product_serializer = ProductCardSerializer(products, many=True, context={'request': request}, **fieldset)
 
             response_data = {
                 'category': category_serializer.data,
                 'products': product_serializer.data,
-                'total': total,
+                **page_info,
             }
 
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
             return Response(response_data)
         except Http404:
             return Response({'error': 'Category not found or inactive'}, status=status.HTTP_404_NOT_FOUND)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'error': f'Server error: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -316,58 +365,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
             return Category.objects.all().only('id', 'name', 'slug').prefetch_related('images')
         return Category.objects.all().prefetch_related('images')
 
+    @cached_response(key_params=['search'], ttl=60 * 15, tags=['catalog'])  # Cache for 15 minutes
     def list(self, request, *args, **kwargs):
-        cache_key = 'categories_list'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
-
-    def create(self, request, *args, **kwargs):
-        response = super().create(request, *args, **kwargs)
-        # Invalidate category caches
-        cache_keys = ['categories_list', 'category_list', 'categories_with_products', 'all_categories_with_products']
-        for key in cache_keys:
-            try:
-                cache.delete(key)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to invalidate cache {key}: {e}")
-        return response
-
-    def update(self, request, *args, **kwargs):
-        response = super().update(request, *args, **kwargs)
-        # Invalidate category caches
-        cache_keys = ['categories_list', 'category_list', 'categories_with_products', 'all_categories_with_products']
-        for key in cache_keys:
-            try:
-                cache.delete(key)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to invalidate cache {key}: {e}")
-        return response
-
-    def destroy(self, request, *args, **kwargs):
-        response = super().destroy(request, *args, **kwargs)
-        # Invalidate category caches
-        cache_keys = ['categories_list', 'category_list', 'categories_with_products', 'all_categories_with_products']
-        for key in cache_keys:
-            try:
-                cache.delete(key)
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to invalidate cache {key}: {e}")
-        return response
+        return Response(serializer.data)
 
 
 class CategoriesWithProductsViewSet(APIView):
@@ -376,51 +378,23 @@ class CategoriesWithProductsViewSet(APIView):
     """
     permission_classes = [permissions.AllowAny]
 
+    @cached_response(ttl=60 * 15, tags=['catalog'])  # Cache for 15 minutes
     def get(self, request, format=None):
-        cache_key = 'categories_with_products'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
-        categories = Category.objects.prefetch_related('products')
+        categories = Category.objects.prefetch_related('images')
         serializer = CategorySerializer(categories, many=True, context={'request': request})
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
 
 
 class CategoryListView(APIView):
     """
     Simple list of all categories.
     """
+    @cached_response(ttl=60 * 30, tags=['catalog'])  # Cache for 30 minutes
     def get(self, request):
-        cache_key = 'category_list'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
-            categories = Category.objects.all().order_by('id')
+            categories = Category.objects.prefetch_related('images').order_by('id')
             serializer = CategorySerializer(categories, many=True, context={'request': request})
-            response_data = serializer.data
-
-            try:
-                cache.set(cache_key, response_data, timeout=60 * 30)  # Cache for 30 minutes
-            except (InvalidCacheBackendError, Exception) as e:
-                print(f"Failed to cache response: {e}")
-
-            return Response(response_data, status=status.HTTP_200_OK)
+            return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -431,32 +405,19 @@ class AllCategoriesWithProductsView(APIView):
     """
     permission_classes = [AllowAny]
 
+    @cached_response(ttl=60 * 15, stale_ttl=60 * 30, single_flight=True, tags=['catalog'])  # Cache for 15 minutes
     def get(self, request, *args, **kwargs):
-        cache_key = 'all_categories_with_products'
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         # Fetch all categories and their products, ignoring default manager filters
         categories = Category.objects.prefetch_related(
-            Prefetch('products', queryset=Product.objects.all())
+            Prefetch('products', queryset=Product.objects.for_listing())
         ).all()
 
         serializer = CategoriesProductsSerializer(categories, many=True, context={'request': request})
-        response_data = serializer.data
-
-        try:
-            cache.set(cache_key, response_data, timeout=60 * 15)  # Cache for 15 minutes
-        except (InvalidCacheBackendError, Exception) as e:
-            print(f"Failed to cache response: {e}")
-
-        return Response(response_data)
+        return Response(serializer.data)
 
 
 @api_view(['GET'])
+@cached_response(key_params={'page': '1', 'fields': '', 'expand': ''}, ttl=60 * 5, tags=['catalog'])  # Cache for 5 minutes
 def pickup_home_categories(request):
     """
     Get categories that have pick-and-pay products.
@@ -464,13 +425,15 @@ def pickup_home_categories(request):
     page = request.query_params.get('page', '1')
     products = Product.objects.filter(is_pick_and_pay=True)
     category_ids = products.values_list('category_id', flat=True).distinct()
-    categories = Category.objects.filter(id__in=category_ids)
+    categories = Category.objects.filter(id__in=category_ids).prefetch_related(
+        home_products_prefetch(pickup_only=True, fieldset=sparse_fieldset(request))
+    )
 
     paginator = PageNumberPagination()
     paginator.page_size = 8  # Match HomePage.vue
     result_page = paginator.paginate_queryset(categories, request)
 
-    serializer = HomeCategorySerializer(result_page, many=True, context={'pickup_only': True})
+    serializer = HomeCategorySerializer(result_page, many=True, context={'request': request, 'pickup_only': True})
     return paginator.get_paginated_response(serializer.data)
 
 
@@ -481,53 +444,34 @@ class HomeCategoriesView(APIView):
     permission_classes = [AllowAny]
     pagination_class = HomeCategoriesPagination
 
+    @cached_response(
+        key_params={'page': '1', 'page_size': '', 'fields': '', 'expand': ''},
+        ttl=60 * 5,  # Cache for 5 minutes
+        stale_ttl=60 * 15,  # then serve stale for up to 15 more while refreshing
+        single_flight=True,
+        tags=['catalog'],
+    )
     def get(self, request, *args, **kwargs):
-        cache_key = f'home_categories_with_products_page_{request.query_params.get("page", 1)}'
-
-        try:
-            cached_data = cache.get(cache_key)
-            if cached_data:
-                return Response(cached_data)
-        except Exception as e:
-            print(f"Cache error: {e}. Falling back to direct query.")
-
         try:
             # Fetch all active categories ordered by id
-            categories = Category.objects.all().order_by('id')
-
-            # Debug: Print the count
-            print(f"Found {categories.count()} active categories")
+            categories = Category.objects.prefetch_related(
+                home_products_prefetch(fieldset=sparse_fieldset(request))
+            ).order_by('id')
 
             # Apply pagination
             paginator = self.pagination_class()
             paginated_categories = paginator.paginate_queryset(categories, request)
 
-            # Debug: Print paginated count
-            print(f"Paginated categories count: {len(paginated_categories) if paginated_categories else 0}")
-
             # Serialize the paginated queryset
             serializer = HomeCategorySerializer(
                 paginated_categories,
                 many=True,
                 context={'request': request}
             )
-
-            # Debug: Print serialized data
-            print(f"Serialized data: {serializer.data}")
-
-            # Get the paginated response
-            response = paginator.get_paginated_response(serializer.data)
-
-            # Cache the response data (optional, but good for performance)
-            try:
-                cache.set(cache_key, response.data, timeout=300)  # Cache for 5 minutes
-            except Exception as e:
-                print(f"Cache set error: {e}")
-
-            return response
+            return paginator.get_paginated_response(serializer.data)
 
         except Exception as e:
-            print(f"HomeCategoriesView error: {str(e)}")
+            logger.error(f"HomeCategoriesView error: {str(e)}")
             return Response(
                 {'error': f'Server error: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -544,6 +488,13 @@ class ProductViewSet(viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]
 
+    def get_queryset(self):
+        # Writes add images after save, so only read-only actions use the
+        # prefetched listing queryset.
+        if self.action in ('list', 'retrieve'):
+            return Product.objects.for_listing()
+        return super().get_queryset()
+
     def create(self, request, *args, **kwargs):
         logger.info(f"Create request data: {request.data}")
         serializer = self.get_serializer(data=request.data)
@@ -770,347 +721,82 @@ class AttributeValueByAttributeView(APIView):
 
 # ==================== BULK IMPORT ====================
 
-class BulkProductImportView(APIView):
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def bulk_product_import(request):
     """
     Bulk import products from CSV or Excel file.
-    """
-    permission_classes = [permissions.IsAdminUser]
 
-    def post(self, request):
-        file = request.FILES.get('file')
-        if not file:
-            return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            if file.name.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.name.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file)
-            else:
-                return Response({"error": "Unsupported file format. Use CSV or Excel."}, status=status.HTTP_400_BAD_REQUEST)
+    The file is imported by a background job (see product_import.py); this
+    answers with the job's id and progress URL.
+    """
+    file = request.FILES.get('file')
+    if not file:
+        return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Replace NaN with None for nullable fields
-            df = df.replace({pd.NA: None})
+    if not file.name.lower().endswith(IMPORT_EXTENSIONS):
+        return Response({"error": "Unsupported file format. Use CSV or Excel."}, status=status.HTTP_400_BAD_REQUEST)
 
-            created_products = []
-            errors = []
+    import_job = start_import(file)
+    return Response({
+        **import_status(import_job),
+        "progress_url": reverse('bulk-import-progress', kwargs={'job_id': import_job.id}),
+    }, status=status.HTTP_202_ACCEPTED)
 
-            for index, row in df.iterrows():
-                try:
-                    # Required fields validation
-                    if not row.get('name') or not isinstance(row.get('price'), (int, float)) or pd.isna(row.get('category_id')):
-                        errors.append({"row": index + 2, "error": "Missing required fields: name, price, or category_id"})
-                        continue
-
-                    is_pick_and_pay = bool(row.get('is_pick_and_pay', False))
-                    product_data = {
-                        'name': str(row.get('name', '')),
-                        'slug': row.get('slug', slugify(row.get('name', ''))),
-                        'description': str(row.get('description', '')) if row.get('description') else '',
-                        'price': float(row.get('price', 0)),
-                        'below_moq_price': None if is_pick_and_pay else row.get('below_moq_price', None),
-                        'moq': int(row.get('moq', 1)) if not is_pick_and_pay else 1,
-                        'moq_per_person': int(row.get('moq_per_person', 1)) if not is_pick_and_pay else 1,
-                        'moq_status': row.get('moq_status', 'active') if not is_pick_and_pay else 'not_applicable',
-                        'is_pick_and_pay': is_pick_and_pay,
-                        'category_id': int(row['category_id']),
-                        'supplier_id': int(row['supplier_id']) if row.get('supplier_id') and not pd.isna(row['supplier_id']) else None,
-                        'meta_title': str(row.get('meta_title', '')) if row.get('meta_title') else '',
-                        'meta_description': str(row.get('meta_description', '')) if row.get('meta_description') else '',
-                    }
-
-                    # Attribute processing
-                    attributes_str = row.get('attributes', '')
-                    attribute_value_ids = []
-                    if attributes_str:
-                        attributes_list = str(attributes_str).split(';')
-                        for attr in attributes_list:
-                            if ':' in attr:
-                                name, values_str = attr.split(':', 1)
-                                name = name.strip().capitalize()
-                                values = [v.strip() for v in values_str.split(',') if v.strip()]
-                                attribute, _ = Attribute.objects.get_or_create(name=name)
-                                for value in values:
-                                    attr_value, _ = AttributeValue.objects.get_or_create(attribute=attribute, value=value)
-                                    attribute_value_ids.append(attr_value.id)
-                    product_data['attribute_value_ids'] = attribute_value_ids
-
-                    serializer = ProductSerializer(data=product_data)
-                    if serializer.is_valid():
-                        product = serializer.save()
-                        # Image processing
-                        image_urls = str(row.get('image_urls', '')).split(',') if row.get('image_urls') else []
-                        for url in image_urls:
-                            url = url.strip()
-                            if url:
-                                try:
-                                    response = requests.get(url, timeout=10)
-                                    response.raise_for_status()
-                                    image_name = url.split('/')[-1] or f"image_{product.id}.jpg"
-                                    ProductImage.objects.create(
-                                        product=product,
-                                        image=ContentFile(response.content, name=image_name)
-                                    )
-                                except Exception as e:
-                                    logger.warning(f"Failed to download image {url} for product {product.name}: {str(e)}")
-                        created_products.append(serializer.data)
-                    else:
-                        errors.append({"row": index + 2, "errors": serializer.errors})
-                except Exception as e:
-                    errors.append({"row": index + 2, "error": f"Processing error: {str(e)}"})
 
-            response_data = {
-                "created": len(created_products),
-                "products": created_products,
-                "errors": errors
-            }
-            status_code = status.HTTP_201_CREATED if created_products else status.HTTP_400_BAD_REQUEST
-            return Response(response_data, status=status_code)
-
-        except Exception as e:
-            logger.error(f"Failed to process file: {str(e)}")
-            return Response({"error": f"Failed to process file: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def bulk_import_progress(request, job_id):
+    import_job = Job.objects.filter(pk=job_id, name='products.import').first()
+    if import_job is None:
+        return Response({"error": "Import job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(import_status(import_job))
 
 
 # ==================== WEB SCRAPING ====================
 
-class ScrapeProductsView(APIView):
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def scrape_products(request):
     """
     Scrape products from external platforms (Shein, Alibaba).
-    """
-    permission_classes = [permissions.IsAdminUser]
-
-    def post(self, request):
-        platform = request.data.get('platform')
-        url = request.data.get('url')
-        import_type = request.data.get('import_type', 'single')
-        import_count = int(request.data.get('import_count', 1)) if import_type == 'category' else 1
-
-        if not platform or not url:
-            return Response({"error": "Both 'platform' and 'url' are required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if platform not in ['shein', 'alibaba']:
-            return Response({"error": "Invalid platform."}, status=status.HTTP_400_BAD_REQUEST)
-
-        if import_type not in ['single', 'category']:
-            return Response({"error": "Invalid import_type. Must be 'single' or 'category'."}, status=status.HTTP_400_BAD_REQUEST)
 
-        FIRECRAWL_API_KEY = settings.FIRECRAWL_API_KEY
-        headers = {'Authorization': f'Bearer {FIRECRAWL_API_KEY}'}
-
-        try:
-            if import_type == 'single':
-                product = self.fetch_single_product(platform, url, headers)
-                if not product:
-                    return Response({"error": "No product found."}, status=status.HTTP_404_NOT_FOUND)
-                products = [product]
-            else:  # category
-                product_urls = self.fetch_category_product_urls(platform, url, import_count, headers)
-                products = []
-                for product_url in product_urls:
-                    product = self.fetch_single_product(platform, product_url, headers)
-                    if product:
-                        products.append(product)
-                    if len(products) >= import_count:
-                        break
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        saved_products = []
-        for product in products:
-            serializer = ProductSerializer(data=product, context={'request': request})
-            if serializer.is_valid():
-                product_instance = serializer.save()
-                saved_products.append(serializer.data)
-            else:
-                logger.error(f"Serialization error: {serializer.errors}")
-
-        return Response({
-            "message": f"Successfully saved {len(saved_products)} products.",
-            "products": saved_products
-        }, status=status.HTTP_201_CREATED)
-
-    def fetch_single_product(self, platform, url, headers):
-        if platform == 'shein':
-            return self.fetch_shein_single_product(url, headers)
-        elif platform == 'alibaba':
-            return self.fetch_alibaba_single_product(url, headers)
-
-    def fetch_category_product_urls(self, platform, url, count, headers):
-        response = requests.get(
-            'https://api.firecrawl.dev/scrape',
-            headers=headers,
-            params={'url': url, 'format': 'extract', 'extract': {'selector': 'a[href*="/product/"]'}}
-        )
-        response.raise_for_status()
-        data = response.json()
-        product_links = [link['href'] for link in data.get('extracted', []) if 'href' in link][:count]
-        return product_links
-
-    def fetch_alibaba_single_product(self, url, headers):
-        response = requests.get(
-            'https://api.firecrawl.dev/scrape',
-            headers=headers,
-            params={
-                'url': url,
-                'format': 'extract',
-                'extract': {
-                    'name': 'h1.module-pdp-title',
-                    'price': 'span.price-number',
-                    'moq': 'div.moq-value',
-                    'description': 'div.module-pdp-description',
-                    'thumbnail': 'img.magnifier-image',
-                    'images': 'div.product-images img',
-                    'supplier': 'a.supplier-name',
-                    'attributes': 'div.sku-item'
-                }
-            }
-        )
-        response.raise_for_status()
-        data = response.json()['extracted']
+    The scrape runs as a background job (see scraping.py); this answers with
+    the job's id and progress URL.
+    """
+    platform = request.data.get('platform')
+    url = request.data.get('url')
+    import_type = request.data.get('import_type', 'single')
 
-        if not data.get('name'):
-            return None
+    if not platform or not url:
+        return Response({"error": "Both 'platform' and 'url' are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        category_name = "Alibaba"  # Simplified; adjust as needed
-        category, _ = Category.objects.get_or_create(
-            name=category_name,
-            defaults={"slug": slugify(category_name), "description": f"Category for {category_name}", "is_active": True}
-        )
+    if platform not in PARSERS:
+        return Response({"error": "Invalid platform."}, status=status.HTTP_400_BAD_REQUEST)
 
-        price_text = data.get('price', '0.0').replace('$', '').replace('US', '').replace(',', '')
-        try:
-            if '-' in price_text:
-                prices = price_text.split('-')
-                price_usd = float(prices[0].strip()) * 1.35
-                below_moq_price_usd = float(prices[1].strip()) * 1.35
-            else:
-                price_usd = float(price_text) * 1.35
-                below_moq_price_usd = price_usd * 1.2
-        except ValueError:
-            price_usd = below_moq_price_usd = 0.0
-        USD_TO_KES_RATE = 130.50
-        price_kes = round(price_usd * USD_TO_KES_RATE)
-        below_moq_price_kes = round(below_moq_price_usd * USD_TO_KES_RATE)
-
-        moq_text = data.get('moq', '1')
-        try:
-            moq = int(re.search(r'\d+', moq_text).group())
-        except (AttributeError, ValueError):
-            moq = 1
-
-        supplier_name = data.get('supplier', 'N/A')
-        supplier, _ = Supplier.objects.get_or_create(
-            name=supplier_name,
-            defaults={"contact_email": "", "phone": "", "address": ""}
-        )
+    if import_type not in ['single', 'category']:
+        return Response({"error": "Invalid import_type. Must be 'single' or 'category'."}, status=status.HTTP_400_BAD_REQUEST)
 
-        attribute_value_ids = []
-        attributes = data.get('attributes', [])
-        for attr in attributes:
-            attr_name = attr.get('sku-title', '').replace(':', '').lower()
-            if not attr_name:
-                continue
-            attribute, _ = Attribute.objects.get_or_create(name=attr_name)
-            attr_values = attr.get('sku-item-option', [])
-            for value in attr_values:
-                attr_value = value.strip().lower()
-                if not attr_value:
-                    continue
-                attribute_value, _ = AttributeValue.objects.get_or_create(attribute=attribute, value=attr_value)
-                attribute_value_ids.append(attribute_value.id)
-
-        product = {
-            'name': data.get('name', 'Unknown Product'),
-            'slug': slugify(data.get('name', 'Unknown Product'))[:50],
-            'description': data.get('description', 'No description available'),
-            'price': price_kes,
-            'below_moq_price': below_moq_price_kes,
-            'moq': moq,
-            'moq_per_person': 1,
-            'moq_status': 'not_applicable',
-            'category_id': category.id,
-            'supplier_id': supplier.id,
-            'meta_title': data.get('name', 'Unknown Product'),
-            'meta_description': data.get('description', 'No description available')[:150] + "...",
-            'attribute_value_ids': attribute_value_ids,
-            'thumbnail': data.get('thumbnail', ''),
-            'images': data.get('images', [data.get('thumbnail', '')]) if data.get('thumbnail') else []
-        }
-        return product
-
-    def fetch_shein_single_product(self, url, headers):
-        response = requests.get(
-            'https://api.firecrawl.dev/scrape',
-            headers=headers,
-            params={
-                'url': url,
-                'format': 'extract',
-                'extract': {
-                    'name': 'h1.product-intro__head-name',
-                    'price': 'div.product-intro__head-mainprice',
-                    'description': 'div.product-intro__description',
-                    'thumbnail': 'img.product-intro__main-image',
-                    'attributes': 'div.product-intro__sku-item'
-                }
-            }
+    try:
+        import_count = int(request.data.get('import_count', 1)) if import_type == 'category' else 1
+    except (TypeError, ValueError):
+        return Response({"error": "import_count must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= import_count <= MAX_IMPORT_COUNT:
+        return Response(
+            {"error": f"import_count must be between 1 and {MAX_IMPORT_COUNT}."}, status=status.HTTP_400_BAD_REQUEST
         )
-        response.raise_for_status()
-        data = response.json()['extracted']
 
-        if not data.get('name'):
-            return None
+    scrape_job = start_scrape(platform, url, import_type, import_count)
+    return Response({
+        **scrape_status(scrape_job),
+        "progress_url": reverse('scrape-progress', kwargs={'job_id': scrape_job.id}),
+    }, status=status.HTTP_202_ACCEPTED)
 
-        category, _ = Category.objects.get_or_create(
-            name="Shein",
-            defaults={"slug": "shein", "description": "Products scraped from Shein", "is_active": True}
-        )
 
-        price_text = data.get('price', '0.0').replace('€', '').replace('$', '').replace(',', '')
-        try:
-            if '-' in price_text:
-                prices = price_text.split('-')
-                price_usd = float(prices[0].strip())
-                below_moq_price_usd = float(prices[1].strip())
-            else:
-                price_usd = float(price_text)
-                below_moq_price_usd = price_usd * 1.2
-        except ValueError:
-            price_usd = below_moq_price_usd = 0.0
-        USD_TO_KES_RATE = 130.50
-        price_kes = round(price_usd * USD_TO_KES_RATE)
-        below_moq_price_kes = round(below_moq_price_usd * USD_TO_KES_RATE)
-
-        attribute_value_ids = []
-        attributes = data.get('attributes', [])
-        for attr in attributes:
-            attr_name = attr.get('sku-title', '').replace(':', '').lower()
-            if not attr_name:
-                continue
-            attribute, _ = Attribute.objects.get_or_create(name=attr_name)
-            attr_values = attr.get('sku-item-option', [])
-            for value in attr_values:
-                attr_value = value.strip().lower()
-                if not attr_value:
-                    continue
-                attribute_value, _ = AttributeValue.objects.get_or_create(attribute=attribute, value=attr_value)
-                attribute_value_ids.append(attribute_value.id)
-
-        product = {
-            'name': data.get('name', 'Unknown Product'),
-            'slug': slugify(data.get('name', 'Unknown Product'))[:50],
-            'description': data.get('description', 'No description available'),
-            'price': price_kes,
-            'below_moq_price': below_moq_price_kes,
-            'moq': 1,
-            'moq_per_person': 1,
-            'moq_status': 'not_applicable',
-            'category_id': category.id,
-            'supplier_id': None,
-            'meta_title': data.get('name', 'Unknown Product'),
-            'meta_description': data.get('description', 'No description available')[:150] + "...",
-            'attribute_value_ids': attribute_value_ids,
-            'thumbnail': data.get('thumbnail', ''),
-            'images': [data.get('thumbnail', '')] if data.get('thumbnail') else []
-        }
-        return product
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def scrape_progress(request, job_id):
+    scrape_job = Job.objects.filter(pk=job_id, name='products.scrape').first()
+    if scrape_job is None:
+        return Response({"error": "Scrape job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(scrape_status(scrape_job))
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api import http_client
+from ecommerce.api.payments import await_change, status_version, wait_for_change
+
+# Order id whose payment version never moves, so every long poll runs to its timeout
+BENCH_ORDER_ID = -1
+
+
+class SlowUpstream(ThreadingHTTPServer):
+    """Local stand-in for M-Pesa/Firecrawl: answers every GET after ``latency`` seconds."""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), SlowHandler)
+        self.latency = latency
+        self.in_flight = self.peak = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+        time.sleep(server.latency)
+        with server.lock:
+            server.in_flight -= 1
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Fires concurrent requests at a slow local upstream and at the payment long poll, once from a '
+        'thread-per-request worker and once from a single event loop, and reports the throughput and '
+        'concurrency one worker sustains in each model'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per run')
+        parser.add_argument('--latency', type=int, default=200, help='Upstream answer time / long poll wait, in ms')
+        parser.add_argument('--threads', type=int, default=8, help='Threads of the synchronous worker')
+
+    def handle(self, *args, **options):
+        count, threads, latency = options['requests'], options['threads'], options['latency'] / 1000
+        upstream = SlowUpstream(latency)
+        threading.Thread(target=upstream.serve_forever, daemon=True).start()
+        http_client.UPSTREAMS['bench'] = http_client.Upstream('bench', retries=0, pool_size=max(count, threads))
+        version = status_version(BENCH_ORDER_ID)
+        try:
+            self.stdout.write(self.style.SUCCESS(
+                f"\n{count} requests, {options['latency']} ms each, sync worker with {threads} threads"
+            ))
+            self.stdout.write(f"{'scenario':<12} {'model':<6} {'total ms':>9} {'req/s':>8} {'p50 ms':>8} "
+                              f"{'p95 ms':>8} {'concurrent':>10}")
+
+            def call():
+                http_client.get('bench', upstream.url)
+
+            async def acall():
+                await http_client.aget('bench', upstream.url)
+
+            self.report('upstream', 'sync', self.run_sync(call, count, threads), upstream)
+            self.report('upstream', 'async', self.run_async(acall, count), upstream)
+
+            self.report('long poll', 'sync', self.run_sync(
+                lambda: wait_for_change(BENCH_ORDER_ID, version, latency), count, threads
+            ))
+            self.report('long poll', 'async', self.run_async(
+                lambda: await_change(BENCH_ORDER_ID, version, latency), count
+            ))
+        finally:
+            upstream.shutdown()
+            del http_client.UPSTREAMS['bench']
+            http_client.reset()
+
+    def run_sync(self, call, count, threads):
+        def timed(_):
+            started = time.perf_counter()
+            call()
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(timed, range(count)))
+        return time.perf_counter() - started, latencies
+
+    def run_async(self, call, count):
+        async def timed():
+            started = time.perf_counter()
+            await call()
+            return time.perf_counter() - started
+
+        async def run():
+            return await asyncio.gather(*(timed() for _ in range(count)))
+
+        started = time.perf_counter()
+        latencies = asyncio.run(run())
+        return time.perf_counter() - started, latencies
+
+    def report(self, scenario, model, run, upstream=None):
+        total, latencies = run
+        latencies = sorted(latencies)
+        if upstream is not None:
+            concurrent, upstream.peak = upstream.peak, 0
+        else:
+            # Little's law: requests in progress = throughput x time each one takes
+            concurrent = round(len(latencies) / total * (sum(latencies) / len(latencies)))
+        self.stdout.write(
+            f"{scenario:<12} {model:<6} {total * 1000:>9.0f} {len(latencies) / total:>8.1f} "
+            f"{latencies[len(latencies) // 2] * 1000:>8.0f} {latencies[int(len(latencies) * 0.95)] * 1000:>8.0f} "
+            f"{concurrent:>10}"
+        )
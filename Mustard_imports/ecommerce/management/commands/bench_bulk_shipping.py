@@ -0,0 +1,60 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.api.jobs import run_job
+from ecommerce.api.order_events import bulk_set_delivery_status
+from ecommerce.models import Job, Order, OutboundEmail
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates throwaway orders (rolled back afterwards), bulk-ships them and runs the notification job, '
+        'reporting the time and queries each step takes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                order_ids = self.generate(options['orders'])
+                self.report(order_ids)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def generate(self, count):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(username=f'shipping-bench-{i}', email=f'shipping-bench-{i}@example.com', affiliate_code=f'SB{i:07d}')
+            for i in range(count)
+        ], batch_size=1000)
+        orders = Order.objects.bulk_create(
+            [Order(user=user, payment_status='paid', total_price=Decimal('1000.00')) for user in users],
+            batch_size=1000,
+        )
+        return [order.id for order in orders]
+
+    def timed(self, label, fn):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            result = fn()
+        self.stdout.write(f"{label:<28} {(time.perf_counter() - started) * 1000:>10.1f} ms {len(queries):>6} queries")
+        return result
+
+    def report(self, order_ids):
+        self.stdout.write(self.style.SUCCESS(f"\nShipping {len(order_ids)} orders"))
+        self.timed('bulk_set_delivery_status', lambda: bulk_set_delivery_status(order_ids, 'shipped'))
+        job_id = Job.objects.filter(name='orders.status_changed').latest('id').id
+        self.timed('notification job', lambda: run_job(job_id))
+        self.stdout.write(f"Queued {OutboundEmail.objects.filter(subject__endswith='Has Arrived').count()} emails")
+
+
+class _Rollback(Exception):
+    pass
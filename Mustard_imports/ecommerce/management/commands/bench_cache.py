@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.cache_backends import SQLiteCache
+
+
+def _build_backend(name, sqlite_path):
+    if name == 'locmem':
+        return LocMemCache('bench', {'OPTIONS': {'MAX_ENTRIES': 100000}})
+    if name == 'sqlite':
+        return SQLiteCache(sqlite_path, {'KEY_PREFIX': 'bench', 'OPTIONS': {'MAX_ENTRIES': 100000}})
+    return caches.create_connection('default')
+
+
+def _worker(worker_id, backend_name, sqlite_path, keys, requests_per_worker, compute_ms, start_at, results):
+    """Simulate one gunicorn worker serving a Zipf-distributed mix of endpoints."""
+    backend = _build_backend(backend_name, sqlite_path)
+    rng = random.Random(worker_id)
+    weights = [1 / (rank + 1) for rank in range(len(keys))]
+    while time.time() < start_at:
+        time.sleep(0.001)
+
+    hits = misses = 0
+    started = time.perf_counter()
+    for key in rng.choices(keys, weights=weights, k=requests_per_worker):
+        if backend.get(key) is not None:
+            hits += 1
+            continue
+        misses += 1
+        time.sleep(compute_ms / 1000)  # Stand-in for the DB query + serialization
+        backend.set(key, {'key': key, 'payload': 'x' * 512}, 300)
+    elapsed = time.perf_counter() - started
+
+    # Invalidation probe: worker 0 deletes a key, the others check whether they still see it.
+    probe_key = 'bench:invalidation-probe'
+    if worker_id == 0:
+        backend.set(probe_key, 'stale', 300)
+    time.sleep(0.2)
+    if worker_id == 0:
+        backend.delete(probe_key)
+    time.sleep(0.2)
+    sees_stale = backend.get(probe_key) is not None and worker_id != 0
+
+    results.put((worker_id, hits, misses, elapsed, sees_stale))
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks cache hit rate when several worker processes share (or do not share) a cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3)
+        parser.add_argument('--requests', type=int, default=3000, help='Requests per worker')
+        parser.add_argument('--keys', type=int, default=500, help='Distinct cache keys (endpoints x pages)')
+        parser.add_argument('--compute-ms', type=float, default=1.0, help='Simulated cost of a cache miss')
+        parser.add_argument(
+            '--backends', default='locmem,sqlite,default',
+            help='Comma-separated list of: locmem (per-process), sqlite (shared file), default (settings.CACHES)'
+        )
+
+    def handle(self, *args, **options):
+        keys = [f'bench:product_detail_{i}' for i in range(options['keys'])]
+        context = multiprocessing.get_context('fork')
+
+        for backend_name in options['backends'].split(','):
+            backend_name = backend_name.strip()
+            with tempfile.TemporaryDirectory() as tmpdir:
+                sqlite_path = os.path.join(tmpdir, 'bench-cache.sqlite3')
+                if backend_name == 'default':
+                    caches['default'].clear()
+                results = context.Queue()
+                start_at = time.time() + 0.5
+                processes = [
+                    context.Process(
+                        target=_worker,
+                        args=(worker_id, backend_name, sqlite_path, keys, options['requests'],
+                              options['compute_ms'], start_at, results)
+                    )
+                    for worker_id in range(options['workers'])
+                ]
+                for process in processes:
+                    process.start()
+                rows = sorted(results.get(timeout=600) for _ in processes)
+                for process in processes:
+                    process.join()
+
+            self.stdout.write(self.style.SUCCESS(f"\nBackend: {backend_name}"))
+            self.stdout.write(f"{'worker':>8} {'hits':>8} {'misses':>8} {'hit rate':>9} {'req/s':>9} {'stale':>6}")
+            total_hits = total_misses = 0
+            stale_workers = 0
+            for worker_id, hits, misses, elapsed, sees_stale in rows:
+                total_hits += hits
+                total_misses += misses
+                stale_workers += int(sees_stale)
+                rate = hits / (hits + misses) if hits + misses else 0
+                self.stdout.write(
+                    f"{worker_id:>8} {hits:>8} {misses:>8} {rate:>9.1%} {(hits + misses) / elapsed:>9.0f} {str(sees_stale):>6}"
+                )
+            overall = total_hits / (total_hits + total_misses) if total_hits + total_misses else 0
+            self.stdout.write(
+                f"{'all':>8} {total_hits:>8} {total_misses:>8} {overall:>9.1%}"
+                f"   workers still serving an invalidated key: {stale_workers}"
+            )
@@ -0,0 +1,113 @@
+import csv
+import io
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ecommerce.api import product_import
+from ecommerce.api.jobs import run_job
+from ecommerce.api.serializers import ProductSerializer
+from ecommerce.models import Attribute, AttributeValue, Category, Job
+
+COLORS = ['red', 'blue', 'green', 'black', 'white', 'amber', 'clear', 'grey']
+SIZES = ['S', 'M', 'L', 'XL', '250ml', '500ml', '1000ml']
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a product import file, imports it with the chunked import job and a sample of it '
+        'with the old row-by-row serializer path, and reports rows/s and queries (all rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000)
+        parser.add_argument('--legacy-rows', type=int, default=500, help='Rows imported the old way for comparison')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                category = Category.objects.create(name='Import bench', slug='import-bench')
+                self.report(category, options['rows'], options['legacy_rows'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def records(self, count, category):
+        for n in range(count):
+            pick_and_pay = n % 5 == 0
+            yield {
+                'name': f'Bench Product {n}',
+                'description': f'Generated product {n} for the import benchmark',
+                'price': f'{100 + n % 900}.50',
+                'below_moq_price': '' if pick_and_pay else f'{120 + n % 900}.00',
+                'moq': 1 if pick_and_pay else 10 + n % 40,
+                'is_pick_and_pay': 'true' if pick_and_pay else 'false',
+                'inventory_quantity': n % 100 if pick_and_pay else '',
+                'category_id': category.id,
+                'attributes': f'Color: {COLORS[n % len(COLORS)]}, {COLORS[(n + 3) % len(COLORS)]}; '
+                              f'Size: {SIZES[n % len(SIZES)]}',
+            }
+
+    def csv_file(self, count, category):
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=[
+            'name', 'description', 'price', 'below_moq_price', 'moq', 'is_pick_and_pay',
+            'inventory_quantity', 'category_id', 'attributes',
+        ])
+        writer.writeheader()
+        writer.writerows(self.records(count, category))
+        return ContentFile(out.getvalue().encode('utf-8'), name='bench-products.csv')
+
+    def timed(self, label, rows, fn):
+        # The query log keeps the last 9000 queries; start each count from an empty one
+        connection.queries_log.clear()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            fn()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{label:<22} {rows:>8} {elapsed * 1000:>10.0f} {rows / elapsed:>10.0f} {len(queries):>8} "
+            f"{len(queries) / rows:>10.2f}"
+        )
+
+    def report(self, category, rows, legacy_rows):
+        self.stdout.write(self.style.SUCCESS(
+            f"\nImporting {rows} rows in chunks of {product_import.IMPORT_CHUNK_SIZE}"
+        ))
+        self.stdout.write(f"{'path':<22} {'rows':>8} {'ms':>10} {'rows/s':>10} {'queries':>8} {'q/row':>10}")
+
+        legacy = list(self.records(legacy_rows, category))
+        for record in legacy:
+            record['name'] = f'Legacy {record["name"]}'
+        self.timed('row by row', legacy_rows, lambda: self.legacy_import(legacy))
+
+        import_job = product_import.start_import(self.csv_file(rows, category))
+        self.timed('chunked job', rows, lambda: run_job(import_job.id))
+        import_job = Job.objects.get(pk=import_job.id)
+        self.stdout.write(
+            f"Job {import_job.status}: {import_job.result['created']} created, {import_job.result['failed']} rejected"
+        )
+
+    def legacy_import(self, records):
+        """What the import did per row before it ran as a job: get_or_create per value, save per product."""
+        for record in records:
+            data = {key: value for key, value in record.items() if value != '' and key != 'attributes'}
+            data['is_pick_and_pay'] = data['is_pick_and_pay'] == 'true'
+            value_ids = []
+            for item in record['attributes'].split(';'):
+                name, values = item.split(':', 1)
+                attribute, _ = Attribute.objects.get_or_create(name=name.strip().capitalize())
+                for value in values.split(','):
+                    attribute_value, _ = AttributeValue.objects.get_or_create(attribute=attribute, value=value.strip())
+                    value_ids.append(attribute_value.id)
+            data['attribute_value_ids'] = value_ids
+            serializer = ProductSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+
+class _Rollback(Exception):
+    pass
@@ -0,0 +1,104 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from ecommerce.api.pagination import KeysetPagination
+from ecommerce.models import Order
+
+PAGE_SIZE = 20
+
+
+@contextmanager
+def explicit_created_at():
+    """Let bulk_create keep the generated created_at values instead of now()."""
+    field = Order._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a throwaway order table (rolled back afterwards) and compares the latency of '
+        'OFFSET + COUNT(*) pages with keyset pages at increasing depths'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per page, the median is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                self.generate(options['orders'])
+                self.stdout.write(f"Generated {options['orders']} orders in {time.perf_counter() - started:.1f}s")
+                self.report(options['orders'], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def generate(self, count):
+        rng = random.Random(42)
+        user = get_user_model().objects.create(username='pagination-benchmark', email='bench@example.com')
+        start = timezone.now() - timedelta(days=3 * 365)
+        batch = []
+        with explicit_created_at():
+            for i in range(count):
+                batch.append(Order(
+                    user=user, created_at=start + timedelta(seconds=i * 90 + rng.randrange(90)),
+                    payment_status=rng.choice(('pending', 'paid', 'paid', 'failed')),
+                ))
+                if len(batch) == 5000:
+                    Order.objects.bulk_create(batch)
+                    batch = []
+            Order.objects.bulk_create(batch)
+
+    def timed(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def report(self, count, repeat):
+        orders = Order.objects.all()
+        paginator = KeysetPagination()
+        ordered = orders.order_by(*paginator.ordering)
+
+        def offset_page(offset):
+            orders.count()
+            return list(ordered[offset:offset + PAGE_SIZE])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nMedian latency of one {PAGE_SIZE}-row page over {repeat} runs"
+        ))
+        self.stdout.write(f"{'page':>8} {'offset + count ms':>18} {'keyset ms':>10} {'keyset+approx ms':>17}")
+        pages = [1, 10, 100, 1000, 10000, count // PAGE_SIZE - 1]
+        for page in pages:
+            offset = (page - 1) * PAGE_SIZE
+            if offset >= count:
+                continue
+            # Cursor of the row just before the page, as the previous response would have returned
+            cursor = paginator.encode_cursor(ordered[offset - 1], reverse=False) if offset else None
+            expected = [order.id for order in offset_page(offset)]
+            assert [order.id for order in paginator.paginate(orders, cursor, PAGE_SIZE)] == expected
+
+            offset_ms = self.timed(lambda: offset_page(offset), repeat)
+            keyset_ms = self.timed(lambda: paginator.paginate(orders, cursor, PAGE_SIZE), repeat)
+            approx_ms = self.timed(lambda: paginator.paginate(orders, cursor, PAGE_SIZE, count='approx'), repeat)
+            self.stdout.write(f"{page:>8} {offset_ms:>18.1f} {keyset_ms:>10.1f} {approx_ms:>17.1f}")
+
+
+class _Rollback(Exception):
+    pass
@@ -0,0 +1,111 @@
+import gzip
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+
+from ecommerce.api.serializers import HOME_CATEGORY_PRODUCTS, ProductCardSerializer, ProductSerializer
+from ecommerce.management.commands.bench_search import ADJECTIVES, WORDS
+from ecommerce.models import (
+    Attribute, AttributeValue, Category, CustomerReview, Product, ProductImage, Supplier
+)
+
+HOME_PAGE_CATEGORIES = 4  # HomeCategoriesPagination.page_size
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a throwaway catalog (rolled back afterwards) and compares the home page payload '
+        'size and query + serialization time of full ProductSerializer products and product cards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per representation, the median is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.generate()
+                self.report(options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def generate(self):
+        rng = random.Random(42)
+        users = [
+            get_user_model().objects.create(username=f'card-benchmark-{i}', email=f'card{i}@example.com')
+            for i in range(5)
+        ]
+        supplier = Supplier.objects.create(name='Benchmark supplier', contact_email='supplier@example.com')
+        values = []
+        for name in ('Color', 'Size'):
+            attribute = Attribute.objects.create(name=f'Benchmark {name}')
+            values += [AttributeValue.objects.create(attribute=attribute, value=f'{name} {i}') for i in range(3)]
+
+        for c in range(HOME_PAGE_CATEGORIES):
+            category = Category.objects.create(name=f'Card benchmark {c}', slug=f'card-benchmark-{c}')
+            for p in range(HOME_CATEGORY_PRODUCTS):
+                words = rng.sample(WORDS, 2)
+                product = Product.objects.create(
+                    name=f"{rng.choice(ADJECTIVES).title()} {words[0].title()} {words[1].title()}",
+                    slug=f'card-benchmark-{c}-{p}', category=category, supplier=supplier,
+                    description=' '.join(rng.choice(WORDS + ADJECTIVES) for _ in range(150)),
+                    price=Decimal(rng.randrange(200, 60000)), moq=50,
+                )
+                product.attribute_values.set(rng.sample(values, 4))
+                for i in range(4):
+                    ProductImage.objects.create(
+                        product=product, image=f'product_images/{product.slug}-{i}.jpg',
+                        thumbnail=f'product_thumbnails/{product.slug}-{i}.jpg',
+                    )
+                for user in users:
+                    CustomerReview.objects.create(
+                        user=user, product=product, rating=rng.randint(1, 5),
+                        content=' '.join(rng.choice(WORDS) for _ in range(30)),
+                    )
+
+    def home_page(self, serializer_class, products):
+        categories = Category.objects.filter(slug__startswith='card-benchmark-').order_by('id').prefetch_related(
+            Prefetch('products', queryset=products.order_by('-created_at')[:HOME_CATEGORY_PRODUCTS],
+                     to_attr='home_products')
+        )
+        return [
+            {
+                'id': category.id, 'name': category.name, 'slug': category.slug,
+                'products': serializer_class(category.home_products, many=True).data,
+            }
+            for category in categories
+        ]
+
+    def measure(self, serializer_class, products, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            payload = json.dumps(self.home_page(serializer_class, products), cls=DjangoJSONEncoder).encode('utf-8')
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), len(payload), len(gzip.compress(payload))
+
+    def report(self, repeat):
+        self.stdout.write(self.style.SUCCESS(
+            f"\nHome page, {HOME_PAGE_CATEGORIES} categories x {HOME_CATEGORY_PRODUCTS} products, "
+            f"median of {repeat} runs (queries + serialization + JSON)"
+        ))
+        self.stdout.write(f"{'representation':<16} {'ms':>8} {'bytes':>9} {'gzip bytes':>11}")
+        for label, serializer_class, products in (
+            ('full product', ProductSerializer, Product.objects.for_listing()),
+            ('product card', ProductCardSerializer, Product.objects.for_cards()),
+        ):
+            ms, size, compressed = self.measure(serializer_class, products, repeat)
+            self.stdout.write(f"{label:<16} {ms:>8.1f} {size:>9} {compressed:>11}")
+
+
+class _Rollback(Exception):
+    pass
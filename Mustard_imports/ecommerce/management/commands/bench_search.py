@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ecommerce.api.search import BACKENDS, IContainsSearchBackend, search_products
+from ecommerce.models import Category, Product
+
+WORDS = (
+    'wireless bluetooth headphones speaker phone case charger cable laptop stand keyboard mouse '
+    'monitor camera tripod lens watch band fitness tracker kettle blender toaster cooker pan pot '
+    'knife set towel bedsheet pillow curtain lamp bulb solar panel battery inverter generator '
+    'drill hammer spanner ladder tent backpack bottle flask jacket sneakers sandals dress shirt '
+    'trouser handbag wallet perfume lotion shampoo razor trimmer dryer iron fan heater fridge '
+    'freezer microwave oven television antenna router modem printer scanner projector tablet '
+    'stylus earbuds gaming controller console chair desk shelf mattress carpet mirror clock'
+).split()
+ADJECTIVES = 'portable smart premium compact heavy duty stainless waterproof rechargeable digital mini pro'.split()
+
+# (label, query): exact words, prefixes, a misspelling and a multi-word query
+QUERIES = [
+    ('word', 'headphones'),
+    ('prefix', 'headph'),
+    ('typo', 'headphnes'),
+    ('two words', 'wireless charger'),
+    ('rare word', 'projector'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates a throwaway catalog (rolled back afterwards) and compares search latency of the '
+        'indexed backend with the old name/description icontains scan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query, the median is reported')
+        parser.add_argument('--backend', choices=sorted(set(BACKENDS) - {'icontains'}),
+                            help='Defaults to the database vendor')
+
+    def handle(self, *args, **options):
+        name = options['backend'] or {'postgresql': 'postgres', 'sqlite': 'sqlite'}.get(connection.vendor)
+        if name is None:
+            raise CommandError(f"No indexed search backend for the '{connection.vendor}' database")
+
+        try:
+            with transaction.atomic():
+                self.generate(options['products'])
+                indexed = BACKENDS[name]()
+                started = time.perf_counter()
+                indexed.setup()
+                self.stdout.write(f"Indexed {options['products']} products in {time.perf_counter() - started:.1f}s")
+                self.report(indexed, IContainsSearchBackend(), options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def generate(self, count):
+        rng = random.Random(42)
+        category = Category.objects.create(name='Search benchmark', slug='search-benchmark')
+        batch = []
+        for i in range(count):
+            words = rng.sample(WORDS, 2)
+            name = f"{rng.choice(ADJECTIVES).title()} {words[0].title()} {words[1].title()} {i}"
+            description = ' '.join(rng.choice(WORDS + ADJECTIVES) for _ in range(25))
+            batch.append(Product(
+                name=name, slug=f'search-benchmark-{i}', description=description,
+                price=Decimal(rng.randrange(200, 60000)), category=category,
+                is_pick_and_pay=rng.random() < 0.3,
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        Product.objects.bulk_create(batch)
+
+    def timed(self, backend, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = search_products(query, backend=backend)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), result
+
+    def report(self, indexed, scan, repeat):
+        self.stdout.write(self.style.SUCCESS(f"\nMedian latency over {repeat} runs (first page, facets included)"))
+        self.stdout.write(
+            f"{'query':<12} {'text':<18} {'icontains ms':>13} {'hits':>7} {indexed.name + ' ms':>13} {'hits':>7}"
+        )
+        for label, query in QUERIES:
+            scan_ms, scan_result = self.timed(scan, query, repeat)
+            indexed_ms, indexed_result = self.timed(indexed, query, repeat)
+            self.stdout.write(
+                f"{label:<12} {query:<18} {scan_ms:>13.1f} {scan_result.total:>7} "
+                f"{indexed_ms:>13.1f} {indexed_result.total:>7}"
+            )
+
+
+class _Rollback(Exception):
+    pass
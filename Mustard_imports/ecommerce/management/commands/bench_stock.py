@@ -0,0 +1,120 @@
+import multiprocessing
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from ecommerce.api import stock
+from ecommerce.models import Cart, CartItem, Category, Inventory, Product, StockReservation, User
+
+
+def row_lock_reserve(item):
+    """A hold taken by locking the inventory row and counting the holds under it."""
+    with transaction.atomic():
+        inventory = Inventory.objects.select_for_update().get(product_id=item.product_id)
+        held = StockReservation.objects.filter(product_id=item.product_id).aggregate(held=Sum('quantity'))['held'] or 0
+        if inventory.quantity - held < 1:
+            raise stock.OutOfStock(item.product, inventory.quantity - held, 1)
+        StockReservation.objects.create(
+            product_id=item.product_id, cart_item=item, quantity=1, expires_at=timezone.now() + stock.RESERVATION_TTL,
+        )
+
+
+def counter_reserve(item):
+    stock.reserve(item, 1)
+
+
+MODES = {'row lock': row_lock_reserve, 'counter': counter_reserve}
+
+
+def worker(mode, item_ids, start, results):
+    # Forked from the command: open connections of our own
+    connections.close_all()
+    items = list(CartItem.objects.filter(id__in=item_ids).select_related('product'))
+    outcomes = Counter()
+    start.wait()
+    for item in items:
+        try:
+            MODES[mode](item)
+            outcomes['held'] += 1
+        except stock.OutOfStock:
+            outcomes['out of stock'] += 1
+        except Exception:
+            outcomes['errors'] += 1
+    connections.close_all()
+    results.put(dict(outcomes))
+
+
+class Command(BaseCommand):
+    help = (
+        'Has several processes reserve one unit of the same Pick and Pay product at once, through the '
+        'inventory row lock and through the stock counters, and reports holds/s and oversold units. '
+        'The products, carts and users it creates are deleted afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=250, help='Reservations tried per process')
+        parser.add_argument('--stock', type=int, default=None, help='Units on the shelf (default: half the attempts)')
+
+    def handle(self, *args, **options):
+        processes, attempts = options['processes'], options['attempts']
+        units = options['stock'] if options['stock'] is not None else processes * attempts // 2
+        tag = uuid.uuid4().hex[:8]
+        category = Category.objects.create(name=f'Stock bench {tag}', slug=f'stock-bench-{tag}')
+        users = [
+            User.objects.create(username=f'stock-bench-{tag}-{n}', email=f'stock-bench-{tag}-{n}@example.com')
+            for n in range(processes)
+        ]
+        try:
+            carts = [Cart.objects.create(user=user) for user in users]
+            self.stdout.write(self.style.SUCCESS(
+                f"\n{processes} processes x {attempts} reservations of one product with {units} units"
+            ))
+            self.stdout.write(f"{'path':<10} {'ms':>8} {'holds/s':>10} {'held':>6} {'refused':>8} {'errors':>7} {'oversold':>9}")
+            for mode in MODES:
+                self.run(mode, category, carts, units, attempts, tag)
+        finally:
+            category.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def run(self, mode, category, carts, units, attempts, tag):
+        slug = f"stock-bench-{tag}-{mode.replace(' ', '-')}"
+        product = Product.objects.create(
+            name=f'Stock bench {mode}', slug=slug, category=category, price=Decimal('100.00'), is_pick_and_pay=True,
+        )
+        Inventory.objects.create(product=product, quantity=units)
+        cache.delete(stock.COUNTER_KEY.format(product.id))
+        item_ids = []
+        for cart in carts:
+            items = CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=1, attributes={'n': n}) for n in range(attempts)
+            ])
+            item_ids.append([item.id for item in items])
+
+        context = multiprocessing.get_context('fork')
+        start, results = context.Barrier(len(carts) + 1), context.Queue()
+        connections.close_all()
+        workers = [context.Process(target=worker, args=(mode, ids, start, results)) for ids in item_ids]
+        for process in workers:
+            process.start()
+        start.wait()
+        started = time.perf_counter()
+        outcomes = Counter()
+        for _ in workers:
+            outcomes.update(results.get())
+        elapsed = time.perf_counter() - started
+        for process in workers:
+            process.join()
+
+        held = StockReservation.objects.filter(product=product).aggregate(held=Sum('quantity'))['held'] or 0
+        self.stdout.write(
+            f"{mode:<10} {elapsed * 1000:>8.0f} {outcomes['held'] / elapsed:>10.0f} {outcomes['held']:>6} "
+            f"{outcomes['out of stock']:>8} {outcomes['errors']:>7} {max(held - units, 0):>9}"
+        )
@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.suggest import PrefixIndex
+from ecommerce.management.commands.bench_search import ADJECTIVES, WORDS
+
+CATEGORIES = ['Electronics', 'Home & Kitchen', 'Fashion', 'Tools', 'Outdoor', 'Beauty', 'Office']
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the autocomplete prefix index over a generated catalog (no database) and reports '
+        'build time, memory footprint, lookup latency percentiles and incremental update cost'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--lookups', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        rows = []
+        for product_id in range(1, options['products'] + 1):
+            words = rng.sample(WORDS, 2)
+            name = f"{rng.choice(ADJECTIVES).title()} {words[0].title()} {words[1].title()} {rng.randrange(100, 999)}"
+            slug = name.lower().replace(' ', '-') + f'-{product_id}'
+            rows.append((product_id, name, slug, f'product_thumbnails/{slug}.jpg', rng.choice(CATEGORIES)))
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex()
+        index.load(rows)
+        build_seconds = time.perf_counter() - started
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # What a user types: 1-6 leading letters of a word, sometimes two words
+        queries = []
+        for _ in range(options['lookups']):
+            word = rng.choice(WORDS + ADJECTIVES)
+            query = word[:rng.randint(1, min(6, len(word)))]
+            if rng.random() < 0.2:
+                query = f"{rng.choice(ADJECTIVES)} {query}"
+            queries.append(query)
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.lookup(query)
+            timings.append((time.perf_counter() - started) * 1e6)
+
+        updates = []
+        for product_id, name, slug, thumbnail, category in rng.sample(rows, 200):
+            started = time.perf_counter()
+            index.add(product_id, name + ' Renamed', slug, thumbnail, category)
+            updates.append((time.perf_counter() - started) * 1e3)
+
+        self.stdout.write(self.style.SUCCESS(f"\nPrefix index over {len(index)} products"))
+        self.stdout.write(f"build time            {build_seconds:.2f}s")
+        self.stdout.write(f"entries               {len(index._keys)}")
+        self.stdout.write(f"memory (estimated)    {index.memory_usage() / 2 ** 20:.1f} MiB")
+        self.stdout.write(f"memory (tracemalloc)  {traced / 2 ** 20:.1f} MiB allocated while building")
+        self.stdout.write(
+            f"lookup latency (us)   p50 {statistics.median(timings):.0f}  "
+            f"p99 {_percentile(timings, 0.99):.0f}  max {max(timings):.0f}  over {len(timings)} lookups"
+        )
+        self.stdout.write(
+            f"incremental update    median {statistics.median(updates):.2f}ms  p99 {_percentile(updates, 0.99):.2f}ms"
+        )
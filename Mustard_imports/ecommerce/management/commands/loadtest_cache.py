@@ -0,0 +1,121 @@
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.test import APIRequestFactory
+
+from ecommerce.api.caching import cached_response
+from ecommerce.api.views_products import AllCategoriesWithProductsView, HomeCategoriesView
+from ecommerce.models import Category, Product
+
+ENDPOINTS = {
+    'home-categories': ('/api/home-categories/', HomeCategoriesView),
+    'all-categories': ('/api/all-categories-with-products/', AllCategoriesWithProductsView),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammers a hot catalog endpoint from many threads while its cache entry expires and '
+        'prints DB queries per second with and without stampede protection'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='home-categories')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--duration', type=int, default=12, help='Seconds per run')
+        parser.add_argument('--ttl', type=int, default=3, help='Cache TTL used for the run, in seconds')
+        parser.add_argument('--seed', type=int, default=0, help='Create this many throwaway categories (8 products each)')
+
+    def handle(self, *args, **options):
+        seeded = self.seed(options['seed']) if options['seed'] else []
+        try:
+            if not Category.objects.exists():
+                raise CommandError('No categories to serve; run with --seed N')
+            path, view_class = ENDPOINTS[options['endpoint']]
+            runs = {
+                'unprotected': self.run(path, view_class, options, stale_ttl=0, single_flight=False),
+                'protected': self.run(path, view_class, options, stale_ttl=60, single_flight=True),
+            }
+        finally:
+            Category.objects.filter(id__in=seeded).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nDB queries per second, {options['threads']} threads, TTL {options['ttl']}s"
+        ))
+        self.stdout.write(f"{'second':>6} {'unprotected':>12} {'protected':>10}")
+        for second in range(options['duration']):
+            self.stdout.write(
+                f"{second:>6} {runs['unprotected'][0][second]:>12} {runs['protected'][0][second]:>10}"
+            )
+        for mode, (queries, requests) in runs.items():
+            peak = max(queries.values(), default=0)
+            self.stdout.write(
+                f"{mode}: {sum(queries.values())} queries, peak {peak}/s, {requests} requests served"
+            )
+
+    def seed(self, count):
+        ids = []
+        for i in range(count):
+            category = Category.objects.create(name=f'Loadtest {i}', slug=f'loadtest-{i}')
+            ids.append(category.id)
+            for j in range(8):
+                Product.objects.create(
+                    name=f'Loadtest {i}-{j}', slug=f'loadtest-{i}-{j}', price=Decimal('100.00'), category=category
+                )
+        return ids
+
+    def run(self, path, view_class, options, stale_ttl, single_flight):
+        decorator = cached_response(
+            key_params={'page': '1'},
+            ttl=options['ttl'],
+            stale_ttl=stale_ttl,
+            single_flight=single_flight,
+            name=f'loadtest:{uuid.uuid4().hex}',  # fresh key for every run
+        )
+        view = type('LoadTestView', (view_class,), {'get': decorator(view_class.get.__wrapped__)}).as_view()
+
+        queries = Counter()
+        lock = threading.Lock()
+        started = time.monotonic()
+
+        def count_queries(execute, sql, params, many, context):
+            with lock:
+                queries[int(time.monotonic() - started)] += 1
+            return execute(sql, params, many, context)
+
+        # Count on every connection opened during the run, including the
+        # stale-while-revalidate refresh threads.
+        def instrument(sender, connection, **kwargs):
+            connection.execute_wrappers.append(count_queries)
+
+        connections.close_all()
+        connection_created.connect(instrument)
+        served = Counter()
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        factory = APIRequestFactory(HTTP_HOST=host)
+
+        def client(index):
+            try:
+                while time.monotonic() - started < options['duration']:
+                    view(factory.get(path))
+                    served[index] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(options['threads'])]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            time.sleep(0.5)  # let an in-flight background refresh finish
+        finally:
+            connection_created.disconnect(instrument)
+        return queries, sum(served.values())
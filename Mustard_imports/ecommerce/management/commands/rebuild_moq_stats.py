@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ecommerce.models import ProductMOQStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes ProductMOQStats (paid quantity and paid orders per product) from the order items'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = ProductMOQStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt MOQ stats for {count} products"))
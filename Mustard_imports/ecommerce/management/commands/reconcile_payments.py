@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.payments import (
+    RECONCILE_AFTER, RECONCILE_BATCH_SIZE, RECONCILE_CONCURRENCY, reconcile_pending_payments
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Queries Daraja for pending M-Pesa payments whose callback never arrived and applies the results. '
+        'Runs one pass (for cron) unless --loop is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=RECONCILE_AFTER,
+                            help='Only payments initiated at least this many seconds ago')
+        parser.add_argument('--limit', type=int, default=RECONCILE_BATCH_SIZE, help='Payments per batch')
+        parser.add_argument('--concurrency', type=int, default=RECONCILE_CONCURRENCY,
+                            help='Daraja queries in flight at once')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling until interrupted')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                outcomes = self.reconcile(options)
+                summary = ', '.join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+                self.stdout.write(self.style.SUCCESS(f"Checked {sum(outcomes.values())} payments: {summary or 'none due'}"))
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def reconcile(self, options):
+        """Work through every due batch; a full batch means more payments may be waiting."""
+        total = None
+        while True:
+            outcomes = reconcile_pending_payments(
+                older_than=options['older_than'], limit=options['limit'], concurrency=options['concurrency'],
+            )
+            total = outcomes if total is None else total + outcomes
+            if sum(outcomes.values()) < options['limit']:
+                return total
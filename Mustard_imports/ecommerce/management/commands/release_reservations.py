@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.stock import SWEEP_BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        'Releases expired Pick and Pay stock reservations so other carts can take the units. '
+        'Runs one pass (for cron) unless --loop is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=SWEEP_BATCH_SIZE, help='Reservations released per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep releasing until interrupted')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                released = release_expired(batch_size=options['batch'])
+                self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations"))
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.jobs import run_pending, worker_id
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued background jobs (retries, jobs enqueued without in-process running, '
+        'jobs orphaned by a restart). Loops until interrupted unless --once is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit')
+        parser.add_argument('--batch', type=int, default=100, help='Jobs claimed per pass')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when no job is due')
+
+    def handle(self, *args, **options):
+        worker = worker_id()
+        if options['once']:
+            ran = 0
+            while True:
+                batch = run_pending(options['batch'], worker)
+                ran += batch
+                if batch < options['batch']:
+                    break
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
+            return
+
+        self.stdout.write(f"Job worker {worker} started")
+        try:
+            while True:
+                if not run_pending(options['batch'], worker):
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.SUCCESS(f"Job worker {worker} stopped"))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.api.mailer import BATCH_SIZE, drain_outbox, warm_templates
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends the queued emails in the outbox, a batch per SMTP connection. '
+        'Runs one pass (for cron) unless --loop is given'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=BATCH_SIZE, help='Messages per SMTP connection')
+        parser.add_argument('--loop', action='store_true', help='Keep sending until interrupted')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        warm_templates()
+        try:
+            while True:
+                outcomes = drain_outbox(limit=options['batch'])
+                summary = ', '.join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+                self.stdout.write(self.style.SUCCESS(f"Processed {sum(outcomes.values())} emails: {summary or 'none due'}"))
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
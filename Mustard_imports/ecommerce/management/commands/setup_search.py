@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ecommerce.api.search import BACKENDS, PostgresSearchBackend, SQLiteSearchBackend
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the product search index for the database in use: GIN indexes (tsvector and pg_trgm) '
+        'on PostgreSQL, an FTS5 table rebuilt from the products on SQLite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=sorted(BACKENDS), help='Defaults to the database vendor')
+
+    def handle(self, *args, **options):
+        name = options['backend'] or {'postgresql': 'postgres', 'sqlite': 'sqlite'}.get(connection.vendor)
+        if name not in (PostgresSearchBackend.name, SQLiteSearchBackend.name):
+            raise CommandError(f"No search index to set up for the '{connection.vendor}' database")
+
+        with transaction.atomic():
+            BACKENDS[name]().setup()
+        self.stdout.write(self.style.SUCCESS(f"Search index ready ({name})"))
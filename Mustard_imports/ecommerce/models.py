@@ -7,7 +7,8 @@ from django.utils import timezone
 from django.core.files import File
 from PIL import Image
 from io import BytesIO
-from django.db.models import Sum
+from django.db.models import Case, Count, ExpressionWrapper, F, Prefetch, Q, Sum, When
+from django.db.models.functions import Coalesce, Greatest
 from django.conf import settings
 from django.utils.text import slugify
 import logging
@@ -167,6 +168,9 @@ class Category(models.Model):
 
     def get_absolute_url(self):
         return f'/{self.slug}'
+
+    def first_image(self):
+        return _first_related(self, 'images')
     
 class CategoryImage(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='images')
@@ -181,7 +185,7 @@ class CategoryImage(models.Model):
         return ''
 
     def get_primary_image(self):
-        first_image = self.category.images.first()
+        first_image = self.category.first_image()
         return first_image.get_image() if first_image else ''
 
 class Attribute(models.Model):
@@ -200,6 +204,37 @@ class AttributeValue(models.Model):
     def __str__(self):
         return f"{self.attribute.name}: {self.value}"
 
+def _first_related(instance, name):
+    """Lowest-id related object, read from the prefetch cache when there is one."""
+    if name in getattr(instance, '_prefetched_objects_cache', {}):
+        return min(getattr(instance, name).all(), key=lambda obj: obj.pk, default=None)
+    return getattr(instance, name).order_by('pk').first()
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_paid_moq_count(self):
+        """Annotate paid_moq_count, the quantity ordered in paid orders."""
+        return self.annotate(paid_moq_count=Coalesce(F('moq_stats__paid_quantity'), 0))
+
+    def for_listing(self):
+        """
+        Everything ProductSerializer reads, fetched up front so a page of
+        products serializes in a fixed number of queries.
+        """
+        return self.with_paid_moq_count().select_related(
+            'category', 'supplier', 'inventory'
+        ).prefetch_related(
+            'images',
+            'category__images',
+            Prefetch('attribute_values', queryset=AttributeValue.objects.select_related('attribute')),
+            Prefetch('reviews', queryset=CustomerReview.objects.select_related('user')),
+        )
+
+    def for_cards(self):
+        """What ProductCardSerializer reads: the listing without supplier, attributes and reviews."""
+        return self.with_paid_moq_count().select_related('category', 'inventory').prefetch_related('images')
+
+
 class Product(models.Model):
     MOQ_STATUS_CHOICES = (
         ('active', 'Active'),
@@ -225,8 +260,14 @@ class Product(models.Model):
     meta_title = models.CharField(max_length=255, blank=True, null=True)
     meta_description = models.TextField(blank=True, null=True)
 
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # Keyset pagination of category listings
+            models.Index(fields=['category', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return self.name
@@ -253,11 +294,11 @@ class Product(models.Model):
         # Pick & Pay products don't use MOQ, so return 0
         if self.is_pick_and_pay:
             return 0
-        order_items = OrderItem.objects.filter(
-            product=self,
-            order__payment_status='paid'
-        )
-        return sum(item.quantity for item in order_items)
+        # Set by Product.objects.with_paid_moq_count() / for_listing()
+        if hasattr(self, 'paid_moq_count'):
+            return self.paid_moq_count
+        paid_quantity = ProductMOQStats.objects.filter(product=self).values_list('paid_quantity', flat=True).first()
+        return paid_quantity or 0
 
     def moq_progress_percentage(self):
         if self.is_pick_and_pay or self.moq <= 1 or self.moq_status != 'active':
@@ -268,12 +309,15 @@ class Product(models.Model):
     def get_absolute_url(self):
         return f'/{self.category.slug}/{self.slug}/'
 
+    def first_image(self):
+        return _first_related(self, 'images')
+
     def get_primary_image(self):
-        first_image = self.images.first()
+        first_image = self.first_image()
         return first_image.get_image() if first_image else ''
 
     def get_primary_thumbnail(self):
-        first_image = self.images.first()
+        first_image = self.first_image()
         return first_image.get_thumbnail() if first_image else ''
 
     def available_stock(self):
@@ -281,6 +325,59 @@ class Product(models.Model):
             return None  # Stock tracking only for Pick and Pay
         return self.inventory.quantity if self.inventory else 0
 
+class ProductMOQStats(models.Model):
+    """
+    Running totals of paid, uncancelled orders per product.
+
+    Kept in step by the Order/OrderItem signals in api/signals.py so MOQ
+    progress is a single-row read; rebuild_moq_stats recomputes it from the
+    order items if it ever drifts.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='moq_stats')
+    paid_quantity = models.PositiveIntegerField(default=0, db_index=True)
+    paid_orders = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"MOQ stats for product {self.product_id}: {self.paid_quantity} in {self.paid_orders} orders"
+
+    @classmethod
+    def apply_delta(cls, product_id, quantity, orders):
+        """Add ``quantity`` and ``orders`` (either may be negative) to a product's totals."""
+        if not quantity and not orders:
+            return
+        cls.objects.get_or_create(product_id=product_id)
+        cls.objects.filter(product_id=product_id).update(
+            paid_quantity=Greatest(F('paid_quantity') + quantity, 0),
+            paid_orders=Greatest(F('paid_orders') + orders, 0),
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def apply_order(cls, order, sign):
+        """Count (sign=1) or uncount (sign=-1) every item of ``order``."""
+        totals = order.items.values('product_id').annotate(quantity=Sum('quantity')).order_by()
+        for row in totals:
+            cls.apply_delta(row['product_id'], sign * row['quantity'], sign)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every product's totals from the order items."""
+        totals = OrderItem.objects.filter(
+            order__payment_status='paid',
+            order__is_cancelled=False
+        ).values('product_id').annotate(
+            quantity=Sum('quantity'),
+            orders=Count('order_id', distinct=True)
+        ).order_by()
+        stats = [
+            cls(product_id=row['product_id'], paid_quantity=row['quantity'], paid_orders=row['orders'])
+            for row in totals
+        ]
+        cls.objects.all().delete()
+        cls.objects.bulk_create(stats, batch_size=500)
+        return len(stats)
+
 class Inventory(models.Model):
     product = models.OneToOneField(
         Product,
@@ -299,19 +396,26 @@ class Inventory(models.Model):
     def is_low_stock(self):
         return self.quantity <= self.low_stock_threshold
 
+    # Both update the row in SQL, so concurrent calls can't lose each other's change
     def reduce_stock(self, quantity):
         if not self.product.is_pick_and_pay:
             raise ValueError("Stock reduction only applies to Pick and Pay products")
-        if self.quantity < quantity:
+        updated = Inventory.objects.filter(pk=self.pk, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity, last_updated=timezone.now()
+        )
+        self.refresh_from_db(fields=['quantity', 'last_updated'])
+        if not updated:
             raise ValueError(f"Insufficient stock for {self.product.name}. Available: {self.quantity}, Requested: {quantity}")
-        self.quantity -= quantity
-        self.save()
+        from .api.stock import stock_changed
+        stock_changed({self.product_id: -quantity})
 
     def restock(self, quantity):
         if not self.product.is_pick_and_pay:
             raise ValueError("Restocking only applies to Pick and Pay products")
-        self.quantity += quantity
-        self.save()
+        Inventory.objects.filter(pk=self.pk).update(quantity=F('quantity') + quantity, last_updated=timezone.now())
+        self.refresh_from_db(fields=['quantity', 'last_updated'])
+        from .api.stock import stock_changed
+        stock_changed({self.product_id: quantity})
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
@@ -365,6 +469,49 @@ class ShippingMethod(models.Model):
     class Meta:
         ordering = ['name']
 
+def cart_item_price(prefix=''):
+    """
+    CartItem.price_per_piece as an SQL expression, for the cart item at
+    ``prefix`` (e.g. 'items__' from a Cart queryset).
+    """
+    product = f'{prefix}product__'
+    return Case(
+        When(**{f'{product}is_pick_and_pay': True}, then=F(f'{product}price')),
+        When(
+            Q(**{f'{product}moq_status': 'active'}) & Q(**{f'{prefix}quantity__lt': F(f'{product}moq_per_person')}),
+            then=Coalesce(F(f'{product}below_moq_price'), F(f'{product}price')),
+        ),
+        default=F(f'{product}price'),
+    )
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate item_count, items_subtotal and shipped_item_count (items
+        that aren't Pick and Pay), aggregated over the items in SQL.
+        """
+        line_total = ExpressionWrapper(
+            F('items__quantity') * cart_item_price('items__'), output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        )
+        return self.annotate(
+            item_count=Count('items'),
+            items_subtotal=Sum(line_total),
+            shipped_item_count=Count('items', filter=Q(items__product__is_pick_and_pay=False)),
+        )
+
+    def for_display(self):
+        """
+        Everything CartSerializer reads, in four queries however many items
+        the cart holds: the cart with its totals and shipping method, the
+        items, their products with category and inventory, and their images.
+        """
+        return self.with_totals().select_related('shipping_method').prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.order_by('id')),
+            Prefetch('items__product', queryset=Product.objects.for_cards()),
+        )
+
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     shipping_method = models.ForeignKey(
@@ -377,20 +524,33 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     def __str__(self):
         return f"Cart for {self.user.username}"
 
+    # item_count, items_subtotal and shipped_item_count are set by
+    # Cart.objects.with_totals() / for_display()
+
     @property
     def total_items(self):
+        if hasattr(self, 'item_count'):
+            return self.item_count
         return self.items.count()
 
     @property
     def subtotal(self):
+        if hasattr(self, 'items_subtotal'):
+            return Decimal(self.items_subtotal or 0).quantize(Decimal('0.01'))
         return sum(item.line_total for item in self.items.all())
 
     @property
     def shipping_cost(self):
         """Return shipping cost as Decimal, handling edge cases"""
+        if hasattr(self, 'shipped_item_count'):
+            shipped = self.shipped_item_count and self.shipping_method
+            return Decimal(str(self.shipping_method.price)) if shipped else Decimal('0.00')
+
         items = self.items.all()
 
         # Empty cart returns 0
@@ -448,6 +608,26 @@ class CartItem(models.Model):
     def line_total(self):
         return self.price_per_piece * self.quantity
 
+
+class StockReservation(models.Model):
+    """
+    Units of a Pick and Pay product held for a cart item, kept by api/stock.py.
+
+    A hold lasts until ``expires_at``; the sweeper then deletes it and the
+    units become available to other carts again. Checkout turns the cart's
+    holds into an order. The available stock served to shoppers is
+    ``Inventory.quantity`` minus every row here, counted in the cache.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='reservation')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_id} for cart item {self.cart_item_id} until {self.expires_at}"
+
+
 class Order(models.Model):
     PAYMENT_STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -513,6 +693,10 @@ class Order(models.Model):
         order_item.delete()
         self.update_total_price()
 
+    @property
+    def counts_toward_moq(self):
+        return self.payment_status == 'paid' and not self.is_cancelled
+
     def mark_as_completed(self):
         if self.delivery_status in ('delivered', 'ready_for_pickup') and self.payment_status == 'paid':
             try:
@@ -535,7 +719,9 @@ class Order(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=['created_at']),
+            # (created_at, id) rather than created_at alone so keyset
+            # pagination can seek to a cursor
+            models.Index(fields=['created_at', 'id']),
             models.Index(fields=['payment_status']),
             models.Index(fields=['delivery_status']),
         ]
@@ -618,6 +804,15 @@ class Payment(models.Model):
         blank=True,
         help_text="Reason for payment failure, if any"
     )
+    status_checks = models.PositiveIntegerField(
+        default=0,
+        help_text="Status queries made by the reconciler since the payment was initiated"
+    )
+    next_status_check = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Earliest time the reconciler queries this payment again"
+    )
 
     def __str__(self):
         return f"Payment for Order #{self.order.id}"
@@ -630,6 +825,32 @@ class Payment(models.Model):
     class Meta:
         verbose_name = "Payment"
         verbose_name_plural = "Payments"
+        indexes = [
+            models.Index(fields=['payment_status', 'payment_date'], name='payment_status_date_idx'),
+        ]
+
+class PaymentCallbackInbox(models.Model):
+    """
+    M-Pesa STK callbacks as received, stored before they are acknowledged.
+
+    mpesa_callback only records the payload (Daraja's retries land on the
+    unique CheckoutRequestID and are counted in ``deliveries``) and answers;
+    the payments.process_callback job applies it and sets ``processed_at``.
+    """
+    checkout_request_id = models.CharField(max_length=50, unique=True)
+    payload = models.JSONField(help_text="The stkCallback object")
+    result_code = models.IntegerField(null=True, blank=True)
+    deliveries = models.PositiveIntegerField(default=1)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, blank=True, help_text="completed, failed, duplicate, ignored or unmatched")
+
+    class Meta:
+        verbose_name = "Payment callback"
+        verbose_name_plural = "Payment callback inbox"
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.outcome or 'unprocessed'})"
 
 class CompletedOrder(models.Model):
     original_order = models.OneToOneField(Order, on_delete=models.CASCADE, null=True, related_name='completed_order')
@@ -665,6 +886,12 @@ class CustomerReview(models.Model):
     rating = models.IntegerField(choices=[(i, i) for i in range(1, 6)])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a product's reviews
+            models.Index(fields=['product', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Review by {self.user.username} for {self.product.name}"
 
@@ -694,4 +921,88 @@ class MOQRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"MOQ Request: {self.product_name}"
\ No newline at end of file
+        return f"MOQ Request: {self.product_name}"
+
+class Job(models.Model):
+    """
+    A unit of background work, run by api/jobs.py.
+
+    Jobs are claimed with a compare-and-set on ``status`` so any number of
+    workers can drain the table without double-running a job. ``key``, when
+    set, is unique among queued and running jobs, which makes enqueueing the
+    same work twice a no-op.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=200, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=dict, blank=True, help_text="Progress and output reported by the job")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'], condition=models.Q(status__in=['queued', 'running']), name='job_active_key_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.name} ({self.status})"
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting to be sent, or the record of one, drained by api/mailer.py.
+
+    Views and signals only insert rows; the worker sends them in batches over
+    one SMTP connection. A message that keeps failing is retried with backoff
+    until ``max_attempts`` and then left here as ``dead`` for inspection.
+    """
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    )
+
+    to = models.JSONField(help_text="Recipient addresses")
+    from_email = models.CharField(max_length=254, blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html_body = models.TextField(blank=True)
+    template = models.CharField(max_length=100, blank=True, help_text="HTML template rendered with context when sent")
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    send_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='email_status_send_after_idx'),
+        ]
+
+    def __str__(self):
+        return f"Email {self.id} to {', '.join(self.to)} ({self.status})"
@@ -3,6 +3,9 @@ import django
 import pytest
 from decimal import Decimal
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from fakeredis import FakeRedisConnection
+from rest_framework.test import APIClient
 
 # Set the DJANGO_SETTINGS_MODULE environment variable
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Mustard_imports.settings")
@@ -18,12 +21,44 @@ from ecommerce.models import (
 User = get_user_model()
 
 
+FAKEREDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/15',
+        'KEY_PREFIX': 'mustard-test',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CONNECTION_POOL_KWARGS': {'connection_class': FakeRedisConnection},
+        },
+    }
+}
+
+
 @pytest.fixture(scope="session")
 def django_db_setup():
     """Set up Django database configuration."""
     pass
 
 
+@pytest.fixture(autouse=True)
+def shared_cache(settings):
+    """Run every test against an empty fakeredis-backed shared cache."""
+    settings.CACHES = FAKEREDIS_CACHES
+    # Refresh inline so stale-while-revalidate stays inside the test transaction
+    settings.RESPONSE_CACHE_BACKGROUND_REFRESH = False
+    # Tests run queued jobs explicitly with jobs.run_pending()
+    settings.JOBS_RUN_IN_PROCESS = False
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.fixture
+def committed(django_capture_on_commit_callbacks):
+    """Run the on-commit callbacks of a ``with committed():`` block on leaving it."""
+    return lambda: django_capture_on_commit_callbacks(execute=True)
+
+
 @pytest.fixture
 def user_factory(db):
     """Factory for creating test users."""
@@ -73,6 +108,16 @@ def pick_and_pay_product(db, product_factory):
     return product
 
 
+@pytest.fixture
+def stocked(db, product_factory):
+    """Factory for Pick & Pay products with ``quantity`` units in inventory."""
+    def create(quantity, **kwargs):
+        product = product_factory(is_pick_and_pay=True, price=Decimal('500.00'), **kwargs)
+        Inventory.objects.create(product=product, quantity=quantity)
+        return product
+    return create
+
+
 @pytest.fixture
 def moq_product(db, product_factory):
     """Create MOQ group buy product."""
@@ -115,6 +160,20 @@ def admin_user(db, user_factory):
     )
 
 
+@pytest.fixture
+def api_client():
+    """Unauthenticated API client."""
+    return APIClient()
+
+
+@pytest.fixture
+def admin_client(admin_user):
+    """API client authenticated as the admin user."""
+    client = APIClient()
+    client.force_authenticate(user=admin_user)
+    return client
+
+
 @pytest.fixture
 def cart(db, user):
     """Create cart for user."""
@@ -130,4 +189,24 @@ def delivery_location(db, user):
         ward='Westlands',
         address='123 Test Street',
         is_default=True
-    )
\ No newline at end of file
+    )
+
+
+@pytest.fixture
+def daraja(monkeypatch):
+    """Point the M-Pesa client at a local Daraja stub with a cold token cache."""
+    from ecommerce.api import http_client, mpesa
+    from ecommerce.tests.daraja_stub import DarajaStub
+
+    http_client.reset()
+    stub = DarajaStub().start()
+    monkeypatch.setattr(mpesa, 'MPESA_BASE_URL', stub.url)
+    monkeypatch.setattr(mpesa, 'CONSUMER_KEY', stub.consumer_key)
+    monkeypatch.setattr(mpesa, 'CONSUMER_SECRET', stub.consumer_secret)
+    monkeypatch.setattr(mpesa, 'MPESA_SHORTCODE', '174379')
+    monkeypatch.setattr(mpesa, 'MPESA_PASSKEY', 'test-passkey')
+    mpesa.token_manager._entry = None
+    yield stub
+    mpesa.token_manager._entry = None
+    http_client.reset()
+    stub.stop()
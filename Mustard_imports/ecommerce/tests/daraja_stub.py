@@ -0,0 +1,151 @@
+"""
+A local stand-in for the Safaricom Daraja API, served over real HTTP so the
+M-Pesa client is exercised end to end (requests, headers, JSON bodies).
+
+Implements the OAuth token endpoint, STK push and STK push query, records
+every request it receives, and has knobs for slow token issuing, revoking
+tokens and scripting failure responses.
+"""
+import base64
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROCESSING = object()
+
+
+class DarajaStub:
+    def __init__(self, consumer_key='test-key', consumer_secret='test-secret', expires_in=3599):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.expires_in = expires_in
+        self.token_delay = 0  # seconds the token endpoint takes to answer
+        self.token_requests = 0
+        self.requests = []  # (path, json body) of every STK call
+        self.valid_tokens = set()
+        self.stk_query_result = {'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'}
+        # CheckoutRequestID -> query result; PROCESSING answers like Daraja does
+        # for a prompt the customer hasn't responded to yet
+        self.query_results = {}
+        self.query_delay = 0  # seconds each status query takes
+        self.queries_in_flight = 0
+        self.max_queries_in_flight = 0
+        self.failures = {}  # path -> list of (status, body) answered before the normal response
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like Daraja
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._dispatch(self)
+
+            def do_POST(self):
+                stub._dispatch(self)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.valid_tokens.clear()
+
+    def fail_next(self, path, status, body):
+        self.failures.setdefault(path, []).append((status, body))
+
+    # ---- request handling ----
+
+    def _dispatch(self, handler):
+        path = handler.path.split('?')[0]
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}') if length else {}
+
+        with self._lock:
+            scripted = self.failures.get(path)
+            failure = scripted.pop(0) if scripted else None
+        if failure:
+            return self._reply(handler, *failure)
+
+        if path == '/oauth/v1/generate':
+            return self._reply(handler, *self._token(handler))
+        if not self._authorized(handler):
+            return self._reply(handler, 401, {
+                'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token',
+            })
+        with self._lock:
+            self.requests.append((path, body))
+        if path == '/mpesa/stkpush/v1/processrequest':
+            return self._reply(handler, 200, {
+                'MerchantRequestID': f'merchant-{next(self._ids)}',
+                'CheckoutRequestID': f'ws_CO_{next(self._ids)}',
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            })
+        if path == '/mpesa/stkpushquery/v1/query':
+            return self._reply(handler, *self._query(body))
+        return self._reply(handler, 404, {'errorMessage': 'Not found'})
+
+    def _query(self, body):
+        with self._lock:
+            self.queries_in_flight += 1
+            self.max_queries_in_flight = max(self.max_queries_in_flight, self.queries_in_flight)
+        try:
+            if self.query_delay:
+                time.sleep(self.query_delay)
+            result = self.query_results.get(body.get('CheckoutRequestID'), self.stk_query_result)
+            if result is PROCESSING:
+                return 500, {
+                    'requestId': f'request-{next(self._ids)}',
+                    'errorCode': '500.001.1001',
+                    'errorMessage': 'The transaction is being processed',
+                }
+            return 200, {'ResponseCode': '0', 'CheckoutRequestID': body.get('CheckoutRequestID'), **result}
+        finally:
+            with self._lock:
+                self.queries_in_flight -= 1
+
+    def _token(self, handler):
+        expected = base64.b64encode(f'{self.consumer_key}:{self.consumer_secret}'.encode()).decode()
+        if handler.headers.get('Authorization') != f'Basic {expected}':
+            return 400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'}
+        if self.token_delay:
+            time.sleep(self.token_delay)
+        with self._lock:
+            self.token_requests += 1
+            token = f'token-{self.token_requests}'
+            self.valid_tokens.add(token)
+        return 200, {'access_token': token, 'expires_in': str(self.expires_in)}
+
+    def _authorized(self, handler):
+        header = handler.headers.get('Authorization', '')
+        with self._lock:
+            return header.startswith('Bearer ') and header[len('Bearer '):] in self.valid_tokens
+
+    def _reply(self, handler, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
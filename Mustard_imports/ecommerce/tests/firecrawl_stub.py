@@ -0,0 +1,86 @@
+"""
+A local stand-in for Firecrawl's scrape endpoint, serving saved pages from
+tests/fixtures/scraping over real HTTP so the scraping pipeline runs end to
+end (I/O loop, concurrency limits, rate limits).
+
+``pages`` maps a scraped URL to a fixture file name; any other URL is
+answered like Firecrawl answers a page it could not load. Every request is
+recorded with the time it arrived, and the stub tracks how many requests it
+was serving at once.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'scraping'
+
+
+def fixture(name):
+    return (FIXTURES / name).read_text(encoding='utf-8')
+
+
+class FirecrawlStub:
+    def __init__(self, pages=None):
+        self.pages = dict(pages or {})
+        self.delay = 0  # seconds each scrape takes
+        self.requests = []  # (arrival time, scraped url)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/v1/scrape'
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                stub._dispatch(self)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def scraped_urls(self):
+        return [url for _, url in self.requests]
+
+    def _dispatch(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}')
+        url = body.get('url')
+        with self._lock:
+            self.requests.append((time.monotonic(), url))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if url in self.pages:
+                payload = {'success': True, 'data': {'rawHtml': fixture(self.pages[url])}}
+            else:
+                payload = {'success': False, 'error': 'Failed to load the page'}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        data = json.dumps(payload).encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
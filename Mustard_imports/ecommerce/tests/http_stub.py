@@ -0,0 +1,80 @@
+"""
+A local HTTP server that answers from a script of faults, for exercising the
+outbound client's timeouts, retries and circuit breakers over real sockets.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FaultStub:
+    def __init__(self):
+        # Consumed one per request, then every request gets 200 {"ok": true}:
+        # ('status', code) answers with that status, ('delay', seconds) answers
+        # 200 after sleeping, ('drop',) closes the connection without answering
+        self.script = []
+        self.requests = []  # (method, path) of every request received
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                stub._dispatch(self)
+
+            def do_POST(self):
+                stub._dispatch(self)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def then(self, *actions):
+        self.script.extend(actions)
+        return self
+
+    def _dispatch(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        if length:
+            handler.rfile.read(length)
+        with self._lock:
+            self.requests.append((handler.command, handler.path))
+            action = self.script.pop(0) if self.script else ('status', 200)
+
+        if action[0] == 'drop':
+            handler.close_connection = True
+            return
+        if action[0] == 'delay':
+            time.sleep(action[1])
+            action = ('status', 200)
+
+        payload = json.dumps({'ok': action[1] < 400}).encode('utf-8')
+        handler.send_response(action[1])
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
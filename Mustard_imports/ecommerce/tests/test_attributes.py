@@ -0,0 +1,129 @@
+"""
+Tests for the cached per-product attribute index: one query to build it for
+any number of products, none once cached, retirement when the attribute
+links, values or attributes change, and its use by the serializer, the cart
+endpoints and the bulk importer.
+"""
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecommerce.api.attributes import allowed_attributes, attribute_index
+from ecommerce.api.bulk_products import create_products
+from ecommerce.api.serializers import ProductSerializer
+from ecommerce.models import Attribute, AttributeValue, Cart, Product
+
+
+@pytest.fixture
+def values(db):
+    color, size = Attribute.objects.create(name='Color'), Attribute.objects.create(name='Size')
+    return {
+        value: AttributeValue.objects.create(attribute=attribute, value=value)
+        for attribute, value in [(color, 'Red'), (color, 'Blue'), (size, 'M'), (size, 'L')]
+    }
+
+
+@pytest.fixture
+def shirt(product_factory, values, committed):
+    product = product_factory(name='Shirt', slug='shirt')
+    with committed():
+        product.attribute_values.set([values['Red'], values['Blue'], values['M']])
+    return product
+
+
+def queries(function, *args):
+    with CaptureQueriesContext(connection) as captured:
+        result = function(*args)
+    return result, len(captured)
+
+
+@pytest.mark.django_db
+class TestIndex:
+    def test_built_in_one_query_then_cached(self, shirt, product_factory, values):
+        plain = product_factory(name='Plain', slug='plain')
+        index, count = queries(attribute_index, [shirt.id, plain.id])
+        assert count == 1
+        assert index == {
+            shirt.id: {'Color': ((values['Blue'].id, 'Blue'), (values['Red'].id, 'Red')), 'Size': ((values['M'].id, 'M'),)},
+            plain.id: {},
+        }
+
+        allowed, count = queries(allowed_attributes, [shirt.id, plain.id])
+        assert count == 0
+        assert allowed == {shirt.id: {'Color': frozenset({'Red', 'Blue'}), 'Size': frozenset({'M'})}, plain.id: {}}
+
+    def test_link_changes_retire_the_index(self, shirt, product_factory, values, committed):
+        allowed_attributes([shirt.id])
+        with committed():
+            shirt.attribute_values.remove(values['Red'])
+            shirt.attribute_values.add(values['L'])
+        assert allowed_attributes([shirt.id])[shirt.id] == {'Color': frozenset({'Blue'}), 'Size': frozenset({'M', 'L'})}
+
+        hat = product_factory(name='Hat', slug='hat')
+        allowed_attributes([shirt.id, hat.id])
+        with committed():
+            values['Red'].products.add(shirt, hat)
+        assert allowed_attributes([shirt.id, hat.id]) == {
+            shirt.id: {'Color': frozenset({'Red', 'Blue'}), 'Size': frozenset({'M', 'L'})},
+            hat.id: {'Color': frozenset({'Red'})},
+        }
+
+        with committed():
+            values['Red'].products.clear()
+            shirt.attribute_values.clear()
+        assert allowed_attributes([shirt.id, hat.id]) == {shirt.id: {}, hat.id: {}}
+
+    def test_renamed_and_deleted_values_retire_the_index(self, shirt, values, committed):
+        allowed_attributes([shirt.id])
+        with committed():
+            values['Blue'].value = 'Navy'
+            values['Blue'].save()
+        assert allowed_attributes([shirt.id])[shirt.id]['Color'] == frozenset({'Red', 'Navy'})
+
+        with committed():
+            Attribute.objects.get(name='Size').delete()
+        assert set(allowed_attributes([shirt.id])[shirt.id]) == {'Color'}
+
+    def test_serializer_renders_the_index(self, shirt, values):
+        expected = [
+            {'id': 1, 'name': 'Color', 'values': [
+                {'id': values['Blue'].id, 'value': 'Blue'}, {'id': values['Red'].id, 'value': 'Red'},
+            ]},
+            {'id': 2, 'name': 'Size', 'values': [{'id': values['M'].id, 'value': 'M'}]},
+        ]
+        prefetched = Product.objects.for_listing().get(pk=shirt.pk)
+        assert ProductSerializer(prefetched).data['attributes'] == expected
+
+        attribute_index([shirt.id])
+        product = Product.objects.get(pk=shirt.pk)
+        data, count = queries(lambda: ProductSerializer(product, fields=['id', 'attributes']).data)
+        assert (data['attributes'], count) == (expected, 0)
+
+    def test_cart_validation_uses_the_index(self, user, shirt):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        cart = Cart.objects.create(user=user)
+        url = reverse('add-item-to-cart', args=[cart.id])
+        response = client.post(url, {'productId': shirt.id, 'attributes': {'Color': 'Green'}}, format='json')
+        assert (response.status_code, response.data) == (400, {'error': 'Invalid value for Color: Green'})
+        response = client.post(url, {'productId': shirt.id, 'attributes': {'Color': ['Red']}}, format='json')
+        assert response.status_code == 400
+        assert client.post(url, {'productId': shirt.id, 'attributes': {'Color': 'Red'}}, format='json').status_code == 201
+
+    def test_importer_stores_the_index_of_new_products(self, category, committed):
+        rows = [
+            {
+                'name': f'Jar {n}', 'description': 'Glass jar', 'price': 100, 'category_id': category.id,
+                'attributes': [('Color', 'Clear'), ('Capacity', f'{n}00ml')],
+            }
+            for n in range(1, 4)
+        ]
+        with committed():
+            created, errors = create_products(rows)
+        assert errors == []
+
+        index, count = queries(allowed_attributes, [product.id for product in created])
+        assert count == 0
+        assert index[created[1].id] == {'Color': frozenset({'Clear'}), 'Capacity': frozenset({'200ml'})}
@@ -0,0 +1,89 @@
+"""
+Tests for the shared cache backends.
+"""
+import multiprocessing
+import time
+
+import pytest
+from django.core.cache import cache, caches
+
+from ecommerce.api.cache_backends import SQLiteCache
+
+
+def make_worker_cache(path):
+    """Each worker process builds its own backend instance on the same file."""
+    return SQLiteCache(str(path), {'KEY_PREFIX': 'test'})
+
+
+def _write_from_other_process(path, key, value):
+    make_worker_cache(path).set(key, value, 60)
+
+
+class TestSQLiteCache:
+    def test_entries_are_shared_between_workers(self, tmp_path):
+        path = tmp_path / 'cache.sqlite3'
+        worker_a, worker_b = make_worker_cache(path), make_worker_cache(path)
+
+        worker_a.set('categories_list', [{'id': 1, 'name': 'Electronics'}], 60)
+        assert worker_b.get('categories_list') == [{'id': 1, 'name': 'Electronics'}]
+
+        worker_b.delete('categories_list')
+        assert worker_a.get('categories_list') is None
+
+    def test_entries_written_by_another_process_are_visible(self, tmp_path):
+        path = tmp_path / 'cache.sqlite3'
+        process = multiprocessing.get_context('fork').Process(
+            target=_write_from_other_process, args=(path, 'product_detail_x', {'id': 7})
+        )
+        process.start()
+        process.join(10)
+        assert process.exitcode == 0
+        assert make_worker_cache(path).get('product_detail_x') == {'id': 7}
+
+    def test_add_only_succeeds_once(self, tmp_path):
+        worker_a, worker_b = make_worker_cache(tmp_path / 'c.db'), make_worker_cache(tmp_path / 'c.db')
+        assert worker_a.add('lock', 1, 60) is True
+        assert worker_b.add('lock', 2, 60) is False
+        assert worker_b.get('lock') == 1
+
+    def test_add_replaces_expired_entry(self, tmp_path):
+        backend = make_worker_cache(tmp_path / 'c.db')
+        backend.set('lock', 1, 0.05)
+        time.sleep(0.1)
+        assert backend.add('lock', 2, 60) is True
+        assert backend.get('lock') == 2
+
+    def test_incr_is_shared_and_requires_existing_key(self, tmp_path):
+        worker_a, worker_b = make_worker_cache(tmp_path / 'c.db'), make_worker_cache(tmp_path / 'c.db')
+        with pytest.raises(ValueError):
+            worker_a.incr('hits')
+        worker_a.set('hits', 0, None)
+        worker_a.incr('hits')
+        assert worker_b.incr('hits', 5) == 6
+
+    def test_expired_entries_are_misses(self, tmp_path):
+        backend = make_worker_cache(tmp_path / 'c.db')
+        backend.set('short', 'value', 0.05)
+        time.sleep(0.1)
+        assert backend.get('short', 'missing') == 'missing'
+        assert backend.has_key('short') is False
+
+    def test_many_operations(self, tmp_path):
+        backend = make_worker_cache(tmp_path / 'c.db')
+        backend.set_many({'a': 1, 'b': {'nested': True}}, 60)
+        assert backend.get_many(['a', 'b', 'c']) == {'a': 1, 'b': {'nested': True}}
+        backend.delete_many(['a'])
+        assert backend.get_many(['a', 'b']) == {'b': {'nested': True}}
+        backend.clear()
+        assert backend.get('b') is None
+
+
+class TestFakeRedisTestMode:
+    def test_default_cache_is_redis_protocol(self):
+        assert caches['default'].__class__.__name__ == 'RedisCache'
+        cache.set('counter', 1)
+        assert cache.incr('counter') == 2
+        assert cache.add('counter', 10) is False
+
+    def test_cache_starts_empty_for_each_test(self):
+        assert cache.get('counter') is None
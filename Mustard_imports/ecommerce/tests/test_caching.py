@@ -0,0 +1,300 @@
+"""
+Tests for the @cached_response decorator, tag invalidation and the
+per-endpoint cache metrics.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from ecommerce.api import caching
+from ecommerce.api.caching import bump_tags, cached_response, get_generations
+from ecommerce.api.metrics import cache_stats
+from ecommerce.models import Category, CategoryImage, CustomerReview, Order
+
+
+def endpoint_stats(name):
+    return cache_stats()[name]
+
+
+@pytest.mark.django_db
+class TestCachedResponse:
+    def test_default_and_explicit_params_share_an_entry(self, api_client, product_factory):
+        product_factory(name='Test Product')
+
+        first = api_client.get(reverse('search'), {'search': 'Test'})
+        second = api_client.get(reverse('search'), {'search': 'Test', 'page': '1', 'per_page': '10'})
+
+        assert first.status_code == second.status_code == status.HTTP_200_OK
+        assert second.data == first.data
+        assert endpoint_stats('search') == {'hits': 1, 'stale': 0, 'coalesced': 0, 'misses': 1, 'hit_rate': 0.5}
+
+    def test_params_that_change_the_response_get_separate_entries(self, api_client, category, product_factory):
+        for i in range(3):
+            product_factory(name=f'Product {i}', slug=f'product-{i}')
+        url = reverse('category-products', args=[category.slug])
+
+        assert len(api_client.get(url, {'per_page': 1}).data['products']) == 1
+        assert len(api_client.get(url, {'per_page': 3}).data['products']) == 3
+
+    def test_hit_skips_the_database(self, api_client, product_factory, django_assert_num_queries):
+        product_factory(name='Test Product')
+        api_client.get(reverse('latest-products'))
+
+        with django_assert_num_queries(0):
+            response = api_client.get(reverse('latest-products'))
+        assert response.data['results'][0]['name'] == 'Test Product'
+
+    def test_if_none_match_returns_not_modified(self, api_client, product_factory):
+        product_factory(name='Test Product')
+        response = api_client.get(reverse('latest-products'))
+        etag = response['ETag']
+
+        assert api_client.get(reverse('latest-products'), HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_304_NOT_MODIFIED
+        assert api_client.get(reverse('latest-products'), HTTP_IF_NONE_MATCH='"stale"').status_code == status.HTTP_200_OK
+
+    def test_error_responses_are_not_cached(self, api_client):
+        url = reverse('category-products', args=['missing'])
+        assert api_client.get(url).status_code == status.HTTP_404_NOT_FOUND
+        assert api_client.get(url).status_code == status.HTTP_404_NOT_FOUND
+        assert endpoint_stats('CategoryProductsView.get')['misses'] == 2
+
+    def test_cached_cart_is_not_served_to_other_users(self, api_client, user, user_factory):
+        other = user_factory(username='other', email='other@example.com')
+        url = reverse('get-user-cart', args=[user.id])
+
+        api_client.force_authenticate(user)
+        assert api_client.get(url).status_code == status.HTTP_200_OK
+
+        api_client.force_authenticate(other)
+        assert api_client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_per_user_entries(self, api_client, user, user_factory):
+        other = user_factory(username='other', email='other@example.com')
+
+        api_client.force_authenticate(user)
+        assert api_client.get(reverse('get_current_user')).data['username'] == 'testuser'
+        api_client.force_authenticate(other)
+        assert api_client.get(reverse('get_current_user')).data['username'] == 'other'
+
+    def test_new_review_invalidates_cached_reviews(self, api_client, user, product_factory, committed):
+        product = product_factory(name='Test Product')
+        url = reverse('product-reviews', args=[product.id])
+        assert api_client.get(url).data['total'] == 0
+
+        api_client.force_authenticate(user)
+        with committed():
+            response = api_client.post(url, {'rating': 5, 'content': 'Great'}, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert api_client.get(url).data['total'] == 1
+
+
+@pytest.mark.django_db
+class TestTagInvalidation:
+    def test_product_save_invalidates_every_page_of_its_category(self, api_client, category, product_factory, committed):
+        products = [product_factory(name=f'Product {i}', slug=f'product-{i}') for i in range(3)]
+        url = reverse('category-products', args=[category.slug])
+        pages = [api_client.get(url, {'page': page, 'per_page': 1}).data for page in (1, 2, 3)]
+        assert pages[2]['products'][0]['name'] == 'Product 0'
+
+        with committed():
+            products[0].name = 'Renamed'
+            products[0].save()
+
+        assert api_client.get(url, {'page': 3, 'per_page': 1}).data['products'][0]['name'] == 'Renamed'
+
+    def test_moving_a_product_invalidates_the_old_category(self, api_client, category, product_factory, committed):
+        product = product_factory(name='Mover')
+        other = Category.objects.create(name='Garden', slug='garden')
+        url = reverse('category-products', args=[category.slug])
+        assert api_client.get(url).data['total'] == 1
+
+        with committed():
+            product.category = other
+            product.save()
+
+        assert api_client.get(url).data['total'] == 0
+
+    def test_category_change_invalidates_category_lists(self, api_client, category, committed):
+        assert api_client.get(reverse('all-categories-with-products')).data[0]['name'] == 'Electronics'
+
+        with committed():
+            category.name = 'Gadgets'
+            category.save()
+
+        assert api_client.get(reverse('all-categories-with-products')).data[0]['name'] == 'Gadgets'
+
+    def test_category_rename_invalidates_its_old_pages_and_product_pages(self, api_client, category, product_factory, committed):
+        product = product_factory(name='Lamp', slug='lamp')
+        old_url = reverse('category-products', args=[category.slug])
+        detail_url = reverse('product-detail', args=[category.slug, product.slug])
+        assert api_client.get(old_url).data['total'] == 1
+        assert api_client.get(detail_url).data['category']['name'] == 'Electronics'
+
+        with committed():
+            category.name, category.slug = 'Gadgets', 'gadgets'
+            category.save()
+
+        assert api_client.get(old_url).status_code == status.HTTP_404_NOT_FOUND
+        detail = api_client.get(reverse('product-detail', args=['gadgets', product.slug])).data
+        assert detail['category']['name'] == 'Gadgets'
+
+    def test_category_image_change_invalidates_product_pages(self, api_client, category, product_factory, committed):
+        product = product_factory(name='Lamp', slug='lamp')
+        detail_url = reverse('product-detail', args=[category.slug, product.slug])
+        assert api_client.get(detail_url).data['category']['primary_image'] is None
+
+        with committed():
+            CategoryImage.objects.create(category=category, image='category_images/lamps.jpg')
+
+        assert api_client.get(detail_url).data['category']['primary_image'].endswith('category_images/lamps.jpg')
+
+    def test_review_signal_invalidates_all_review_pages(self, api_client, user, product_factory, committed):
+        product = product_factory(name='Test Product')
+        url = reverse('product-reviews', args=[product.id])
+        assert api_client.get(url, {'page': 2, 'per_page': 1}).data['total'] == 0
+
+        with committed():
+            CustomerReview.objects.create(user=user, product=product, rating=4, content='Fine')
+
+        assert api_client.get(url, {'page': 2, 'per_page': 1}).data['total'] == 1
+
+    def test_order_save_invalidates_user_orders(self, api_client, user, committed):
+        api_client.force_authenticate(user)
+        assert api_client.get(reverse('get-user-orders')).data == []
+
+        with committed():
+            Order.objects.create(user=user)
+
+        assert len(api_client.get(reverse('get-user-orders')).data) == 1
+
+    def test_signals_bump_once_the_transaction_commits(self, category, django_capture_on_commit_callbacks):
+        before = get_generations(['catalog', f'category:{category.slug}'])
+        with django_capture_on_commit_callbacks() as callbacks:
+            category.name = 'Gadgets'
+            category.save()
+            # A reader before the commit would cache the old rows under a new generation
+            assert get_generations(['catalog', f'category:{category.slug}']) == before
+
+        for callback in callbacks:
+            callback()
+        after = get_generations(['catalog', f'category:{category.slug}'])
+        assert all(after[tag] > generation for tag, generation in before.items())
+
+    def test_bump_only_touches_its_own_tag(self):
+        before = get_generations(['catalog', 'user_orders:1'])
+        bump_tags('user_orders:1')
+        after = get_generations(['catalog', 'user_orders:1'])
+
+        assert after['catalog'] == before['catalog']
+        assert after['user_orders:1'] == before['user_orders:1'] + 1
+
+    def test_evicted_generation_never_goes_back(self):
+        first = get_generations(['catalog'])['catalog']
+        bump_tags('catalog')
+        cache.delete('gen:catalog')
+
+        assert get_generations(['catalog'])['catalog'] > first + 1
+
+
+def make_counting_view(delay=0, **options):
+    """A cached view that counts how often its body actually runs."""
+    calls = []
+
+    @api_view(['GET'])
+    @permission_classes([AllowAny])
+    @cached_response(name='counting_view', **options)
+    def view(request):
+        calls.append(1)
+        time.sleep(delay)
+        return Response({'computed': len(calls)})
+
+    return view, calls
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable wall clock for entry freshness."""
+    now = SimpleNamespace(value=time.time())
+    monkeypatch.setattr(caching, 'time', SimpleNamespace(
+        time=lambda: now.value, time_ns=time.time_ns, monotonic=time.monotonic, sleep=time.sleep,
+    ))
+    return now
+
+
+class TestStampedeProtection:
+    factory = APIRequestFactory()
+
+    def get(self, view):
+        return view(self.factory.get('/counting/'))
+
+    def test_concurrent_misses_compute_once(self):
+        view, calls = make_counting_view(delay=0.2, ttl=60, single_flight=True)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.get(view).data)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [{'computed': 1}] * 5
+        assert cache_stats()['counting_view']['coalesced'] == 4
+
+    def test_without_single_flight_every_miss_computes(self):
+        view, calls = make_counting_view(delay=0.2, ttl=60)
+        threads = [threading.Thread(target=self.get, args=(view,)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 3
+
+    def test_expired_entry_is_served_stale_while_one_request_refreshes(self, clock, settings):
+        settings.RESPONSE_CACHE_BACKGROUND_REFRESH = True
+        view, calls = make_counting_view(ttl=60, stale_ttl=600, single_flight=True)
+        assert self.get(view).data == {'computed': 1}
+
+        clock.value += 61
+        assert self.get(view).data == {'computed': 1}  # stale payload, refresh scheduled
+        deadline = time.monotonic() + 5
+        while len(calls) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        caching._refresh_executor().submit(lambda: None).result()
+
+        assert len(calls) == 2
+        assert self.get(view).data == {'computed': 2}
+        assert cache_stats()['counting_view']['stale'] == 1
+
+    def test_inline_refresh_returns_fresh_payload(self, clock):
+        view, calls = make_counting_view(ttl=60, stale_ttl=600)
+        self.get(view)
+        clock.value += 61
+        assert self.get(view).data == {'computed': 2}
+
+    def test_protection_can_be_switched_off(self, clock, settings):
+        settings.RESPONSE_CACHE_STAMPEDE_PROTECTION = False
+        view, calls = make_counting_view(ttl=60, stale_ttl=600)
+        self.get(view)
+        clock.value += 61
+        assert self.get(view).data == {'computed': 2}
+
+
+@pytest.mark.django_db
+def test_cache_stats_endpoint_requires_staff(api_client, user, admin_user):
+    api_client.force_authenticate(user)
+    assert api_client.get(reverse('cache_stats')).status_code == status.HTTP_403_FORBIDDEN
+
+    api_client.force_authenticate(admin_user)
+    api_client.get(reverse('random-products'))
+    response = api_client.get(reverse('cache_stats'))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['random_products']['misses'] == 1
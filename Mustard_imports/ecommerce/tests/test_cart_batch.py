@@ -0,0 +1,139 @@
+"""
+Tests for the batch cart endpoint: operations applied in order and merged
+like the single-item endpoints, attribute and stock checks, all-or-nothing
+failures and a query count independent of the number of operations.
+"""
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecommerce.api import stock
+from ecommerce.models import Attribute, AttributeValue, Cart, CartItem, StockReservation
+
+
+@pytest.fixture
+def client(user):
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture
+def shirt(product_factory):
+    product = product_factory(name='Shirt', slug='shirt')
+    color = Attribute.objects.create(name='Color')
+    product.attribute_values.set([
+        AttributeValue.objects.create(attribute=color, value='Red'),
+        AttributeValue.objects.create(attribute=color, value='Blue'),
+    ])
+    return product
+
+
+def patch(client, cart, *operations):
+    return client.patch(reverse('update-cart-items', args=[cart.id]), {'operations': list(operations)}, format='json')
+
+
+def lines(cart):
+    return sorted(
+        (item.product.name, item.attributes.get('Color'), item.quantity)
+        for item in CartItem.objects.filter(cart=cart).select_related('product')
+    )
+
+
+@pytest.mark.django_db
+class TestBatch:
+    def test_operations_are_applied_in_order(self, client, cart, shirt, moq_product, pick_and_pay_product):
+        kept = CartItem.objects.create(cart=cart, product=moq_product, quantity=5)
+        dropped = CartItem.objects.create(cart=cart, product=shirt, attributes={'Color': 'Blue'}, quantity=1)
+
+        response = patch(
+            client, cart,
+            {'op': 'add', 'productId': shirt.id, 'attributes': {'Color': 'Red'}, 'quantity': 2},
+            {'op': 'add', 'productId': shirt.id, 'attributes': {'Color': 'Red'}},
+            {'op': 'add', 'productId': pick_and_pay_product.id, 'quantity': 4},
+            {'op': 'update', 'itemId': kept.id, 'quantity': 7},
+            {'op': 'remove', 'itemId': dropped.id},
+        )
+        assert response.status_code == 200
+        assert lines(cart) == [('MOQ Product', None, 7), ('Pick & Pay Product', None, 4), ('Shirt', 'Red', 3)]
+        assert response.data['total_items'] == len(response.data['items']) == 3
+        assert StockReservation.objects.get().quantity == 4
+
+    def test_adds_merge_into_matching_items(self, client, cart, stocked):
+        mug = stocked(10)
+        item = CartItem.objects.create(cart=cart, product=mug, quantity=2)
+        stock.reserve(item, 2)
+        assert patch(client, cart, {'op': 'add', 'productId': mug.id, 'quantity': 3}).status_code == 200
+        assert CartItem.objects.get().quantity == 5
+        assert StockReservation.objects.get().quantity == 5
+        assert stock.available_stock([mug.id])[mug.id] == 5
+
+    @pytest.mark.parametrize('operation, error, index', [
+        ({'op': 'add', 'productId': 999999}, 'Product not found', 1),
+        ({'op': 'add', 'productId': 'shirt'}, 'productId required', 1),
+        ({'op': 'add', 'productId': None, 'attributes': {'Size': 'L'}}, 'Invalid attribute: Size', 1),
+        ({'op': 'add', 'productId': None, 'attributes': {'Color': 'Green'}}, 'Invalid value for Color: Green', 1),
+        ({'op': 'update', 'itemId': 999999, 'quantity': 1}, 'Cart item not found', 1),
+        ({'op': 'update', 'itemId': 1, 'quantity': 0}, 'Invalid quantity', 1),
+        ({'op': 'clear'}, 'op must be one of: add, update, remove', 1),
+    ])
+    def test_a_bad_operation_changes_nothing(self, client, cart, shirt, operation, error, index):
+        if operation.get('productId', 0) is None:
+            operation['productId'] = shirt.id
+        response = patch(client, cart, {'op': 'add', 'productId': shirt.id}, operation)
+        assert response.status_code == 400
+        assert response.data == {'error': error, 'operation': index}
+        assert not CartItem.objects.exists()
+
+    def test_stock_is_held_for_all_or_none(self, client, cart, stocked):
+        mug, jug = stocked(5, name='Mug', slug='mug'), stocked(2, name='Jug', slug='jug')
+        response = patch(
+            client, cart,
+            {'op': 'add', 'productId': mug.id, 'quantity': 3},
+            {'op': 'add', 'productId': jug.id, 'quantity': 3},
+        )
+        assert response.status_code == 400
+        assert response.data == {'error': 'Jug: Requested quantity (3) exceeds available stock (2)'}
+        assert not CartItem.objects.exists()
+        assert stock.available_stock([mug.id, jug.id]) == {mug.id: 5, jug.id: 2}
+
+    def test_pick_and_pay_only_cart_drops_its_shipping_method(self, client, cart, shipping_method, moq_product, stocked):
+        item = CartItem.objects.create(cart=cart, product=moq_product, quantity=5)
+        Cart.objects.filter(pk=cart.pk).update(shipping_method=shipping_method)
+        mug = stocked(5)
+        response = patch(client, cart, {'op': 'remove', 'itemId': item.id}, {'op': 'add', 'productId': mug.id})
+        assert response.status_code == 200
+        assert Cart.objects.get(pk=cart.pk).shipping_method is None
+
+    def test_other_users_carts_and_empty_batches(self, client, cart, user_factory, shirt):
+        other = Cart.objects.create(user=user_factory(username='other', email='other@example.com'))
+        assert patch(client, other, {'op': 'add', 'productId': shirt.id}).status_code == 404
+        response = patch(client, cart)
+        assert response.status_code == 400
+        assert response.data == {'error': 'operations must be a non-empty list'}
+
+    def test_query_count_is_independent_of_the_batch_size(self, user_factory, product_factory, stocked):
+        def queries_to_apply(size):
+            buyer = user_factory(username=f'buyer{size}', email=f'buyer{size}@example.com')
+            cart = Cart.objects.create(user=buyer)
+            client = APIClient()
+            client.force_authenticate(user=buyer)
+            operations = []
+            for n in range(size):
+                shipped = product_factory(name=f'Shipped {size} {n}', slug=f'shipped-{size}-{n}')
+                mug = stocked(5, name=f'Mug {size} {n}', slug=f'mug-{size}-{n}')
+                held = CartItem.objects.create(cart=cart, product=mug, quantity=1)
+                stock.reserve(held, 1)
+                dropped = CartItem.objects.create(cart=cart, product=shipped, quantity=1)
+                operations += [
+                    {'op': 'remove', 'itemId': dropped.id},
+                    {'op': 'add', 'productId': shipped.id, 'quantity': 2},
+                    {'op': 'update', 'itemId': held.id, 'quantity': 3},
+                ]
+            with CaptureQueriesContext(connection) as queries:
+                assert patch(client, cart, *operations).status_code == 200
+            return len(queries)
+
+        assert queries_to_apply(1) == queries_to_apply(10)
@@ -0,0 +1,136 @@
+"""
+Tests for the checkout engine: totals and stock, all-or-nothing failures,
+a query count independent of the cart size, and concurrent checkouts
+competing for the last unit of a product.
+"""
+import threading
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecommerce.models import Cart, CartItem, Inventory, Order, OrderItem
+
+User = get_user_model()
+
+
+def checkout(user, cart):
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client.post(reverse('create-order-from-cart', args=[cart.id]), format='json')
+
+
+@pytest.mark.django_db
+class TestCheckout:
+    def test_order_totals_and_stock(self, user, cart, shipping_method, stocked, moq_product):
+        mug = stocked(10, name='Mug', slug='mug')
+        cart.shipping_method = shipping_method
+        cart.save()
+        CartItem.objects.create(cart=cart, product=mug, quantity=2, attributes={'color': 'red'})
+        CartItem.objects.create(cart=cart, product=mug, quantity=3, attributes={'color': 'blue'})
+        CartItem.objects.create(cart=cart, product=moq_product, quantity=2)  # below moq_per_person
+
+        response = checkout(user, cart)
+        assert response.status_code == 201
+        # 5 x 500 + 2 x 6000 below-MOQ price + 200 shipping
+        assert Decimal(response.data['total_price']) == Decimal('14700.00')
+        assert (Decimal(response.data['shipping_cost']), response.data['delivery_status']) == (Decimal('200.00'), 'processing')
+        assert [(item['product_name'], item['quantity'], Decimal(item['price'])) for item in response.data['items']] == [
+            ('Mug', 2, Decimal('500.00')), ('Mug', 3, Decimal('500.00')), ('MOQ Product', 2, Decimal('6000.00')),
+        ]
+        assert Inventory.objects.get(product=mug).quantity == 5
+        assert not cart.items.exists()
+
+        order = Order.objects.get(pk=response.data['id'])
+        assert order.calculate_total_price() == order.total_price
+
+    def test_pick_and_pay_only_order_is_for_pickup(self, user, cart, stocked):
+        CartItem.objects.create(cart=cart, product=stocked(1), quantity=1)
+        response = checkout(user, cart)
+        assert response.status_code == 201
+        assert (response.data['delivery_status'], response.data['shipping_method'], Decimal(response.data['total_price'])) \
+            == ('ready_for_pickup', None, Decimal('500.00'))
+
+    def test_failure_changes_nothing(self, user, cart, stocked):
+        plenty, scarce = stocked(10, name='Plenty', slug='plenty'), stocked(2, name='Scarce', slug='scarce')
+        CartItem.objects.create(cart=cart, product=plenty, quantity=4)
+        item = CartItem.objects.create(cart=cart, product=scarce, quantity=2)
+        CartItem.objects.filter(pk=item.pk).update(quantity=3)  # stock sold since it was added
+
+        response = checkout(user, cart)
+        assert response.status_code == 400
+        assert response.data['error'] == 'Insufficient stock for Scarce: 2 available, 3 requested'
+        assert list(Inventory.objects.order_by('product_id').values_list('quantity', flat=True)) == [10, 2]
+        assert not Order.objects.exists()
+        assert cart.items.count() == 2
+
+    @pytest.mark.parametrize('shipping, error', [
+        (True, 'Shipping method must be null for carts with only Pick and Pay products'),
+        (False, 'No shipping method selected for non-Pick and Pay products'),
+    ])
+    def test_shipping_rules(self, user, cart, shipping_method, stocked, moq_product, shipping, error):
+        CartItem.objects.create(cart=cart, product=stocked(5) if shipping else moq_product, quantity=1)
+        cart.shipping_method = shipping_method if shipping else None
+        cart.save()
+        assert checkout(user, cart).data['error'] == error
+
+    def test_empty_missing_and_foreign_carts(self, user, user_factory, cart):
+        assert checkout(user, cart).data['error'] == 'Cart is empty'
+        other = user_factory(username='other', email='other@example.com')
+        assert checkout(other, cart).status_code == 404
+
+    def test_incomplete_orders_are_cleaned_up(self, user, cart, stocked):
+        stale = Order.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=stocked(1), quantity=1)
+        assert checkout(user, cart).status_code == 201
+        assert not Order.objects.filter(pk=stale.pk).exists()
+
+    def test_query_count_is_independent_of_cart_size(self, user_factory, shipping_method, stocked, moq_product):
+        def queries_to_checkout(size):
+            buyer = user_factory(username=f'buyer{size}', email=f'buyer{size}@example.com')
+            cart = Cart.objects.create(user=buyer, shipping_method=shipping_method)
+            for n in range(size):
+                CartItem.objects.create(cart=cart, product=stocked(5, name=f'Item {size} {n}', slug=f'item-{size}-{n}'), quantity=2)
+                CartItem.objects.create(cart=cart, product=moq_product, quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                assert checkout(buyer, cart).status_code == 201
+            return len(queries)
+
+        assert queries_to_checkout(1) == queries_to_checkout(10)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_checkouts_sell_the_last_unit_once(stocked):
+    last_unit = stocked(1, name='Last Unit', slug='last-unit')
+    buyers = []
+    for n in range(50):
+        # No password: hashing 50 of them would dominate the test
+        buyer = User.objects.create(username=f'buyer{n}', email=f'buyer{n}@example.com')
+        cart = Cart.objects.create(user=buyer)
+        CartItem.objects.create(cart=cart, product=last_unit, quantity=1)
+        buyers.append((buyer, cart))
+
+    start = threading.Barrier(len(buyers))
+    results = [None] * len(buyers)
+
+    def buy(index, buyer, cart):
+        try:
+            start.wait()
+            results[index] = checkout(buyer, cart).status_code
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=buy, args=(n, *pair)) for n, pair in enumerate(buyers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [201] + [400] * 49
+    assert Inventory.objects.get(product=last_unit).quantity == 0
+    assert OrderItem.objects.filter(product=last_unit).count() == 1
+    assert Order.objects.count() == 1
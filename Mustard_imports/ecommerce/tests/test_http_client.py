@@ -0,0 +1,220 @@
+"""
+Fault-injection tests for the outbound HTTP client, against local stub servers.
+"""
+import asyncio
+import socket
+import time
+
+import pytest
+import requests
+
+from ecommerce.api import http_client, mpesa
+from ecommerce.api.http_client import CircuitBreaker, CircuitOpenError, ConnectFailed, Upstream, UpstreamSession
+from ecommerce.api.metrics import get_counters
+from ecommerce.tests.http_stub import FaultStub
+
+
+@pytest.fixture
+def stub():
+    http_client.reset()
+    stub = FaultStub().start()
+    yield stub
+    http_client.reset()
+    stub.stop()
+
+
+def make_session(**options):
+    defaults = {'connect_timeout': 1, 'read_timeout': 1, 'backoff': 0.01, 'backoff_cap': 0.02}
+    defaults.update(options)
+    return UpstreamSession(Upstream('test', **defaults))
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestUpstreamSession:
+    def test_connections_are_kept_alive(self, stub):
+        client = make_session()
+        for _ in range(5):
+            assert client.get(f'{stub.url}/ping').json() == {'ok': True}
+        assert stub.connections == 1
+
+    def test_read_timeout_bounds_the_call(self, stub):
+        stub.then(('delay', 1), ('delay', 1))
+        client = make_session(read_timeout=0.2, retries=1)
+
+        started = time.monotonic()
+        with pytest.raises(requests.ReadTimeout):
+            client.get(f'{stub.url}/slow')
+        assert time.monotonic() - started < 1
+        assert len(stub.requests) == 2
+
+    def test_callers_can_only_shorten_timeouts(self):
+        client = make_session(connect_timeout=2, read_timeout=5)
+        assert client._timeout(None) == (2, 5)
+        assert client._timeout(120) == (2, 5)
+        assert client._timeout(1) == (1, 1)
+        assert client._timeout((None, 3)) == (2, 3)
+
+    def test_idempotent_calls_are_retried(self, stub):
+        stub.then(('status', 503), ('drop',))
+        response = make_session().get(f'{stub.url}/flaky')
+
+        assert response.status_code == 200
+        assert len(stub.requests) == 3
+
+    def test_post_is_not_resent_once_it_may_have_arrived(self, stub):
+        stub.then(('status', 503))
+        assert make_session().post(f'{stub.url}/pay', json={}).status_code == 503
+
+        stub.then(('drop',))
+        with pytest.raises(requests.ConnectionError):
+            make_session().post(f'{stub.url}/pay', json={})
+        assert len(stub.requests) == 2
+
+    def test_post_is_retried_when_it_never_connected(self, shared_cache):
+        client = make_session(retries=2, failure_threshold=10)
+        with pytest.raises(requests.ConnectionError):
+            client.post(f'http://127.0.0.1:{closed_port()}/pay', json={})
+        assert get_counters(['http:test:retry'])['http:test:retry'] == 2
+
+    def test_client_errors_are_returned_without_retrying(self, stub):
+        stub.then(('status', 404))
+        assert make_session().get(f'{stub.url}/missing').status_code == 404
+        assert len(stub.requests) == 1
+
+
+class TestAsyncUpstreamClient:
+    @pytest.fixture(autouse=True)
+    def upstream(self, monkeypatch):
+        def configure(**options):
+            defaults = {'connect_timeout': 1, 'read_timeout': 1, 'backoff': 0.01, 'backoff_cap': 0.02}
+            defaults.update(options)
+            monkeypatch.setitem(http_client.UPSTREAMS, 'test', Upstream('test', **defaults))
+        configure()
+        return configure
+
+    def call(self, method, url, **kwargs):
+        # Each call on a fresh loop, as async views get under WSGI and in tests
+        return asyncio.run(http_client.arequest('test', method, url, **kwargs))
+
+    def test_connections_are_kept_alive_across_loops(self, stub):
+        for _ in range(5):
+            assert self.call('GET', f'{stub.url}/ping').json() == {'ok': True}
+        assert stub.connections == 1
+
+    def test_query_string_matches_the_sync_client(self, stub):
+        params = {'url': 'https://example.com/a b?x=1', 'extract': {'name': 'h1'}}
+        self.call('GET', f'{stub.url}/scrape', params=params)
+        http_client.session('test').get(f'{stub.url}/scrape', params=params)
+        assert stub.requests[0] == stub.requests[1]
+
+    def test_read_timeout_is_retried_then_raised(self, stub, upstream):
+        upstream(read_timeout=0.2, retries=1)
+        stub.then(('delay', 1), ('delay', 1))
+
+        started = time.monotonic()
+        with pytest.raises(requests.ReadTimeout):
+            self.call('GET', f'{stub.url}/slow')
+        assert time.monotonic() - started < 1
+        assert len(stub.requests) == 2
+
+    def test_post_is_not_resent_once_it_may_have_arrived(self, stub):
+        stub.then(('drop',))
+        with pytest.raises(requests.ConnectionError):
+            self.call('POST', f'{stub.url}/pay', json={})
+        assert len(stub.requests) == 1
+
+    def test_post_is_retried_when_it_never_connected(self, stub, shared_cache):
+        with pytest.raises(ConnectFailed):
+            self.call('POST', f'http://127.0.0.1:{closed_port()}/pay', json={})
+        assert get_counters(['http:test:retry'])['http:test:retry'] == 2
+
+    def test_breaker_is_shared_with_the_sync_client(self, stub, upstream):
+        upstream(retries=0, failure_threshold=2, reset_timeout=60)
+        stub.then(('status', 500), ('status', 500))
+        assert self.call('GET', f'{stub.url}/down').status_code == 500
+        assert http_client.get('test', f'{stub.url}/down').status_code == 500
+        with pytest.raises(CircuitOpenError):
+            self.call('GET', f'{stub.url}/down')
+
+    def test_calls_wait_concurrently(self, stub):
+        stub.then(*[('delay', 0.3)] * 10)
+
+        async def burst():
+            return await asyncio.gather(*(http_client.aget('test', f'{stub.url}/slow') for _ in range(10)))
+
+        started = time.monotonic()
+        responses = asyncio.run(burst())
+        assert [response.status_code for response in responses] == [200] * 10
+        assert time.monotonic() - started < 1.5
+
+
+class TestCircuitBreaker:
+    def test_breaker_opens_and_fails_fast(self, stub):
+        stub.then(*[('status', 500)] * 3)
+        client = make_session(retries=0, failure_threshold=3, reset_timeout=60)
+        for _ in range(3):
+            assert client.get(f'{stub.url}/down').status_code == 500
+
+        with pytest.raises(CircuitOpenError):
+            client.get(f'{stub.url}/down')
+        assert len(stub.requests) == 3
+
+    def test_probe_after_reset_timeout_closes_the_breaker(self, stub):
+        stub.then(('status', 500), ('status', 500))
+        client = make_session(retries=0, failure_threshold=2, reset_timeout=0.1)
+        client.get(f'{stub.url}/down')
+        client.get(f'{stub.url}/down')
+        assert http_client.get_breaker(client.upstream).state == CircuitBreaker.OPEN
+
+        time.sleep(0.15)
+        assert client.get(f'{stub.url}/up').status_code == 200
+        assert http_client.get_breaker(client.upstream).state == CircuitBreaker.CLOSED
+
+    def test_failed_probe_reopens_the_breaker(self):
+        now = [0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+        now[0] = 10
+        assert breaker.allow()
+        assert not breaker.allow()  # only one probe at a time
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_breakers_can_be_per_host(self, stub):
+        stub.then(('status', 500))
+        client = make_session(retries=0, failure_threshold=1, reset_timeout=60, breaker_per_host=True)
+        client.get(f'{stub.url}/image.jpg')
+        with pytest.raises(CircuitOpenError):
+            client.get(f'{stub.url}/image.jpg')
+
+        other_host = stub.url.replace('127.0.0.1', 'localhost')
+        assert client.get(f'{other_host}/image.jpg').status_code == 200
+
+
+def test_upstream_stats(stub, monkeypatch):
+    monkeypatch.setitem(http_client.UPSTREAMS, 'firecrawl', Upstream('firecrawl', backoff=0.01))
+    stub.then(('status', 503))
+    http_client.get('firecrawl', f'{stub.url}/scrape')
+    http_client.get('firecrawl', f'{stub.url}/scrape')
+
+    stats = http_client.upstream_stats()['firecrawl']
+    assert stats['ok'] == 2
+    assert stats['server_error'] == 1
+    assert stats['retry'] == 1
+    assert stats['latency_ms']['count'] == 3
+    assert sum(stats['latency_ms']['buckets'].values()) == 3
+    assert stats['latency_ms']['p50'] in http_client.LATENCY_BUCKETS_MS
+    assert stats['circuits'] == {'firecrawl': 'closed'}
+
+
+def test_mpesa_token_fetch_survives_a_gateway_error(daraja):
+    daraja.fail_next('/oauth/v1/generate', 503, {'errorMessage': 'Service unavailable'})
+    assert mpesa.generate_access_token() == 'token-1'
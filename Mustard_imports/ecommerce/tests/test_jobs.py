@@ -0,0 +1,179 @@
+"""
+Tests for the database-backed background job queue.
+"""
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from ecommerce.api import jobs
+from ecommerce.api.jobs import JobProgress, RetryJob, enqueue, job, run_pending
+from ecommerce.models import Job
+
+calls = []
+failures = []
+
+
+@job('tests.record')
+def record(current):
+    calls.append(current.payload)
+    current.result = {'seen': len(calls)}
+
+
+@job('tests.flaky', max_attempts=2, on_failure=lambda failed, exc: failures.append((failed.id, str(exc))))
+def flaky(current):
+    raise RuntimeError('upstream down')
+
+
+@job('tests.later')
+def later(current):
+    raise RetryJob('not yet', delay=120)
+
+
+def expire_lease(current):
+    """Age the job's lease past LEASE_TIMEOUT, as a worker stalled that long would."""
+    Job.objects.filter(pk=current.pk).update(locked_at=timezone.now() - timedelta(seconds=jobs.LEASE_TIMEOUT + 1))
+
+
+def take_over(current):
+    """What the next run_jobs pass and another worker do to a job whose lease expired."""
+    expire_lease(current)
+    jobs.requeue_orphans()
+    jobs.claim(current.pk, 'worker-b')
+
+
+@job('tests.long')
+def long_running(current):
+    progress = JobProgress(current, steps=0)
+    expire_lease(current)
+    progress.update(force=True, steps=1)  # renews the lease
+    calls.append(jobs.requeue_orphans())
+    take_over(current)
+    progress.update(force=True, steps=2)
+    calls.append('carried on')
+
+
+@job('tests.stalled', max_attempts=2)
+def stalled(current):
+    take_over(current)
+    if current.payload.get('fail'):
+        raise RuntimeError('gave up')
+    current.result = {'finished': True}
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+    failures.clear()
+
+
+def make_due(queued):
+    Job.objects.filter(pk=queued.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+
+
+@pytest.mark.django_db
+class TestJobs:
+    def test_enqueued_jobs_run(self):
+        queued = enqueue('tests.record', {'order_id': 7})
+        assert run_pending() == 1
+
+        queued.refresh_from_db()
+        assert calls == [{'order_id': 7}]
+        assert queued.status == 'done'
+        assert queued.attempts == 1
+        assert queued.result == {'seen': 1}
+        assert run_pending() == 0
+
+    def test_jobs_start_after_the_transaction_commits(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks() as callbacks:
+            enqueue('tests.record')
+        assert len(callbacks) == 1
+
+    def test_active_job_with_the_same_key_is_reused(self):
+        first = enqueue('tests.record', key='payment:1')
+        assert enqueue('tests.record', key='payment:1').id == first.id
+
+        run_pending()
+        assert enqueue('tests.record', key='payment:1').id != first.id
+
+    def test_failures_are_retried_with_backoff_then_failed(self):
+        queued = enqueue('tests.flaky')
+        run_pending()
+
+        queued.refresh_from_db()
+        assert queued.status == 'queued'
+        assert queued.run_after > timezone.now()
+        assert 'upstream down' in queued.last_error
+        assert run_pending() == 0  # not due yet
+
+        make_due(queued)
+        run_pending()
+        queued.refresh_from_db()
+        assert queued.status == 'failed'
+        assert queued.attempts == 2
+        assert failures == [(queued.id, 'upstream down')]
+
+    def test_retry_job_sets_the_delay(self):
+        queued = enqueue('tests.later')
+        run_pending()
+        queued.refresh_from_db()
+        assert queued.status == 'queued'
+        assert timedelta(seconds=110) < queued.run_after - timezone.now() <= timedelta(seconds=120)
+
+    def test_a_job_is_claimed_once(self):
+        queued = enqueue('tests.record')
+        assert jobs.claim(queued.id, 'worker-a')
+        assert not jobs.claim(queued.id, 'worker-b')
+        assert not jobs.run_job(queued.id, 'worker-b')
+        assert calls == []
+
+    def test_orphaned_jobs_are_requeued(self):
+        queued = enqueue('tests.record')
+        jobs.claim(queued.id, 'dead-worker')
+        Job.objects.filter(pk=queued.pk).update(locked_at=timezone.now() - timedelta(seconds=jobs.LEASE_TIMEOUT + 1))
+
+        assert run_pending() == 1
+        assert calls == [{}]
+
+    def test_progress_renews_the_lease_and_a_lost_lease_stops_the_job(self):
+        queued = enqueue('tests.long')
+        assert run_pending() == 1
+        assert calls == [0]  # not requeued while it reports progress
+
+        queued.refresh_from_db()
+        assert (queued.status, queued.locked_by, queued.result) == ('running', 'worker-b', {'steps': 1})
+        assert jobs.job_stats()['tests.long']['done'] == 0
+
+    @pytest.mark.parametrize('payload', [{}, {'fail': True}])
+    def test_a_job_that_lost_its_lease_leaves_the_row_alone(self, payload):
+        queued = enqueue('tests.stalled', payload)
+        run_pending()
+        queued.refresh_from_db()
+        assert (queued.status, queued.locked_by, queued.result, queued.last_error) == ('running', 'worker-b', {}, '')
+
+    def test_unknown_jobs_fail(self):
+        orphan = Job.objects.create(name='tests.missing')
+        run_pending()
+        orphan.refresh_from_db()
+        assert orphan.status == 'failed'
+        assert 'No handler registered' in orphan.last_error
+
+    def test_run_jobs_command(self):
+        for i in range(3):
+            enqueue('tests.record', {'i': i})
+        out = StringIO()
+        call_command('run_jobs', '--once', '--batch', '2', stdout=out)
+        assert 'Ran 3 jobs' in out.getvalue()
+        assert len(calls) == 3
+
+    def test_stats(self):
+        enqueue('tests.record')
+        enqueue('tests.flaky')
+        enqueue('tests.record')
+        run_pending(limit=2)
+
+        stats = jobs.job_stats()
+        assert stats['tests.record'] == {'queued': 1, 'running': 0, 'done': 1, 'retry': 0, 'failed': 0}
+        assert stats['tests.flaky']['retry'] == 1
@@ -0,0 +1,139 @@
+"""
+Tests for the email outbox: queueing off the request path, batched delivery
+over one connection, retries and dead-lettering.
+"""
+import smtplib
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ecommerce.api import mailer
+from ecommerce.api.jobs import run_pending
+from ecommerce.api.mailer import drain_outbox, email_stats, queue_email
+from ecommerce.models import Job, OutboundEmail
+
+
+class CountingBackend(EmailBackend):
+    """locmem backend that counts connections and rejects some recipients."""
+    opened = 0
+    reject = set()
+
+    def open(self):
+        if not getattr(self, '_open', False):
+            self._open = True
+            CountingBackend.opened += 1
+        return True
+
+    def close(self):
+        self._open = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & CountingBackend.reject:
+                raise smtplib.SMTPRecipientsRefused({address: (550, b'No such user') for address in message.to})
+        return super().send_messages(messages)
+
+
+@pytest.fixture
+def backend(settings):
+    settings.EMAIL_BACKEND = 'ecommerce.tests.test_mailer.CountingBackend'
+    CountingBackend.opened = 0
+    CountingBackend.reject = set()
+    return CountingBackend
+
+
+@pytest.mark.django_db
+class TestOutbox:
+    def test_request_path_only_queues(self, user):
+        response = APIClient().post(reverse('forgot-password'), {'email': user.email})
+        assert response.status_code == 200
+        assert [m.subject for m in mail.outbox] == []
+        queued = OutboundEmail.objects.get(subject='Password Reset')
+        assert queued.status == 'queued'
+        assert Job.objects.filter(name='email.send', status='queued').count() == 1
+
+        run_pending()
+        assert [m.subject for m in mail.outbox] == ['Welcome', 'Password Reset']
+        queued.refresh_from_db()
+        assert queued.status == 'sent'
+        assert queued.sent_at is not None
+
+    def test_one_connection_per_batch(self, backend, db):
+        for n in range(7):
+            queue_email('Hello', 'Body', [f'user{n}@example.com'])
+        assert Job.objects.filter(name='email.send').count() == 1
+
+        outcomes = drain_outbox(limit=5)
+        assert outcomes == {'sent': 7}
+        assert len(mail.outbox) == 7
+        assert backend.opened == 2
+
+    def test_template_is_rendered_when_sent_and_compiled_once(self, backend, db, monkeypatch):
+        compiled = []
+        get_template = mailer.get_template
+        monkeypatch.setattr(mailer, 'get_template', lambda name: compiled.append(name) or get_template(name))
+        mailer._template.cache_clear()
+
+        for n in range(3):
+            queue_email(
+                'Shipped', 'Your order has arrived.', ['buyer@example.com'], template='shipped_email.html',
+                context={'user_name': 'Buyer', 'order_number': f'MI{n}', 'delivery_location': 'Nairobi',
+                         'site_url': 'https://example.com', 'year': 2025},
+            )
+        drain_outbox()
+        html, mimetype = mail.outbox[2].alternatives[0]
+        assert mimetype == 'text/html'
+        assert 'MI2' in html
+        assert compiled == ['shipped_email.html']
+
+    def test_failures_retry_then_dead_letter(self, backend, db):
+        backend.reject = {'bounce@example.com'}
+        bad = queue_email('Hello', 'Body', ['bounce@example.com'], max_attempts=2)
+        good = queue_email('Hello', 'Body', ['ok@example.com'])
+
+        assert drain_outbox() == {'retry': 1, 'sent': 1}
+        bad.refresh_from_db()
+        assert bad.status == 'queued'
+        assert bad.send_after > timezone.now()
+        assert 'No such user' in bad.last_error
+        assert drain_outbox() == {}  # not due yet
+
+        OutboundEmail.objects.filter(pk=bad.pk).update(send_after=timezone.now())
+        assert drain_outbox() == {'dead': 1}
+        bad.refresh_from_db()
+        assert (bad.status, bad.attempts) == ('dead', 2)
+        assert OutboundEmail.objects.get(pk=good.pk).status == 'sent'
+        # The failed message doesn't stop the rest of its batch from sharing the connection
+        assert [m.to for m in mail.outbox] == [['ok@example.com']]
+
+        stats = email_stats()
+        assert (stats['sent'], stats['retry'], stats['dead']) == (1, 1, 1)
+        assert stats['outbox']['dead'] == 1
+
+    def test_drain_job_schedules_the_next_retry(self, backend, db):
+        backend.reject = {'bounce@example.com'}
+        queue_email('Hello', 'Body', ['bounce@example.com'])
+        run_pending()
+        retry_job = Job.objects.get(name='email.send', status='queued')
+        assert retry_job.run_after > timezone.now() + timedelta(seconds=mailer.RETRY_BASE_DELAY - 5)
+
+    def test_orphaned_messages_are_requeued(self, backend, db):
+        email = queue_email('Hello', 'Body', ['ok@example.com'])
+        OutboundEmail.objects.filter(pk=email.pk).update(
+            status='sending', locked_by='dead-worker',
+            locked_at=timezone.now() - timedelta(seconds=mailer.LEASE_TIMEOUT + 1),
+        )
+        assert drain_outbox() == {'sent': 1}
+
+    def test_command(self, backend, db):
+        queue_email('Hello', 'Body', ['ok@example.com'])
+        out = StringIO()
+        call_command('send_emails', stdout=out)
+        assert 'Processed 1 emails: 1 sent' in out.getvalue()
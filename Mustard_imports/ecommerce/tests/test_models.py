@@ -4,7 +4,8 @@ from django.contrib.auth import get_user_model
 from ecommerce.models import (
     Product, Inventory, Category, Order, OrderItem, User,
     Cart, CartItem, ShippingMethod, DeliveryLocation, OTP,
-    CompletedOrder, Payment, Attribute, AttributeValue, Supplier
+    CompletedOrder, Payment, Attribute, AttributeValue, Supplier,
+    ProductMOQStats
 )
 
 User = get_user_model()
@@ -690,3 +691,77 @@ class DeliveryLocationModelTests(TestCase):
 
         self.assertIn(active_method, active_methods)
         self.assertNotIn(inactive_method, active_methods)
+
+
+class ProductMOQStatsModelTests(TestCase):
+    """Test the incrementally maintained paid quantity per product"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Electronics", slug="electronics")
+        self.product = Product.objects.create(
+            name="Group Buy Product", price=Decimal("1000.00"), moq=100, category=self.category
+        )
+        self.other = Product.objects.create(
+            name="Other Product", price=Decimal("1000.00"), moq=100, category=self.category
+        )
+        self.user = User.objects.create_user(username="buyer", email="buyer@test.com", password="pass")
+
+    def stats(self, product):
+        stats = ProductMOQStats.objects.filter(product=product).first()
+        return (stats.paid_quantity, stats.paid_orders) if stats else (0, 0)
+
+    def test_payment_counts_existing_items_once(self):
+        """Flipping an order to paid adds its items; saving it again does not"""
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=10, price=self.product.price)
+        OrderItem.objects.create(order=order, product=self.product, quantity=5, price=self.product.price)
+        self.assertEqual(self.stats(self.product), (0, 0))
+
+        order.payment_status = 'paid'
+        order.save()
+        order.save()
+
+        self.assertEqual(self.stats(self.product), (15, 1))
+        self.assertEqual(self.product.current_moq_count(), 15)
+
+    def test_refund_and_cancellation_remove_the_order(self):
+        refunded = Order.objects.create(user=self.user, payment_status='paid')
+        OrderItem.objects.create(order=refunded, product=self.product, quantity=10, price=self.product.price)
+        cancelled = Order.objects.create(user=self.user, payment_status='paid')
+        OrderItem.objects.create(order=cancelled, product=self.product, quantity=20, price=self.product.price)
+        self.assertEqual(self.stats(self.product), (30, 2))
+
+        refunded.payment_status = 'refunded'
+        refunded.save()
+        cancelled.is_cancelled = True
+        cancelled.save()
+
+        self.assertEqual(self.stats(self.product), (0, 0))
+
+    def test_item_changes_on_paid_order(self):
+        order = Order.objects.create(user=self.user, payment_status='paid')
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=10, price=self.product.price)
+
+        item.quantity = 4
+        item.save()
+        self.assertEqual(self.stats(self.product), (4, 1))
+
+        item.product = self.other
+        item.save()
+        self.assertEqual(self.stats(self.product), (0, 0))
+        self.assertEqual(self.stats(self.other), (4, 1))
+
+        item.delete()
+        self.assertEqual(self.stats(self.other), (0, 0))
+
+    def test_rebuild_matches_incremental_totals(self):
+        for quantity, payment_status in ((10, 'paid'), (7, 'paid'), (50, 'pending')):
+            order = Order.objects.create(user=self.user, payment_status=payment_status)
+            OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price=self.product.price)
+        incremental = self.stats(self.product)
+        ProductMOQStats.objects.update(paid_quantity=999)
+
+        ProductMOQStats.rebuild()
+
+        self.assertEqual(self.stats(self.product), incremental)
+        self.assertEqual(incremental, (17, 2))
@@ -0,0 +1,132 @@
+"""
+Tests for the M-Pesa client and its shared OAuth token cache, against a local Daraja stub.
+"""
+import threading
+import time
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from ecommerce.api import mpesa
+from ecommerce.api.mpesa import MpesaTokenManager, token_stats
+
+
+class TestTokenManager:
+    def test_token_is_reused_across_calls_and_processes(self, daraja):
+        first = mpesa.token_manager.get_token()
+        assert mpesa.token_manager.get_token() == first
+        # A fresh manager stands in for another worker process
+        assert MpesaTokenManager().get_token() == first
+        assert daraja.token_requests == 1
+
+    def test_token_is_refreshed_before_it_expires(self, daraja):
+        manager = MpesaTokenManager()
+        first = manager.get_token()
+        entry = cache.get(manager.cache_key)
+        entry['refresh_at'] = time.time() - 1
+        cache.set(manager.cache_key, entry)
+        manager._entry = None
+
+        assert manager.get_token() != first
+        assert daraja.token_requests == 2
+
+    def test_short_lived_tokens_refresh_halfway(self, daraja):
+        daraja.expires_in = 60
+        manager = MpesaTokenManager()
+        manager.get_token()
+        entry = manager._entry
+        assert entry['refresh_at'] - (entry['expires_at'] - 60) == pytest.approx(30, abs=1)
+
+    def test_current_token_is_used_while_another_process_refreshes(self, daraja):
+        manager = MpesaTokenManager()
+        first = manager.get_token()
+        manager._entry['refresh_at'] = time.time() - 1
+        cache.set(manager.cache_key, manager._entry)
+        cache.add(manager.lock_key, 1)
+
+        assert manager.get_token() == first
+        assert daraja.token_requests == 1
+
+    def test_concurrent_callers_share_one_fetch(self, daraja):
+        daraja.token_delay = 0.2
+        manager = MpesaTokenManager()
+        tokens = []
+
+        def call():
+            tokens.append(manager.get_token())
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert tokens == ['token-1'] * 8
+        assert daraja.token_requests == 1
+
+    def test_fetch_error_is_raised_without_a_token(self, daraja):
+        daraja.fail_next('/oauth/v1/generate', 400, {'errorMessage': 'Invalid Authentication passed'})
+        with pytest.raises(Exception, match='Invalid Authentication passed'):
+            MpesaTokenManager().get_token()
+
+    def test_failed_refresh_keeps_the_current_token(self, daraja):
+        manager = MpesaTokenManager()
+        first = manager.get_token()
+        manager._entry['refresh_at'] = time.time() - 1
+        cache.set(manager.cache_key, manager._entry)
+        daraja.fail_next('/oauth/v1/generate', 500, {'errorMessage': 'Service unavailable'})
+
+        assert manager.get_token() == first
+
+    def test_stats(self, daraja):
+        mpesa.token_manager.get_token()
+        mpesa.token_manager.get_token()
+        mpesa.token_manager.get_token()
+
+        stats = token_stats()
+        assert stats['fetch'] == 1
+        assert stats['hit'] == 2
+        assert stats['hit_rate'] == pytest.approx(0.6667, abs=1e-4)
+        assert stats['fetch_latency']['count'] == 1
+
+
+class TestStkPush:
+    def test_stk_push_uses_the_cached_token(self, daraja):
+        for order_id in (1, 2, 3):
+            response = mpesa.send_stk_push('254712345678', '150.00', order_id)
+            assert response['ResponseCode'] == '0'
+
+        assert daraja.token_requests == 1
+        path, body = daraja.requests[0]
+        assert path == '/mpesa/stkpush/v1/processrequest'
+        assert body['Amount'] == '150'
+        assert body['AccountReference'] == 'Order-1'
+
+    def test_rejected_token_is_fetched_again_once(self, daraja):
+        mpesa.send_stk_push('254712345678', 100, 1)
+        daraja.revoke_tokens()
+
+        response = mpesa.query_stk_push('ws_CO_1')
+
+        assert response['ResultCode'] == '0'
+        assert daraja.token_requests == 2
+
+    def test_invalid_amount(self, daraja):
+        with pytest.raises(ValueError):
+            mpesa.send_stk_push('254712345678', 0, 1)
+        assert daraja.token_requests == 0
+
+
+@pytest.mark.django_db
+def test_admin_token_stats_endpoint(daraja, admin_user):
+    mpesa.token_manager.get_token()
+    client = APIClient()
+    client.force_authenticate(user=admin_user)
+
+    response = client.get(reverse('mpesa_token_stats'))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['fetch'] == 1
@@ -0,0 +1,142 @@
+"""
+Tests for delivery status transitions: previous state capture for single
+and bulk updates, one notification job per operation, and batched shipped
+emails.
+"""
+import itertools
+from decimal import Decimal
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ecommerce.api import mailer
+from ecommerce.api.jobs import run_job
+from ecommerce.api.order_events import bulk_set_delivery_status
+from ecommerce.models import Job, Order, OrderItem, OutboundEmail
+
+
+@pytest.fixture
+def make_orders(user_factory, product_factory):
+    product = product_factory()
+    buyers = itertools.count()
+
+    def make(count, delivery_status='processing'):
+        orders = []
+        for _ in range(count):
+            n = next(buyers)
+            buyer = user_factory(username=f'buyer{n}', email=f'buyer{n}@example.com', first_name='Amina')
+            order = Order.objects.create(user=buyer, payment_status='paid', delivery_status=delivery_status)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=Decimal('100.00'))
+            orders.append(order)
+        return orders
+    return make
+
+
+def run_status_jobs():
+    """Run the notification jobs only, leaving the queued emails unsent."""
+    for job_id in Job.objects.filter(name='orders.status_changed', status='queued').values_list('id', flat=True):
+        run_job(job_id)
+
+
+def shipped_emails():
+    return OutboundEmail.objects.filter(subject__endswith='Has Arrived')
+
+
+@pytest.mark.django_db
+class TestStatusTransitions:
+    def test_save_sees_the_previous_status(self, make_orders):
+        order, = make_orders(1)
+        order.delivery_status = 'shipped'
+        order.save()
+        job = Job.objects.get(name='orders.status_changed')
+        assert job.payload == {'transitions': [[order.id, 'processing', 'shipped']]}
+
+        order.save()  # still shipped: no new transition
+        assert Job.objects.filter(name='orders.status_changed').count() == 1
+
+        run_status_jobs()
+        email = shipped_emails().get()
+        assert email.to == [order.user.email]
+        assert f'Order #{order.order_number}' in email.html_body
+        assert 'Dear Amina,' in email.html_body
+
+    def test_unnotified_statuses_enqueue_nothing(self, make_orders):
+        order, = make_orders(1)
+        order.delivery_status = 'delivered'
+        order.save()
+        assert not Job.objects.filter(name='orders.status_changed').exists()
+
+    def test_rolled_back_update_notifies_nobody(self, make_orders):
+        orders = make_orders(2)
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                bulk_set_delivery_status([order.id for order in orders], 'shipped')
+                raise RuntimeError
+        assert not Job.objects.filter(name='orders.status_changed').exists()
+        assert set(Order.objects.values_list('delivery_status', flat=True)) == {'processing'}
+
+    def test_single_update_endpoint(self, admin_client, make_orders):
+        order, = make_orders(1)
+        url = reverse('update_single_order_status', kwargs={'order_id': order.id})
+        assert admin_client.post(url, {'delivery_status': 'shipped'}).status_code == 200
+        run_status_jobs()
+        assert shipped_emails().count() == 1
+
+
+@pytest.mark.django_db
+class TestBulkShipping:
+    def bulk_ship(self, client, orders):
+        return client.post(
+            reverse('bulk_update_order_status'),
+            {'order_ids': [order.id for order in orders], 'delivery_status': 'shipped'}, format='json',
+        )
+
+    def test_one_job_and_one_email_per_changed_order(self, admin_client, make_orders):
+        already_shipped = make_orders(3, delivery_status='shipped')
+        orders = make_orders(20) + already_shipped
+
+        response = self.bulk_ship(admin_client, orders)
+        assert response.status_code == 200
+        assert response.data['message'] == 'Successfully updated 23 orders to shipped'
+        assert len(response.data['orders']) == 23
+
+        job = Job.objects.get(name='orders.status_changed')
+        assert len(job.payload['transitions']) == 20
+        run_status_jobs()
+        emails = shipped_emails()
+        assert emails.count() == 20
+        assert {tuple(email.to) for email in emails} == {(order.user.email,) for order in orders[:20]}
+        assert all(email.html_body and not email.template for email in emails)
+
+    def test_template_rendered_once_per_shape(self, admin_client, make_orders, monkeypatch):
+        rendered = []
+        template = mailer._template('shipped_email.html')
+        render = template.render
+        monkeypatch.setattr(template, 'render', lambda context: rendered.append(1) or render(context))
+
+        orders = make_orders(10)
+        bodies = mailer.render_many('shipped_email.html', [
+            {'user_name': f'<b>{n}</b>', 'order_number': f'MI{n}', 'delivery_location': 'N/A',
+             'site_url': 'https://example.com', 'year': 2025}
+            for n in range(10)
+        ], fields=('user_name', 'order_number', 'delivery_location'))
+        assert len(rendered) == 1
+        assert 'Dear &lt;b&gt;7&lt;/b&gt;,' in bodies[7]
+        assert 'Order #MI7' in bodies[7]
+
+        self.bulk_ship(admin_client, orders)
+        run_status_jobs()
+        assert len(rendered) == 2
+
+    def test_query_count_is_independent_of_batch_size(self, admin_client, make_orders):
+        def queries_to_ship(count):
+            orders = make_orders(count)
+            with CaptureQueriesContext(connection) as request_queries:
+                self.bulk_ship(admin_client, orders)
+            with CaptureQueriesContext(connection) as job_queries:
+                run_status_jobs()
+            return len(request_queries), len(job_queries)
+
+        assert queries_to_ship(5) == queries_to_ship(40)
@@ -0,0 +1,141 @@
+"""
+Tests for keyset (cursor) pagination and the endpoints that offer it.
+"""
+from datetime import timedelta
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from ecommerce.api.pagination import InvalidCursor, KeysetPagination
+from ecommerce.api.search import SQLiteSearchBackend
+from ecommerce.models import CustomerReview, Order, Product
+
+
+@pytest.fixture
+def products(product_factory):
+    """Seven products, newest first; the middle three share a created_at."""
+    now = timezone.now()
+    created = [product_factory(name=f'Product {i}', slug=f'product-{i}') for i in range(7)]
+    for i, product in enumerate(created):
+        stamp = now - timedelta(minutes=3) if 2 <= i <= 4 else now - timedelta(minutes=i)
+        Product.objects.filter(pk=product.pk).update(created_at=stamp)
+    return list(Product.objects.order_by('-created_at', '-id'))
+
+
+def walk(paginator, queryset, page_size):
+    """Ids of every page, following next_cursor from the first page."""
+    pages, cursor = [], None
+    while True:
+        rows = paginator.paginate(queryset, cursor, page_size)
+        pages.append([row.id for row in rows])
+        cursor = paginator.next_cursor
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    def test_pages_follow_the_ordering_across_ties(self, products):
+        pages = walk(KeysetPagination(), Product.objects.all(), 2)
+        assert [product_id for page in pages for product_id in page] == [product.id for product in products]
+        assert [len(page) for page in pages] == [2, 2, 2, 1]
+
+    def test_previous_cursor_returns_the_page_before(self, products):
+        paginator = KeysetPagination()
+        first = [row.id for row in paginator.paginate(Product.objects.all(), None, 3)]
+        assert paginator.previous_cursor is None
+
+        second = [row.id for row in paginator.paginate(Product.objects.all(), paginator.next_cursor, 3)]
+        assert second == [product.id for product in products[3:6]]
+
+        back = [row.id for row in paginator.paginate(Product.objects.all(), paginator.previous_cursor, 3)]
+        assert back == first
+        assert paginator.previous_cursor is None
+        assert paginator.next_cursor is not None
+
+    def test_other_orderings(self, products):
+        pages = walk(KeysetPagination(ordering=('name', 'id')), Product.objects.all(), 3)
+        assert [product_id for page in pages for product_id in page] == [
+            product.id for product in sorted(products, key=lambda product: product.name)
+        ]
+
+    def test_counts_are_only_computed_on_request(self, products):
+        paginator = KeysetPagination()
+        paginator.paginate(Product.objects.all(), None, 2)
+        assert 'total' not in paginator.get_page_info()
+
+        paginator.paginate(Product.objects.all(), None, 2, count='approx')
+        assert paginator.get_page_info()['total'] == len(products)
+
+    @pytest.mark.parametrize('cursor', ['garbage', 'W1siMjAyNCJdLDBd', 'WyJ4Il0'])
+    def test_invalid_cursors_are_rejected(self, cursor):
+        with pytest.raises(InvalidCursor):
+            KeysetPagination().paginate(Product.objects.all(), cursor, 2)
+
+
+@pytest.mark.django_db
+class TestCursorEndpoints:
+    def test_category_products(self, api_client, category, products):
+        url = reverse('category-products', kwargs={'category_slug': category.slug})
+        first = api_client.get(url, {'pagination': 'cursor', 'per_page': 4})
+
+        assert first.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in first.data['products']] == [product.id for product in products[:4]]
+        assert 'total' not in first.data
+
+        second = api_client.get(url, {'cursor': first.data['next_cursor'], 'per_page': 4, 'count': 'exact'})
+        assert [item['id'] for item in second.data['products']] == [product.id for product in products[4:]]
+        assert second.data['next_cursor'] is None
+        assert second.data['total'] == 7
+
+    def test_page_numbers_still_work(self, api_client, category, products):
+        url = reverse('category-products', kwargs={'category_slug': category.slug})
+        response = api_client.get(url, {'page': 2, 'per_page': 4})
+        assert len(response.data['products']) == 3
+        assert response.data['total'] == 7
+
+    def test_product_reviews(self, api_client, user_factory, product_factory):
+        product = product_factory(name='Reviewed', slug='reviewed')
+        reviews = [
+            CustomerReview.objects.create(
+                user=user_factory(username=f'reviewer{i}', email=f'r{i}@example.com'),
+                product=product, content='Good', rating=4,
+            )
+            for i in range(3)
+        ]
+        url = reverse('product-reviews', kwargs={'product_id': product.id})
+        response = api_client.get(url, {'pagination': 'cursor', 'per_page': 2})
+
+        assert [item['id'] for item in response.data['reviews']] == [reviews[2].id, reviews[1].id]
+        response = api_client.get(url, {'cursor': response.data['next_cursor'], 'per_page': 2})
+        assert [item['id'] for item in response.data['reviews']] == [reviews[0].id]
+
+    def test_admin_orders(self, api_client, admin_user, user):
+        orders = [Order.objects.create(user=user) for _ in range(3)]
+        api_client.force_authenticate(user=admin_user)
+
+        response = api_client.get(reverse('get_all_orders'), {'pagination': 'cursor', 'per_page': 2})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in response.data['results']] == [orders[2].id, orders[1].id]
+        assert response.data['previous_cursor'] is None
+
+    def test_search_with_an_explicit_ordering(self, api_client, products):
+        SQLiteSearchBackend().setup()
+        params = {'search': 'product', 'ordering': 'name', 'pagination': 'cursor', 'per_page': 5}
+        response = api_client.get(reverse('search'), params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['name'] for item in response.data['results']] == [f'Product {i}' for i in range(5)]
+        assert response.data['facets']['categories'][0]['count'] == 7
+
+    def test_search_by_relevance_is_rejected(self, api_client):
+        response = api_client.get(reverse('search'), {'search': 'product', 'pagination': 'cursor'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_invalid_cursor_is_rejected(self, api_client, category):
+        url = reverse('category-products', kwargs={'category_slug': category.slug})
+        response = api_client.get(url, {'cursor': 'garbage'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,409 @@
+"""
+Tests for background payment initiation, the local-state payment status
+endpoint with long polling, and the callback inbox, against the Daraja stub.
+"""
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from io import StringIO
+
+import pytest
+from django.core import mail
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from django.core.management import call_command
+
+from ecommerce.api import payments
+from ecommerce.api.jobs import run_pending
+from ecommerce.api.payments import reconcile_pending_payments, reconcile_stats
+from ecommerce.models import Job, Order, OrderItem, OutboundEmail, Payment, PaymentCallbackInbox, ProductMOQStats
+from ecommerce.tests.daraja_stub import PROCESSING
+
+
+@pytest.fixture
+def order(user, product_factory):
+    order = Order.objects.create(user=user)
+    OrderItem.objects.create(order=order, product=product_factory(), quantity=2, price=Decimal('250.00'))
+    order.update_total_price()
+    return order
+
+
+@pytest.fixture
+def client(user):
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+def initiate(client, order):
+    return client.post(reverse('process_payment'), {'order_id': order.id, 'phone_number': '0712345678'})
+
+
+def details(client, order, **params):
+    return client.get(reverse('get_payment_details', kwargs={'order_id': order.id}), params)
+
+
+def callback(checkout_request_id, result_code=0, receipt='QJ12345678'):
+    stk_callback = {
+        'MerchantRequestID': 'merchant-1',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+    }
+    if result_code == 0:
+        stk_callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': 500},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'PhoneNumber', 'Value': 254712345678},
+        ]}
+    return APIClient().post(reverse('mpesa-callback'), {'Body': {'stkCallback': stk_callback}}, format='json')
+
+
+@pytest.mark.django_db
+class TestPaymentInitiation:
+    def test_initiation_is_queued_and_returns_at_once(self, daraja, client, order):
+        response = initiate(client, order)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        assert daraja.token_requests == 0 and daraja.requests == []
+        payment = Payment.objects.get(order=order)
+        assert payment.payment_status == 'pending'
+        assert payment.mpesa_checkout_request_id is None
+        assert Job.objects.get(name='payments.initiate').key == f'payment:{order.id}'
+
+        run_pending()
+
+        payment.refresh_from_db()
+        assert payment.mpesa_checkout_request_id.startswith('ws_CO_')
+        path, body = daraja.requests[0]
+        assert body['Amount'] == '500' and body['PhoneNumber'] == '254712345678'
+        assert details(client, order).data['version'] > response.data['version']
+
+    def test_double_submit_sends_one_prompt(self, daraja, client, order):
+        initiate(client, order)
+        initiate(client, order)
+        run_pending()
+        assert len(daraja.requests) == 1
+
+    def test_rejected_stk_push_fails_the_payment(self, daraja, client, order):
+        daraja.fail_next('/mpesa/stkpush/v1/processrequest', 400, {'errorMessage': 'Invalid PhoneNumber'})
+        initiate(client, order)
+        run_pending()
+
+        data = details(client, order).data
+        assert data['payment_status'] == 'failed'
+        assert data['error_message'] == 'Invalid PhoneNumber'
+
+    def test_unreachable_daraja_is_retried_then_fails(self, daraja, client, order, monkeypatch):
+        monkeypatch.setattr('ecommerce.api.mpesa.MPESA_BASE_URL', 'http://127.0.0.1:9')
+        initiate(client, order)
+        job = Job.objects.get(name='payments.initiate')
+        for _ in range(job.max_attempts):
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            run_pending()
+
+        job.refresh_from_db()
+        assert job.status == 'failed'
+        payment = Payment.objects.get(order=order)
+        assert payment.payment_status == 'failed'
+        assert payment.error_message == 'Payment service unavailable, please try again'
+
+    def test_paid_order_is_rejected(self, daraja, client, order):
+        Order.objects.filter(pk=order.pk).update(payment_status='paid')
+        assert initiate(client, order).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestPaymentStatus:
+    @pytest.fixture
+    def pending(self, daraja, client, order):
+        initiate(client, order)
+        run_pending()
+        return Payment.objects.get(order=order)
+
+    def test_status_reads_local_state_only(self, daraja, client, order, pending):
+        for _ in range(5):
+            assert details(client, order).data['payment_status'] == 'pending'
+        assert [path for path, body in daraja.requests] == ['/mpesa/stkpush/v1/processrequest']
+
+    def test_callback_completes_the_payment_once(self, daraja, client, order, pending):
+        assert callback(pending.mpesa_checkout_request_id).status_code == status.HTTP_200_OK
+        assert callback(pending.mpesa_checkout_request_id).status_code == status.HTTP_200_OK
+        assert details(client, order).data['payment_status'] == 'pending'  # stored, not yet applied
+
+        run_pending()
+        run_pending()  # the confirmation email is enqueued by the callback job
+        data = details(client, order).data
+        assert data['payment_status'] == 'completed'
+        assert data['mpesa_receipt_number'] == 'QJ12345678'
+        order.refresh_from_db()
+        assert order.payment_status == 'paid'
+        confirmations = [m for m in mail.outbox if m.subject == f'Order Confirmation #{order.order_number}']
+        assert len(confirmations) == 1
+        assert confirmations[0].to == [order.user.email]
+
+        entry = PaymentCallbackInbox.objects.get(checkout_request_id=pending.mpesa_checkout_request_id)
+        assert (entry.deliveries, entry.outcome) == (2, 'completed')
+
+    def test_failed_callback_does_not_undo_a_completed_payment(self, daraja, client, order, pending):
+        callback(pending.mpesa_checkout_request_id)
+        run_pending()
+        callback(pending.mpesa_checkout_request_id, result_code=1032)
+        run_pending()
+        assert details(client, order).data['payment_status'] == 'completed'
+
+    def test_long_poll_returns_when_the_callback_lands(self, daraja, client, order, pending):
+        version = details(client, order).data['version']
+        # The callback's database writes can't be shared with another thread
+        # inside the test transaction, so apply them here and only signal later
+        Payment.objects.filter(pk=pending.pk).update(payment_status='completed')
+        threading.Timer(0.3, payments.notify_change, args=[order.id]).start()
+
+        started = time.monotonic()
+        data = details(client, order, version=version, wait=10).data
+        assert time.monotonic() - started < 2
+        assert data['payment_status'] == 'completed'
+        assert data['version'] == version + 1
+
+    def test_long_poll_times_out_unchanged(self, daraja, client, order, pending):
+        version = details(client, order).data['version']
+        started = time.monotonic()
+        data = details(client, order, version=version, wait=0.3).data
+        assert 0.25 < time.monotonic() - started < 2
+        assert data['version'] == version
+
+    def test_overdue_payment_is_queried_once_for_all_pollers(self, daraja, client, order, pending):
+        Payment.objects.filter(pk=pending.pk).update(
+            payment_date=timezone.now() - timedelta(seconds=payments.QUERY_AFTER + 1)
+        )
+        for _ in range(5):
+            details(client, order)
+        assert Job.objects.filter(name='payments.query_status').count() == 1
+
+        run_pending()
+        assert [path for path, body in daraja.requests].count('/mpesa/stkpushquery/v1/query') == 1
+        assert details(client, order).data['payment_status'] == 'completed'
+
+    def test_query_started_by_a_poll_confirms_and_a_late_callback_adds_the_receipt(self, daraja, client, order, pending):
+        Payment.objects.filter(pk=pending.pk).update(
+            payment_date=timezone.now() - timedelta(seconds=payments.QUERY_AFTER + 1)
+        )
+        details(client, order)
+        run_pending()
+        data = details(client, order).data
+        assert (data['payment_status'], data['mpesa_receipt_number']) == ('completed', None)
+        assert OutboundEmail.objects.filter(subject=f'Order Confirmation #{order.order_number}').count() == 1
+
+        callback(pending.mpesa_checkout_request_id)
+        run_pending()
+        assert details(client, order).data['mpesa_receipt_number'] == 'QJ12345678'
+        assert OutboundEmail.objects.filter(subject=f'Order Confirmation #{order.order_number}').count() == 1
+
+    def test_polls_are_rate_limited(self, daraja, client, order, pending):
+        codes = [details(client, order).status_code for _ in range(61)]
+        assert codes[-1] == status.HTTP_429_TOO_MANY_REQUESTS
+
+    def test_other_users_payment_is_not_found(self, daraja, order, pending, user_factory):
+        other = APIClient()
+        other.force_authenticate(user=user_factory(username='other', email='other@example.com'))
+        assert details(other, order).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestReconciliation:
+    @pytest.fixture
+    def make_payment(self, user):
+        def make(checkout_request_id, age=payments.RECONCILE_AFTER + 10):
+            order = Order.objects.create(user=user)
+            payment = Payment.objects.create(
+                order=order, phone_number='254712345678', amount=Decimal('100.00'),
+                mpesa_checkout_request_id=checkout_request_id,
+            )
+            Payment.objects.filter(pk=payment.pk).update(payment_date=timezone.now() - timedelta(seconds=age))
+            return payment
+        return make
+
+    def test_results_are_applied(self, daraja, make_payment):
+        paid = make_payment('ws_CO_paid')
+        cancelled = make_payment('ws_CO_cancelled')
+        waiting = make_payment('ws_CO_waiting')
+        fresh = make_payment('ws_CO_fresh', age=5)
+        daraja.query_results = {
+            'ws_CO_cancelled': {'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user'},
+            'ws_CO_waiting': PROCESSING,
+        }
+
+        outcomes = reconcile_pending_payments()
+
+        assert outcomes == {'reconciled': 1, 'failed': 1, 'pending': 1}
+        assert Payment.objects.get(pk=paid.pk).payment_status == 'completed'
+        assert Order.objects.get(pk=paid.order_id).payment_status == 'paid'
+        assert Payment.objects.get(pk=cancelled.pk).error_message == 'Request cancelled by user'
+        assert Payment.objects.get(pk=waiting.pk).payment_status == 'pending'
+        assert Payment.objects.get(pk=fresh.pk).payment_status == 'pending'
+        assert 'ws_CO_fresh' not in [body.get('CheckoutRequestID') for path, body in daraja.requests]
+
+    def test_late_callback_stores_the_receipt(self, daraja, make_payment):
+        payment = make_payment('ws_CO_paid')
+        assert reconcile_pending_payments() == {'reconciled': 1}
+        payment.refresh_from_db()
+        # The query result carries no receipt
+        assert (payment.payment_status, payment.mpesa_receipt_number) == ('completed', None)
+        assert OutboundEmail.objects.filter(subject__startswith='Order Confirmation').count() == 1
+
+        callback('ws_CO_paid', receipt='QJ00000001')
+        run_pending()
+        payment.refresh_from_db()
+        assert payment.mpesa_receipt_number == 'QJ00000001'
+        assert OutboundEmail.objects.filter(subject__startswith='Order Confirmation').count() == 1
+        assert PaymentCallbackInbox.objects.get().outcome == 'completed'
+
+    def test_in_progress_payments_back_off(self, daraja, make_payment):
+        waiting = make_payment('ws_CO_waiting')
+        daraja.query_results = {'ws_CO_waiting': PROCESSING}
+
+        reconcile_pending_payments()
+        assert reconcile_pending_payments() == {}
+
+        waiting.refresh_from_db()
+        assert waiting.status_checks == 1
+        first_delay = waiting.next_status_check - timezone.now()
+        assert timedelta(seconds=payments.RECONCILE_BACKOFF - 5) < first_delay <= timedelta(seconds=payments.RECONCILE_BACKOFF)
+
+        Payment.objects.filter(pk=waiting.pk).update(next_status_check=timezone.now())
+        reconcile_pending_payments()
+        waiting.refresh_from_db()
+        assert waiting.next_status_check - timezone.now() > timedelta(seconds=payments.RECONCILE_BACKOFF * 2 - 5)
+
+    def test_query_errors_back_off_without_failing(self, daraja, make_payment, monkeypatch):
+        payment = make_payment('ws_CO_1')
+        monkeypatch.setattr('ecommerce.api.mpesa.MPESA_BASE_URL', 'http://127.0.0.1:9')
+
+        assert reconcile_pending_payments() == {'error': 1}
+        payment.refresh_from_db()
+        assert payment.payment_status == 'pending'
+        assert payment.next_status_check is not None
+
+    def test_queries_run_concurrently_within_the_bound(self, daraja, make_payment):
+        for i in range(12):
+            make_payment(f'ws_CO_{i}')
+        payments.generate_access_token()  # warm the token cache so only the queries are timed
+        daraja.query_delay = 0.1
+
+        started = time.monotonic()
+        outcomes = reconcile_pending_payments(concurrency=4)
+
+        assert outcomes == {'reconciled': 12}
+        assert daraja.max_queries_in_flight <= 4
+        assert time.monotonic() - started < 12 * 0.1
+
+    def test_command_and_stats(self, daraja, make_payment):
+        for i in range(3):
+            make_payment(f'ws_CO_{i}')
+        daraja.query_results = {'ws_CO_2': PROCESSING}
+
+        out = StringIO()
+        call_command('reconcile_payments', '--limit', '2', stdout=out)
+
+        assert 'Checked 3 payments: 1 pending, 2 reconciled' in out.getvalue()
+        stats = reconcile_stats()
+        assert stats['reconciled'] == 2 and stats['pending'] == 1
+        assert stats['currently_pending'] == 1
+
+
+@pytest.mark.django_db
+class TestCallbackInbox:
+    @pytest.fixture
+    def make_pending(self, daraja, user, product_factory):
+        def make(n, quantity=2):
+            product = product_factory(moq=100, name=f'MOQ product {n}')
+            order = Order.objects.create(user=user)
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=Decimal('250.00'))
+            order.update_total_price()
+            return Payment.objects.create(
+                order=order, amount=order.total_price, phone_number='254712345678',
+                mpesa_checkout_request_id=f'ws_CO_inbox_{n}',
+            )
+        return make
+
+    def confirmations(self):
+        return [m for m in mail.outbox if m.subject.startswith('Order Confirmation')]
+
+    def test_acknowledges_without_doing_the_work(self, make_pending):
+        payment = make_pending(1)
+        started = time.monotonic()
+        response = callback(payment.mpesa_checkout_request_id)
+        assert time.monotonic() - started < 0.5
+        assert response.json() == {'ResultCode': 0, 'ResultDesc': 'Accepted'}
+        payment.refresh_from_db()
+        assert payment.payment_status == 'pending'
+        assert Job.objects.filter(name='payments.process_callback').count() == 1
+
+    def test_replayed_and_out_of_order_callbacks_apply_once(self, make_pending):
+        paid = [make_pending(n) for n in range(5)]
+        cancelled = [make_pending(n) for n in range(5, 10)]
+
+        # Daraja redelivers until it sees an answer, and a late failure may follow a success
+        for _ in range(10):
+            for payment in paid:
+                response = callback(payment.mpesa_checkout_request_id, receipt=f'QJ{payment.pk:08d}')
+                assert response.status_code == status.HTTP_200_OK
+            for payment in cancelled:
+                assert callback(payment.mpesa_checkout_request_id, result_code=1032).status_code == status.HTTP_200_OK
+        for payment in paid:
+            callback(payment.mpesa_checkout_request_id, result_code=1032)
+        run_pending()
+        for payment in paid:
+            callback(payment.mpesa_checkout_request_id, result_code=1032)
+            callback(payment.mpesa_checkout_request_id, receipt=f'QJ{payment.pk:08d}')
+        run_pending()
+        run_pending()
+
+        assert Job.objects.filter(name='payments.process_callback').count() == 10
+        for payment in paid:
+            payment.refresh_from_db()
+            assert payment.payment_status == 'completed'
+            assert payment.order.payment_status == 'paid'
+            assert ProductMOQStats.objects.get(product=payment.order.items.get().product).paid_quantity == 2
+        for payment in cancelled:
+            payment.refresh_from_db()
+            assert payment.payment_status == 'failed'
+        assert len(self.confirmations()) == 5
+
+        inbox = PaymentCallbackInbox.objects.all()
+        assert inbox.count() == 10
+        assert sorted(set(inbox.values_list('outcome', flat=True))) == ['completed', 'failed']
+        assert {entry.deliveries for entry in inbox if entry.outcome == 'completed'} == {13}
+        assert {entry.deliveries for entry in inbox if entry.outcome == 'failed'} == {10}
+
+    def test_callback_before_the_checkout_id_is_stored_is_retried(self, make_pending):
+        payment = make_pending(1)
+        Payment.objects.filter(pk=payment.pk).update(mpesa_checkout_request_id=None)
+        callback('ws_CO_inbox_1')
+        run_pending()
+        entry = PaymentCallbackInbox.objects.get()
+        assert entry.processed_at is None
+        assert Job.objects.get(name='payments.process_callback').status == 'queued'
+
+        # The initiation job stores the ID, then the retry applies the callback
+        Payment.objects.filter(pk=payment.pk).update(mpesa_checkout_request_id='ws_CO_inbox_1')
+        Job.objects.filter(name='payments.process_callback').update(run_after=timezone.now())
+        run_pending()
+        payment.refresh_from_db()
+        assert payment.payment_status == 'completed'
+        entry.refresh_from_db()
+        assert entry.outcome == 'completed'
+
+    def test_unmatched_callback_is_marked_after_the_last_attempt(self, make_pending):
+        callback('ws_CO_unknown')
+        callback_job = Job.objects.get(name='payments.process_callback')
+        for _ in range(callback_job.max_attempts):
+            Job.objects.filter(pk=callback_job.pk).update(run_after=timezone.now())
+            run_pending()
+        assert Job.objects.get(pk=callback_job.pk).status == 'failed'
+        assert PaymentCallbackInbox.objects.get().outcome == 'unmatched'
@@ -0,0 +1,195 @@
+"""
+Tests for the bulk product import job: row checks, chunked CSV and Excel
+reading, resuming after a failed attempt, the per-file attribute lookup,
+parallel image downloads against a local server and the progress endpoint.
+"""
+import csv
+import io
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from openpyxl import Workbook
+from rest_framework.test import APIClient
+
+from ecommerce.api import http_client, product_import
+from ecommerce.api.jobs import run_pending
+from ecommerce.models import AttributeValue, Inventory, Job, Product, ProductImage
+from ecommerce.tests.http_stub import FaultStub
+
+COLUMNS = [
+    'name', 'description', 'price', 'below_moq_price', 'moq', 'moq_status', 'is_pick_and_pay',
+    'inventory_quantity', 'category_id', 'attributes', 'image_urls',
+]
+
+
+@pytest.fixture(autouse=True)
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def images():
+    http_client.reset()
+    stub = FaultStub().start()
+    yield stub
+    http_client.reset()
+    stub.stop()
+
+
+def rows(count, category, **overrides):
+    return [
+        {
+            'name': f'Imported Mug {n}', 'description': 'Ceramic mug', 'price': '450.50', 'below_moq_price': '520',
+            'moq': '10', 'moq_status': 'active', 'is_pick_and_pay': 'false', 'inventory_quantity': '',
+            'category_id': str(category.id), 'attributes': f'color: red, blue; size: {n % 3}00ml', 'image_urls': '',
+            **overrides,
+        }
+        for n in range(count)
+    ]
+
+
+def csv_file(records, name='products.csv'):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(records)
+    return SimpleUploadedFile(name, out.getvalue().encode('utf-8'), content_type='text/csv')
+
+
+def xlsx_file(records, name='products.xlsx'):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(COLUMNS)
+    for record in records:
+        sheet.append([record[column] or None for column in COLUMNS])
+    out = io.BytesIO()
+    workbook.save(out)
+    return SimpleUploadedFile(name, out.getvalue())
+
+
+class TestRows:
+    def test_row_is_typed_and_checked(self):
+        row = product_import.product_row({
+            'name': ' Mug ', 'price': '450.50', 'category_id': '3', 'moq': '10.0',
+            'attributes': 'color: Red, Blue; size:M;junk', 'image_urls': 'https://a/1.jpg, https://a/2.jpg',
+        })
+        assert (row['name'], str(row['price']), row['category_id'], row['moq']) == ('Mug', '450.50', 3, 10)
+        assert row['attributes'] == [('Color', 'Red'), ('Color', 'Blue'), ('Size', 'M')]
+        assert row['images'] == ['https://a/1.jpg', 'https://a/2.jpg']
+        assert row['inventory_quantity'] is None
+
+    @pytest.mark.parametrize('record, field', [
+        ({'name': 'Mug', 'price': '', 'category_id': '3'}, None),
+        ({'name': 'Mug', 'price': 'cheap', 'category_id': '3'}, 'price'),
+        ({'name': 'Mug', 'price': '-1', 'category_id': '3'}, 'price'),
+        ({'name': 'Mug', 'price': '1', 'category_id': '3', 'moq': '0'}, 'moq'),
+        ({'name': 'Mug', 'price': '1', 'category_id': '3', 'moq_status': 'open'}, 'moq_status'),
+        ({'name': 'Mug', 'price': '1', 'category_id': '3', 'is_pick_and_pay': 'TRUE'}, 'inventory_quantity'),
+        ({'name': 'Mug', 'price': '1', 'category_id': '3', 'inventory_quantity': '5'}, 'inventory_quantity'),
+    ])
+    def test_invalid_rows(self, record, field):
+        with pytest.raises(ValueError) as raised:
+            product_import.product_row(record)
+        error = raised.value.args[0]
+        assert field in error if field else error.startswith('Missing required fields')
+
+    def test_pick_and_pay_row_has_no_moq(self):
+        row = product_import.product_row({
+            'name': 'Mug', 'price': '1', 'category_id': '3', 'is_pick_and_pay': True,
+            'inventory_quantity': 7, 'moq': '50', 'below_moq_price': '2',
+        })
+        assert (row['moq'], row['moq_status'], row['below_moq_price'], row['inventory_quantity']) == (1, 'not_applicable', None, 7)
+
+
+@pytest.mark.django_db
+class TestImportJob:
+    def start(self, client, file):
+        return client.post(reverse('bulk-import'), {'file': file}, format='multipart')
+
+    def test_csv_import_in_chunks(self, admin_client, category, monkeypatch, media):
+        monkeypatch.setattr(product_import, 'IMPORT_CHUNK_SIZE', 2)
+        records = rows(4, category)
+        records.insert(2, {**records[0], 'name': ''})
+        records.append({**records[0], 'name': 'Counter Mug', 'is_pick_and_pay': 'true', 'inventory_quantity': '12'})
+
+        response = self.start(admin_client, csv_file(records))
+        assert response.status_code == 202
+        assert response.data['status'] == 'queued'
+        run_pending()
+
+        progress = admin_client.get(response.data['progress_url']).data
+        assert progress['status'] == 'done'
+        assert (progress['stage'], progress['total'], progress['rows_done']) == ('done', 6, 6)
+        assert (progress['created'], progress['failed']) == (5, 1)
+        assert progress['errors'] == [{'row': 4, 'error': 'Missing required fields: name, price, or category_id'}]
+
+        products = Product.objects.filter(name__contains='Mug').order_by('id')
+        assert [product.slug for product in products][:2] == ['imported-mug-0', 'imported-mug-1']
+        assert sorted(products[1].attribute_values.values_list('value', flat=True)) == ['100ml', 'blue', 'red']
+        assert Inventory.objects.get(product__name='Counter Mug').quantity == 12
+        # The stored upload is removed once imported
+        assert not list((media / 'imports').iterdir())
+
+    def test_xlsx_import(self, admin_client, category):
+        response = self.start(admin_client, xlsx_file(rows(3, category)))
+        run_pending()
+        progress = admin_client.get(response.data['progress_url']).data
+        assert (progress['status'], progress['created'], progress['failed']) == ('done', 3, 0)
+        assert Product.objects.get(name='Imported Mug 2').price == 450.5
+
+    def test_retry_resumes_after_the_imported_rows(self, category):
+        import_job = product_import.start_import(csv_file(rows(5, category)))
+        Job.objects.filter(pk=import_job.pk).update(result={
+            'stage': 'importing', 'total': 5, 'rows_done': 3, 'created': 3, 'failed': 0, 'errors': [],
+            'pending_images': [], 'images': 0, 'failed_images': 0,
+        })
+
+        run_pending()
+        import_job.refresh_from_db()
+        assert import_job.status == 'done'
+        assert (import_job.result['rows_done'], import_job.result['created']) == (5, 5)
+        assert list(Product.objects.order_by('id').values_list('name', flat=True)) == ['Imported Mug 3', 'Imported Mug 4']
+
+    def test_query_count_is_independent_of_file_length(self, category, monkeypatch):
+        monkeypatch.setattr(product_import, 'IMPORT_CHUNK_SIZE', 100)
+
+        def queries_to_import(count):
+            # Names not taken yet, so both files allocate their slugs alike
+            records = [{**record, 'name': f'Batch {count} {record["name"]}'} for record in rows(count, category)]
+            product_import.start_import(csv_file(records))
+            with CaptureQueriesContext(connection) as queries:
+                run_pending()
+            return len(queries)
+
+        assert queries_to_import(3) == queries_to_import(30)
+        # Each (attribute, value) pair of the file was created once
+        assert AttributeValue.objects.filter(value__in=['red', 'blue', '000ml', '100ml', '200ml']).count() == 5
+
+    def test_images_are_downloaded_and_attached(self, admin_client, category, images):
+        records = rows(3, category, image_urls=f'{images.url}/mug-front.jpg?w=800, {images.url}/mug-back.jpg')
+        records[2]['image_urls'] = 'http://127.0.0.1:1/unreachable.jpg'
+
+        response = self.start(admin_client, csv_file(records))
+        run_pending()
+        progress = admin_client.get(response.data['progress_url']).data
+        assert (progress['images'], progress['failed_images']) == (4, 1)
+
+        assert ProductImage.objects.count() == 4
+        image = ProductImage.objects.filter(product__name='Imported Mug 0').order_by('id').first()
+        assert image.image.name.startswith('product_images/mug-front')
+        assert default_storage.exists(image.image.name)
+        assert sorted(path for _, path in images.requests) == sorted(['/mug-back.jpg', '/mug-front.jpg?w=800'] * 2)
+
+    def test_validation(self, admin_client, user):
+        assert admin_client.post(reverse('bulk-import'), {}, format='multipart').status_code == 400
+        assert self.start(admin_client, SimpleUploadedFile('products.pdf', b'%PDF')).status_code == 400
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        assert self.start(client, SimpleUploadedFile('products.csv', b'name\n')).status_code == 403
+        assert admin_client.get(reverse('bulk-import-progress', kwargs={'job_id': 999999})).status_code == 404
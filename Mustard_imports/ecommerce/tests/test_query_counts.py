@@ -0,0 +1,177 @@
+"""
+Query-count tests for the product listing endpoints and the cart.
+
+Every product on a page must come from the same batched queries, so the
+number of queries stays fixed however many products the page holds. The
+same goes for the items of a cart, whose totals are worked out in SQL.
+"""
+from decimal import Decimal
+
+import pytest
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecommerce.models import (
+    Attribute, AttributeValue, Cart, CartItem, Category, CategoryImage, CustomerReview,
+    Inventory, Order, OrderItem, ProductImage, Supplier
+)
+
+
+@pytest.fixture
+def catalog(db, category, product_factory, user):
+    """Builds ``count`` fully populated products in ``category``."""
+    CategoryImage.objects.create(category=category, image='category_images/electronics.jpg')
+    supplier = Supplier.objects.create(name='Acme', contact_email='acme@example.com')
+    color = Attribute.objects.create(name='Color')
+    values = [AttributeValue.objects.create(attribute=color, value=value) for value in ('Red', 'Blue')]
+    order = Order.objects.create(user=user, payment_status='paid')
+
+    def build(count, category=category):
+        products = []
+        for i in range(count):
+            product = product_factory(
+                name=f'Widget {category.slug} {i}', slug=f'widget-{category.slug}-{i}',
+                category=category, supplier=supplier, moq=10,
+            )
+            product.attribute_values.set(values)
+            ProductImage.objects.create(
+                product=product, image='product_images/widget.jpg', thumbnail='product_thumbnails/widget.jpg'
+            )
+            CustomerReview.objects.create(user=user, product=product, rating=4, content='Good')
+            OrderItem.objects.create(order=order, product=product, quantity=3, price=Decimal('1000.00'))
+            products.append(product)
+        pick_and_pay = product_factory(
+            name=f'Widget {category.slug} stocked', slug=f'widget-{category.slug}-stocked',
+            category=category, is_pick_and_pay=True,
+        )
+        Inventory.objects.create(product=pick_and_pay, quantity=5)
+        products.append(pick_and_pay)
+        return products
+
+    return build
+
+
+@pytest.mark.django_db
+class TestListingQueryCounts:
+    # (url name, url args, query params, expected queries)
+    #   search: index check, 2 facet queries, count, ranked ids, products,
+    #           then images, category images, attributes, reviews
+    #   listings send product cards: products + images
+    #   latest_products expanded to full products: products + 4 prefetches
+    #   CategoryProductsView: category, its images, count, products + images
+    #   HomeCategoriesView: count, categories, sliced products + images
+    endpoints = [
+        ('search', [], {'search': 'Widget', 'per_page': 20}, 10),
+        ('latest-products', [], {'limit': 20}, 2),
+        ('latest-products', [], {'limit': 20, 'expand': 'category,attributes,creviews'}, 5),
+        ('category-products', ['electronics'], {'per_page': 20}, 5),
+        ('home-categories', [], {}, 4),
+    ]
+
+    @pytest.mark.parametrize('name, args, params, expected', endpoints)
+    @pytest.mark.parametrize('size', [1, 5])
+    def test_query_count_does_not_grow_with_page_size(
+        self, api_client, catalog, django_assert_num_queries, name, args, params, expected, size
+    ):
+        catalog(size)
+        Category.objects.create(name='Garden', slug='garden')
+        catalog(size, category=Category.objects.get(slug='garden'))
+
+        with django_assert_num_queries(expected):
+            response = api_client.get(reverse(name, args=args), params)
+        assert response.status_code == 200
+
+    def test_listing_matches_per_product_values(self, api_client, catalog):
+        products = catalog(2)
+        params = {'limit': 20, 'expand': 'category,attributes,supplier,creviews'}
+        results = api_client.get(reverse('latest-products'), params).data['results']
+        by_slug = {item['slug']: item for item in results}
+
+        widget = by_slug[products[0].slug]
+        assert widget['moq_progress'] == {'current': 3, 'target': 10, 'percentage': 30}
+        assert widget['thumbnail'].endswith('product_thumbnails/widget.jpg')
+        assert widget['category']['primary_image'].endswith('category_images/electronics.jpg')
+        assert [value['value'] for value in widget['attributes'][0]['values']] == ['Blue', 'Red']
+        assert widget['supplier']['name'] == 'Acme'
+        assert widget['creviews'][0]['username'] == 'testuser'
+        assert by_slug[products[-1].slug]['inventory']['quantity'] == 5
+
+    def test_home_categories_keep_the_six_newest_products(self, api_client, catalog):
+        products = catalog(7)
+        home = api_client.get(reverse('home-categories')).data['results'][0]
+
+        assert len(home['products']) == 6
+        assert home['products'][0]['slug'] == products[-1].slug
+
+
+@pytest.mark.django_db
+class TestCartQueryCounts:
+    @pytest.fixture
+    def shopper(self, user, cart):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client
+
+    def fill(self, cart, catalog, shipping_method, size):
+        cart.shipping_method = shipping_method
+        cart.save()
+        *widgets, stocked = catalog(size)
+        for n, widget in enumerate(widgets):
+            widget.below_moq_price = Decimal('1200.00') if n % 2 else None
+            widget.moq_per_person = 3
+            widget.save()
+            # Every fourth at the per-person MOQ, the rest below it
+            CartItem.objects.create(cart=cart, product=widget, quantity=3 if n % 4 == 0 else 2)
+        CartItem.objects.create(cart=cart, product=stocked, quantity=2)
+
+    @pytest.mark.parametrize('size', [1, 5])
+    def test_query_count_does_not_grow_with_cart_size(
+        self, shopper, user, cart, catalog, shipping_method, django_assert_num_queries, size
+    ):
+        self.fill(cart, catalog, shipping_method, size)
+        # cart with totals and shipping method, items, products, images
+        with django_assert_num_queries(4):
+            response = shopper.get(reverse('get-user-cart', args=[user.id]))
+        assert response.status_code == 200
+        assert len(response.data['items']) == size + 1
+
+    def test_sql_totals_match_the_item_prices(self, shopper, user, cart, catalog, shipping_method):
+        self.fill(cart, catalog, shipping_method, 6)
+        data = shopper.get(reverse('get-user-cart', args=[user.id])).data
+
+        cart = Cart.objects.get(pk=cart.pk)
+        assert Decimal(data['subtotal']) == cart.subtotal == sum(item.line_total for item in cart.items.all())
+        assert (data['total_items'], Decimal(data['shipping_cost']), Decimal(data['total'])) \
+            == (7, Decimal('200.00'), cart.subtotal + Decimal('200.00'))
+        prices = {item['product']['slug']: Decimal(item['price_per_piece']) for item in data['items']}
+        assert prices['widget-electronics-stocked'] == Decimal('1000.00')
+        assert prices['widget-electronics-0'] == Decimal('1000.00')  # at the per-person MOQ
+        assert prices['widget-electronics-1'] == Decimal('1200.00')  # below it
+        assert prices['widget-electronics-2'] == Decimal('1000.00')  # below it, without a below-MOQ price
+        assert data['items'][-1]['product']['inventory']['quantity'] == 5
+
+    def test_pick_and_pay_only_cart_ships_free(self, user_factory, cart, shipping_method, pick_and_pay_product):
+        cart.shipping_method = shipping_method
+        cart.save()
+        CartItem.objects.create(cart=cart, product=pick_and_pay_product, quantity=3)
+        projected = Cart.objects.for_display().get(pk=cart.pk)
+        assert (projected.subtotal, projected.shipping_cost, projected.total) == (Decimal('1500.00'), 0, Decimal('1500.00'))
+        empty = Cart.objects.create(user=user_factory(username='empty', email='empty@example.com'))
+        empty = Cart.objects.for_display().get(pk=empty.pk)
+        assert (empty.total_items, empty.subtotal, empty.total) == (0, 0, 0)
+
+    def test_cart_mutations_refresh_the_cached_cart(self, shopper, user, cart, pick_and_pay_product):
+        url = reverse('get-user-cart', args=[user.id])
+        assert shopper.get(url).data['items'] == []
+
+        item = shopper.post(
+            reverse('add-item-to-cart', args=[cart.id]), {'productId': pick_and_pay_product.id, 'quantity': 2}, format='json'
+        ).data
+        assert item['product']['inventory']['quantity'] == 20 and item['is_pick_and_pay']
+        assert shopper.get(url).data['total_items'] == 1
+
+        shopper.post(reverse('update-cart-item-quantity', args=[item['id']]), {'cart_id': cart.id, 'quantity': 3}, format='json')
+        assert Decimal(shopper.get(url).data['subtotal']) == Decimal('1500.00')
+
+        assert shopper.post(reverse('create-order-from-cart', args=[cart.id])).status_code == 201
+        assert shopper.get(url).data['items'] == []
@@ -0,0 +1,223 @@
+"""
+Tests for the scraping pipeline: parsers on saved pages, the scrape job
+against a local Firecrawl stub, fetch concurrency and per-host rate limits,
+batched persistence and the progress endpoint.
+"""
+import asyncio
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecommerce.api import http_client, scraping
+from ecommerce.api.bulk_products import AttributeLookup, create_products
+from ecommerce.api.jobs import run_pending
+from ecommerce.models import Category, Job, Product, Supplier
+from ecommerce.tests.firecrawl_stub import FirecrawlStub, fixture
+
+CATEGORY_URL = 'https://www.alibaba.com/catalog/kitchen-storage.html'
+PRODUCT_URLS = [
+    'https://www.alibaba.com/product/1600912345678.html',
+    'https://www.alibaba.com/product/1600923456789.html',
+    'https://www.alibaba.com/product/1600934567890.html',
+    'https://www.alibaba.com/product/1600945678901.html',
+]
+
+
+@pytest.fixture
+def firecrawl(monkeypatch):
+    http_client.reset()
+    stub = FirecrawlStub().start()
+    monkeypatch.setattr(scraping, 'FIRECRAWL_SCRAPE_URL', stub.url)
+    # Fast enough for tests; TestFetch sets its own limits
+    monkeypatch.setattr(scraping, 'host_limiter', scraping.HostRateLimiter(1000))
+    yield stub
+    http_client.reset()
+    stub.stop()
+
+
+class TestParsers:
+    def test_alibaba_product(self):
+        product = scraping.parse_alibaba_product(fixture('alibaba_product.html'))
+        assert product['name'] == 'Glass Storage Jar With Bamboo Lid'
+        assert product['description'].startswith('Airtight borosilicate glass jar')
+        assert (product['price'], product['below_moq_price']) == (211, 440)  # USD x 1.35 markup, in KES
+        assert product['moq'] == 500
+        assert product['supplier_name'] == 'Zhejiang Homeware Co., Ltd.'
+        assert product['category'] == ('Alibaba', 'alibaba', 'Category for Alibaba')
+        assert product['attributes'] == [
+            ('capacity', '500ml'), ('capacity', '1000ml'), ('color', 'clear'), ('color', 'amber'),
+        ]
+        assert product['images'] == [
+            'https://s.alicdn.com/@sc04/kf/jar-main.jpg',
+            'https://s.alicdn.com/@sc04/kf/jar-side.jpg',
+            'https://s.alicdn.com/@sc04/kf/jar-lid.jpg',
+        ]
+
+    def test_shein_product(self):
+        product = scraping.parse_shein_product(fixture('shein_product.html'))
+        assert product['name'] == "Women's Ribbed Knit Cardigan"
+        assert (product['price'], product['below_moq_price']) == (2414, 2897)
+        assert product['moq'] == 1
+        assert product['attributes'] == [('size', 's'), ('size', 'm'), ('size', 'l'), ('color', 'beige')]
+        assert product['thumbnail'] == 'https://img.ltwebstatic.com/images3_pi/cardigan-main.jpg'
+
+    def test_page_without_a_product(self):
+        assert scraping.parse_alibaba_product(fixture('not_a_product.html')) is None
+        assert scraping.parse_shein_product(fixture('not_a_product.html')) is None
+
+    def test_category_links_are_absolute_and_unique(self):
+        assert scraping.parse_product_links(fixture('alibaba_category.html'), CATEGORY_URL) == PRODUCT_URLS
+
+
+class TestFetch:
+    def fetch(self, urls):
+        delivered = []
+        http_client.submit(scraping.fetch_pages(urls, delivered.append)).result()
+        return delivered
+
+    def test_fetches_are_concurrent_but_bounded(self, firecrawl):
+        firecrawl.delay = 0.2
+        urls = [f'https://shop{n}.example.com/product/{n}' for n in range(12)]
+        firecrawl.pages = {url: 'shein_product.html' for url in urls}
+
+        delivered = self.fetch(urls)
+        assert sorted(url for url, _, _ in delivered) == sorted(urls)
+        assert all(error is None for _, _, error in delivered)
+        assert 1 < firecrawl.max_in_flight <= scraping.SCRAPE_CONCURRENCY
+
+    def test_requests_to_one_host_are_rate_limited(self, firecrawl, monkeypatch):
+        # A stopped clock: every request arrives at once, and the limiter's
+        # sleeps are its schedule
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+            await asyncio.sleep(0)
+
+        monkeypatch.setattr(scraping, 'host_limiter', scraping.HostRateLimiter(10, clock=lambda: 100.0, sleep=sleep))
+        same_host = [f'https://www.shein.com/product/{n}' for n in range(4)]
+        other_host = ['https://m.shein.com/product/0']
+        firecrawl.pages = {url: 'shein_product.html' for url in same_host + other_host}
+
+        self.fetch(same_host + other_host)
+        assert len(firecrawl.requests) == 5
+        # One request goes at once and the others wait 0.1s more each; another
+        # host isn't held up behind them
+        assert sorted(sleeps) == pytest.approx([0.1, 0.2, 0.3])
+
+    def test_failed_pages_are_reported(self, firecrawl):
+        delivered = self.fetch(['https://www.shein.com/product/gone'])
+        assert delivered == [('https://www.shein.com/product/gone', None, 'Failed to load the page')]
+
+
+@pytest.mark.django_db
+class TestPersistence:
+    def rows(self, count, category):
+        return [
+            {
+                'name': f'Scraped Jar {n % 3}', 'description': 'Glass jar', 'price': 211, 'below_moq_price': 440,
+                'moq': 500, 'moq_per_person': 1, 'moq_status': 'not_applicable', 'category_id': category.id,
+                'supplier_name': f'Supplier {n % 2}',
+                'attributes': [('capacity', f'{n % 3}00ml'), ('color', 'clear')],
+            }
+            for n in range(count)
+        ]
+
+    def test_batch_is_saved_with_signals_equivalents(self, category):
+        created, errors = create_products(self.rows(4, category) + [{'name': '', 'category_id': category.id}])
+        assert len(created) == 4
+        assert errors[0][0] == 4 and 'name' in errors[0][1]
+
+        products = Product.objects.filter(pk__in=[product.id for product in created]).order_by('id')
+        assert [product.slug for product in products] == [
+            'scraped-jar-0', 'scraped-jar-1', 'scraped-jar-2', 'scraped-jar-0-1',
+        ]
+        assert Supplier.objects.filter(name__startswith='Supplier ').count() == 2
+        assert sorted(products[1].attribute_values.values_list('value', flat=True)) == ['100ml', 'clear']
+
+        created, _ = create_products(self.rows(1, category))
+        assert created[0].slug == 'scraped-jar-0-2'
+
+    def test_query_count_is_independent_of_batch_size(self, category):
+        def queries_to_save(count):
+            attributes = AttributeLookup()
+            create_products(self.rows(3, category), attributes)  # warm the lookups
+            with CaptureQueriesContext(connection) as queries:
+                create_products(self.rows(count, category), attributes)
+            return len(queries)
+
+        assert queries_to_save(3) == queries_to_save(30)
+
+    def test_unknown_category_is_rejected(self, category):
+        created, errors = create_products([{**self.rows(1, category)[0], 'category_id': 999999}])
+        assert created == []
+        assert 'category_id' in errors[0][1]
+
+
+@pytest.mark.django_db
+class TestScrapeJob:
+    def start(self, client, **data):
+        return client.post(reverse('scrape-products'), {'platform': 'alibaba', **data}, format='json')
+
+    def test_category_import(self, admin_client, firecrawl):
+        firecrawl.pages = {
+            CATEGORY_URL: 'alibaba_category.html',
+            PRODUCT_URLS[0]: 'alibaba_product.html',
+            PRODUCT_URLS[1]: 'alibaba_product.html',
+            PRODUCT_URLS[2]: 'not_a_product.html',
+            PRODUCT_URLS[3]: 'alibaba_product.html',
+        }
+        response = self.start(admin_client, url=CATEGORY_URL, import_type='category', import_count=4)
+        assert response.status_code == 202
+        assert response.data['status'] == 'queued'
+        assert self.start(admin_client, url=CATEGORY_URL, import_type='category', import_count=4).data['job_id'] \
+            == response.data['job_id']  # already queued
+
+        run_pending()
+        progress = admin_client.get(response.data['progress_url']).data
+        assert progress['status'] == 'done'
+        assert progress['stage'] == 'done'
+        assert (progress['total'], progress['fetched'], progress['saved']) == (4, 4, 3)
+        assert progress['failed'] == [{'url': PRODUCT_URLS[2], 'error': 'No product found on the page'}]
+
+        products = Product.objects.filter(pk__in=progress['product_ids'])
+        assert products.count() == 3
+        assert {product.category.name for product in products} == {'Alibaba'}
+        assert {product.supplier.name for product in products} == {'Zhejiang Homeware Co., Ltd.'}
+        assert products.first().attribute_values.count() == 4
+        assert sorted(firecrawl.scraped_urls()) == sorted([CATEGORY_URL] + PRODUCT_URLS)
+
+    def test_retry_resumes_after_the_saved_pages(self, firecrawl, db):
+        firecrawl.pages = {url: 'alibaba_product.html' for url in PRODUCT_URLS}
+        scrape_job = scraping.start_scrape('alibaba', CATEGORY_URL, 'category', 4)
+        Category.objects.create(name='Alibaba', slug='alibaba')
+        Job.objects.filter(pk=scrape_job.pk).update(result={
+            'stage': 'fetching', 'urls': PRODUCT_URLS, 'done': PRODUCT_URLS[:2], 'fetched': 2, 'saved': 2,
+            'product_ids': [], 'failed': [],
+        })
+
+        run_pending()
+        scrape_job.refresh_from_db()
+        assert scrape_job.status == 'done'
+        assert sorted(firecrawl.scraped_urls()) == sorted(PRODUCT_URLS[2:])
+        assert scrape_job.result['saved'] == 4
+
+    def test_listing_failure_fails_the_attempt(self, admin_client, firecrawl):
+        response = self.start(admin_client, url=CATEGORY_URL, import_type='category', import_count=2)
+        run_pending()
+        progress = admin_client.get(response.data['progress_url']).data
+        assert progress['status'] == 'queued'  # retried later
+        assert Job.objects.get(pk=response.data['job_id']).attempts == 1
+
+    def test_validation(self, admin_client, user):
+        assert self.start(admin_client, url=CATEGORY_URL, platform='amazon').status_code == 400
+        assert self.start(admin_client, url=CATEGORY_URL, import_type='category', import_count=0).status_code == 400
+        assert self.start(admin_client, url=CATEGORY_URL, import_type='category', import_count='x').status_code == 400
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        assert self.start(client, url=CATEGORY_URL).status_code == 403
+        assert admin_client.get(reverse('scrape-progress', kwargs={'job_id': 999999})).status_code == 404
@@ -0,0 +1,120 @@
+"""
+Tests for the product search engine (SQLite FTS5 backend) and the search endpoint.
+"""
+from decimal import Decimal
+
+import pytest
+from django.urls import reverse
+from rest_framework import status
+
+from ecommerce.api.search import IContainsSearchBackend, SQLiteSearchBackend, get_search_backend, search_products
+from ecommerce.models import Category
+
+
+@pytest.fixture
+def search_index(db):
+    backend = SQLiteSearchBackend()
+    backend.setup()
+    return backend
+
+
+@pytest.fixture
+def catalog(search_index, category, product_factory):
+    garden = Category.objects.create(name='Garden', slug='garden')
+    return {
+        'headphones': product_factory(
+            name='Wireless Headphones', slug='wireless-headphones',
+            description='Over-ear sound', price=Decimal('4500.00'),
+        ),
+        'speaker': product_factory(
+            name='Bluetooth Speaker', slug='bluetooth-speaker',
+            description='Pairs with wireless headphones', price=Decimal('800.00'),
+        ),
+        'hose': product_factory(
+            name='Garden Hose', slug='garden-hose', description='Twenty metres',
+            price=Decimal('25000.00'), category=garden, is_pick_and_pay=True,
+        ),
+    }
+
+
+@pytest.mark.django_db
+class TestSearchEngine:
+    def test_auto_backend_uses_the_index_once_set_up(self, search_index):
+        assert get_search_backend().name == 'sqlite'
+
+    def test_auto_backend_falls_back_without_an_index(self):
+        assert get_search_backend().name == 'icontains'
+
+    def test_name_matches_rank_above_description_matches(self, catalog):
+        result = search_products('headphones')
+        assert result.ids == [catalog['headphones'].id, catalog['speaker'].id]
+
+    def test_prefix_and_typo_tolerance(self, catalog):
+        assert search_products('headph').ids[0] == catalog['headphones'].id
+        assert search_products('headphnes').ids[0] == catalog['headphones'].id
+
+    def test_every_term_must_match(self, catalog):
+        assert search_products('wireless speaker').ids == [catalog['speaker'].id]
+
+    def test_facets_cover_every_text_match(self, catalog):
+        result = search_products('wireless', category='garden')
+        assert result.total == 0
+        assert result.facets['categories'] == [{'slug': 'electronics', 'name': 'Electronics', 'count': 2}]
+        assert result.facets['price_bands'] == {'0-1000': 1, '1000-5000': 1, '5000-20000': 0, '20000+': 0}
+
+    def test_filters(self, catalog):
+        assert search_products('wireless', price_band='0-1000').ids == [catalog['speaker'].id]
+        assert search_products('hose', pick_and_pay=True).ids == [catalog['hose'].id]
+        assert search_products('hose', pick_and_pay=False).ids == []
+
+    def test_product_save_and_delete_update_the_index(self, catalog):
+        product = catalog['hose']
+        product.name = 'Garden Sprinkler'
+        product.save()
+        assert search_products('sprinkler').ids == [product.id]
+        assert search_products('hose').ids == []
+
+        product.delete()
+        assert search_products('sprinkler').ids == []
+
+    def test_icontains_backend_keeps_substring_matching(self, catalog):
+        result = search_products('ER-EAR', backend=IContainsSearchBackend())
+        assert result.ids == [catalog['headphones'].id]
+
+
+@pytest.mark.django_db
+class TestSearchEndpoint:
+    def test_results_are_ranked_and_faceted(self, api_client, catalog):
+        response = api_client.get(reverse('search'), {'search': 'headphones'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['slug'] for item in response.data['results']] == ['wireless-headphones', 'bluetooth-speaker']
+        assert response.data['total'] == 2
+        assert response.data['facets']['is_pick_and_pay'] == {'true': 0, 'false': 2}
+
+    def test_explicit_ordering(self, api_client, catalog):
+        response = api_client.get(reverse('search'), {'search': 'wireless', 'ordering': 'price'})
+        assert [item['slug'] for item in response.data['results']] == ['bluetooth-speaker', 'wireless-headphones']
+
+    @pytest.mark.parametrize('params', [
+        {'ordering': 'description'},
+        {'price_band': 'cheap'},
+        {'is_pick_and_pay': 'yes'},
+        {'page': 'two'},
+        {'per_page': '1.5'},
+    ])
+    def test_invalid_parameters_are_rejected(self, api_client, params):
+        response = api_client.get(reverse('search'), {'search': 'wireless', **params})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize('params, current_page, pages, count', [
+        ({'page': 0}, 1, 2, 1),
+        ({'page': -1}, 1, 2, 1),
+        ({'per_page': 0, 'page': 2}, 2, 2, 1),
+        ({'per_page': -5}, 1, 2, 1),
+        ({'per_page': 1000}, 1, 1, 2),
+    ])
+    def test_page_and_size_are_clamped(self, api_client, catalog, params, current_page, pages, count):
+        response = api_client.get(reverse('search'), {'search': 'headphones', 'per_page': 1, **params})
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['current_page'], response.data['pages'], len(response.data['results'])) == (current_page, pages, count)
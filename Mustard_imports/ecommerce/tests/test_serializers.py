@@ -4,12 +4,12 @@ from rest_framework import serializers as drf_serializers
 from decimal import Decimal
 from django.contrib.auth import get_user_model
 from ecommerce.api.serializers import (
-    ProductSerializer, OrderSerializer, CartSerializer,
+    ProductSerializer, ProductCardSerializer, CARD_FIELDS, OrderSerializer, CartSerializer,
     AdminRegisterSerializer, RegisterSerializer, LoginSerializer,
     AdminLoginSerializer, CartItemSerializer, DeliveryLocationSerializer
 )
 from ecommerce.models import (
-    Category, Product, Inventory, Order, Cart, CartItem,
+    Category, Product, ProductImage, Inventory, Order, Cart, CartItem,
     ShippingMethod, DeliveryLocation, AdminUser
 )
 
@@ -103,6 +103,35 @@ class ProductSerializerTests(TestCase):
         self.assertEqual(product.price, Decimal('1000.00'))
 
 
+class ProductCardSerializerTests(TestCase):
+    """Test the listing card and the fields/expand sparse fieldsets"""
+
+    def setUp(self):
+        category = Category.objects.create(name="Electronics", slug="electronics")
+        self.product = Product.objects.create(
+            name='Headphones', slug='headphones', description='Long description',
+            price=Decimal('1000.00'), category=category, moq=10
+        )
+        ProductImage.objects.create(
+            product=self.product, image='product_images/h.jpg', thumbnail='product_thumbnails/h.jpg'
+        )
+
+    def test_card_renders_only_card_fields(self):
+        data = ProductCardSerializer(self.product).data
+        self.assertEqual(set(data), set(CARD_FIELDS))
+        self.assertTrue(data['image'].endswith('product_images/h.jpg'))
+        self.assertEqual(data['moq_progress'], {'current': 0, 'target': 10, 'percentage': 0})
+
+    def test_expand_adds_product_fields(self):
+        data = ProductCardSerializer(self.product, expand=['description', 'images']).data
+        self.assertEqual(data['description'], 'Long description')
+        self.assertEqual(len(data['images']), 1)
+
+    def test_fields_selects_an_exact_subset(self):
+        data = ProductSerializer(self.product, fields=['id', 'name', 'unknown']).data
+        self.assertEqual(data, {'id': self.product.id, 'name': 'Headphones'})
+
+
 class OrderSerializerTests(TestCase):
     """Test OrderSerializer validation and business rules"""
 
@@ -0,0 +1,267 @@
+"""
+Tests for Pick and Pay stock reservations: holds taken through the cart
+endpoints, the cached available-stock counters and their rebuild, the
+expiry sweeper, checkout consuming holds, cancellations putting stock back
+and concurrent shoppers competing for the last units.
+"""
+import threading
+from datetime import timedelta
+
+import pytest
+import redis
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+from fakeredis import FakeRedisConnection
+from rest_framework.test import APIClient
+
+from ecommerce.api import stock
+from ecommerce.models import Cart, CartItem, Inventory, Order, StockReservation
+
+User = get_user_model()
+
+
+@pytest.fixture
+def shopper(user_factory):
+    def create(name):
+        buyer = user_factory(username=name, email=f'{name}@example.com')
+        client = APIClient()
+        client.force_authenticate(user=buyer)
+        return client, Cart.objects.create(user=buyer)
+    return create
+
+
+def add(client, cart, product, quantity):
+    return client.post(
+        reverse('add-item-to-cart', args=[cart.id]), {'productId': product.id, 'quantity': quantity}, format='json'
+    )
+
+
+def available(product):
+    return stock.available_stock([product.id])[product.id]
+
+
+@pytest.mark.django_db
+class TestHolds:
+    def test_adding_to_the_cart_holds_stock(self, shopper, stocked, committed):
+        mug = stocked(5, name='Mug', slug='mug')
+        (alice, alice_cart), (bob, bob_cart) = shopper('alice'), shopper('bob')
+
+        with committed():
+            assert add(alice, alice_cart, mug, 2).status_code == 201
+            assert add(alice, alice_cart, mug, 1).status_code == 201
+        hold = StockReservation.objects.get()
+        assert (hold.quantity, hold.cart_item.quantity) == (3, 3)
+        assert hold.expires_at > timezone.now() + stock.RESERVATION_TTL - timedelta(minutes=1)
+        assert available(mug) == 2
+
+        response = add(bob, bob_cart, mug, 3)
+        assert response.status_code == 400
+        assert response.data['error'] == 'Requested quantity (3) exceeds available stock (2)'
+        assert not bob_cart.items.exists()
+        # Holds don't touch the stock on the shelf
+        assert Inventory.objects.get(product=mug).quantity == 5
+
+    def test_changing_and_removing_items_moves_the_hold(self, shopper, stocked, committed):
+        mug = stocked(5)
+        client, cart = shopper('alice')
+        with committed():
+            item_id = add(client, cart, mug, 4).data['id']
+        update_url = reverse('update-cart-item-quantity', args=[item_id])
+
+        assert client.post(update_url, {'cart_id': cart.id, 'quantity': 6}, format='json').status_code == 400
+        assert (StockReservation.objects.get().quantity, available(mug)) == (4, 1)
+
+        with committed():
+            assert client.post(update_url, {'cart_id': cart.id, 'quantity': 2}, format='json').status_code == 200
+        assert (StockReservation.objects.get().quantity, available(mug)) == (2, 3)
+
+        with committed():
+            response = client.post(reverse('remove-cart-item', args=[cart.id]), {'item_id': item_id}, format='json')
+        assert response.status_code == 200
+        assert not StockReservation.objects.exists()
+        assert available(mug) == 5
+
+    def test_counters_are_rebuilt_from_the_database(self, cart, stocked, committed):
+        mug, jug = stocked(10, name='Mug', slug='mug'), stocked(4, name='Jug', slug='jug')
+        item = CartItem.objects.create(cart=cart, product=mug, quantity=3)
+        stock.reserve(item, 3)
+
+        cache.clear()
+        assert stock.available_stock([mug.id, jug.id]) == {mug.id: 7, jug.id: 4}
+
+        # Stock set by hand replaces the counted level once committed
+        with committed():
+            Inventory.objects.filter(product=jug).update(quantity=0)  # not seen by the counter
+            inventory = Inventory.objects.get(product=mug)
+            inventory.quantity = 20
+            inventory.save()
+        assert stock.available_stock([mug.id, jug.id]) == {mug.id: 17, jug.id: 4}
+
+    def test_stock_endpoint(self, client, stocked, moq_product):
+        mug = stocked(6)
+        response = client.get(reverse('product-stock'), {'ids': f'{mug.id},{moq_product.id},999999'})
+        assert response.status_code == 200
+        assert response.json() == {'stock': {str(mug.id): 6}}
+        assert client.get(reverse('product-stock'), {'ids': 'mug'}).status_code == 400
+        assert client.get(reverse('product-stock')).status_code == 400
+
+
+@pytest.mark.django_db
+class TestSweeper:
+    def test_expired_holds_are_released_in_batches(self, user_factory, stocked, committed):
+        mug = stocked(10)
+        past, future = timezone.now() - timedelta(minutes=1), timezone.now() + timedelta(minutes=5)
+        for n in range(5):
+            cart = Cart.objects.create(user=user_factory(username=f'buyer{n}', email=f'buyer{n}@example.com'))
+            stock.reserve(CartItem.objects.create(cart=cart, product=mug, quantity=2), 2)
+        assert available(mug) == 0
+        StockReservation.objects.filter(id__in=StockReservation.objects.order_by('id').values('id')[:3]).update(expires_at=past)
+        StockReservation.objects.exclude(expires_at=past).update(expires_at=future)
+
+        with committed():
+            assert stock.release_expired(batch_size=2) == 3
+        assert StockReservation.objects.count() == 2
+        assert available(mug) == 6
+        # The cart items stay; checkout takes their units again if still free
+        assert CartItem.objects.count() == 5
+
+    def test_command(self, cart, stocked, capsys):
+        item = CartItem.objects.create(cart=cart, product=stocked(3), quantity=1)
+        stock.reserve(item, 1)
+        StockReservation.objects.update(expires_at=timezone.now())
+        call_command('release_reservations', batch=10)
+        assert 'Released 1 expired reservations' in capsys.readouterr().out
+        assert not StockReservation.objects.exists()
+
+
+@pytest.mark.django_db
+class TestCheckoutAndCancel:
+    def checkout(self, client, cart):
+        return client.post(reverse('create-order-from-cart', args=[cart.id]), format='json')
+
+    def test_checkout_consumes_the_holds(self, shopper, stocked, committed):
+        mug = stocked(5)
+        (alice, alice_cart), (bob, bob_cart) = shopper('alice'), shopper('bob')
+        with committed():
+            add(alice, alice_cart, mug, 3)
+            add(bob, bob_cart, mug, 2)
+
+        with committed():
+            assert self.checkout(alice, alice_cart).status_code == 201
+        assert Inventory.objects.get(product=mug).quantity == 2
+        assert list(StockReservation.objects.values_list('quantity', flat=True)) == [2]
+        assert available(mug) == 0
+
+    def test_held_units_are_not_sold_to_other_carts(self, shopper, stocked, committed):
+        mug = stocked(3, name='Mug', slug='mug')
+        (alice, alice_cart), (bob, bob_cart) = shopper('alice'), shopper('bob')
+        with committed():
+            add(alice, alice_cart, mug, 3)
+        # Bob's hold expired and was swept
+        CartItem.objects.create(cart=bob_cart, product=mug, quantity=1)
+
+        response = self.checkout(bob, bob_cart)
+        assert response.status_code == 400
+        assert response.data['error'] == 'Insufficient stock for Mug: 0 available, 1 requested'
+        assert (Inventory.objects.get(product=mug).quantity, available(mug)) == (3, 0)
+
+    def test_cancel_puts_the_stock_back(self, shopper, stocked, moq_product, shipping_method, committed):
+        mug, jug = stocked(5, name='Mug', slug='mug'), stocked(5, name='Jug', slug='jug')
+        client, cart = shopper('alice')
+        with committed():
+            add(client, cart, mug, 2)
+            add(client, cart, jug, 1)
+            # A shipped item keeps the order cancellable
+            CartItem.objects.create(cart=cart, product=moq_product, quantity=5)
+            Cart.objects.filter(pk=cart.pk).update(shipping_method=shipping_method)
+            order_id = self.checkout(client, cart).data['id']
+        assert stock.available_stock([mug.id, jug.id]) == {mug.id: 3, jug.id: 4}
+
+        with committed():
+            assert client.post(reverse('cancel-order', args=[order_id])).status_code == 200
+        assert list(Inventory.objects.order_by('product_id').values_list('quantity', flat=True)) == [5, 5]
+        assert stock.available_stock([mug.id, jug.id]) == {mug.id: 5, jug.id: 5}
+        assert Order.objects.get(pk=order_id).delivery_status == 'cancelled'
+
+    def test_stock_methods_update_in_sql(self, stocked, committed):
+        mug = stocked(10)
+        first, second = Inventory.objects.get(product=mug), Inventory.objects.get(product=mug)
+        available(mug)
+        with committed():
+            first.reduce_stock(4)
+            second.reduce_stock(4)  # loaded before the first reduction
+            first.restock(1)
+        assert (first.quantity, Inventory.objects.get(product=mug).quantity, available(mug)) == (3, 3, 3)
+        with pytest.raises(ValueError, match='Available: 3, Requested: 4'):
+            second.reduce_stock(4)
+
+
+@pytest.fixture
+def cache_outage(settings, monkeypatch):
+    """An unreachable Redis, with the IGNORE_EXCEPTIONS of the production settings."""
+    default = settings.CACHES['default']
+    settings.CACHES = {'default': {**default, 'OPTIONS': {**default['OPTIONS'], 'IGNORE_EXCEPTIONS': True}}}
+
+    def unreachable(*args, **kwargs):
+        raise redis.ConnectionError('Connection refused')
+
+    monkeypatch.setattr(FakeRedisConnection, 'send_packed_command', unreachable)
+
+
+@pytest.mark.django_db
+def test_cache_outage_checks_holds_against_the_database(shopper, stocked, cache_outage):
+    mug = stocked(5, name='Mug', slug='mug')
+    (alice, alice_cart), (bob, bob_cart) = shopper('alice'), shopper('bob')
+    assert cache.decr(stock.COUNTER_KEY.format(mug.id)) is None
+
+    assert add(alice, alice_cart, mug, 3).status_code == 201
+    response = add(bob, bob_cart, mug, 3)
+    assert response.status_code == 400
+    assert response.data['error'] == 'Requested quantity (3) exceeds available stock (2)'
+    assert add(bob, bob_cart, mug, 2).status_code == 201
+    assert list(StockReservation.objects.order_by('id').values_list('quantity', flat=True)) == [3, 2]
+
+    # Checkout takes Alice's held units; none are free for a third cart
+    assert TestCheckoutAndCancel().checkout(alice, alice_cart).status_code == 201
+    carol, carol_cart = shopper('carol')
+    CartItem.objects.create(cart=carol_cart, product=mug, quantity=1)
+    response = TestCheckoutAndCancel().checkout(carol, carol_cart)
+    assert response.status_code == 400
+    assert response.data['error'] == 'Insufficient stock for Mug: 0 available, 1 requested'
+    assert Inventory.objects.get(product=mug).quantity == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_shoppers_hold_the_last_units_once(stocked):
+    last_units = stocked(5, name='Last Units', slug='last-units')
+    shoppers = []
+    for n in range(40):
+        # No password: hashing 40 of them would dominate the test
+        buyer = User.objects.create(username=f'buyer{n}', email=f'buyer{n}@example.com')
+        client = APIClient()
+        client.force_authenticate(user=buyer)
+        shoppers.append((client, Cart.objects.create(user=buyer)))
+
+    start = threading.Barrier(len(shoppers))
+    results = [None] * len(shoppers)
+
+    def shop(index, client, cart):
+        try:
+            start.wait()
+            results[index] = add(client, cart, last_units, 1).status_code
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=shop, args=(n, *pair)) for n, pair in enumerate(shoppers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(201) == 5
+    assert StockReservation.objects.count() == 5
+    assert available(last_units) == 0
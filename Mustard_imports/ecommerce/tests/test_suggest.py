@@ -0,0 +1,140 @@
+"""
+Tests for the search-as-you-type prefix index and the suggest endpoint.
+"""
+import pytest
+from django.urls import reverse
+from rest_framework import status
+
+from ecommerce.api import suggest
+from ecommerce.api.suggest import PrefixIndex, get_suggest_index
+from ecommerce.models import ProductImage
+
+
+@pytest.fixture
+def index():
+    index = PrefixIndex()
+    index.load([
+        (1, 'Wireless Headphones', 'wireless-headphones', 'product_thumbnails/1.jpg', 'Electronics'),
+        (2, 'Headphone Stand', 'headphone-stand', '', 'Electronics'),
+        (3, 'Garden Hose', 'garden-hose', '', 'Garden'),
+        (4, 'Solar Lamp', 'solar-lamp', '', 'Garden'),
+    ])
+    return index
+
+
+def ids(results):
+    return [item['id'] for item in results]
+
+
+class TestPrefixIndex:
+    def test_first_name_word_ranks_above_later_words_and_categories(self, index):
+        assert ids(index.lookup('head')) == [2, 1]
+        assert ids(index.lookup('gar')) == [3, 4]
+
+    def test_every_query_word_must_match(self, index):
+        assert ids(index.lookup('wire head')) == [1]
+        assert ids(index.lookup('garden lam')) == [4]
+        assert index.lookup('wireless hose') == []
+
+    def test_results_carry_only_the_listing_fields(self, index, settings):
+        assert index.lookup('wireless') == [{
+            'id': 1,
+            'name': 'Wireless Headphones',
+            'slug': 'wireless-headphones',
+            'thumbnail': settings.SITE_URL + 'product_thumbnails/1.jpg',
+        }]
+
+    def test_limit_and_empty_query(self, index):
+        assert len(index.lookup('h', limit=1)) == 1
+        assert index.lookup('  ') == []
+
+    def test_add_replaces_and_remove_drops_a_product(self, index):
+        index.add(3, 'Garden Sprinkler', 'garden-sprinkler', '', 'Garden')
+        assert ids(index.lookup('sprink')) == [3]
+        assert index.lookup('hose') == []
+
+        index.remove(3)
+        assert index.lookup('sprink') == []
+        assert ids(index.lookup('garden')) == [4]
+        assert len(index) == 3
+
+    def test_copies_change_independently(self, index):
+        copy = index.copy()
+        copy.add(5, 'Garden Sprinkler', 'garden-sprinkler', '', 'Garden')
+        copy.remove(4)
+        assert ids(copy.lookup('solar')) == []
+        assert ids(copy.lookup('sprink')) == [5]
+        assert ids(index.lookup('solar')) == [4]
+        assert index.lookup('sprink') == []
+
+
+@pytest.mark.django_db
+class TestSuggestIndexSync:
+    def test_saves_are_picked_up_from_the_change_journal(self, product_factory, django_capture_on_commit_callbacks, monkeypatch):
+        product = product_factory(name='Garden Hose', slug='garden-hose')
+        index = get_suggest_index()
+        assert ids(index.lookup('hose')) == [product.id]
+        loaded = []
+        load_rows = suggest.load_rows
+        monkeypatch.setattr(suggest, 'load_rows', lambda product_ids=None: loaded.append(product_ids) or load_rows(product_ids))
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.name = 'Garden Sprinkler'
+            product.slug = 'garden-sprinkler'
+            product.save()
+            ProductImage.objects.create(product=product, image='product_images/hose.jpg')
+
+        # Replayed into a copy rather than rebuilt; readers of the old index are unaffected
+        replayed = get_suggest_index()
+        assert loaded == [{product.id}]
+        assert replayed is not index
+        assert ids(index.lookup('hose')) == [product.id]
+        assert replayed.lookup('hose') == []
+        assert replayed.lookup('sprink')[0]['thumbnail'].endswith('product_images/hose.jpg')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.delete()
+        assert get_suggest_index().lookup('sprink') == []
+
+    def test_category_changes_rebuild_the_index(self, product_factory, django_capture_on_commit_callbacks):
+        product = product_factory(name='Garden Hose', slug='garden-hose')
+        index = get_suggest_index()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.category.name = 'Outdoor'
+            product.category.save()
+
+        rebuilt = get_suggest_index()
+        assert rebuilt is not index
+        assert ids(rebuilt.lookup('outdoor')) == [product.id]
+
+    def test_missing_changes_force_a_rebuild(self, product_factory, django_capture_on_commit_callbacks):
+        product = product_factory(name='Garden Hose', slug='garden-hose')
+        index = get_suggest_index()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.name = 'Garden Sprinkler'
+            product.save()
+        suggest.cache.delete(suggest.CHANGE_KEY.format(suggest._current_version()))
+
+        rebuilt = get_suggest_index()
+        assert rebuilt is not index
+        assert ids(rebuilt.lookup('sprink')) == [product.id]
+
+
+@pytest.mark.django_db
+class TestSuggestEndpoint:
+    def test_returns_matching_products(self, api_client, product_factory):
+        product = product_factory(name='Wireless Headphones', slug='wireless-headphones')
+        product_factory(name='Garden Hose', slug='garden-hose')
+
+        response = api_client.get(reverse('suggest'), {'q': 'wireless he'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'] == [{
+            'id': product.id, 'name': 'Wireless Headphones', 'slug': 'wireless-headphones', 'thumbnail': '',
+        }]
+
+    def test_invalid_limit_is_rejected(self, api_client):
+        response = api_client.get(reverse('suggest'), {'q': 'wireless', 'limit': 'ten'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -582,6 +582,17 @@ export const removeFromCart = async (api, cartId, itemId) => {
   }
 };
 
+// operations: [{ op: 'add', productId, quantity, attributes }, { op: 'update', itemId, quantity }, { op: 'remove', itemId }]
+export const updateCartItems = async (api, cartId, operations) => {
+  try {
+    const response = await api.patch(`carts/${cartId}/items/`, { operations });
+    return response.data;
+  } catch (error) {
+    console.error('Error updating cart items:', error.response?.data || error.message);
+    throw error;
+  }
+};
+
 export const checkoutCart = async (api, cartId, shippingMethod, ) => {
   try {
     const response = await api.post(`carts/${cartId}/checkout/`, {
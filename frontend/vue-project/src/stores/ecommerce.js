@@ -681,6 +681,23 @@ export const useEcommerceStore = defineStore('ecommerce', {
       }
     },
 
+    // Long poll: resolves as soon as the payment changes from `version`
+    // (returned by initiatePayment/verifyPayment), or after `wait` seconds
+    async waitForPaymentUpdate(orderId, version, wait = 25) {
+      if (!this.apiInstance) {
+        this.initializeApiInstance();
+      }
+      try {
+        const response = await this.apiInstance.get(`/payment-details/${orderId}/`, {
+          params: { version, wait },
+        });
+        return response.data;
+      } catch (error) {
+        console.error('Wait for payment error:', error.response?.data || error.message);
+        throw error;
+      }
+    },
+
     async checkoutCart(checkoutData) {
       if (!this.apiInstance) {
         this.initializeApiInstance();